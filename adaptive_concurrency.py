@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+AIMD (additive-increase / multiplicative-decrease) concurrency limiter for
+LlamaParse jobs.
+
+A fixed asyncio.Semaphore either under-uses the parse quota or bursts into
+429s and timeouts. This limiter starts at the configured worker count and:
+
+- adds roughly one slot per "round" of healthy completions (latency per MB
+  within latency_tolerance x the best seen recently, no throttling),
+- cuts the limit by decrease_factor on a 429 / throttling error or a timeout
+  (at most once per round, so one burst of failures is one decrease),
+- cuts it as well when the recent error rate exceeds max_error_rate.
+
+Waiters are served smallest-priority first, so callers that pass the file
+size as priority get small files through first (faster time-to-first-result).
+Every limit change is logged and kept in `trajectory`.
+
+Usage:
+    limiter = AdaptiveConcurrencyLimiter(initial=4, max_limit=16)
+    async with limiter.slot(priority=size_mb, cost=size_mb) as slot:
+        docs = await parser.aload_data(path)
+        if not docs:
+            slot.outcome = "error"
+
+Try it against the offline parse stand-in with a simulated quota:
+    python offline_providers.py --parse_job_seconds 2 --parse_max_concurrent_jobs 6
+    OFFLINE_PROVIDER_URL=http://127.0.0.1:8089 python parse.py -i data/sample_docs --max_concurrency 16
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+THROTTLE_STATUS_CODES = (429, 503)
+MIN_COST = 0.05  # Floor for per-MB latency normalisation (tiny files)
+BASELINE_DRIFT = 1.02  # Lets the latency baseline recover after a slow period
+
+
+def classify_error(exc: BaseException) -> str:
+    """Maps an exception to 'timeout', 'throttled' or 'error'."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return "timeout"
+    status = getattr(exc, "status_code", None)
+    response = getattr(exc, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    message = str(exc).lower()
+    if status in THROTTLE_STATUS_CODES or "429" in message or "rate limit" in message or "too many" in message:
+        return "throttled"
+    return "error"
+
+
+class _Slot:
+    """Handle yielded by slot(); set outcome to override the automatic classification."""
+
+    def __init__(self):
+        self.outcome: Optional[str] = None
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(
+        self,
+        initial: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 16,
+        decrease_factor: float = 0.7,
+        latency_tolerance: float = 2.5,
+        error_window: int = 20,
+        max_error_rate: float = 0.25,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self._recent_failures = deque(maxlen=error_window)
+        self._in_flight = 0
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self._start = time.monotonic()
+        self.counts = {"ok": 0, "throttled": 0, "timeout": 0, "error": 0}
+        self.trajectory: List[Dict[str, Any]] = []
+        self._record_change(int(self.limit), "start")
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    # --- Slot management ---
+    @asynccontextmanager
+    async def slot(self, priority: float = 0.0, cost: float = 1.0):
+        await self._acquire(priority)
+        handle = _Slot()
+        started = time.monotonic()
+        outcome = "ok"
+        try:
+            yield handle
+        except asyncio.CancelledError:
+            outcome = None
+            raise
+        except BaseException as e:
+            outcome = classify_error(e)
+            raise
+        finally:
+            # Update the limit before waking waiters, so a decrease takes effect immediately
+            if outcome is not None:
+                self.record(handle.outcome or outcome, time.monotonic() - started, cost, started)
+            self._release()
+
+    async def _acquire(self, priority: float):
+        if not self._waiters and self._in_flight < self.current_limit:
+            self._in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # Slot was granted just before cancellation
+            raise
+
+    def _release(self):
+        self._in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._in_flight < self.current_limit:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # Cancelled while waiting
+            self._in_flight += 1
+            future.set_result(None)
+
+    # --- AIMD control ---
+    def record(self, outcome: str, latency: float, cost: float = 1.0, started: Optional[float] = None):
+        """Feeds one completed job into the controller."""
+        self.counts[outcome] = self.counts.get(outcome, 0) + 1
+        self._recent_failures.append(outcome != "ok")
+        started = time.monotonic() if started is None else started
+
+        if outcome in ("throttled", "timeout"):
+            self._decrease(outcome, started)
+            return
+        if outcome != "ok":
+            window = self._recent_failures
+            if len(window) >= window.maxlen // 2 and sum(window) / len(window) > self.max_error_rate:
+                self._decrease("error rate", started)
+            return
+
+        normalised = latency / max(cost, MIN_COST)
+        if self._baseline is None:
+            self._baseline = normalised
+        else:
+            self._baseline = min(normalised, self._baseline * BASELINE_DRIFT)
+        if normalised > self.latency_tolerance * self._baseline:
+            return  # Latency is rising: hold the limit steady
+
+        if self.limit < self.max_limit:
+            old = self.current_limit
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            if self.current_limit != old:
+                self._record_change(old, "healthy")
+                self._wake()
+
+    def _decrease(self, reason: str, started: float):
+        # Jobs started before the last decrease belong to the same congestion episode
+        if started < self._last_decrease:
+            return
+        old = self.current_limit
+        self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+        self._last_decrease = time.monotonic()
+        self._recent_failures.clear()
+        if self.current_limit != old:
+            self._record_change(old, reason)
+
+    def _record_change(self, old: int, reason: str):
+        elapsed = time.monotonic() - self._start
+        self.trajectory.append(
+            {"t": round(elapsed, 2), "limit": self.current_limit, "in_flight": self._in_flight, "reason": reason}
+        )
+        if reason != "start":
+            logging.info(
+                f"Parse concurrency {old} -> {self.current_limit} ({reason}, {self._in_flight} in flight, t={elapsed:.1f}s)"
+            )
+
+    def summary(self) -> Dict[str, Any]:
+        limits = [point["limit"] for point in self.trajectory]
+        return {
+            "final_limit": self.current_limit,
+            "peak_limit": max(limits),
+            "changes": len(self.trajectory) - 1,
+            "counts": dict(self.counts),
+            "trajectory": self.trajectory,
+        }
+
+    def format_trajectory(self, max_points: int = 20) -> str:
+        points = self.trajectory
+        if len(points) > max_points:
+            step = len(points) / max_points
+            points = [points[int(i * step)] for i in range(max_points)] + [self.trajectory[-1]]
+        return " -> ".join(f"{p['limit']}@{p['t']:.0f}s" for p in points)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+OpenAI Batch API mode for bulk context generation (metadata.py --backend batch).
+
+For a full re-enrichment of the corpus, one interactive request per chunk is
+the slowest and most expensive way to call the model. The Batch API takes
+JSONL files of requests, runs them within 24 hours at half the price and under
+a separate, much larger quota, so there are no RPM/TPM limits to tune.
+
+run_batch_contexts() drives the whole cycle in a working directory:
+
+1. Writes the requests as JSONL shards (shard-0000.jsonl, ...), one line per
+   distinct chunk text, with the text hash as custom_id.
+2. Uploads and submits each shard as a batch.
+3. Polls until the batches finish and downloads their output and error files
+   (shard-0000.output.jsonl / .errors.jsonl).
+4. Maps the results back by custom_id.
+
+Progress is recorded in manifest.json after every step. An interrupted run,
+or one started with wait=False, resumes on the next call: submitted batches
+are polled instead of resubmitted. The upload, create, status and download
+calls are retried with backoff on timeouts, throttling and 5xx errors, so a
+transient failure during a long poll doesn't end the run. Requests that failed, or that a batch did
+not reach before it expired, go into new shards (up to max_rounds per run).
+
+For offline testing, results_dir reads result files from a local directory
+instead of calling the API. offline_providers.py also implements the Files and
+Batches endpoints (see --batch_seconds there).
+
+Usage (via metadata.py):
+    python metadata.py --backend batch
+    python metadata.py --backend batch --batch_no_wait   # submit and exit, re-run to collect
+    python metadata.py --backend batch --batch_results ./batch_outputs
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from rate_limiter import backoff_delay, is_retryable, retry_after_seconds
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# The API accepts up to 50,000 requests (200 MB) per batch; smaller shards
+# start returning results sooner and lose less when one batch expires
+DEFAULT_SHARD_SIZE = 10_000
+DEFAULT_POLL_SECONDS = 60.0
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+MANIFEST_NAME = "manifest.json"
+CONTROL_PLANE_RETRIES = 8  # Attempts per Files/Batches call (backoff capped at 30 s)
+
+
+def batch_request_line(custom_id: str, body: Dict[str, Any]) -> str:
+    return json.dumps(
+        {"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}
+    )
+
+
+def parse_result_line(line: str) -> Tuple[Optional[str], Optional[str], str]:
+    """(custom_id, content or None, error message) of one Batch API result line."""
+    item = json.loads(line)
+    if "response" not in item and "error" not in item:
+        return None, None, ""  # A request line, not a result
+    custom_id = item.get("custom_id")
+    response = item.get("response") or {}
+    if item.get("error") or response.get("status_code") != 200:
+        error = item.get("error") or (response.get("body") or {}).get("error") or {}
+        message = error.get("message") if isinstance(error, dict) else str(error)
+        return custom_id, None, f"status {response.get('status_code')}: {message}"
+    try:
+        content = response["body"]["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return custom_id, None, "malformed response body"
+    return custom_id, (content or "").strip(), ""
+
+
+def read_results(paths: Iterable[Path]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Reads result files into ({custom_id: content}, {custom_id: error})."""
+    results: Dict[str, str] = {}
+    errors: Dict[str, str] = {}
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                custom_id, content, error = parse_result_line(line)
+                if custom_id is None:
+                    continue
+                if content:
+                    results[custom_id] = content
+                    errors.pop(custom_id, None)
+                elif custom_id not in results:
+                    errors[custom_id] = error or "empty response"
+    return results, errors
+
+
+def shard_custom_ids(path: Path) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["custom_id"] for line in f if line.strip()]
+
+
+class BatchManifest:
+    """Shard and batch state of a batch working directory, saved atomically."""
+
+    def __init__(self, batch_dir: Path, version: str):
+        self.batch_dir = batch_dir
+        self.path = batch_dir / MANIFEST_NAME
+        self.data: Dict[str, Any] = {"version": version, "shards": {}}
+        if self.path.exists():
+            loaded = json.loads(self.path.read_text())
+            if loaded.get("version") == version:
+                self.data = loaded
+            else:
+                logging.warning(
+                    f"Ignoring batches in {batch_dir} made for context version "
+                    f"{loaded.get('version')} (now {version})"
+                )
+                self.data["next_index"] = loaded.get("next_index", len(loaded.get("shards", {})))
+
+    @property
+    def shards(self) -> Dict[str, Dict[str, Any]]:
+        return self.data["shards"]
+
+    def new_shard_name(self) -> str:
+        index = self.data.get("next_index", 0)
+        self.data["next_index"] = index + 1
+        return f"shard-{index:04d}"
+
+    def save(self):
+        self.batch_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.data, indent=2))
+        os.replace(tmp_path, self.path)
+
+    def result_files(self) -> List[Path]:
+        files = []
+        for shard in self.shards.values():
+            for key in ("output", "errors"):
+                if shard.get(key):
+                    files.append(self.batch_dir / shard[key])
+        return files
+
+    def in_flight_ids(self) -> Set[str]:
+        ids: Set[str] = set()
+        for name, shard in self.shards.items():
+            if not shard.get("done"):
+                ids.update(shard_custom_ids(self.batch_dir / f"{name}.jsonl"))
+        return ids
+
+
+def write_shards(
+    manifest: BatchManifest, requests: Dict[str, Dict[str, Any]], shard_size: int
+) -> List[str]:
+    """Writes requests ({custom_id: body}) as new JSONL shards and registers them."""
+    manifest.batch_dir.mkdir(parents=True, exist_ok=True)
+    items = list(requests.items())
+    names = []
+    for start in range(0, len(items), shard_size):
+        name = manifest.new_shard_name()
+        path = manifest.batch_dir / f"{name}.jsonl"
+        with open(path, "w", encoding="utf-8") as f:
+            for custom_id, body in items[start : start + shard_size]:
+                f.write(batch_request_line(custom_id, body) + "\n")
+        manifest.shards[name] = {"requests": len(items[start : start + shard_size]), "done": False}
+        names.append(name)
+    manifest.save()
+    if names:
+        logging.info(f"Wrote {len(items)} requests to {len(names)} batch shards in {manifest.batch_dir}")
+    return names
+
+
+async def with_retries(description: str, call: Callable[[int], Awaitable[Any]]) -> Any:
+    """
+    Runs call(attempt) until it succeeds, retrying retryable errors with backoff
+    (the client itself is created with max_retries=0, see metadata.configure_openai).
+    """
+    for attempt in range(CONTROL_PLANE_RETRIES):
+        try:
+            return await call(attempt)
+        except Exception as e:
+            if not is_retryable(e) or attempt == CONTROL_PLANE_RETRIES - 1:
+                raise
+            delay = retry_after_seconds(e) or backoff_delay(attempt)
+            logging.warning(
+                f"{description} failed ({e}); retrying in {delay:.1f}s "
+                f"(attempt {attempt + 1}/{CONTROL_PLANE_RETRIES})"
+            )
+            await asyncio.sleep(delay)
+
+
+async def find_batch(client: Any, input_file_id: str) -> Optional[Any]:
+    """A batch already created from input_file_id, e.g. by a create whose response was lost."""
+    try:
+        page = await client.batches.list(limit=100)
+    except Exception as e:
+        logging.warning(f"Could not list batches to check for a duplicate: {e}")
+        return None
+    return next((b for b in page.data if b.input_file_id == input_file_id), None)
+
+
+async def submit_shard(client: Any, manifest: BatchManifest, name: str):
+    shard = manifest.shards[name]
+    path = manifest.batch_dir / f"{name}.jsonl"
+    if not shard.get("input_file_id"):
+        uploaded = await with_retries(
+            f"Uploading {name}",
+            lambda _: client.files.create(file=(path.name, path.read_bytes()), purpose="batch"),
+        )
+        shard["input_file_id"] = uploaded.id
+        manifest.save()
+
+    async def create(attempt):
+        # A failed create may still have gone through; don't submit (and pay for) the shard twice
+        existing = await find_batch(client, shard["input_file_id"]) if attempt else None
+        if existing is not None:
+            logging.info(f"Found batch {existing.id} already created for {name}")
+            return existing
+        return await client.batches.create(
+            input_file_id=shard["input_file_id"],
+            endpoint=BATCH_ENDPOINT,
+            completion_window=COMPLETION_WINDOW,
+            metadata={"shard": name, "version": manifest.data["version"]},
+        )
+
+    batch = await with_retries(f"Creating the batch for {name}", create)
+    shard["batch_id"] = batch.id
+    shard["status"] = batch.status
+    manifest.save()
+    logging.info(f"Submitted {name} ({shard['requests']} requests) as batch {batch.id}")
+
+
+async def download_file(client: Any, file_id: str, path: Path):
+    response = await with_retries(f"Downloading {path.name}", lambda _: client.files.content(file_id))
+    path.write_bytes(response.content)
+
+
+async def poll_shards(client: Any, manifest: BatchManifest) -> int:
+    """Refreshes every submitted, unfinished batch; downloads finished ones. Returns how many remain."""
+    remaining = 0
+    for name, shard in manifest.shards.items():
+        if shard.get("done") or not shard.get("batch_id"):
+            continue
+        batch = await with_retries(
+            f"Checking batch {name}", lambda _: client.batches.retrieve(shard["batch_id"])
+        )
+        counts = getattr(batch, "request_counts", None)
+        if batch.status != shard.get("status"):
+            logging.info(
+                f"Batch {name}: {shard.get('status')} -> {batch.status}"
+                + (f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else "")
+            )
+        shard["status"] = batch.status
+        if batch.status not in TERMINAL_STATUSES:
+            remaining += 1
+            continue
+        # Expired and cancelled batches still return the requests they finished
+        for key, file_id in (("output", batch.output_file_id), ("errors", batch.error_file_id)):
+            if file_id:
+                filename = f"{name}.{key}.jsonl"
+                await download_file(client, file_id, manifest.batch_dir / filename)
+                shard[key] = filename
+        shard["done"] = True
+        manifest.save()
+    manifest.save()
+    return remaining
+
+
+async def run_batch_contexts(
+    client: Any,
+    requests: Dict[str, Dict[str, Any]],
+    batch_dir: str,
+    version: str,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    poll_seconds: float = DEFAULT_POLL_SECONDS,
+    wait: bool = True,
+    results_dir: Optional[str] = None,
+    max_rounds: int = 3,
+) -> Dict[str, str]:
+    """
+    Runs requests ({custom_id: chat completion body}) through the Batch API,
+    resuming whatever an earlier run in batch_dir left unfinished. Returns
+    {custom_id: content} for the requests that have succeeded so far.
+    """
+    if results_dir:
+        files = sorted(Path(results_dir).glob("*.jsonl"))
+        results, errors = read_results(files)
+        found = {cid: results[cid] for cid in requests if cid in results}
+        failed = sum(1 for cid in requests if cid in errors and cid not in found)
+        logging.info(
+            f"Read {len(found)}/{len(requests)} batch results from {len(files)} files in {results_dir}"
+            f" ({failed} failed, {len(requests) - len(found) - failed} missing)"
+        )
+        return found
+
+    manifest = BatchManifest(Path(batch_dir), version)
+    started = time.monotonic()
+    for round_num in range(1, max_rounds + 1):
+        results, errors = read_results(manifest.result_files())
+        in_flight = manifest.in_flight_ids()
+        missing = {
+            cid: body for cid, body in requests.items() if cid not in results and cid not in in_flight
+        }
+        if missing and round_num > 1:
+            logging.info(f"Resubmitting {len(missing)} failed or unfinished requests (round {round_num})")
+        write_shards(manifest, missing, shard_size)
+        for name, shard in manifest.shards.items():
+            if not shard.get("batch_id") and not shard.get("done"):
+                await submit_shard(client, manifest, name)
+
+        remaining = await poll_shards(client, manifest)
+        while wait and remaining:
+            logging.info(
+                f"{remaining} batches in progress, checking again in {poll_seconds:.0f}s "
+                f"(elapsed {time.monotonic() - started:.0f}s)"
+            )
+            await asyncio.sleep(poll_seconds)
+            remaining = await poll_shards(client, manifest)
+        if remaining:
+            logging.info(f"{remaining} batches still in progress; re-run to collect their results")
+            break
+
+        results, errors = read_results(manifest.result_files())
+        if all(cid in results for cid in requests):
+            break
+
+    results, errors = read_results(manifest.result_files())
+    found = {cid: results[cid] for cid in requests if cid in results}
+    failed = {cid: errors[cid] for cid in requests if cid in errors and cid not in found}
+    for cid, error in list(failed.items())[:5]:
+        logging.warning(f"Batch request {cid[:16]} failed: {error}")
+    logging.info(
+        f"Batch results: {len(found)}/{len(requests)} contexts, {len(failed)} failed, "
+        f"{len(requests) - len(found) - len(failed)} pending"
+    )
+    return found
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Chunking benchmark: table-preserving Markdown chunker vs. SentenceSplitter.
+
+Chunks a Document pickle (parse.py output) or synthetic datasheet pages with
+large Markdown spec tables, and reports for each chunker:
+
+- chunks and tokens per chunk (cl100k_base, see markdown_chunker.py)
+- table fragments: chunks holding table rows without the table's header row
+  (what a reader or the LLM sees when a table is cut mid-way)
+- headless tables: chunks holding a table but no heading
+- chunking time
+
+Retrieval quality and prompt tokens per answer come from
+retrieval_benchmark.py: index both variants (metadata.py --chunker markdown /
+sentence, then create_vector_db.py) and run it with --match text.
+
+Requires llama-index for the SentenceSplitter variant; without it only the
+Markdown chunker is measured.
+
+Usage:
+    python benchmarks/chunking_benchmark.py --docs parsed_docs.pkl
+    python benchmarks/chunking_benchmark.py --pages 200 --chunk_size 1024 -o reports/chunking.json
+"""
+
+import sys
+import json
+import time
+import pickle
+import random
+import argparse
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from markdown_chunker import (  # noqa: E402
+    DEFAULT_CHUNK_OVERLAP,
+    DEFAULT_CHUNK_SIZE,
+    HEADING,
+    TABLE_ROW,
+    MarkdownTableSplitter,
+    count_tokens,
+    parse_blocks,
+    split_table_rows,
+)
+
+try:
+    from llama_index.core.node_parser import SentenceSplitter
+
+    LLAMAINDEX_INSTALLED = True
+except ImportError:
+    SentenceSplitter = None
+    LLAMAINDEX_INSTALLED = False
+
+
+def make_page(rng, rows):
+    model = f"PM{rng.randint(1, 999)}"
+    lines = [f"# {model} Thermal Power Sensor", "", "Broadband thermopile sensor for CW and pulsed lasers. " * 4, ""]
+    lines += ["## Specifications", "", "Table 1: Optical specifications", ""]
+    lines += [f"| Parameter | {model} | {model}-USB | {model}-RS |", "|---|---|---|---|"]
+    for i in range(rows):
+        lines.append(
+            f"| Parameter {i} ({rng.choice(['W', 'mW', 'nm', 'mm', '%'])}) | {rng.uniform(0, 100):.2f} "
+            f"| {rng.uniform(0, 100):.2f} | {rng.randint(1_000_000, 9_999_999)} |"
+        )
+    lines += ["", "## Ordering Information", "", "| Model | Part Number |", "|---|---|"]
+    lines += [f"| {model} variant {i} | {rng.randint(1_000_000, 9_999_999)} |" for i in range(8)]
+    lines += ["", "## Notes", "", " ".join(f"Calibration note {i} applies to this sensor." for i in range(40))]
+    return "\n".join(lines)
+
+
+def chunk_stats(chunks):
+    tokens = sorted(count_tokens(chunk) for chunk in chunks)
+    fragments = headless = 0
+    for chunk in chunks:
+        blocks = parse_blocks(chunk)
+        tables = [b for b in blocks if b.kind == "table"]
+        # SentenceSplitter output may start mid-table: leading rows count as a table
+        if not tables and any(TABLE_ROW.match(line) for line in chunk.splitlines()[:1]):
+            fragments += 1
+            continue
+        for table in tables:
+            header, _ = split_table_rows(table.text)
+            if not header:
+                fragments += 1
+        if tables and not any(HEADING.match(line) for line in chunk.splitlines()):
+            headless += 1
+    return {
+        "chunks": len(chunks),
+        "mean_tokens": sum(tokens) / len(tokens) if tokens else 0,
+        "p95_tokens": tokens[int(0.95 * (len(tokens) - 1))] if tokens else 0,
+        "max_tokens": tokens[-1] if tokens else 0,
+        "table_fragments": fragments,
+        "headless_tables": headless,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the Markdown table-preserving chunker with SentenceSplitter.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--docs", default=None, help="Document pickle; synthetic pages are used when omitted.")
+    parser.add_argument("--pages", type=int, default=100, help="Synthetic pages.")
+    parser.add_argument("--rows", type=int, default=120, help="Spec table rows per synthetic page.")
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--chunk_overlap", type=int, default=DEFAULT_CHUNK_OVERLAP)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", "-o", default=None, help="Write results as JSON.")
+    args = parser.parse_args()
+
+    if args.docs:
+        with open(args.docs, "rb") as f:
+            texts = [doc.text for doc in pickle.load(f)]
+    else:
+        rng = random.Random(args.seed)
+        texts = [make_page(rng, args.rows) for _ in range(args.pages)]
+
+    chunkers = {"markdown": MarkdownTableSplitter(args.chunk_size, args.chunk_overlap).split_text}
+    if LLAMAINDEX_INSTALLED:
+        chunkers["sentence"] = SentenceSplitter(
+            chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
+        ).split_text
+    else:
+        print("llama-index not installed: measuring the Markdown chunker only.")
+
+    results = {}
+    for name, split_text in chunkers.items():
+        start = time.perf_counter()
+        chunks = [chunk for text in texts for chunk in split_text(text)]
+        elapsed = time.perf_counter() - start
+        results[name] = {**chunk_stats(chunks), "seconds": elapsed}
+
+    print("\n--- Chunking Benchmark ---")
+    print(f"{len(texts)} documents, chunk_size {args.chunk_size}, overlap {args.chunk_overlap}")
+    print(f"{'chunker':<10}{'chunks':>8}{'mean tok':>10}{'p95 tok':>9}{'max tok':>9}{'fragments':>11}{'headless':>10}{'ms':>9}")
+    for name, r in results.items():
+        print(
+            f"{name:<10}{r['chunks']:>8}{r['mean_tokens']:>10.0f}{r['p95_tokens']:>9}{r['max_tokens']:>9}"
+            f"{r['table_fragments']:>11}{r['headless_tables']:>10}{r['seconds'] * 1000:>9.1f}"
+        )
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps({"config": vars(args), "results": results}, indent=2))
+        print(f"\nSaved benchmark results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+Async load generator for the FastHTML chat app (matrix_chatbot/main.py).
+
+Drives GET /stream-message with a configurable mix of queries, parses the
+NDJSON stream and reports time-to-first-token (TTFT), inter-token gaps and
+total latency at p50/p95/p99, plus error rate and (optionally) server CPU
+and RSS sampled from the server process.
+
+Load models:
+- Closed loop: --concurrency N virtual users, each sending the next query as
+  soon as the previous stream finishes.
+- Open loop:   --arrival_rate R requests/second with Poisson arrivals,
+  independent of how fast the server responds (exposes queueing).
+
+Query mix: questions from suggested_questions.json and, optionally, a query
+log (plain text, one query per line, or JSONL with a "query" field). Use
+--log_weight to set the share of requests drawn from the log.
+
+For network-free capacity runs, start offline_providers.py and launch the
+app with OFFLINE_PROVIDER_URL set; this tool only talks to the app.
+
+Requires:
+- `pip install httpx` (and optionally `psutil` for --server_pid sampling)
+
+Usage:
+    python benchmarks/load_test_chat.py --url http://127.0.0.1:5002 --concurrency 8 --requests 200
+    python benchmarks/load_test_chat.py --arrival_rate 5 --duration 120 --query_log queries.jsonl
+    python benchmarks/load_test_chat.py --help for more options
+"""
+
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import threading
+from pathlib import Path
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Optional
+
+try:
+    import httpx
+except ImportError:
+    raise ImportError("httpx not found. Please install with: pip install httpx")
+
+try:
+    import psutil
+
+    PSUTIL_INSTALLED = True
+except ImportError:
+    psutil = None
+    PSUTIL_INSTALLED = False
+
+DEFAULT_QUESTIONS_FILE = (
+    Path(__file__).resolve().parent.parent / "matrix_chatbot" / "suggested_questions.json"
+)
+PERCENTILES = (50, 95, 99)
+
+
+@dataclass
+class RequestResult:
+    """Timing and outcome of a single streamed chat request."""
+
+    query: str
+    status: int = 0
+    ok: bool = False
+    error: Optional[str] = None
+    start: float = 0.0
+    ttft: Optional[float] = None
+    total: Optional[float] = None
+    n_chunks: int = 0
+    gaps: List[float] = field(default_factory=list)
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Linear-interpolated percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def load_queries(questions_file: Optional[str], query_log: Optional[str]) -> Dict[str, List[str]]:
+    """Loads the suggested questions and query log into named pools."""
+    pools: Dict[str, List[str]] = {"suggested": [], "log": []}
+    if questions_file and Path(questions_file).is_file():
+        with open(questions_file, "r", encoding="utf-8") as f:
+            pools["suggested"] = [q for q in json.load(f) if isinstance(q, str) and q.strip()]
+    if query_log:
+        with open(query_log, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("{"):
+                    try:
+                        line = json.loads(line).get("query", "")
+                    except json.JSONDecodeError:
+                        pass
+                if line:
+                    pools["log"].append(line)
+    logging.info(
+        f"Loaded {len(pools['suggested'])} suggested questions and {len(pools['log'])} logged queries."
+    )
+    return pools
+
+
+class QueryMix:
+    """Draws queries from the pools according to the configured log share."""
+
+    def __init__(self, pools: Dict[str, List[str]], log_weight: float, seed: int):
+        self.pools = pools
+        self.log_weight = log_weight if pools["log"] else 0.0
+        if not pools["suggested"] and not pools["log"]:
+            raise ValueError("No queries available: provide suggested questions or a query log.")
+        if not pools["suggested"]:
+            self.log_weight = 1.0
+        self.rng = random.Random(seed)
+
+    def next(self) -> str:
+        pool = "log" if self.rng.random() < self.log_weight else "suggested"
+        return self.rng.choice(self.pools[pool])
+
+
+class ServerSampler:
+    """Samples CPU% and RSS of the server process (and its children) on a thread."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.process = psutil.Process(pid)
+        self.interval = interval
+        self.cpu: List[float] = []
+        self.rss_mb: List[float] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _processes(self):
+        try:
+            return [self.process] + self.process.children(recursive=True)
+        except psutil.Error:
+            return [self.process]
+
+    def _run(self):
+        for p in self._processes():
+            p.cpu_percent(None)  # Prime the counters
+        while not self._stop.wait(self.interval):
+            cpu, rss = 0.0, 0
+            for p in self._processes():
+                try:
+                    cpu += p.cpu_percent(None)
+                    rss += p.memory_info().rss
+                except psutil.Error:
+                    continue
+            self.cpu.append(cpu)
+            self.rss_mb.append(rss / (1024 * 1024))
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> Dict[str, Optional[float]]:
+        self._stop.set()
+        self._thread.join(timeout=2)
+        return {
+            "cpu_percent_mean": sum(self.cpu) / len(self.cpu) if self.cpu else None,
+            "cpu_percent_max": max(self.cpu) if self.cpu else None,
+            "rss_mb_max": max(self.rss_mb) if self.rss_mb else None,
+        }
+
+
+async def run_request(client: httpx.AsyncClient, url: str, query: str, timeout: float) -> RequestResult:
+    """Sends one /stream-message request and times the NDJSON stream."""
+    result = RequestResult(query=query, start=time.perf_counter())
+    last_chunk_at = None
+    try:
+        async with client.stream(
+            "GET", f"{url}/stream-message", params={"query": query}, timeout=timeout
+        ) as response:
+            result.status = response.status_code
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+                now = time.perf_counter()
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    result.error = f"Malformed NDJSON line: {line[:80]}"
+                    continue
+                event_type = event.get("type")
+                if event_type == "content":
+                    if result.ttft is None:
+                        result.ttft = now - result.start
+                    elif last_chunk_at is not None:
+                        result.gaps.append(now - last_chunk_at)
+                    last_chunk_at = now
+                    result.n_chunks += 1
+                elif event_type == "error":
+                    result.error = str(event.get("content", "error"))[:200]
+                elif event_type == "done":
+                    break
+        result.total = time.perf_counter() - result.start
+        result.ok = result.status == 200 and result.error is None and result.n_chunks > 0
+        if result.status != 200 and result.error is None:
+            result.error = f"HTTP {result.status}"
+        elif result.ok is False and result.error is None:
+            result.error = "Empty stream"
+    except (httpx.HTTPError, asyncio.TimeoutError) as e:
+        result.total = time.perf_counter() - result.start
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def closed_loop(
+    url: str, mix: QueryMix, concurrency: int, n_requests: Optional[int], duration: Optional[float], timeout: float
+) -> List[RequestResult]:
+    """N virtual users issuing requests back to back."""
+    results: List[RequestResult] = []
+    deadline = time.perf_counter() + duration if duration else None
+    issued = 0
+    lock = asyncio.Lock()
+
+    async def user(client):
+        nonlocal issued
+        while True:
+            async with lock:
+                if n_requests is not None and issued >= n_requests:
+                    return
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                issued += 1
+                query = mix.next()
+            results.append(await run_request(client, url, query, timeout))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits) as client:
+        await asyncio.gather(*(user(client) for _ in range(concurrency)))
+    return results
+
+
+async def open_loop(
+    url: str, mix: QueryMix, arrival_rate: float, n_requests: Optional[int], duration: Optional[float], timeout: float, seed: int
+) -> List[RequestResult]:
+    """Poisson arrivals at a fixed rate, regardless of response times."""
+    rng = random.Random(seed + 1)
+    tasks = []
+    start = time.perf_counter()
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=None)) as client:
+        next_at = start
+        while True:
+            if n_requests is not None and len(tasks) >= n_requests:
+                break
+            if duration is not None and next_at - start >= duration:
+                break
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(run_request(client, url, mix.next(), timeout)))
+            next_at += rng.expovariate(arrival_rate)
+        return list(await asyncio.gather(*tasks))
+
+
+def summarize(results: List[RequestResult], wall_time: float) -> Dict:
+    """Aggregates per-request results into the report dictionary."""
+    ok = [r for r in results if r.ok]
+    ttfts = [r.ttft for r in ok if r.ttft is not None]
+    totals = [r.total for r in ok if r.total is not None]
+    gaps = [g for r in ok for g in r.gaps]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if not r.ok:
+            key = (r.error or "unknown")[:80]
+            errors[key] = errors.get(key, 0) + 1
+
+    def pcts(values):
+        return {f"p{p}": percentile(values, p) for p in PERCENTILES}
+
+    return {
+        "requests": len(results),
+        "succeeded": len(ok),
+        "error_rate": (len(results) - len(ok)) / len(results) if results else 0.0,
+        "throughput_rps": len(ok) / wall_time if wall_time > 0 else 0.0,
+        "wall_time_s": wall_time,
+        "ttft_s": pcts(ttfts),
+        "inter_token_gap_s": pcts(gaps),
+        "total_latency_s": pcts(totals),
+        "errors": errors,
+    }
+
+
+def print_report(report: Dict):
+    """Prints the summary in the same plain style as the other scripts."""
+
+    def fmt(v):
+        return f"{v * 1000:8.1f} ms" if v is not None else "     n/a"
+
+    print("\n--- Load Test Summary ---")
+    print(f"Mode: {report['mode']}")
+    print(
+        f"Requests: {report['requests']} | Succeeded: {report['succeeded']} | Error rate: {report['error_rate']:.2%}"
+    )
+    print(f"Throughput: {report['throughput_rps']:.2f} req/s over {report['wall_time_s']:.1f} s")
+    print(f"{'metric':<20}" + "".join(f"{'p' + str(p):>12}" for p in PERCENTILES))
+    for key, label in (
+        ("ttft_s", "TTFT"),
+        ("inter_token_gap_s", "Inter-token gap"),
+        ("total_latency_s", "Total latency"),
+    ):
+        print(f"{label:<20}" + "".join(f"{fmt(report[key][f'p{p}']):>12}" for p in PERCENTILES))
+    server = report.get("server")
+    if server:
+        cpu_mean = server["cpu_percent_mean"]
+        print(
+            f"Server CPU: mean {cpu_mean if cpu_mean is not None else float('nan'):.1f}% "
+            f"max {server['cpu_percent_max'] or 0:.1f}% | RSS max {server['rss_mb_max'] or 0:.1f} MB"
+        )
+    if report["errors"]:
+        print("Errors:")
+        for message, count in sorted(report["errors"].items(), key=lambda x: -x[1]):
+            print(f"  {count:5d} x {message}")
+
+
+async def main(args):
+    pools = load_queries(args.questions_file, args.query_log)
+    mix = QueryMix(pools, args.log_weight, args.seed)
+    n_requests = args.requests if args.requests > 0 else None
+    if n_requests is None and not args.duration:
+        raise ValueError("Specify --requests or --duration.")
+
+    sampler = None
+    if args.server_pid:
+        if not PSUTIL_INSTALLED:
+            logging.warning("psutil not installed; server CPU/RSS sampling disabled.")
+        else:
+            sampler = ServerSampler(args.server_pid)
+            sampler.start()
+
+    start = time.perf_counter()
+    if args.arrival_rate:
+        mode = f"open loop @ {args.arrival_rate} req/s"
+        results = await open_loop(
+            args.url, mix, args.arrival_rate, n_requests, args.duration, args.timeout, args.seed
+        )
+    else:
+        mode = f"closed loop, concurrency {args.concurrency}"
+        results = await closed_loop(
+            args.url, mix, args.concurrency, n_requests, args.duration, args.timeout
+        )
+    wall_time = time.perf_counter() - start
+
+    report = summarize(results, wall_time)
+    report["mode"] = mode
+    if sampler:
+        report["server"] = sampler.stop()
+    print_report(report)
+
+    if args.output:
+        output_path = Path(args.output)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        report["config"] = vars(args)
+        if args.per_request:
+            report["per_request"] = [asdict(r) for r in results]
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved report to {output_path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Load-test the chat /stream-message endpoint and report TTFT and tail latency.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:5002", help="Base URL of the chat app.")
+    parser.add_argument(
+        "--questions_file",
+        type=str,
+        default=str(DEFAULT_QUESTIONS_FILE),
+        help="JSON list of suggested questions.",
+    )
+    parser.add_argument(
+        "--query_log", type=str, default=None, help="Query log (text lines or JSONL with 'query')."
+    )
+    parser.add_argument(
+        "--log_weight", type=float, default=0.5, help="Share of requests drawn from the query log."
+    )
+    parser.add_argument(
+        "--concurrency", "-c", type=int, default=4, help="Virtual users (closed loop)."
+    )
+    parser.add_argument(
+        "--arrival_rate",
+        "-r",
+        type=float,
+        default=None,
+        help="Open-loop Poisson arrival rate in requests/second (overrides --concurrency).",
+    )
+    parser.add_argument(
+        "--requests", "-n", type=int, default=100, help="Total requests (0 = use --duration only)."
+    )
+    parser.add_argument("--duration", "-d", type=float, default=None, help="Stop issuing after N seconds.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds.")
+    parser.add_argument("--server_pid", type=int, default=None, help="PID of the server for CPU/RSS sampling.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for query selection and arrivals.")
+    parser.add_argument("--output", "-o", type=str, default=None, help="Write the JSON report here.")
+    parser.add_argument(
+        "--per_request", action="store_true", help="Include per-request timings in the JSON report."
+    )
+
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args))
+    except (FileNotFoundError, ValueError) as e:
+        logging.error(f"Load test failed: {e}")
+        print(f"Error: {e}")
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for pairs metadata extraction.
+
+Builds synthetic parsed sections with large "Metadata: {'pairs': [...]}"
+blocks (10k pairs by default, with surrounding Markdown and a few escaped and
+double-quoted entries) and times:
+
+- legacy:  the previous inline implementation (per-call DOTALL regex compile,
+           ast.literal_eval, re.sub to remove the block)
+- scanner: pairs_extraction.extract_pairs (precompiled linear scanner and
+           restricted tuple parser)
+- pool:    extract_pairs_batch over a ProcessPoolExecutor, one batch per file
+
+Both implementations must agree on the extracted pairs and (up to blank-line
+normalisation) on the remaining text; the run fails otherwise. Sections with
+several blocks between body paragraphs are checked too, with the remaining
+text compared exactly, so no extra blank lines are left where blocks were.
+
+Usage:
+    python benchmarks/pairs_extraction_benchmark.py --pairs 10000 --sections 20
+    python benchmarks/pairs_extraction_benchmark.py --pairs 10000 -o reports/pairs_extraction.json
+"""
+
+import re
+import ast
+import sys
+import json
+import time
+import random
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from pairs_extraction import extract_pairs, extract_pairs_batch  # noqa: E402
+
+
+def legacy_extract_pairs(text):
+    """The pre-pairs_extraction logic, reduced to text in / (pairs, text) out."""
+    metadata_pairs_regex = re.compile(
+        r"^\s*Metadata:\s*\{\s*['\"]pairs['\"]\s*:\s*(\[.*?\])\s*\}\s*$",
+        re.MULTILINE | re.DOTALL | re.IGNORECASE,
+    )
+    match = metadata_pairs_regex.search(text)
+    if not match:
+        return None, None
+    try:
+        raw = ast.literal_eval(match.group(1))
+    except (ValueError, SyntaxError):
+        return None, None
+    if not isinstance(raw, list) or not all(
+        isinstance(p, tuple) and len(p) == 2 and all(isinstance(v, str) for v in p) for p in raw
+    ):
+        return None, None
+    pairs = [{"model_name": p[0], "part_number": p[1]} for p in raw]
+    if match.group(0).strip() == text.strip():
+        return pairs, None
+    return pairs, metadata_pairs_regex.sub("", text).strip()
+
+
+def make_section(n_pairs, rng, body_paragraphs=20):
+    body = []
+    for i in range(body_paragraphs):
+        body.append(f"## Specification group {i}\n\n|Model|PM{i}|PM{i + 1}|\n|---|---|---|\n|Range (W)|0.1 to {i + 10}|1 to {i + 30}|")
+    entries = []
+    for i in range(n_pairs):
+        model = f"PM{rng.randint(1, 999)} {rng.choice(['USB', 'RS', 'DB25', ''])}".strip()
+        part = str(rng.randint(1_000_000, 9_999_999))
+        if i % 997 == 0:
+            entries.append(f'        ("{model} 1\\" head", "{part}")')
+        elif i % 499 == 0:
+            entries.append(f"        ('{model} O\\'Brien', '33-{part[:4]}-000')")
+        else:
+            entries.append(f"        ('{model}', '{part}')")
+    block = "Metadata: {\n    'pairs': [\n" + ",\n".join(entries) + "\n    ]\n}"
+    return "\n\n".join(body) + "\n\n" + block + "\n"
+
+
+def make_multi_block_section(rng, blocks=3):
+    """Body paragraphs with a small pairs block after each (LlamaParse can emit one per table)."""
+    parts = []
+    for i in range(blocks):
+        parts.append(f"## Ordering information {i}\n\n|Model|Part number|\n|---|---|\n|PM{i}|{1174250 + i}|")
+        entries = ",\n".join(
+            f"        ('PM{rng.randint(1, 999)} USB', '{rng.randint(1_000_000, 9_999_999)}')" for _ in range(3)
+        )
+        parts.append("Metadata: {\n    'pairs': [\n" + entries + "\n    ]\n}")
+    parts.append("Specifications subject to change without notice.")
+    return "\n\n".join(parts) + "\n"
+
+
+def normalise(text):
+    return None if text is None else re.sub(r"\n{2,}", "\n\n", text)
+
+
+def time_it(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark pairs metadata extraction.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--pairs", type=int, default=10_000, help="Pairs per section.")
+    parser.add_argument("--sections", type=int, default=20, help="Sections (documents) per run.")
+    parser.add_argument("--files", type=int, default=4, help="Files the sections are spread over (pool batches).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timing repetitions (best is reported).")
+    parser.add_argument("--workers", type=int, default=4, help="Processes for the pool variant.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", "-o", default=None, help="Write results as JSON.")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    texts = [make_section(args.pairs, rng) for _ in range(args.sections)]
+    total_mb = sum(len(t) for t in texts) / 1e6
+
+    for text in texts:
+        legacy_pairs, legacy_text = legacy_extract_pairs(text)
+        result = extract_pairs(text)
+        pairs = [{"model_name": m, "part_number": p} for m, p in result.pairs]
+        if pairs != legacy_pairs or normalise(result.text) != normalise(legacy_text):
+            raise SystemExit("Mismatch between legacy and scanner results.")
+    for _ in range(10):
+        text = make_multi_block_section(rng)
+        legacy_pairs, legacy_text = legacy_extract_pairs(text)
+        result = extract_pairs(text)
+        pairs = [{"model_name": m, "part_number": p} for m, p in result.pairs]
+        if pairs != legacy_pairs or result.text != legacy_text:
+            raise SystemExit("Mismatch between legacy and scanner results for a multi-block section.")
+
+    per_file = max(1, len(texts) // args.files)
+    batches = [texts[i : i + per_file] for i in range(0, len(texts), per_file)]
+
+    timings = {
+        "legacy": time_it(lambda: [legacy_extract_pairs(t) for t in texts], args.repeat),
+        "scanner": time_it(lambda: [extract_pairs(t) for t in texts], args.repeat),
+    }
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(extract_pairs_batch, batches[:1]))  # Warm up the workers
+        timings["pool"] = time_it(lambda: list(pool.map(extract_pairs_batch, batches)), args.repeat)
+
+    total_pairs = args.pairs * args.sections
+    print("\n--- Pairs Extraction Benchmark ---")
+    print(f"{args.sections} sections x {args.pairs} pairs ({total_mb:.1f} MB of text), best of {args.repeat}")
+    for name, seconds in timings.items():
+        print(
+            f"{name:<8} {seconds * 1000:9.1f} ms  {total_pairs / seconds / 1e6:6.2f} M pairs/s  "
+            f"x{timings['legacy'] / seconds:5.2f} vs legacy"
+        )
+
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(
+            json.dumps({"config": vars(args), "mb": total_mb, "seconds": timings}, indent=2)
+        )
+        print(f"\nSaved benchmark results to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+Retrieval quality-and-latency benchmark for the hybrid retriever.
+
+Two steps:
+
+1. build-golden: derives a golden question -> expected-node set from a node
+   pickle. Questions come from the structured 'pairs' metadata (model name
+   <-> part number lookups) and from Markdown headings in node text. Hand
+   written entries can be merged in with --extra (same JSON format).
+
+2. run: evaluates one or more retriever configurations over the golden set
+   and reports recall@k, MRR and nDCG@k alongside per-stage latency
+   (vector, keyword, fusion, rerank), context tokens handed to the LLM and an
+   estimated cost per query. Prints a Pareto table over quality vs. cost so
+   the cheapest configuration that keeps quality is easy to pick.
+
+Golden entries also record the expected answer (the part number, model or
+heading). With --match text, a result counts as relevant when it contains the
+answer. Node ids don't carry over between chunkings, so this lets one golden
+set compare indexes built with metadata.py --chunker markdown and --chunker
+sentence.
+
+With --batch, each configuration runs through the retriever's retrieve_batch
+entry point, which is much faster on large golden sets but only reports
+amortized latency.
+
+Configurations are JSON: either a list of dicts or a dict of lists (expanded
+as a grid). Recognised keys: name, vector_top_k, keyword_top_k, rerank_top_n
+(0 disables reranking), vector_weight, keyword_weight, initial_top_k.
+
+Runs against the same Qdrant/SQLite stores as the app (the chat_engine
+module in matrix_chatbot is reused), so set OFFLINE_PROVIDER_URL to run it
+without network.
+
+Usage:
+    python benchmarks/retrieval_benchmark.py build-golden --nodes matrix_chatbot/matrix_nodes.pkl -o benchmarks/golden.json
+    python benchmarks/retrieval_benchmark.py run --golden benchmarks/golden.json --configs grid.json -o reports/retrieval.json
+    python benchmarks/retrieval_benchmark.py run --golden benchmarks/golden.json --label local --app_dir ./local_app -o reports/retrieval_local.json
+    python benchmarks/retrieval_benchmark.py run --golden benchmarks/golden.json --match text --label sentence --app_dir ./sentence_app
+    python benchmarks/retrieval_benchmark.py --help for more options
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import pickle
+import hashlib
+import logging
+import argparse
+import itertools
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_APP_DIR = REPO_ROOT / "matrix_chatbot"
+sys.path.insert(0, str(REPO_ROOT))
+
+from context_cache import split_context  # noqa: E402
+
+# Approximate list prices (USD) used for the cost column
+EMBED_COST_PER_1M_TOKENS = 0.13  # text-embedding-3-large
+RERANK_COST_PER_SEARCH = 0.002  # Cohere rerank, one search unit per query
+LLM_INPUT_COST_PER_1M_TOKENS = 2.50  # gpt-4o input tokens
+
+DEFAULT_CONFIG = {
+    "name": "production",
+    "vector_top_k": 10,
+    "keyword_top_k": 5,
+    "rerank_top_n": 5,
+    "vector_weight": 0.7,
+    "keyword_weight": 0.3,
+    "initial_top_k": 20,
+}
+
+HEADING_RE = re.compile(r"^\s{0,3}#{1,4}\s+(.+?)\s*#*\s*$", re.MULTILINE)
+
+
+# --- Golden set construction ---
+def text_hash(text: str) -> str:
+    """
+    Stable fingerprint of node text, used when node ids change between builds.
+    The enrichment context is left out, so one golden set fits node sets
+    enriched by different metadata.py backends.
+    """
+    return hashlib.sha256(split_context(text)[0].strip().encode("utf-8")).hexdigest()[:16]
+
+
+def build_golden_set(nodes: List[Any], max_nodes_per_heading: int = 3, min_heading_words: int = 2) -> List[Dict]:
+    """Derives golden entries from pairs metadata and Markdown headings."""
+    entries: Dict[str, Dict] = {}
+
+    def add(question: str, node, source: str, answer: str):
+        key = question.lower()
+        entry = entries.setdefault(
+            key,
+            {
+                "id": f"{source}-{len(entries) + 1}",
+                "question": question,
+                "expected_node_ids": [],
+                "expected_text_hashes": [],
+                "expected_answer": answer,
+                "source": source,
+            },
+        )
+        if node.node_id not in entry["expected_node_ids"]:
+            entry["expected_node_ids"].append(node.node_id)
+            entry["expected_text_hashes"].append(text_hash(node.text))
+
+    # Pairs: both lookup directions
+    for node in nodes:
+        for pair in (getattr(node, "metadata", None) or {}).get("pairs", []) or []:
+            if not isinstance(pair, dict):
+                continue
+            model = str(pair.get("model_name", "")).strip()
+            part = str(pair.get("part_number", "")).strip()
+            if not model or not part:
+                continue
+            add(f"What is the part number for the {model}?", node, "pairs", part)
+            add(f"Which model has part number {part}?", node, "pairs", model)
+
+    # Headings: skip boilerplate that repeats across many nodes
+    heading_nodes: Dict[str, List[Any]] = {}
+    for node in nodes:
+        for heading in set(HEADING_RE.findall(getattr(node, "text", "") or "")):
+            heading = heading.strip(" *_`")
+            if len(heading.split()) >= min_heading_words:
+                heading_nodes.setdefault(heading, []).append(node)
+    for heading, matched in heading_nodes.items():
+        if len(matched) <= max_nodes_per_heading:
+            for node in matched:
+                add(f"Tell me about {heading}", node, "heading", heading)
+
+    golden = list(entries.values())
+    logging.info(
+        f"Built {len(golden)} golden entries "
+        f"({sum(e['source'] == 'pairs' for e in golden)} from pairs, "
+        f"{sum(e['source'] == 'heading' for e in golden)} from headings)."
+    )
+    return golden
+
+
+def load_golden(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        golden = json.load(f)
+    return [g for g in golden if g.get("question") and (g.get("expected_node_ids") or g.get("expected_text_hashes"))]
+
+
+# --- Metrics ---
+def is_relevant(entry: Dict, node_id: str, node_text: str) -> bool:
+    if node_id in entry.get("expected_node_ids", []):
+        return True
+    hashes = entry.get("expected_text_hashes")
+    return bool(hashes) and text_hash(node_text) in hashes
+
+
+def judge(entry: Dict, results: List[Any], match: str = "node"):
+    """
+    (relevance list, number of relevant nodes) for one query's results.
+
+    "node" matches the golden node ids / text hashes, so it only works for the
+    node set the golden set was built from. "text" counts the first result
+    whose text contains the entry's expected_answer as the one relevant hit,
+    so one golden set can compare indexes built with different chunkers.
+    """
+    if match == "text" and entry.get("expected_answer"):
+        answer = entry["expected_answer"].lower()
+        relevance, found = [], False
+        for r in results:
+            hit = not found and answer in r.node.get_content().lower()
+            found = found or hit
+            relevance.append(hit)
+        return relevance, 1
+    relevance = [is_relevant(entry, r.node.node_id, r.node.get_content()) for r in results]
+    n_relevant = max(len(entry.get("expected_node_ids", [])), len(entry.get("expected_text_hashes", [])))
+    return relevance, n_relevant
+
+
+def recall_at_k(relevance: List[bool], n_relevant: int, k: int) -> float:
+    if n_relevant == 0:
+        return 0.0
+    return sum(relevance[:k]) / min(n_relevant, k)
+
+
+def reciprocal_rank(relevance: List[bool]) -> float:
+    for rank, rel in enumerate(relevance, 1):
+        if rel:
+            return 1.0 / rank
+    return 0.0
+
+
+def ndcg_at_k(relevance: List[bool], n_relevant: int, k: int) -> float:
+    dcg = sum(1.0 / math.log2(i + 2) for i, rel in enumerate(relevance[:k]) if rel)
+    ideal = sum(1.0 / math.log2(i + 2) for i in range(min(n_relevant, k)))
+    return dcg / ideal if ideal else 0.0
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+# --- Timing proxies ---
+class _TimedRetriever:
+    """Wraps a retriever and accumulates time spent in retrieve()."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.elapsed = 0.0
+
+    def retrieve(self, query_bundle):
+        start = time.perf_counter()
+        try:
+            return self.inner.retrieve(query_bundle)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def retrieve_batch(self, query_strs):
+        start = time.perf_counter()
+        try:
+            if hasattr(self.inner, "retrieve_batch"):
+                return self.inner.retrieve_batch(query_strs)
+            from llama_index.core.schema import QueryBundle
+
+            return [self.inner.retrieve(QueryBundle(query_str=q)) for q in query_strs]
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+class _TimedReranker:
+    """
+    Wraps a node postprocessor, accumulates time spent reranking and records
+    the queries whose rerank call failed (the retriever then silently falls
+    back to the fused order, which must not be scored as a rerank).
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.top_n = inner.top_n
+        self.elapsed = 0.0
+        self.failed_queries = set()
+
+    def postprocess_nodes(self, nodes, query_bundle):
+        start = time.perf_counter()
+        try:
+            return self.inner.postprocess_nodes(nodes, query_bundle)
+        except Exception:
+            self.failed_queries.add(query_bundle.query_str)
+            raise
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def failed(self, query_str: str) -> bool:
+        return query_str in self.failed_queries
+
+
+# --- Benchmark runner ---
+def expand_configs(raw: Any) -> List[Dict]:
+    """Accepts a list of configs or a dict of lists (grid) and fills defaults."""
+    if isinstance(raw, dict):
+        keys = list(raw.keys())
+        values = [v if isinstance(v, list) else [v] for v in raw.values()]
+        raw = [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+    configs = []
+    for i, cfg in enumerate(raw, 1):
+        merged = {**DEFAULT_CONFIG, **cfg}
+        if "name" not in cfg:
+            merged["name"] = (
+                f"v{merged['vector_top_k']}-k{merged['keyword_top_k']}-r{merged['rerank_top_n']}"
+                f"-w{merged['vector_weight']}-i{merged['initial_top_k']}"
+            )
+        configs.append(merged)
+    return configs
+
+
+class RetrievalBench:
+    """Builds retrievers from chat_engine components and evaluates configurations."""
+
+    def __init__(self, app_dir: Path, cohere_api_key: Optional[str]):
+        sys.path.insert(0, str(app_dir))
+        os.chdir(app_dir)  # chat_engine resolves its DB paths relative to cwd
+        import chat_engine
+
+        self.ce = chat_engine
+        chat_engine._init_settings()
+        from llama_index.core import VectorStoreIndex
+        from llama_index.vector_stores.qdrant import QdrantVectorStore
+        from qdrant_client import QdrantClient
+
+        production = os.environ.get("PLASH_PRODUCTION") == "1"
+        self.sqlite_db_path = chat_engine.SQLITE_DB_NAME_PROD if production else chat_engine.SQLITE_DB_NAME_LOCAL
+        qdrant_path = chat_engine.QDRANT_PATH_PROD if production else chat_engine.QDRANT_PATH_LOCAL
+        self.qdrant_client = QdrantClient(path=qdrant_path)
+        vector_store = QdrantVectorStore(
+            client=self.qdrant_client, collection_name=chat_engine.QDRANT_COLLECTION_NAME
+        )
+        self.index = VectorStoreIndex.from_vector_store(
+            vector_store=vector_store, embed_model=chat_engine.Settings.embed_model
+        )
+        if chat_engine.OFFLINE_PROVIDER_URL:
+            cohere_api_key = cohere_api_key or chat_engine.OFFLINE_API_KEY
+        self.cohere_api_key = cohere_api_key
+
+    def build(self, cfg: Dict):
+        vector = _TimedRetriever(self.index.as_retriever(similarity_top_k=cfg["vector_top_k"]))
+        keyword = _TimedRetriever(
+            self.ce.SQLiteFTSRetriever(db_path=self.sqlite_db_path, top_k=cfg["keyword_top_k"])
+        )
+        reranker = None
+        if cfg["rerank_top_n"] > 0:
+            if not self.cohere_api_key:
+                raise ValueError("COHERE_API_KEY is required for configurations with reranking.")
+            from llama_index.postprocessor.cohere_rerank import CohereRerank
+
+            reranker = _TimedReranker(
+                CohereRerank(
+                    api_key=self.cohere_api_key,
+                    model=self.ce.RERANK_MODEL,
+                    top_n=cfg["rerank_top_n"],
+                    base_url=self.ce.OFFLINE_PROVIDER_URL,  # None: the Cohere API
+                )
+            )
+        retriever = self.ce.HybridRetrieverWithReranking(
+            vector_retriever=vector,
+            keyword_retriever=keyword,
+            reranker=reranker,
+            vector_weight=cfg["vector_weight"],
+            keyword_weight=cfg["keyword_weight"],
+            initial_top_k=cfg["initial_top_k"],
+            qdrant_client=self.qdrant_client,
+            collection_name=self.ce.QDRANT_COLLECTION_NAME,
+            embed_model=self.ce.Settings.embed_model,
+            vector_top_k=cfg["vector_top_k"],
+        )
+        return retriever, vector, keyword, reranker
+
+    def evaluate(
+        self, cfg: Dict, golden: List[Dict], ks: List[int], batch: bool = False, match: str = "node"
+    ) -> Dict:
+        from llama_index.core.schema import QueryBundle
+
+        retriever, vector, keyword, reranker = self.build(cfg)
+        if batch:
+            return self._evaluate_batch(cfg, golden, ks, retriever, reranker, match)
+        per_query = []
+        for entry in golden:
+            marks = (vector.elapsed, keyword.elapsed, reranker.elapsed if reranker else 0.0)
+            start = time.perf_counter()
+            try:
+                results = retriever._retrieve(QueryBundle(query_str=entry["question"]))
+                error = None
+            except Exception as e:
+                results, error = [], str(e)
+            total = time.perf_counter() - start
+            t_vector = vector.elapsed - marks[0]
+            t_keyword = keyword.elapsed - marks[1]
+            t_rerank = (reranker.elapsed if reranker else 0.0) - marks[2]
+            relevance, n_relevant = judge(entry, results, match)
+            ctx_tokens = sum(estimate_tokens(r.node.get_content()) for r in results)
+            rerank_failed = bool(reranker and reranker.failed(entry["question"]))
+            per_query.append(
+                {
+                    "id": entry.get("id"),
+                    "error": error,
+                    "rerank_failed": rerank_failed,
+                    "relevance": relevance,
+                    "n_relevant": n_relevant,
+                    "latency": {
+                        "total": total,
+                        "vector": t_vector,
+                        "keyword": t_keyword,
+                        "rerank": t_rerank,
+                        "fusion": max(0.0, total - t_vector - t_keyword - t_rerank),
+                    },
+                    "ctx_tokens": ctx_tokens,
+                    "cost": estimate_tokens(entry["question"]) * EMBED_COST_PER_1M_TOKENS / 1e6
+                    + (RERANK_COST_PER_SEARCH if reranker and not rerank_failed else 0.0)
+                    + ctx_tokens * LLM_INPUT_COST_PER_1M_TOKENS / 1e6,
+                }
+            )
+        return aggregate(cfg, per_query, ks)
+
+    def _evaluate_batch(
+        self, cfg: Dict, golden: List[Dict], ks: List[int], retriever, reranker, match: str = "node"
+    ) -> Dict:
+        """Evaluates through retrieve_batch; latency is amortized per query, stages are not split."""
+        start = time.perf_counter()
+        batch_results = retriever.retrieve_batch(
+            [entry["question"] for entry in golden], rerank=reranker is not None
+        )
+        amortized = (time.perf_counter() - start) / (len(golden) or 1)
+        rerank_time = (reranker.elapsed / (len(golden) or 1)) if reranker else 0.0
+        per_query = []
+        for entry, results in zip(golden, batch_results):
+            ctx_tokens = sum(estimate_tokens(r.node.get_content()) for r in results)
+            relevance, n_relevant = judge(entry, results, match)
+            rerank_failed = bool(reranker and reranker.failed(entry["question"]))
+            per_query.append(
+                {
+                    "id": entry.get("id"),
+                    "error": None,
+                    "rerank_failed": rerank_failed,
+                    "relevance": relevance,
+                    "n_relevant": n_relevant,
+                    "latency": {
+                        "total": amortized,
+                        "vector": 0.0,
+                        "keyword": 0.0,
+                        "rerank": rerank_time,
+                        "fusion": 0.0,
+                    },
+                    "ctx_tokens": ctx_tokens,
+                    "cost": estimate_tokens(entry["question"]) * EMBED_COST_PER_1M_TOKENS / 1e6
+                    + (RERANK_COST_PER_SEARCH if reranker and not rerank_failed else 0.0)
+                    + ctx_tokens * LLM_INPUT_COST_PER_1M_TOKENS / 1e6,
+                }
+            )
+        return aggregate(cfg, per_query, ks)
+
+
+def aggregate(cfg: Dict, per_query: List[Dict], ks: List[int]) -> Dict:
+    n = len(per_query) or 1
+    # A failed rerank falls back to the fused order: an error, not a reranked result
+    summary = {
+        "config": cfg,
+        "queries": len(per_query),
+        "errors": sum(1 for q in per_query if q["error"] or q.get("rerank_failed")),
+        "rerank_errors": sum(1 for q in per_query if q.get("rerank_failed")),
+    }
+    for k in ks:
+        summary[f"recall@{k}"] = sum(recall_at_k(q["relevance"], q["n_relevant"], k) for q in per_query) / n
+        summary[f"ndcg@{k}"] = sum(ndcg_at_k(q["relevance"], q["n_relevant"], k) for q in per_query) / n
+    summary["mrr"] = sum(reciprocal_rank(q["relevance"]) for q in per_query) / n
+    for stage in ("total", "vector", "keyword", "fusion", "rerank"):
+        values = [q["latency"][stage] for q in per_query]
+        summary[f"{stage}_p50_ms"] = (percentile(values, 50) or 0.0) * 1000
+        summary[f"{stage}_p95_ms"] = (percentile(values, 95) or 0.0) * 1000
+    summary["ctx_tokens"] = sum(q["ctx_tokens"] for q in per_query) / n
+    summary["cost_per_1k_queries"] = sum(q["cost"] for q in per_query) / n * 1000
+    return summary
+
+
+def mark_pareto(summaries: List[Dict], quality_key: str) -> None:
+    """Flags configurations not dominated on (higher quality, lower cost, lower p95)."""
+    for s in summaries:
+        s["pareto"] = not any(
+            o is not s
+            and o[quality_key] >= s[quality_key]
+            and o["cost_per_1k_queries"] <= s["cost_per_1k_queries"]
+            and o["total_p95_ms"] <= s["total_p95_ms"]
+            and (
+                o[quality_key] > s[quality_key]
+                or o["cost_per_1k_queries"] < s["cost_per_1k_queries"]
+                or o["total_p95_ms"] < s["total_p95_ms"]
+            )
+            for o in summaries
+        )
+
+
+def print_pareto_table(summaries: List[Dict], ks: List[int], quality_key: str, min_quality: Optional[float]):
+    cols = [f"recall@{k}" for k in ks] + ["mrr", f"ndcg@{ks[-1]}"]
+    header = f"{'config':<36}" + "".join(f"{c:>11}" for c in cols)
+    header += f"{'p50 ms':>9}{'p95 ms':>9}{'rerank':>9}{'ctx tok':>9}{'$/1k q':>9}  pareto"
+    print("\n--- Retrieval Benchmark ---")
+    print(header)
+    for s in sorted(summaries, key=lambda x: x["cost_per_1k_queries"]):
+        row = f"{s['config']['name'][:35]:<36}" + "".join(f"{s[c]:>11.3f}" for c in cols)
+        row += f"{s['total_p50_ms']:>9.1f}{s['total_p95_ms']:>9.1f}{s['rerank_p50_ms']:>9.1f}"
+        row += f"{s['ctx_tokens']:>9.0f}{s['cost_per_1k_queries']:>9.3f}  {'*' if s['pareto'] else ''}"
+        print(row)
+    for s in summaries:
+        if s["errors"]:
+            print(
+                f"WARNING: {s['config']['name']}: {s['errors']} of {s['queries']} queries failed "
+                f"({s['rerank_errors']} rerank errors); their results are not comparable."
+            )
+    if min_quality is not None:
+        eligible = [s for s in summaries if s[quality_key] >= min_quality]
+        if eligible:
+            best = min(eligible, key=lambda x: (x["cost_per_1k_queries"], x["total_p95_ms"]))
+            print(f"\nCheapest config with {quality_key} >= {min_quality}: {best['config']['name']}")
+        else:
+            print(f"\nNo configuration reached {quality_key} >= {min_quality}.")
+
+
+def cmd_build_golden(args):
+    with open(args.nodes, "rb") as f:
+        nodes = pickle.load(f)
+    golden = build_golden_set(nodes, args.max_nodes_per_heading)
+    if args.extra:
+        golden.extend(load_golden(args.extra))
+    if args.limit:
+        golden = golden[: args.limit]
+    output_path = Path(args.output)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(golden, f, indent=2)
+    print(f"Saved {len(golden)} golden entries to {output_path}")
+
+
+def cmd_run(args):
+    golden = load_golden(args.golden)
+    if args.limit:
+        golden = golden[: args.limit]
+    if args.configs:
+        with open(args.configs, "r", encoding="utf-8") as f:
+            configs = expand_configs(json.load(f))
+    else:
+        configs = expand_configs([DEFAULT_CONFIG])
+    ks = sorted(set(args.k))
+    output = Path(args.output).resolve() if args.output else None
+
+    bench = RetrievalBench(Path(args.app_dir).resolve(), os.environ.get("COHERE_API_KEY"))
+    summaries = []
+    for cfg in configs:
+        if args.label:
+            cfg["name"] = f"{args.label}/{cfg['name']}"
+        logging.info(f"Evaluating {cfg['name']} on {len(golden)} queries...")
+        summaries.append(bench.evaluate(cfg, golden, ks, batch=args.batch, match=args.match))
+    quality_key = f"ndcg@{ks[-1]}"
+    mark_pareto(summaries, quality_key)
+    print_pareto_table(summaries, ks, quality_key, args.min_quality)
+
+    if output:
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, indent=2)
+        print(f"\nSaved benchmark results to {output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Build a golden set and benchmark retriever configurations for quality, latency and cost.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    golden_parser = subparsers.add_parser(
+        "build-golden", help="Derive golden questions from a node pickle.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    golden_parser.add_argument("--nodes", required=True, help="Node pickle that was indexed.")
+    golden_parser.add_argument("--output", "-o", default="benchmarks/golden.json", help="Golden set output path.")
+    golden_parser.add_argument("--extra", default=None, help="Hand-written golden entries to merge in.")
+    golden_parser.add_argument(
+        "--max_nodes_per_heading", type=int, default=3,
+        help="Skip headings that occur in more nodes than this (boilerplate).",
+    )
+    golden_parser.add_argument("--limit", type=int, default=None, help="Keep only the first N entries.")
+
+    run_parser = subparsers.add_parser(
+        "run", help="Evaluate retriever configurations on a golden set.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    run_parser.add_argument("--golden", required=True, help="Golden set JSON.")
+    run_parser.add_argument("--configs", default=None, help="JSON list of configs or dict-of-lists grid.")
+    run_parser.add_argument("--app_dir", default=str(DEFAULT_APP_DIR), help="Directory holding chat_engine.py and its DBs.")
+    run_parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5], help="Cutoffs for recall/nDCG.")
+    run_parser.add_argument("--min_quality", type=float, default=None, help="Report the cheapest config reaching this nDCG.")
+    run_parser.add_argument("--limit", type=int, default=None, help="Evaluate only the first N golden entries.")
+    run_parser.add_argument(
+        "--batch", action="store_true",
+        help="Use retrieve_batch (one embedding call + Qdrant search_batch); latency is amortized.",
+    )
+    run_parser.add_argument(
+        "--label", default=None,
+        help="Prefix for config names, e.g. the metadata.py --backend the indexed nodes were enriched with.",
+    )
+    run_parser.add_argument(
+        "--match", choices=["node", "text"], default="node",
+        help="node: relevant = the golden nodes; text: relevant = first result containing the expected "
+        "answer (compares indexes built with different chunkers).",
+    )
+    run_parser.add_argument("--output", "-o", default=None, help="Write per-config summaries as JSON.")
+
+    args = parser.parse_args()
+    if args.command == "build-golden":
+        cmd_build_golden(args)
+    else:
+        cmd_run(args)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Persistent cache of generated node contexts, and the node fields that hold them.
+
+Contexts are stored in SQLite, keyed by the hash of the chunk text and a
+context version (model + prompt version). Re-running metadata.py only pays
+for chunks that are new or changed, or for chunks made under a different
+prompt or model. Failed generations are never cached.
+
+On the nodes, a context lives in two metadata fields instead of being appended
+to node.text:
+
+    node.metadata["context"]          the generated keywords / phrases
+    node.metadata["context_version"]  e.g. "gpt-4o-mini@1"
+
+Both fields are excluded from LlamaIndex's embed/LLM metadata text.
+compose_context() joins the context onto the text when a node is indexed
+(create_vector_db.py, and the SQLite FTS build in chat_engine.py) and removes
+the fields, so the context can't be applied twice. split_context() recovers
+text and context from legacy nodes that had it appended, and from nodes
+that were enhanced more than once.
+
+NodeCheckpoint periodically snapshots the nodes enriched so far during a long
+metadata.py run (atomically, every N nodes or T seconds). With --resume, the
+contexts in the snapshot are matched back to nodes by text hash, so a resumed
+run skips them even if chunking now produces the nodes in another order, and
+even when the cache is disabled or bypassed (--no_cache, --no_reuse).
+
+Usage:
+    cache = ContextCache("./data/nodes/context_cache.sqlite")
+    found = cache.get_many([text_hash(n.text) for n in nodes], version)
+    cache.put_many([(text_hash(node.text), context)], version)
+    cache.close()
+
+    checkpoint = NodeCheckpoint("enhanced_laser_nodes.pkl.checkpoint", version)
+    done = checkpoint.load()  # {text_hash: context}
+    if checkpoint.due(): checkpoint.save(enriched_nodes)
+"""
+
+import os
+import time
+import pickle
+import logging
+import sqlite3
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Shared with the deployed chatbot, which indexes the same fields
+from matrix_chatbot.shared_constants import (
+    CONTEXT_FIELD,
+    CONTEXT_SEPARATOR,
+    CONTEXT_VERSION_FIELD,
+    FAILED_CONTEXT_PREFIXES,
+)
+
+SQLITE_MAX_VARIABLES = 500  # Hashes per IN (...) query
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def context_version(model: str, prompt_version: int) -> str:
+    return f"{model}@{prompt_version}"
+
+
+def is_failed_context(context: Optional[str]) -> bool:
+    return not context or context.startswith(FAILED_CONTEXT_PREFIXES)
+
+
+def split_context(text: str) -> Tuple[str, Optional[str]]:
+    """
+    Splits text that had contexts appended ("<text>\\n\\nContext: <context>",
+    possibly several times) into the original text and the last context.
+    Returns (text, None) when there is none.
+    """
+    original, sep, rest = text.partition(CONTEXT_SEPARATOR)
+    if not sep:
+        return text, None
+    return original, rest.rsplit(CONTEXT_SEPARATOR, 1)[-1]
+
+
+def _exclude_from_metadata_text(node: Any):
+    for attr in ("excluded_embed_metadata_keys", "excluded_llm_metadata_keys"):
+        keys = getattr(node, attr, None)
+        if keys is None:
+            continue
+        for key in (CONTEXT_FIELD, CONTEXT_VERSION_FIELD):
+            if key not in keys:
+                keys.append(key)
+
+
+def attach_context(node: Any, context: str, version: str):
+    """Stores a context on a node without touching its text."""
+    node.metadata[CONTEXT_FIELD] = context
+    node.metadata[CONTEXT_VERSION_FIELD] = version
+    _exclude_from_metadata_text(node)
+
+
+def node_context(node: Any, version: Optional[str] = None) -> Optional[str]:
+    """The node's stored context (of the given version, if one is given)."""
+    metadata = getattr(node, "metadata", None) or {}
+    context = metadata.get(CONTEXT_FIELD)
+    if is_failed_context(context):
+        return None
+    if version is not None and metadata.get(CONTEXT_VERSION_FIELD) != version:
+        return None
+    return context
+
+
+def indexed_text(node: Any) -> str:
+    """The text to embed / index for a node: its text plus its context, if any."""
+    context = node_context(node)
+    return f"{node.text}{CONTEXT_SEPARATOR}{context}" if context else node.text
+
+
+def compose_context(node: Any) -> Any:
+    """
+    Folds a node's context into its text for indexing and drops the context
+    fields, so composing again is a no-op. Nodes without a context field
+    (including legacy nodes with the context already in the text) are left as is.
+    """
+    metadata = getattr(node, "metadata", None)
+    if not metadata or CONTEXT_FIELD not in metadata:
+        return node
+    node.text = indexed_text(node)
+    metadata.pop(CONTEXT_FIELD, None)
+    metadata.pop(CONTEXT_VERSION_FIELD, None)
+    return node
+
+
+class ContextCache:
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path))
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS contexts ("
+            "text_hash TEXT NOT NULL, version TEXT NOT NULL, context TEXT NOT NULL, "
+            "created REAL NOT NULL, PRIMARY KEY (text_hash, version))"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def get_many(self, hashes: Iterable[str], version: str) -> Dict[str, str]:
+        """Cached contexts for the given text hashes, as {hash: context}."""
+        hashes = list(dict.fromkeys(hashes))
+        found: Dict[str, str] = {}
+        for i in range(0, len(hashes), SQLITE_MAX_VARIABLES):
+            batch = hashes[i : i + SQLITE_MAX_VARIABLES]
+            rows = self._conn.execute(
+                f"SELECT text_hash, context FROM contexts WHERE version = ? "
+                f"AND text_hash IN ({', '.join('?' * len(batch))})",
+                [version, *batch],
+            )
+            found.update(rows)
+        self.hits += len(found)
+        self.misses += len(hashes) - len(found)
+        return found
+
+    def put_many(self, items: List[Tuple[str, str]], version: str) -> int:
+        """Stores (text_hash, context) pairs; failed contexts are skipped."""
+        rows = [
+            (h, version, context, time.time())
+            for h, context in items
+            if not is_failed_context(context)
+        ]
+        if rows:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO contexts (text_hash, version, context, created) "
+                "VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self.writes += len(rows)
+        return len(rows)
+
+    def count(self, version: Optional[str] = None) -> int:
+        if version is None:
+            return self._conn.execute("SELECT COUNT(*) FROM contexts").fetchone()[0]
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM contexts WHERE version = ?", (version,)
+        ).fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        size = os.path.getsize(self.path) if self.path.exists() else 0
+        return {
+            "entries": self.count(),
+            "size_mb": round(size / 1e6, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+        }
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class NodeCheckpoint:
+    """Atomic snapshots of the nodes enriched so far, for resuming an interrupted run."""
+
+    def __init__(self, path: str, version: str, every_nodes: int = 500, every_seconds: float = 300.0):
+        self.path = Path(path)
+        self.version = version
+        self.every_nodes = every_nodes
+        self.every_seconds = every_seconds
+        self.saves = 0
+        self.unsaved = 0  # Nodes completed since the last save
+        self._saved_at = time.monotonic()
+
+    def load(self) -> Dict[str, str]:
+        """{text_hash: context} of the checkpointed nodes with a context of this version."""
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "rb") as f:
+                nodes = pickle.load(f)
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return {}
+        done = {}
+        for node in nodes:
+            context = node_context(node, self.version)
+            if context is not None:
+                done[text_hash(split_context(node.text)[0])] = context
+        logging.info(f"Loaded {len(done)} completed contexts from checkpoint {self.path}")
+        return done
+
+    def completed(self, count: int = 1):
+        self.unsaved += count
+
+    def due(self) -> bool:
+        if not self.unsaved:
+            return False
+        return (
+            self.unsaved >= self.every_nodes
+            or time.monotonic() - self._saved_at >= self.every_seconds
+        )
+
+    def save(self, nodes: List[Any]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(nodes, f)
+        os.replace(tmp_path, self.path)
+        self.saves += 1
+        self.unsaved = 0
+        self._saved_at = time.monotonic()
+        logging.info(f"Checkpointed {len(nodes)} enriched nodes to {self.path}")
+
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
@@ -1,6 +1,7 @@
 # --- START OF create_vector_db.py ---
 import os
 import pickle
+import hashlib
 import logging
 import time
 from pathlib import Path
@@ -12,11 +13,16 @@ from tqdm import tqdm
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import Distance, VectorParams
 
+from context_cache import compose_context, node_context
+from node_store import load_nodes
+from offline_providers import OFFLINE_API_KEY, offline_provider_url
+
 # --- Configuration ---
 
 # <<<--- CHANGE THIS LINE ---<<<
 # Path to the nodes generated by metadata.py
 NODES_PICKLE_FILE = "./data/nodes/matrix_nodes.pkl"  # Assuming this path is correct relative to the script's location
+# (a node store such as ./data/nodes/matrix_nodes.nodes works too, see node_store.py)
 # >>>------------------------->>>
 
 # Directory where Qdrant DB files will be stored LOCALLY (keep targeting the deployment folder)
@@ -27,6 +33,9 @@ QDRANT_COLLECTION_NAME = "matrix_docs"
 EMBEDDING_MODEL = "text-embedding-3-large"
 # Vector size for the chosen model
 VECTOR_SIZE = 3072
+# Embeddings from earlier runs, keyed by model and node content hash, so only
+# new or changed nodes (e.g. the revised pages of a datasheet) are re-embedded
+EMBEDDING_CACHE_FILE = "./data/nodes/embedding_cache.pkl"
 # --- End Configuration ---
 
 # Setup logging
@@ -35,6 +44,39 @@ logging.basicConfig(
 )
 
 
+def embedding_key(text):
+    return f"{EMBEDDING_MODEL}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+
+def load_embedding_cache():
+    cache_path = Path(EMBEDDING_CACHE_FILE)
+    if not cache_path.exists():
+        return {}
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+        logging.info(f"Loaded {len(cache)} cached embeddings from {cache_path}")
+        return cache
+    except Exception as e:
+        logging.warning(f"Ignoring unreadable embedding cache {cache_path}: {e}")
+        return {}
+
+
+def save_embedding_cache(nodes):
+    """Keeps only the current nodes' embeddings, so the cache doesn't grow without bound."""
+    current = {}
+    for node in nodes:
+        if node.embedding is not None and len(node.embedding) == VECTOR_SIZE:
+            current[embedding_key(node.get_content())] = node.embedding
+    cache_path = Path(EMBEDDING_CACHE_FILE)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(current, f)
+    os.replace(tmp_path, cache_path)
+    logging.info(f"Saved {len(current)} embeddings to {cache_path}")
+
+
 def create_persistent_qdrant_db():
     """Loads nodes, embeds if necessary, creates a persistent Qdrant DB, and verifies."""
 
@@ -44,6 +86,10 @@ def create_persistent_qdrant_db():
     if not load_dotenv():
         logging.warning("Could not load .env file.")
     openai_api_key = os.environ.get("OPENAI_API_KEY")
+    offline_url = offline_provider_url()
+    if offline_url:
+        logging.info(f"Using offline OpenAI stand-in at {offline_url}")
+        openai_api_key = openai_api_key or OFFLINE_API_KEY
     if not openai_api_key:
         logging.error("Fatal: OPENAI_API_KEY not found.")
         raise ValueError("OPENAI_API_KEY must be set.")
@@ -52,7 +98,10 @@ def create_persistent_qdrant_db():
     logging.info(f"Initializing embedding model: {EMBEDDING_MODEL}")
     # ... (rest of embedding model init) ...
     try:
-        embed_model = OpenAIEmbedding(model=EMBEDDING_MODEL, api_key=openai_api_key)
+        embed_kwargs = {"api_base": f"{offline_url}/v1"} if offline_url else {}
+        embed_model = OpenAIEmbedding(
+            model=EMBEDDING_MODEL, api_key=openai_api_key, **embed_kwargs
+        )
         Settings.embed_model = embed_model
     except Exception as e:
         logging.error(f"Failed to init embedding model: {e}")
@@ -65,36 +114,49 @@ def create_persistent_qdrant_db():
         logging.error(f"Fatal: Node file not found: {nodes_path}")
         raise FileNotFoundError(f"Node file not found: {nodes_path}")
     logging.info(f"Loading nodes from {nodes_path}...")
-    with open(nodes_path, "rb") as f:
-        nodes = pickle.load(f)
+    nodes = load_nodes(str(nodes_path))
     logging.info(f"Loaded {len(nodes)} nodes.")
     if not nodes:
         logging.warning("Node file is empty.")
         return
 
+    # metadata.py keeps node contexts in metadata; fold them into the text that
+    # is embedded and stored in Qdrant (a no-op for nodes already composed)
+    with_context = sum(1 for node in nodes if node_context(node) is not None)
+    nodes = [compose_context(node) for node in nodes]
+    logging.info(f"Composed context into the indexed text of {with_context} nodes.")
+
     # --- Check/Generate Embeddings ---
-    has_existing_embeddings = False
-    # ... (same logic as before to check first node's embedding) ...
-    first_node_embedding = getattr(nodes[0], "embedding", None)
-    if first_node_embedding is not None and isinstance(first_node_embedding, list):
-        if len(first_node_embedding) == VECTOR_SIZE:
-            logging.info(
-                f"Nodes appear to have existing embeddings of correct dimension ({VECTOR_SIZE})."
-            )
-            has_existing_embeddings = True
-        else:
+    # Nodes may already carry embeddings; otherwise reuse one from an earlier
+    # run when the content is unchanged, and embed only what's left.
+    embedding_cache = load_embedding_cache()
+    nodes_to_embed = []
+    reused_embeddings = 0
+    for node in nodes:
+        existing = getattr(node, "embedding", None)
+        if isinstance(existing, list) and len(existing) == VECTOR_SIZE:
+            continue
+        if existing is not None:
             logging.warning(
-                f"Nodes have existing embeddings, dimension ({len(first_node_embedding)}) != target ({VECTOR_SIZE}). Re-embedding."
+                f"Node {node.node_id or 'Unknown'} has embedding dimension ({len(existing)}) != target ({VECTOR_SIZE}). Re-embedding."
             )
-    else:
-        logging.info("Nodes need new embeddings.")
+        cached = embedding_cache.get(embedding_key(node.get_content()))
+        if cached is not None:
+            node.embedding = cached
+            reused_embeddings += 1
+        else:
+            nodes_to_embed.append(node)
+    logging.info(
+        f"Embeddings: {len(nodes) - len(nodes_to_embed) - reused_embeddings} present on nodes, "
+        f"{reused_embeddings} reused from earlier runs, {len(nodes_to_embed)} to generate."
+    )
 
-    if not has_existing_embeddings:
+    if nodes_to_embed:
         logging.info(
-            f"Starting explicit embedding generation for {len(nodes)} nodes..."
+            f"Starting explicit embedding generation for {len(nodes_to_embed)} nodes..."
         )
         embedding_errors = 0
-        for node in tqdm(nodes, desc="Generating Embeddings"):
+        for node in tqdm(nodes_to_embed, desc="Generating Embeddings"):
             try:
                 node_content = (
                     node.get_content()
@@ -114,7 +176,7 @@ def create_persistent_qdrant_db():
         )
         if embedding_errors > 0:
             logging.warning("Some nodes failed to embed.")
-        has_existing_embeddings = True  # Mark true now
+    save_embedding_cache(nodes)
 
     # --- Setup Qdrant Client and Store ---
     qdrant_path = Path(LOCAL_QDRANT_PATH)  # Keep output path the same
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate chunk removal between metadata.py and create_vector_db.py.
+
+Datasheets in a product family repeat a lot of boilerplate: warranty text,
+compliance sections, identical spec tables. Every copy would be embedded,
+stored in Qdrant and in the FTS index, and the copies crowd each other in
+the top-k. This stage keeps one canonical node per group of near-duplicates:
+
+1. Exact duplicates (same normalised text) are grouped by hash.
+2. Every remaining node gets a MinHash signature (NUM_PERM permutations over
+   word 5-gram shingles). The signatures are bucketed with LSH (BANDS bands of
+   ROWS rows), so only nodes that share a bucket are compared.
+3. Candidates in a bucket are near-duplicates when the Jaccard similarity of
+   their shingles reaches --threshold (default 0.9) and they contain the same
+   numbers and part numbers. A PM10 and a PM30 spec table that differ in a
+   few values are therefore both kept.
+
+The first node of each group (in input order) is kept. Its metadata records
+the file names of the dropped copies in "duplicate_sources" and the group
+size in "duplicate_count". Both keys are excluded from the embedded and LLM
+metadata text. Contexts are ignored when comparing, so copies enriched with
+slightly different keywords are still caught.
+
+The summary shows how many embeddings, embedding tokens and dollars, and
+bytes of Qdrant and FTS index were saved. --report also writes it as JSON.
+
+MinHash signatures are computed with numpy when it is installed (and with
+the same hash functions in pure Python otherwise), in a process pool for
+large inputs.
+
+Usage:
+    python dedupe_nodes.py --input enhanced_laser_nodes.pkl --output data/nodes/matrix_nodes.pkl
+    python dedupe_nodes.py --input enhanced_laser_nodes.pkl --dry_run --report reports/dedupe.json
+    python dedupe_nodes.py --input enhanced_laser_nodes.nodes --output data/nodes/matrix_nodes.nodes
+"""
+
+import re
+import json
+import zlib
+import time
+import random
+import hashlib
+import logging
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+# Optional numpy import (vectorised MinHash)
+try:
+    import numpy as np
+
+    NUMPY_INSTALLED = True
+except ImportError:
+    np = None
+    NUMPY_INSTALLED = False
+
+from context_cache import indexed_text, split_context
+from node_store import load_nodes, save_nodes
+from rate_limiter import estimate_tokens
+
+NUM_PERM = 128
+BANDS = 16  # x ROWS = NUM_PERM; candidates above ~0.7 Jaccard share a bucket
+ROWS = 8
+SHINGLE_WORDS = 5
+DEFAULT_THRESHOLD = 0.9
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+SEED = 1
+POOL_MIN_TEXTS = 2_000  # Fewer texts are hashed inline
+BATCH_SIZE = 500
+DUPLICATE_SOURCES_FIELD = "duplicate_sources"
+DUPLICATE_COUNT_FIELD = "duplicate_count"
+# Index size estimates (text-embedding-3-large vectors, float32, in Qdrant)
+EMBEDDING_DIMENSIONS = 3072
+BYTES_PER_VECTOR = EMBEDDING_DIMENSIONS * 4
+EMBED_COST_PER_1M_TOKENS = 0.13
+
+WORD = re.compile(r"\w+")
+IDENTIFIER = re.compile(r"\w*\d[\w.\-/]*")
+
+
+def _permutations() -> Tuple[List[int], List[int]]:
+    rng = random.Random(SEED)
+    a = [rng.randint(1, MAX_HASH) for _ in range(NUM_PERM)]
+    b = [rng.randint(0, MAX_HASH) for _ in range(NUM_PERM)]
+    return a, b
+
+
+PERM_A, PERM_B = _permutations()
+
+
+def comparison_text(node: Any) -> str:
+    """Node text without any context (stored in metadata or appended by older runs)."""
+    return split_context(node.text)[0]
+
+
+def normalise(text: str) -> str:
+    return " ".join(WORD.findall(text.lower()))
+
+
+def shingles(text: str) -> FrozenSet[int]:
+    """CRC32 hashes of the word 5-grams of normalised text (the whole text when shorter)."""
+    words = normalise(text).split()
+    if len(words) <= SHINGLE_WORDS:
+        return frozenset([zlib.crc32(" ".join(words).encode("utf-8"))])
+    return frozenset(
+        zlib.crc32(" ".join(words[i : i + SHINGLE_WORDS]).encode("utf-8"))
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    )
+
+
+def identifiers(text: str) -> FrozenSet[str]:
+    """Numbers, part numbers and other tokens with digits: must match for a near-duplicate."""
+    return frozenset(IDENTIFIER.findall(text.lower()))
+
+
+if NUMPY_INSTALLED:
+    _PERM_A = np.array(PERM_A, dtype=np.uint64)
+    _PERM_B = np.array(PERM_B, dtype=np.uint64)
+    _PRIME = np.uint64(MERSENNE_PRIME)
+
+
+def minhash(shingle_hashes: FrozenSet[int]) -> Tuple[int, ...]:
+    """MinHash signature: min over shingles of ((a * x + b) mod p) & MAX_HASH, per permutation."""
+    if NUMPY_INSTALLED:
+        x = np.fromiter(shingle_hashes, dtype=np.uint64, count=len(shingle_hashes))
+        # a, x < 2**32, so a * x fits in 64 bits; "+ b" may wrap, as in the pure Python branch
+        v = np.outer(x, _PERM_A) + _PERM_B
+        # v mod (2**61 - 1) without a division
+        v = (v & _PRIME) + (v >> np.uint64(61))
+        v = np.where(v >= _PRIME, v - _PRIME, v) & np.uint64(MAX_HASH)
+        return tuple(v.min(axis=0).tolist())
+    mask = (1 << 64) - 1
+    return tuple(
+        min((((a * x + b) & mask) % MERSENNE_PRIME) & MAX_HASH for x in shingle_hashes)
+        for a, b in zip(PERM_A, PERM_B)
+    )
+
+
+def signatures_batch(texts: List[str]) -> List[Tuple[FrozenSet[int], Tuple[int, ...]]]:
+    results = []
+    for text in texts:
+        shingle_hashes = shingles(text)
+        results.append((shingle_hashes, minhash(shingle_hashes)))
+    return results
+
+
+def jaccard(a: FrozenSet[int], b: FrozenSet[int]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        ri, rj = self.find(i), self.find(j)
+        if ri != rj:
+            # The earlier node stays the root, so it becomes the canonical copy
+            self.parent[max(ri, rj)] = min(ri, rj)
+
+
+def find_duplicate_groups(
+    texts: Sequence[str], threshold: float = DEFAULT_THRESHOLD, max_workers: Optional[int] = None
+) -> Tuple[List[List[int]], Dict[str, int]]:
+    """
+    Groups of indices of duplicate texts (first index = canonical), and
+    counts of exact and near-duplicate matches.
+    """
+    uf = UnionFind(len(texts))
+    counts = {"exact": 0, "near": 0, "candidates": 0}
+
+    # 1. Exact duplicates
+    first_by_hash: Dict[str, int] = {}
+    unique: List[int] = []
+    for i, text in enumerate(texts):
+        digest = hashlib.sha256(normalise(text).encode("utf-8")).hexdigest()
+        if digest in first_by_hash:
+            uf.union(first_by_hash[digest], i)
+            counts["exact"] += 1
+        else:
+            first_by_hash[digest] = i
+            unique.append(i)
+
+    # 2. MinHash signatures of the distinct texts
+    unique_texts = [texts[i] for i in unique]
+    batches = [unique_texts[i : i + BATCH_SIZE] for i in range(0, len(unique_texts), BATCH_SIZE)]
+    if len(unique_texts) >= POOL_MIN_TEXTS and max_workers != 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            signed = [item for batch in pool.map(signatures_batch, batches) for item in batch]
+    else:
+        signed = signatures_batch(unique_texts)
+    shingle_sets = {i: shingle_hashes for i, (shingle_hashes, _) in zip(unique, signed)}
+    id_sets: Dict[int, FrozenSet[str]] = {}
+
+    def ids(i: int) -> FrozenSet[str]:
+        if i not in id_sets:
+            id_sets[i] = identifiers(texts[i])
+        return id_sets[i]
+
+    # 3. LSH buckets: each member is compared with the bucket's first member
+    buckets: Dict[Tuple[int, Tuple[int, ...]], int] = {}
+    for i, (_, signature) in zip(unique, signed):
+        for band in range(BANDS):
+            key = (band, signature[band * ROWS : (band + 1) * ROWS])
+            first = buckets.setdefault(key, i)
+            if first == i or uf.find(first) == uf.find(i):
+                continue
+            counts["candidates"] += 1
+            if jaccard(shingle_sets[first], shingle_sets[i]) >= threshold and ids(first) == ids(i):
+                uf.union(first, i)
+                counts["near"] += 1
+
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for i in range(len(texts)):
+        groups[uf.find(i)].append(i)
+    return [members for members in groups.values() if len(members) > 1], counts
+
+
+def _exclude_from_metadata_text(node: Any, keys: Sequence[str]):
+    for attr in ("excluded_embed_metadata_keys", "excluded_llm_metadata_keys"):
+        excluded = getattr(node, attr, None)
+        if excluded is None:
+            continue
+        for key in keys:
+            if key not in excluded:
+                excluded.append(key)
+
+
+def node_index_bytes(node: Any) -> Tuple[int, int]:
+    """(Qdrant bytes, FTS bytes) a node adds to the indexes: vector + payload, text + metadata."""
+    text_bytes = len(indexed_text(node).encode("utf-8"))
+    metadata_bytes = len(json.dumps(node.metadata or {}, default=str).encode("utf-8"))
+    return BYTES_PER_VECTOR + text_bytes + metadata_bytes, text_bytes + metadata_bytes
+
+
+def dedupe_nodes(
+    nodes: List[Any], threshold: float = DEFAULT_THRESHOLD, max_workers: Optional[int] = None
+) -> Tuple[List[Any], Dict[str, Any]]:
+    """Drops near-duplicate nodes, recording alias sources on the canonical nodes. Returns (nodes, report)."""
+    started = time.monotonic()
+    groups, counts = find_duplicate_groups(
+        [comparison_text(node) for node in nodes], threshold, max_workers
+    )
+    dropped = set()
+    saved_tokens = saved_qdrant = saved_fts = 0
+    largest: List[Dict[str, Any]] = []
+    for members in groups:
+        canonical = nodes[members[0]]
+        aliases = [nodes[i] for i in members[1:]]
+        own_source = canonical.metadata.get("file_name")
+        sources = set(canonical.metadata.get(DUPLICATE_SOURCES_FIELD) or [])
+        for alias in aliases:
+            sources.update(alias.metadata.get(DUPLICATE_SOURCES_FIELD) or [])
+            if alias.metadata.get("file_name"):
+                sources.add(alias.metadata["file_name"])
+            saved_tokens += estimate_tokens(indexed_text(alias))
+            qdrant_bytes, fts_bytes = node_index_bytes(alias)
+            saved_qdrant += qdrant_bytes
+            saved_fts += fts_bytes
+        sources.discard(own_source)
+        canonical.metadata[DUPLICATE_SOURCES_FIELD] = sorted(sources)
+        canonical.metadata[DUPLICATE_COUNT_FIELD] = (
+            canonical.metadata.get(DUPLICATE_COUNT_FIELD, 1) + sum(
+                alias.metadata.get(DUPLICATE_COUNT_FIELD, 1) for alias in aliases
+            )
+        )
+        _exclude_from_metadata_text(canonical, (DUPLICATE_SOURCES_FIELD, DUPLICATE_COUNT_FIELD))
+        dropped.update(members[1:])
+        largest.append(
+            {
+                "copies": len(members),
+                "canonical_source": own_source,
+                "sources": len(sources) + (1 if own_source else 0),
+                "sample": comparison_text(canonical)[:120],
+            }
+        )
+
+    kept = [node for i, node in enumerate(nodes) if i not in dropped]
+    largest.sort(key=lambda g: -g["copies"])
+    report = {
+        "nodes_in": len(nodes),
+        "nodes_out": len(kept),
+        "duplicate_groups": len(groups),
+        "exact_duplicates": counts["exact"],
+        "near_duplicates": counts["near"],
+        "lsh_candidates": counts["candidates"],
+        "threshold": threshold,
+        "embeddings_saved": len(dropped),
+        "embedding_tokens_saved": saved_tokens,
+        "embedding_cost_saved_usd": round(saved_tokens * EMBED_COST_PER_1M_TOKENS / 1e6, 4),
+        "qdrant_mb_saved": round(saved_qdrant / 1e6, 2),
+        "fts_mb_saved": round(saved_fts / 1e6, 2),
+        "seconds": round(time.monotonic() - started, 2),
+        "largest_groups": largest[:10],
+    }
+    return kept, report
+
+
+def print_summary(report: Dict[str, Any]):
+    print("\n--- Dedupe Summary ---")
+    print(f"Nodes in / out:          {report['nodes_in']} / {report['nodes_out']}")
+    print(
+        f"Duplicates dropped:      {report['embeddings_saved']} "
+        f"({report['exact_duplicates']} exact, {report['near_duplicates']} near; "
+        f"{report['duplicate_groups']} groups, threshold {report['threshold']})"
+    )
+    print(
+        f"Embeddings saved:        {report['embeddings_saved']} "
+        f"(~{report['embedding_tokens_saved']} tokens, ${report['embedding_cost_saved_usd']:.4f} per full re-embed)"
+    )
+    print(f"Index space saved:       {report['qdrant_mb_saved']} MB Qdrant, {report['fts_mb_saved']} MB FTS")
+    print(f"Time:                    {report['seconds']}s")
+    for group in report["largest_groups"][:5]:
+        print(f"  {group['copies']:>4} copies from {group['sources']} files: {group['sample'][:70]!r}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Drop near-duplicate nodes before embedding and indexing.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--input", default="./enhanced_laser_nodes.pkl", help="Enhanced nodes from metadata.py.")
+    parser.add_argument(
+        "--output", default="./data/nodes/matrix_nodes.pkl", help="Deduplicated nodes for create_vector_db.py."
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="Minimum shingle Jaccard similarity for a near-duplicate.",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Processes for MinHash (default: CPU count).")
+    parser.add_argument("--report", default=None, help="Also write the summary as JSON.")
+    parser.add_argument("--dry_run", action="store_true", help="Report duplicates without writing --output.")
+    args = parser.parse_args()
+
+    if not NUMPY_INSTALLED:
+        logging.warning("numpy not installed: computing MinHash signatures in pure Python (slower).")
+    nodes = load_nodes(args.input)
+    logging.info(f"Loaded {len(nodes)} nodes from {args.input}")
+    kept, report = dedupe_nodes(nodes, args.threshold, args.workers)
+    print_summary(report)
+
+    if args.report:
+        report_path = Path(args.report)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        report_path.write_text(json.dumps(report, indent=2))
+        print(f"\nSaved dedupe report to {report_path}")
+    if not args.dry_run:
+        save_nodes(kept, args.output)
+        print(f"Saved {len(kept)} nodes to {args.output}")
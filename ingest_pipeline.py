@@ -0,0 +1,753 @@
+#!/usr/bin/env python3
+"""
+Streaming ingestion: parse -> chunk -> enrich -> embed -> index as concurrent
+stages linked by bounded asyncio queues.
+
+The batch scripts run one after another: parse_pdf_md.py, metadata.py,
+create_vector_db.py, then the SQLite FTS build in chat_engine.py, and each
+one waits for the previous one to finish. Here every stage starts as soon as
+its first input arrives, so embedding and indexing start while later PDFs are
+still parsing. End-to-end time approaches that of the slowest stage instead
+of the sum of all of them.
+
+    parse  (parse_pdf_md.py: LlamaParse / Markdown, one item per input file)
+      -> chunk   (metadata.py chunkers, in a process pool)
+      -> enrich  (gpt-4o-mini contexts, shared rate limiter + context cache)
+      -> embed   (text-embedding-3-large, reusing create_vector_db.py's embedding cache)
+      -> index   Qdrant collection | SQLite FTS DB | node store (optional),
+                 written in parallel from the same node stream
+
+Every queue holds at most --queue_size batches. When a stage falls behind,
+the stages before it block on put(). This backpressure keeps memory bounded
+and shows up in the summary as "blocked" time. Time spent waiting for input
+shows up as "starved". The summary also reports each stage's throughput, busy
+time and peak queue depth. --report writes the same numbers as JSON.
+
+Parsed files are still written to the parse scripts' <parse_output>.parts
+shards, so an interrupted run resumes without re-parsing finished files. The
+Qdrant collection and the FTS DB are rebuilt from scratch on every run, like
+create_vector_db.py does. The FTS DB is swapped into place only when the run
+completes.
+
+Contexts use the same cache and version as metadata.py. The local keyword
+backend needs the whole corpus, so it can't stream: use --backend none here,
+or run metadata.py --backend local and then feed its nodes to create_vector_db.py.
+Near-duplicate removal (dedupe_nodes.py) also needs the whole corpus and is
+not part of the stream.
+
+Requires:
+    The dependencies of parse_pdf_md.py, metadata.py and create_vector_db.py
+    (llama-index, llama-cloud-services, openai, qdrant-client).
+
+Usage:
+    python ingest_pipeline.py --input_dir ./data/datasheets
+    python ingest_pipeline.py --docs ./parsed_docs.pkl --input_parts --backend none --report reports/ingest.json
+    python ingest_pipeline.py --input_dir ./data/datasheets --nodes_output ./data/nodes/matrix_nodes.nodes
+"""
+
+import os
+import json
+import time
+import pickle
+import sqlite3
+import asyncio
+import logging
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from context_cache import (
+    ContextCache,
+    attach_context,
+    compose_context,
+    is_failed_context,
+    node_context,
+    text_hash,
+)
+from create_vector_db import (
+    EMBEDDING_CACHE_FILE,
+    EMBEDDING_MODEL,
+    LOCAL_QDRANT_PATH,
+    QDRANT_COLLECTION_NAME,
+    VECTOR_SIZE,
+    embedding_key,
+    load_embedding_cache,
+)
+from metadata import (
+    CACHE_COMMIT_EVERY,
+    CHUNK_BATCH_DOCS,
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    CHUNKERS,
+    CONTEXT_CACHE_FILE,
+    CONTEXT_VERSION,
+    _init_chunk_worker,
+    chunk_documents,
+    configure_openai,
+    generate_context,
+    iter_documents,
+    recover_appended_contexts,
+)
+from node_store import NodeStoreWriter
+from offline_providers import OFFLINE_API_KEY, offline_provider_url
+from parse_shards import ShardedDocWriter
+from rate_limiter import TokenBucketLimiter
+
+DONE = object()  # End-of-stream marker passed down the queues
+DEFAULT_QUEUE_SIZE = 8  # Batches per queue
+DEFAULT_EMBED_BATCH = 100  # Texts per embedding request
+SQLITE_DB_PATH = "./matrix_chatbot/matrix_nodes.db"  # Read by chat_engine.py
+MONITOR_SECONDS = 0.5  # Queue depth sampling interval
+
+
+@dataclass
+class StageStats:
+    name: str
+    workers: int = 1
+    items_in: int = 0  # Documents (chunk) or nodes received
+    items_out: int = 0
+    busy_seconds: float = 0.0  # Summed over workers
+    starved_seconds: float = 0.0  # Waiting for input, summed over workers
+    blocked_seconds: float = 0.0  # Waiting for room downstream (backpressure)
+    first_item: Optional[float] = None
+    finished: Optional[float] = None
+    peak_queue: int = 0  # Peak depth of the stage's input queue
+    queue_samples: List[int] = field(default_factory=list, repr=False)
+
+
+class Pipeline:
+    """Bounded queues and the per-stage bookkeeping around them."""
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.stats: Dict[str, StageStats] = {}
+        self.inboxes: Dict[str, asyncio.Queue] = {}
+        self.started = time.monotonic()
+        self.stopping = threading.Event()  # Set when a stage fails, to release blocked parse threads
+
+    def inbox(self, name: str) -> asyncio.Queue:
+        self.inboxes[name] = asyncio.Queue(maxsize=self.queue_size)
+        return self.inboxes[name]
+
+    def stage_stats(self, name: str, workers: int = 1) -> StageStats:
+        self.stats[name] = StageStats(name=name, workers=workers)
+        return self.stats[name]
+
+    async def put(self, stats: StageStats, outboxes: List[asyncio.Queue], item: Any):
+        started = time.monotonic()
+        for outbox in outboxes:
+            await outbox.put(item)
+        stats.blocked_seconds += time.monotonic() - started
+
+    async def run_stage(
+        self,
+        name: str,
+        inbox: asyncio.Queue,
+        outboxes: List[asyncio.Queue],
+        process: Callable[[List[Any]], Awaitable[List[Any]]],
+        workers: int = 1,
+    ):
+        """
+        Runs `workers` copies of process() over batches from inbox, putting each
+        non-empty result on every outbox. Passes DONE on once all workers have
+        finished; if one fails, run_pipeline cancels every stage instead.
+        """
+        stats = self.stage_stats(name, workers)
+
+        async def worker():
+            while True:
+                waited = time.monotonic()
+                batch = await inbox.get()
+                stats.starved_seconds += time.monotonic() - waited
+                if batch is DONE:
+                    await inbox.put(DONE)  # Let sibling workers see it too
+                    return
+                if stats.first_item is None:
+                    stats.first_item = time.monotonic()
+                stats.items_in += len(batch)
+                started = time.monotonic()
+                result = await process(batch)
+                stats.busy_seconds += time.monotonic() - started
+                if result:
+                    stats.items_out += len(result)
+                    await self.put(stats, outboxes, result)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(workers)))
+        finally:
+            stats.finished = time.monotonic()
+        for outbox in outboxes:
+            await outbox.put(DONE)
+
+    async def monitor(self):
+        """Samples queue depths until cancelled."""
+        while True:
+            for name, queue in self.inboxes.items():
+                stats = self.stats.get(name)
+                if stats is not None:
+                    depth = queue.qsize()
+                    stats.peak_queue = max(stats.peak_queue, depth)
+                    stats.queue_samples.append(depth)
+            await asyncio.sleep(MONITOR_SECONDS)
+
+    def summary(self) -> Dict[str, Any]:
+        wall = time.monotonic() - self.started
+        stages = {}
+        for name, s in self.stats.items():
+            active = (s.finished or time.monotonic()) - (s.first_item or self.started)
+            samples = s.queue_samples or [0]
+            stages[name] = {
+                **{k: v for k, v in asdict(s).items() if k not in ("queue_samples", "first_item", "finished")},
+                "started_after": round((s.first_item or self.started) - self.started, 2),
+                "active_seconds": round(active, 2),
+                "throughput_per_second": round(s.items_out / active, 2) if active > 0 else None,
+                "busy_share": round(s.busy_seconds / (active * s.workers), 3) if active > 0 else None,
+                "mean_queue": round(sum(samples) / len(samples), 2),
+                "queue_full_share": round(sum(1 for d in samples if d >= self.queue_size) / len(samples), 3),
+            }
+        return {"wall_seconds": round(wall, 2), "queue_size": self.queue_size, "stages": stages}
+
+
+def print_summary(summary: Dict[str, Any]):
+    print("\n--- Ingestion Pipeline Summary ---")
+    print(f"Wall time: {summary['wall_seconds']:.1f}s (queues of {summary['queue_size']} batches)")
+    print(
+        f"{'stage':<8}{'workers':>8}{'in':>9}{'out':>9}{'start s':>9}{'active s':>10}{'out/s':>9}"
+        f"{'busy':>7}{'starved s':>11}{'blocked s':>11}{'peak q':>8}{'full':>7}"
+    )
+    for name, s in summary["stages"].items():
+        print(
+            f"{name:<8}{s['workers']:>8}{s['items_in']:>9}{s['items_out']:>9}{s['started_after']:>9.1f}"
+            f"{s['active_seconds']:>10.1f}{s['throughput_per_second'] or 0:>9.1f}{s['busy_share'] or 0:>7.0%}"
+            f"{s['starved_seconds']:>11.1f}{s['blocked_seconds']:>11.1f}{s['peak_queue']:>8}{s['queue_full_share']:>7.0%}"
+        )
+    busiest = max(summary["stages"].values(), key=lambda s: s["active_seconds"], default=None)
+    if busiest:
+        print(
+            f"Longest-running stage: {busiest['name']} ({busiest['active_seconds']:.1f}s active). "
+            f"'blocked' is time spent waiting on a full downstream queue (backpressure)."
+        )
+
+
+# --- Parse (source) ---
+class QueueingDocWriter(ShardedDocWriter):
+    """
+    ShardedDocWriter that also hands each completed file's Documents to the
+    chunk queue. write() runs in parse worker threads and blocks while the
+    queue is full, which throttles parsing to what the later stages keep up with.
+    """
+
+    def __init__(self, output_file, pipeline, outbox, loop, stats, restart=False, config=None):
+        super().__init__(output_file, restart=restart, config=config)
+        self.pipeline = pipeline
+        self.outbox = outbox
+        self.loop = loop
+        self.stats = stats
+
+    def write(self, fname, docs, sha256=None):
+        super().write(fname, docs, sha256)
+        started = time.monotonic()
+        future = asyncio.run_coroutine_threadsafe(self.outbox.put(list(docs)), self.loop)
+        while True:
+            try:
+                future.result(timeout=1)
+                break
+            except FutureTimeoutError:
+                if self.pipeline.stopping.is_set():
+                    # The shard is written, so the next run sends it on from there
+                    future.cancel()
+                    return
+        with self._lock:
+            self.stats.blocked_seconds += time.monotonic() - started
+            self.stats.items_out += len(docs)
+            if self.stats.first_item is None:
+                self.stats.first_item = started
+
+
+async def parse_source(pipeline: Pipeline, outbox: asyncio.Queue, args):
+    """Parses --input_dir/--input_file with parse_pdf_md.py, streaming each file's Documents on."""
+    from parse_pdf_md import (
+        PYPDF_INSTALLED,
+        create_parser,
+        ingest_markdown_files,
+        process_pdf_documents_parallel,
+    )
+
+    stats = pipeline.stage_stats("parse", args.max_workers)
+    try:
+        if args.input_file:
+            files = [Path(args.input_file)]
+        else:
+            input_path = Path(args.input_dir)
+            files = sorted(input_path.rglob("*.pdf")) + sorted(input_path.rglob("*.md"))
+            files += sorted(input_path.rglob("*.markdown"))
+        md_files = [f for f in files if f.suffix.lower() in (".md", ".markdown")]
+        pdf_files = [f for f in files if f.suffix.lower() == ".pdf"]
+        logging.info(f"Parsing {len(pdf_files)} PDF and {len(md_files)} Markdown files")
+
+        # Same config string as parse_pdf_md.py, so either can resume the other's shards
+        pdf_mode = "Default Parsing" if args.disable_pair_extraction else "Custom Prompt/Pair Extraction"
+        local_text = args.local_text and PYPDF_INSTALLED
+        if local_text:
+            pdf_mode += " + Local Text"
+        writer = QueueingDocWriter(
+            args.parse_output, pipeline, outbox, asyncio.get_running_loop(), stats,
+            restart=args.restart, config=pdf_mode,
+        )
+        pending_md = await asyncio.to_thread(writer.pending, md_files)
+        pending_pdf = await asyncio.to_thread(writer.pending, pdf_files)
+
+        # Files finished by an earlier run go straight downstream from their shards
+        pending = set(pending_md) | set(pending_pdf)
+        for _, docs in writer.iter_docs([f for f in md_files + pdf_files if f not in pending]):
+            if stats.first_item is None:
+                stats.first_item = time.monotonic()
+            stats.items_out += len(docs)
+            await pipeline.put(stats, [outbox], docs)
+
+        tasks = []
+        if pending_md:
+            tasks.append(ingest_markdown_files(pending_md, writer, max_workers=args.md_workers))
+        if pending_pdf:
+            parser_template = create_parser(disable_pair_extraction=args.disable_pair_extraction)
+            if parser_template:
+                tasks.append(
+                    process_pdf_documents_parallel(
+                        pending_pdf,
+                        parser_template,
+                        max_workers=args.max_workers,
+                        timeout_seconds=args.timeout,
+                        writer=writer,
+                        local_text=local_text,
+                    )
+                )
+            else:
+                logging.warning("PDF parsing skipped: LlamaParse could not be initialized.")
+        started = time.monotonic()
+        await asyncio.gather(*tasks)
+        stats.busy_seconds += max(0.0, time.monotonic() - started - stats.blocked_seconds)
+    finally:
+        stats.finished = time.monotonic()
+    await outbox.put(DONE)
+
+
+async def documents_source(pipeline: Pipeline, outbox: asyncio.Queue, path: str, from_parts: bool):
+    """Streams already-parsed Documents (pickle, node store or .parts shards) instead of parsing."""
+    stats = pipeline.stage_stats("parse")
+    docs = iter_documents(path, from_parts=from_parts)
+
+    def next_batch():
+        batch = []
+        for doc in docs:
+            batch.append(doc)
+            if len(batch) >= CHUNK_BATCH_DOCS:
+                break
+        return batch
+
+    try:
+        while True:
+            started = time.monotonic()
+            batch = await asyncio.to_thread(next_batch)
+            stats.busy_seconds += time.monotonic() - started
+            if not batch:
+                break
+            if stats.first_item is None:
+                stats.first_item = started
+            stats.items_out += len(batch)
+            await pipeline.put(stats, [outbox], batch)
+    finally:
+        stats.finished = time.monotonic()
+    await outbox.put(DONE)
+
+
+# --- Chunk ---
+def make_chunker(pool: ProcessPoolExecutor):
+    async def chunk(docs):
+        return await asyncio.get_running_loop().run_in_executor(pool, chunk_documents, docs)
+
+    return chunk
+
+
+# --- Enrich ---
+class ContextEnricher:
+    """
+    Adds contexts the way metadata.py's online backend does: from the node, the
+    context cache, or one gpt-4o-mini request per distinct text. All batches
+    share one rate limiter and one request semaphore.
+    """
+
+    def __init__(self, client, cache: Optional[ContextCache], concurrency: int, rpm: int, tpm: int):
+        self.client = client
+        self.cache = cache
+        self.limiter = TokenBucketLimiter(rpm=rpm, tpm=tpm)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.to_cache = []
+        self.counts = {"on_node": 0, "cached": 0, "generated": 0, "failed": 0}
+
+    async def _generate(self, h, text):
+        async with self.semaphore:
+            try:
+                return h, await generate_context(self.client, text, self.limiter)
+            except Exception as e:
+                logging.error(f"Error processing node text {h[:12]}: {str(e)}")
+                return h, f"Error generating context: {str(e)}"
+
+    async def __call__(self, nodes):
+        recover_appended_contexts(nodes)
+        pending = {}  # text hash -> nodes with that text
+        for node in nodes:
+            if node_context(node, CONTEXT_VERSION) is not None:
+                self.counts["on_node"] += 1
+            else:
+                pending.setdefault(text_hash(node.text), []).append(node)
+        cached = self.cache.get_many(list(pending), CONTEXT_VERSION) if self.cache is not None else {}
+        for h, context in cached.items():
+            for node in pending.pop(h):
+                attach_context(node, context, CONTEXT_VERSION)
+                self.counts["cached"] += 1
+
+        results = await asyncio.gather(*(self._generate(h, group[0].text) for h, group in pending.items()))
+        for h, context in results:
+            if is_failed_context(context):
+                self.counts["failed"] += len(pending[h])
+                continue
+            for node in pending[h]:
+                attach_context(node, context, CONTEXT_VERSION)
+            self.counts["generated"] += len(pending[h])
+            self.to_cache.append((h, context))
+        if self.cache is not None and len(self.to_cache) >= CACHE_COMMIT_EVERY:
+            self.flush()
+        return nodes
+
+    def flush(self):
+        if self.cache is not None and self.to_cache:
+            self.cache.put_many(self.to_cache, CONTEXT_VERSION)
+        self.to_cache = []
+
+    def close(self):
+        self.flush()
+        logging.info(f"Contexts: {self.counts}, rate limiter {self.limiter.summary()}")
+
+
+async def pass_through(nodes):
+    return nodes
+
+
+# --- Embed ---
+class Embedder:
+    """
+    Folds contexts into the text (as create_vector_db.py does) and embeds it,
+    reusing embeddings from earlier runs by content hash.
+    """
+
+    def __init__(self, embed_model, batch_size: int = DEFAULT_EMBED_BATCH):
+        self.embed_model = embed_model
+        self.batch_size = batch_size
+        self.cache = load_embedding_cache()
+        self.current: Dict[str, List[float]] = {}
+        self.counts = {"reused": 0, "generated": 0, "failed": 0}
+
+    async def __call__(self, nodes):
+        nodes = [compose_context(node) for node in nodes]
+        todo = []
+        for node in nodes:
+            key = embedding_key(node.get_content())
+            existing = getattr(node, "embedding", None)
+            if not (isinstance(existing, list) and len(existing) == VECTOR_SIZE):
+                existing = self.cache.get(key)
+            if existing is not None and len(existing) == VECTOR_SIZE:
+                node.embedding = existing
+                self.current[key] = existing
+                self.counts["reused"] += 1
+            else:
+                todo.append((node, key))
+        for start in range(0, len(todo), self.batch_size):
+            chunk = todo[start : start + self.batch_size]
+            try:
+                vectors = await self.embed_model.aget_text_embedding_batch(
+                    [node.get_content() for node, _ in chunk]
+                )
+            except Exception as e:
+                logging.error(f"Failed to embed {len(chunk)} nodes: {e}")
+                self.counts["failed"] += len(chunk)
+                continue
+            for (node, key), vector in zip(chunk, vectors):
+                node.embedding = vector
+                self.current[key] = vector
+            self.counts["generated"] += len(chunk)
+        return nodes
+
+    def save_cache(self):
+        """Keeps only this run's embeddings, like create_vector_db.save_embedding_cache."""
+        cache_path = Path(EMBEDDING_CACHE_FILE)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.current, f)
+        os.replace(tmp_path, cache_path)
+        logging.info(f"Embeddings: {self.counts}; saved {len(self.current)} to {cache_path}")
+
+
+# --- Index sinks ---
+class QdrantSink:
+    """Recreates the Qdrant collection and adds each embedded batch to it."""
+
+    def __init__(self, path: str, collection: str):
+        from qdrant_client import QdrantClient
+        from qdrant_client.http.models import Distance, VectorParams
+        from llama_index.vector_stores.qdrant import QdrantVectorStore
+
+        Path(path).mkdir(parents=True, exist_ok=True)
+        self.collection = collection
+        self.client = QdrantClient(path=str(path))
+        if any(c.name == collection for c in self.client.get_collections().collections):
+            logging.warning(f"Recreating existing collection: {collection}")
+            self.client.delete_collection(collection_name=collection)
+        self.client.create_collection(
+            collection_name=collection,
+            vectors_config=VectorParams(size=VECTOR_SIZE, distance=Distance.COSINE),
+        )
+        self.vector_store = QdrantVectorStore(client=self.client, collection_name=collection)
+        self.written = 0
+
+    def write(self, nodes):
+        embedded = [node for node in nodes if node.embedding is not None]
+        if embedded:
+            self.vector_store.add(embedded)
+            self.written += len(embedded)
+
+    def close(self):
+        count = self.client.count(collection_name=self.collection, exact=True).count
+        if count != self.written:
+            logging.warning(f"Qdrant point count {count} != {self.written} nodes written")
+        logging.info(f"Qdrant collection '{self.collection}': {count} points")
+        self.client.close()
+
+    def abort(self):
+        logging.warning(f"Qdrant collection '{self.collection}' is incomplete ({self.written} nodes written)")
+        self.client.close()
+
+
+class FtsSink:
+    """
+    Builds the SQLite FTS DB that chat_engine.py reads (same schema as its
+    create_or_load_sqlite_db) in a temporary file, swapped in by close().
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_path = self.db_path.with_name(self.db_path.name + ".tmp")
+        if self.tmp_path.exists():
+            self.tmp_path.unlink()
+        # Written from one sink worker at a time, via asyncio.to_thread
+        self.conn = sqlite3.connect(str(self.tmp_path), check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE nodes (rowid INTEGER PRIMARY KEY, node_id TEXT UNIQUE, content TEXT, metadata TEXT)"
+        )
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE nodes_fts USING fts5(content, content='nodes', content_rowid='rowid', tokenize='porter unicode61')"
+        )
+        self.last_rowid = 0
+        self.written = 0
+
+    def write(self, nodes):
+        # Contexts are already folded into node.text by the embed stage
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO nodes (node_id, content, metadata) VALUES (?, ?, ?)",
+            [(node.node_id, node.text, json.dumps(node.metadata or {}, default=str)) for node in nodes],
+        )
+        self.conn.execute(
+            "INSERT INTO nodes_fts(rowid, content) SELECT rowid, content FROM nodes WHERE rowid > ?",
+            (self.last_rowid,),
+        )
+        self.last_rowid = self.conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM nodes").fetchone()[0]
+        self.conn.commit()
+        self.written = self.last_rowid
+
+    def close(self):
+        self.conn.close()
+        os.replace(self.tmp_path, self.db_path)
+        logging.info(f"SQLite FTS DB {self.db_path}: {self.written} nodes")
+
+    def abort(self):
+        """Leaves the existing FTS DB in place."""
+        self.conn.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+
+class StoreSink:
+    """Streams the indexed nodes, with their embeddings, into a node store (node_store.py)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.writer = NodeStoreWriter(path)
+
+    def write(self, nodes):
+        self.writer.write(nodes)
+
+    def close(self):
+        self.writer.close()
+        logging.info(f"Node store {self.path}: {self.writer.rows} nodes, {self.writer.embedded} embeddings")
+
+    def abort(self):
+        self.writer.abort()
+
+
+def make_sink(sink):
+    async def write(nodes):
+        await asyncio.to_thread(sink.write, nodes)
+        return nodes  # Counted as written; sinks have no outboxes
+
+    return write
+
+
+def make_embed_model():
+    from llama_index.embeddings.openai import OpenAIEmbedding
+
+    api_key = os.environ.get("OPENAI_API_KEY")
+    offline_url = offline_provider_url()
+    if offline_url:
+        logging.info(f"Using offline OpenAI stand-in at {offline_url}")
+        api_key = api_key or OFFLINE_API_KEY
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY must be set.")
+    embed_kwargs = {"api_base": f"{offline_url}/v1"} if offline_url else {}
+    return OpenAIEmbedding(model=EMBEDDING_MODEL, api_key=api_key, **embed_kwargs)
+
+
+async def run_pipeline(args) -> Dict[str, Any]:
+    pipeline = Pipeline(args.queue_size)
+    chunk_in = pipeline.inbox("chunk")
+    enrich_in = pipeline.inbox("enrich")
+    embed_in = pipeline.inbox("embed")
+    sink_inboxes = {"qdrant": pipeline.inbox("qdrant"), "fts": pipeline.inbox("fts")}
+    if args.nodes_output:
+        sink_inboxes["store"] = pipeline.inbox("store")
+
+    chunk_workers = args.chunk_workers or os.cpu_count() or 1
+    chunk_pool = ProcessPoolExecutor(
+        max_workers=chunk_workers,
+        initializer=_init_chunk_worker,
+        initargs=(args.chunker, CHUNK_SIZE, CHUNK_OVERLAP),
+    )
+    cache = None
+    if args.backend == "openai":
+        cache = None if args.no_cache else ContextCache(args.cache_file)
+        enrich = ContextEnricher(configure_openai(), cache, args.concurrency, args.rpm, args.tpm)
+    else:
+        enrich = None
+    embedder = Embedder(make_embed_model(), args.embed_batch)
+    sinks = {"qdrant": QdrantSink(args.qdrant_path, args.collection), "fts": FtsSink(args.sqlite_db)}
+    if args.nodes_output:
+        sinks["store"] = StoreSink(args.nodes_output)
+
+    if args.docs:
+        source = documents_source(pipeline, chunk_in, args.docs, args.input_parts)
+    else:
+        source = parse_source(pipeline, chunk_in, args)
+    monitor = asyncio.create_task(pipeline.monitor())
+    stages = [
+        asyncio.create_task(source),
+        asyncio.create_task(
+            pipeline.run_stage("chunk", chunk_in, [enrich_in], make_chunker(chunk_pool), chunk_workers)
+        ),
+        asyncio.create_task(
+            pipeline.run_stage("enrich", enrich_in, [embed_in], enrich or pass_through, args.enrich_workers)
+        ),
+        asyncio.create_task(
+            pipeline.run_stage("embed", embed_in, list(sink_inboxes.values()), embedder, args.embed_workers)
+        ),
+        *(
+            asyncio.create_task(pipeline.run_stage(name, inbox, [], make_sink(sinks[name])))
+            for name, inbox in sink_inboxes.items()
+        ),
+    ]
+    succeeded = False
+    try:
+        await asyncio.gather(*stages)
+        succeeded = True
+    finally:
+        if not succeeded:
+            # One stage failed: the others would wait on it forever
+            pipeline.stopping.set()
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+        monitor.cancel()
+        chunk_pool.shutdown(cancel_futures=not succeeded)
+        if enrich is not None:
+            enrich.close()  # Contexts generated so far stay cached either way
+        if cache is not None:
+            cache.close()
+        if succeeded:
+            embedder.save_cache()
+        for sink in sinks.values():
+            sink.close() if succeeded else sink.abort()
+
+    summary = pipeline.summary()
+    summary["contexts"] = enrich.counts if enrich is not None else None
+    summary["embeddings"] = embedder.counts
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Run parse, chunk, enrich, embed and index as one streaming pipeline.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input_dir", help="Directory of PDF/Markdown files to parse (recursive).")
+    source.add_argument("--input_file", help="Single PDF/Markdown file to parse.")
+    source.add_argument("--docs", help="Already-parsed Documents (pickle or node store) instead of parsing.")
+    parser.add_argument("--input_parts", action="store_true", help="With --docs, stream its <docs>.parts shards.")
+    parser.add_argument(
+        "--parse_output", default="./parsed_docs.pkl",
+        help="Parse shards go to <parse_output>.parts (resumable, as with parse_pdf_md.py).",
+    )
+    parser.add_argument("--restart", action="store_true", help="Discard completed parse shards first.")
+    parser.add_argument("--max_workers", type=int, default=4, help="Concurrent LlamaParse jobs.")
+    parser.add_argument("--md_workers", type=int, default=8, help="Threads reading Markdown files.")
+    parser.add_argument("--timeout", type=int, default=180, help="LlamaParse timeout per job (seconds).")
+    parser.add_argument("--disable-pair-extraction", action="store_true", help="Parse PDFs with the default prompt.")
+    parser.add_argument("--local_text", action="store_true", help="Extract plain-text PDF pages locally.")
+    parser.add_argument("--chunker", choices=CHUNKERS, default="markdown")
+    parser.add_argument("--chunk_workers", type=int, default=None, help="Chunking processes (default: CPU count).")
+    parser.add_argument(
+        "--backend", choices=("openai", "none"), default="openai",
+        help="Context enrichment: online gpt-4o-mini requests, or none.",
+    )
+    parser.add_argument("--concurrency", type=int, default=16, help="Context requests in flight.")
+    parser.add_argument("--rpm", type=int, default=500, help="Context requests per minute (0 = unlimited).")
+    parser.add_argument("--tpm", type=int, default=200_000, help="Context tokens per minute (0 = unlimited).")
+    parser.add_argument("--enrich_workers", type=int, default=4, help="Node batches enriched concurrently.")
+    parser.add_argument("--cache_file", default=CONTEXT_CACHE_FILE, help="Context cache (shared with metadata.py).")
+    parser.add_argument("--no_cache", action="store_true", help="Don't read or write the context cache.")
+    parser.add_argument("--embed_workers", type=int, default=2, help="Node batches embedded concurrently.")
+    parser.add_argument("--embed_batch", type=int, default=DEFAULT_EMBED_BATCH, help="Texts per embedding request.")
+    parser.add_argument("--qdrant_path", default=LOCAL_QDRANT_PATH, help="Local Qdrant directory.")
+    parser.add_argument("--collection", default=QDRANT_COLLECTION_NAME, help="Qdrant collection (recreated).")
+    parser.add_argument("--sqlite_db", default=SQLITE_DB_PATH, help="SQLite FTS DB for chat_engine.py (rebuilt).")
+    parser.add_argument("--nodes_output", default=None, help="Also stream the indexed nodes into this node store (*.nodes).")
+    parser.add_argument("--queue_size", type=int, default=DEFAULT_QUEUE_SIZE, help="Batches each queue holds.")
+    parser.add_argument("--report", default=None, help="Also write the summary as JSON.")
+    args = parser.parse_args()
+
+    if args.nodes_output and not args.nodes_output.endswith(".nodes"):
+        parser.error("--nodes_output must be a node store path ending in .nodes")
+    load_dotenv()
+    summary = asyncio.run(run_pipeline(args))
+    print_summary(summary)
+    if args.report:
+        report_path = Path(args.report)
+        report_path.parent.mkdir(parents=True, exist_ok=True)
+        report_path.write_text(json.dumps(summary, indent=2))
+        print(f"\nSaved pipeline report to {report_path}")
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Local, API-free context keywords for nodes (metadata.py --backend local).
+
+Produces the same comma-separated keyword/phrase string as the gpt-4o-mini
+prompt in metadata.py, without any API calls:
+
+- Keyphrases: RAKE-style candidates (runs of content words between stopwords
+  and punctuation, scored by word degree / frequency), weighted by the mean
+  corpus IDF of their words, so phrases common to every datasheet ("power
+  meter", "laser") rank below the ones that set a chunk apart.
+- Product identifiers: model names and part numbers from the node's 'pairs'
+  metadata that occur in the chunk, plus any other part numbers in the text.
+
+Candidate extraction is the expensive part and runs over batches of texts in
+a ProcessPoolExecutor. Document frequencies are then summed in the parent and
+each chunk's phrases are scored. Tens of thousands of chunks take seconds.
+
+Contexts depend on the whole corpus (through IDF), so metadata.py recomputes
+them on every run instead of caching them. They are stored under their own
+context version, so LLM contexts and keyword contexts are never mixed up.
+
+To compare with LLM contexts on the retrieval benchmark, build the indexes
+for each variant (metadata.py --backend local / openai, then
+create_vector_db.py) into their own copy of the app directory. Then run
+benchmarks/retrieval_benchmark.py with the same golden set against each
+--app_dir, using --label to tell the runs apart. Golden entries match node
+text without its context, so the same golden set works for both.
+
+Usage:
+    python metadata.py --backend local
+    python local_context.py enhanced_laser_nodes.pkl --show 5
+"""
+
+import re
+import math
+import time
+import pickle
+import logging
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from local_pdf_text import PART_NUMBER
+
+KEYWORD_VERSION = 1  # Bump when the extraction below changes
+TOP_PHRASES = 12
+MAX_PAIR_KEYWORDS = 8
+MAX_PHRASE_WORDS = 4
+POOL_MIN_TEXTS = 2_000  # Fewer texts are processed inline
+BATCH_SIZE = 500
+
+STOPWORDS = frozenset(
+    """
+    a about above after again against all also am an and any are as at be because been
+    before being below between both but by can could did do does doing down during each
+    either etc few for from further had has have having he her here hers herself him
+    himself his how i if in into is it its itself just may me might more most must my
+    myself no nor not now of off on once only or other our ours ourselves out over own
+    per same she should so some such than that the their theirs them themselves then
+    there these they this those through to too under until up upon us use used uses
+    using very via was we were what when where which while who whom why will with within
+    without would you your yours yourself yourselves one two three see table figure
+    page note notes typical typ max min approx approximately e.g i.e
+    """.split()
+)
+_WORD = r"[a-z][a-z0-9+]*(?:[-/.][a-z0-9+]+)*"
+# Phrases are split at stopwords, punctuation, Markdown syntax and line breaks.
+# One pass over the lower-cased text: group 1 is a word, "" is a break.
+TOKEN = re.compile(rf"({_WORD})|[.,;:!?()\[\]{{}}|#*_`\"'<>=\n]|\s-\s")
+URL = re.compile(r"https?://\S+|www\.\S+")
+
+
+def candidate_phrases(text: str) -> Tuple[Dict[str, float], List[str]]:
+    """
+    RAKE scores of the candidate phrases in one text, and its distinct words
+    (for document frequencies). Works on plain strings so it runs in a worker.
+    """
+    runs: List[List[str]] = []
+    current: List[str] = []
+    for word in TOKEN.findall(URL.sub(" ", text.lower())):
+        if not word or word in STOPWORDS or len(word) < 2:
+            if current:
+                runs.append(current)
+                current = []
+        else:
+            current.append(word)
+    if current:
+        runs.append(current)
+    # Long runs (table rows, run-on headings) become consecutive shorter phrases
+    phrases = [
+        run[i : i + MAX_PHRASE_WORDS] for run in runs for i in range(0, len(run), MAX_PHRASE_WORDS)
+    ]
+
+    frequency: Counter = Counter()
+    degree: Counter = Counter()
+    for words in phrases:
+        n = len(words)
+        for word in words:
+            frequency[word] += 1
+            degree[word] += n
+    word_score = {w: degree[w] / f for w, f in frequency.items()}
+    scores: Dict[str, float] = {}
+    for words in phrases:
+        phrase = " ".join(words)
+        if phrase not in scores:
+            scores[phrase] = sum(word_score[w] for w in words)
+    return scores, list(frequency)
+
+
+def extract_candidates_batch(texts: List[str]) -> List[Tuple[Dict[str, float], List[str]]]:
+    return [candidate_phrases(text) for text in texts]
+
+
+def pair_keywords(text: str, pairs: Optional[Sequence[Any]]) -> List[str]:
+    """Model names / part numbers from 'pairs' metadata that the chunk mentions, then other part numbers."""
+    keywords: List[str] = []
+    seen_parts = set()
+    for pair in pairs or []:
+        if len(keywords) >= MAX_PAIR_KEYWORDS:
+            break
+        if not isinstance(pair, dict):
+            continue
+        model = str(pair.get("model_name", "")).strip()
+        part = str(pair.get("part_number", "")).strip()
+        if (model and model in text) or (part and part in text):
+            keywords.append(f"{model} part number {part}" if model and part else model or part)
+            seen_parts.add(part)
+    for part in dict.fromkeys(PART_NUMBER.findall(text)):
+        if len(keywords) >= MAX_PAIR_KEYWORDS:
+            break
+        if part not in seen_parts:
+            keywords.append(f"part number {part}")
+            seen_parts.add(part)
+    return keywords
+
+
+def score_phrases(scores: Dict[str, float], idf: Dict[str, float], top_k: int = TOP_PHRASES) -> List[str]:
+    """Top phrases by RAKE score x mean IDF of their words."""
+    weighted = []
+    for phrase, score in scores.items():
+        words = phrase.split()
+        if all(w.isdigit() for w in words) or (len(words) == 1 and len(phrase) < 3):
+            continue
+        weight = sum(idf.get(w, 0.0) for w in words) / len(words)
+        weighted.append((score * weight, phrase))
+    weighted.sort(key=lambda item: (-item[0], item[1]))
+    return [phrase for _, phrase in weighted[:top_k]]
+
+
+def local_contexts(
+    texts: List[str],
+    pairs: Optional[List[Optional[Sequence[Any]]]] = None,
+    max_workers: Optional[int] = None,
+    top_k: int = TOP_PHRASES,
+) -> List[str]:
+    """Context string for every text, in order; "" when nothing was found."""
+    started = time.monotonic()
+    batches = [texts[i : i + BATCH_SIZE] for i in range(0, len(texts), BATCH_SIZE)]
+    if len(texts) >= POOL_MIN_TEXTS and max_workers != 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = [item for batch in pool.map(extract_candidates_batch, batches) for item in batch]
+    else:
+        results = extract_candidates_batch(texts)
+
+    document_frequency: Counter = Counter()
+    for _, words in results:
+        document_frequency.update(words)
+    n_docs = max(1, len(texts))
+    idf = {w: math.log((1 + n_docs) / (1 + df)) + 1.0 for w, df in document_frequency.items()}
+
+    pairs = pairs or [None] * len(texts)
+    contexts = []
+    for text, node_pairs, (scores, _) in zip(texts, pairs, results):
+        keywords = pair_keywords(text, node_pairs) + score_phrases(scores, idf, top_k)
+        contexts.append(", ".join(dict.fromkeys(keywords)))
+    logging.info(
+        f"Extracted local keywords for {len(texts)} texts in {time.monotonic() - started:.2f}s "
+        f"({len(document_frequency)} distinct words)"
+    )
+    return contexts
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Show the local keyword contexts for the nodes in a pickle.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("nodes", help="Node pickle (e.g. metadata.py output).")
+    parser.add_argument("--show", type=int, default=5, help="Number of nodes to print.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    args = parser.parse_args()
+
+    from context_cache import split_context
+
+    with open(args.nodes, "rb") as f:
+        nodes = pickle.load(f)
+    texts = [split_context(node.text)[0] for node in nodes]
+    contexts = local_contexts(
+        texts, [(node.metadata or {}).get("pairs") for node in nodes], args.workers
+    )
+    for text, context in list(zip(texts, contexts))[: args.show]:
+        print(f"\n{text[:200]!r}...\n  Context: {context}")
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Local page classification and text extraction for PDFs.
+
+Most datasheet pages that are plain prose (overviews, feature lists, notes)
+parse fine without LlamaParse. This module reads a PDF with pypdf, classifies
+every page, and converts the plain-text pages to Markdown locally:
+
+- "text":    enough extractable text, no images, no table-like layout
+             -> converted to Markdown here
+- "complex": images, table-like column layout, or too little text (scanned or
+             graphic pages) -> left for LlamaParse
+
+analyze_pdf() is a plain top-level function so it can run in a
+ProcessPoolExecutor. It can also write the complex pages to a subset PDF so
+that only those pages are uploaded.
+
+pdf_page_fingerprints() hashes what each page shows, so a revised datasheet
+can be diffed page by page against earlier runs.
+
+Requires:
+- `pip install pypdf`
+
+Usage:
+    # Show how the pages of a PDF would be routed
+    python local_pdf_text.py data/sample_docs/pm10k-plus-ds.pdf
+    python local_pdf_text.py data/sample_docs/*.pdf --show_markdown
+"""
+
+import re
+import json
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Optional pypdf import
+try:
+    from pypdf import PdfReader, PdfWriter
+
+    PYPDF_INSTALLED = True
+except ImportError:
+    PdfReader = PdfWriter = None
+    PYPDF_INSTALLED = False
+
+MIN_TEXT_CHARS = 200  # Fewer extractable characters: likely scanned or mostly graphics
+MIN_TABLE_ROWS = 5  # Lines split into columns by wide gaps that make a page "tabular"
+MIN_TABLE_ROW_SHARE = 0.3
+MIN_AXIS_LINES = 5  # Number-only lines (chart axes drawn as vector text)
+MIN_FIGURE_SIDE = 150  # Smaller images (logos, header banners, icons) don't count as figures
+COLUMN_GAP = re.compile(r"\S {3,}(?=\S)")
+NUMBER_ONLY = re.compile(r"^[\d\s.,%KkM]+$")
+# Seven-digit part numbers, or dashed ones starting with 33 (see DATASHEET_PARSE_PROMPT)
+PART_NUMBER = re.compile(r"\b\d{7}\b|\b33-\d{3,4}(?:-\d{2,4})?\b")
+BULLET = re.compile(r"^\s*[•●▪■◦‣\-–‒*]\s+")
+HEADING_MAX_CHARS = 60
+
+
+def layout_reason(layout_text: str) -> Optional[str]:
+    """'table' or 'chart' when the column layout of a page needs LlamaParse, else None."""
+    lines = [line for line in layout_text.splitlines() if line.strip()]
+    if not lines:
+        return None
+    rows = sum(1 for line in lines if COLUMN_GAP.search(BULLET.sub("", line.strip())))
+    if rows >= MIN_TABLE_ROWS and rows / len(lines) >= MIN_TABLE_ROW_SHARE:
+        return "table"
+    if sum(1 for line in lines if NUMBER_ONLY.match(line)) >= MIN_AXIS_LINES:
+        return "chart"
+    return None
+
+
+def image_sizes(resources: Any, depth: int = 0) -> List[tuple]:
+    """
+    (width, height) of every image in a resources dictionary, following form
+    XObjects a few levels deep. Reads only the image dictionaries, never
+    decodes image data.
+    """
+    if resources is None or depth > 3:
+        return []
+    xobjects = resources.get_object().get("/XObject")
+    if not xobjects:
+        return []
+    sizes = []
+    for xobject in xobjects.get_object().values():
+        xobject = xobject.get_object()
+        subtype = xobject.get("/Subtype")
+        if subtype == "/Image":
+            sizes.append((int(xobject.get("/Width", 0)), int(xobject.get("/Height", 0))))
+        elif subtype == "/Form":
+            sizes.extend(image_sizes(xobject.get("/Resources"), depth + 1))
+    return sizes
+
+
+def count_figures(resources: Any) -> int:
+    """Images of at least MIN_FIGURE_SIDE px per side."""
+    return sum(1 for size in image_sizes(resources) if min(size) >= MIN_FIGURE_SIDE)
+
+
+def page_fingerprint(page: Any) -> str:
+    """
+    Fingerprint of what a page shows: whitespace-normalised text, image sizes
+    and page size. Re-exporting a revised datasheet renumbers PDF objects and
+    re-subsets fonts, so hashing raw page bytes would flag every page as changed.
+    """
+    text = " ".join((page.extract_text() or "").split())
+    payload = {
+        "text": text,
+        "images": sorted(image_sizes(page.get("/Resources"))),
+        "size": [round(float(v)) for v in page.mediabox[2:]],
+        "rotation": page.get("/Rotate", 0),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def pdf_page_fingerprints(path: str) -> List[str]:
+    """Fingerprint of every page, in order. Runs in a worker process."""
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    return [page_fingerprint(page) for page in PdfReader(path).pages]
+
+
+def write_page_subset(path: str, page_numbers: List[int], subset_path: str) -> str:
+    """Writes the given 1-based pages of a PDF, in order, to subset_path."""
+    reader = PdfReader(path)
+    writer = PdfWriter()
+    for page_num in page_numbers:
+        writer.add_page(reader.pages[page_num - 1])
+    with open(subset_path, "wb") as f:
+        writer.write(f)
+    return subset_path
+
+
+def _is_heading(line: str, next_line: Optional[str]) -> bool:
+    if len(line) > HEADING_MAX_CHARS or line.endswith((".", ",", ";", ":")):
+        return False
+    if not re.search(r"[A-Za-z]", line) or BULLET.match(line):
+        return False
+    if next_line is None:
+        return False
+    return line.isupper() or line.istitle()
+
+
+def text_to_markdown(text: str) -> str:
+    """
+    Converts plain extracted page text to simple Markdown: short title-like
+    lines become headings, bullet glyphs become list items, and hard-wrapped
+    lines are joined into paragraphs.
+    """
+    lines = [line.strip() for line in text.splitlines()]
+    blocks: List[str] = []
+    paragraph: List[str] = []
+
+    def flush():
+        if paragraph:
+            blocks.append(" ".join(paragraph))
+            paragraph.clear()
+
+    for i, line in enumerate(lines):
+        if not line:
+            flush()
+            continue
+        next_line = next((l for l in lines[i + 1 :] if l), None)
+        if BULLET.match(line):
+            flush()
+            blocks.append("- " + BULLET.sub("", line, count=1))
+        elif _is_heading(line, next_line):
+            flush()
+            blocks.append(f"## {line}")
+        elif blocks and blocks[-1].startswith("- ") and not paragraph and line[:1].islower():
+            blocks[-1] += f" {line}"  # Wrapped continuation of a bullet
+        else:
+            paragraph.append(line)
+    flush()
+
+    # Keep consecutive bullets together, blank lines everywhere else
+    markdown = []
+    for block in blocks:
+        if markdown and not (block.startswith("- ") and markdown[-1].startswith("- ")):
+            markdown.append("")
+        markdown.append(block)
+    return "\n".join(markdown)
+
+
+def classify_page(page: Any, route_part_numbers: bool = True) -> Dict[str, Any]:
+    """
+    Classifies one pypdf page and, for text pages, returns its Markdown.
+    With route_part_numbers, pages mentioning part numbers go to LlamaParse so
+    the datasheet prompt can extract model/part number pairs from them.
+    """
+    text = page.extract_text() or ""
+    try:
+        has_images = count_figures(page.get("/Resources")) > 0
+    except Exception:
+        has_images = True  # Unreadable resources: let LlamaParse handle the page
+    try:
+        layout_text = page.extract_text(extraction_mode="layout") or ""
+    except TypeError:
+        layout_text = text  # pypdf < 3.17 has no layout mode
+
+    if len(text.strip()) < MIN_TEXT_CHARS:
+        reason = "little text"
+    elif has_images:
+        reason = "images"
+    elif route_part_numbers and PART_NUMBER.search(text):
+        reason = "part numbers"
+    else:
+        reason = layout_reason(layout_text)
+    if reason is None:
+        return {"kind": "text", "reason": "", "markdown": text_to_markdown(text)}
+    return {"kind": "complex", "reason": reason, "markdown": None}
+
+
+def analyze_pdf(
+    path: str, subset_path: Optional[str] = None, route_part_numbers: bool = True
+) -> Dict[str, Any]:
+    """
+    Classifies every page of a PDF. Runs in a worker process.
+
+    Returns {"total_pages", "pages": [{"page", "kind", "reason", "markdown"}],
+    "subset_path"}; subset_path is set only when there are complex pages and a
+    destination was given, and holds just those pages in their original order.
+    """
+    logging.getLogger("pypdf").setLevel(logging.ERROR)  # Font-encoding warnings are noise here
+    reader = PdfReader(path)
+    pages = []
+    for page_num, page in enumerate(reader.pages, 1):
+        try:
+            result = classify_page(page, route_part_numbers)
+        except Exception as e:
+            result = {"kind": "complex", "reason": f"extraction error: {e}", "markdown": None}
+        result["page"] = page_num
+        pages.append(result)
+
+    complex_pages = [p["page"] for p in pages if p["kind"] == "complex"]
+    written_subset = None
+    if subset_path and complex_pages:
+        written_subset = write_page_subset(path, complex_pages, subset_path)
+    return {"total_pages": len(pages), "pages": pages, "subset_path": written_subset}
+
+
+def routing_summary(analysis: Dict[str, Any]) -> str:
+    pages = analysis["pages"]
+    local = sum(1 for p in pages if p["kind"] == "text")
+    reasons: Dict[str, int] = {}
+    for p in pages:
+        if p["kind"] == "complex":
+            key = p["reason"].split(":")[0]
+            reasons[key] = reasons.get(key, 0) + 1
+    detail = ", ".join(f"{count} {reason}" for reason, count in sorted(reasons.items()))
+    return f"{local}/{len(pages)} pages local, {len(pages) - local} to LlamaParse" + (
+        f" ({detail})" if detail else ""
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Show how PDF pages would be routed between local extraction and LlamaParse.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("pdfs", nargs="+", help="PDF files to analyze.")
+    parser.add_argument(
+        "--show_markdown", action="store_true", help="Print the Markdown of local pages."
+    )
+    args = parser.parse_args()
+
+    if not PYPDF_INSTALLED:
+        raise SystemExit("pypdf not found. Please install with: pip install pypdf")
+
+    for pdf in args.pdfs:
+        analysis = analyze_pdf(pdf)
+        print(f"{Path(pdf).name}: {routing_summary(analysis)}")
+        for page in analysis["pages"]:
+            label = "local" if page["kind"] == "text" else f"LlamaParse ({page['reason']})"
+            print(f"  page {page['page']:>3}: {label}")
+            if args.show_markdown and page["markdown"]:
+                print("\n".join("      " + line for line in page["markdown"].splitlines()))
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Markdown-structure-aware chunking for LlamaParse output (metadata.py --chunker markdown).
+
+SentenceSplitter treats a datasheet page as a stream of sentences. It cuts
+the large Markdown spec tables LlamaParse produces mid-row, and separates
+tables from the headings that say what they describe. The fragments match
+neither keyword nor vector queries well, and more of them have to be retrieved
+per answer.
+
+MarkdownTableSplitter splits text into blocks (headings, tables, code fences,
+paragraphs) and packs whole blocks into chunks of up to chunk_size tokens:
+
+- A heading always starts the chunk with the block that follows it, and a
+  short caption line stays with its table.
+- A chunk that continues a section starts with that section's heading
+  chain, so every chunk says what it is about.
+- A table larger than a chunk is split into row groups. Each group repeats
+  the table's heading and header rows.
+- Oversize paragraphs are split at sentence boundaries, with chunk_overlap
+  tokens of overlap.
+
+Chunks are sized with the cl100k_base tiktoken encoding (the one used by
+text-embedding-3-large and SentenceSplitter). The encoding is loaded once
+per process and token counts of blocks and table rows are cached. Without
+tiktoken (or its encoding file, e.g. offline), sizes fall back to ~4
+characters per token.
+
+MarkdownTableNodeParser wraps the splitter as a LlamaIndex node parser, a
+drop-in replacement for SentenceSplitter (metadata-aware chunk sizes, same
+node metadata and relationships).
+
+Usage:
+    python metadata.py --chunker markdown
+    python benchmarks/chunking_benchmark.py --docs parsed_docs.pkl
+    python markdown_chunker.py parsed_docs.pkl --show 3
+"""
+
+import re
+import pickle
+import logging
+import argparse
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+# Optional tiktoken import
+try:
+    import tiktoken
+
+    TIKTOKEN_INSTALLED = True
+except ImportError:
+    tiktoken = None
+    TIKTOKEN_INSTALLED = False
+
+# Optional LlamaIndex import (only needed for MarkdownTableNodeParser)
+try:
+    from llama_index.core.node_parser.interface import MetadataAwareTextSplitter
+    from llama_index.core.bridge.pydantic import Field
+
+    LLAMAINDEX_INSTALLED = True
+except ImportError:
+    MetadataAwareTextSplitter = object
+    Field = None
+    LLAMAINDEX_INSTALLED = False
+
+TOKENIZER_ENCODING = "cl100k_base"
+DEFAULT_CHUNK_SIZE = 2048
+DEFAULT_CHUNK_OVERLAP = 128
+MAX_CAPTION_TOKENS = 60  # A paragraph this short right before a table stays with it
+MIN_EFFECTIVE_CHUNK_SIZE = 50
+
+HEADING = re.compile(r"^(#{1,6})\s+\S")
+FENCE = re.compile(r"^\s*(```|~~~)")
+TABLE_ROW = re.compile(r"^\s*\|")
+TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=\S)")
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer() -> Callable[[str], int]:
+    """Token counter for chunk sizing, created once per process."""
+    if TIKTOKEN_INSTALLED:
+        try:
+            encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+            return lambda text: len(encoding.encode(text, disallowed_special=()))
+        except Exception as e:
+            logging.warning(f"tiktoken encoding {TOKENIZER_ENCODING} unavailable ({e}); estimating tokens")
+    return lambda text: max(1, len(text) // 4) if text else 0
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    return get_tokenizer()(text)
+
+
+class Block:
+    """One Markdown block: kind is "heading", "table", "code" or "text"."""
+
+    __slots__ = ("kind", "text", "level", "tokens")
+
+    def __init__(self, kind: str, text: str, level: int = 0):
+        self.kind = kind
+        self.text = text
+        self.level = level
+        self.tokens = count_tokens(text)
+
+    def __repr__(self):
+        return f"Block({self.kind!r}, {self.text[:30]!r}, tokens={self.tokens})"
+
+
+def parse_blocks(text: str) -> List[Block]:
+    """Splits Markdown into heading, table, code fence and paragraph blocks."""
+    blocks: List[Block] = []
+    paragraph: List[str] = []
+    lines = text.splitlines()
+
+    def flush_paragraph():
+        if paragraph:
+            blocks.append(Block("text", "\n".join(paragraph).strip()))
+            paragraph.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if FENCE.match(line):
+            flush_paragraph()
+            fence = FENCE.match(line).group(1)
+            end = i + 1
+            while end < len(lines) and not lines[end].lstrip().startswith(fence):
+                end += 1
+            blocks.append(Block("code", "\n".join(lines[i : end + 1])))
+            i = end + 1
+            continue
+        heading = HEADING.match(line)
+        if heading:
+            flush_paragraph()
+            blocks.append(Block("heading", line.strip(), level=len(heading.group(1))))
+        elif TABLE_ROW.match(line):
+            flush_paragraph()
+            end = i
+            while end < len(lines) and TABLE_ROW.match(lines[end]):
+                end += 1
+            blocks.append(Block("table", "\n".join(row.strip() for row in lines[i:end])))
+            i = end
+            continue
+        elif not line.strip():
+            flush_paragraph()
+        else:
+            paragraph.append(line)
+        i += 1
+    flush_paragraph()
+    return [block for block in blocks if block.text]
+
+
+def split_table_rows(table: str) -> Tuple[List[str], List[str]]:
+    """(header rows, body rows): the header is the first row plus its separator row."""
+    rows = table.split("\n")
+    if len(rows) >= 2 and TABLE_SEPARATOR.match(rows[1]):
+        return rows[:2], rows[2:]
+    return [], rows
+
+
+class MarkdownTableSplitter:
+    """Packs whole Markdown blocks into chunks of at most chunk_size tokens."""
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, chunk_overlap: int = DEFAULT_CHUNK_OVERLAP):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def split_text(self, text: str, chunk_size: Optional[int] = None) -> List[str]:
+        limit = chunk_size or self.chunk_size
+        chunks: List[str] = []
+        current: List[str] = []
+        current_tokens = 0
+        headings: List[Block] = []  # Heading chain of the current section
+        pending: List[Block] = []  # Headings / caption waiting for the block they introduce
+
+        def flush():
+            nonlocal current, current_tokens
+            if current:
+                chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+
+        def breadcrumb(unit_blocks: List[Block]) -> List[Block]:
+            """Enclosing section headings to repeat when a new chunk starts."""
+            return [h for h in headings if h not in unit_blocks]
+
+        blocks = parse_blocks(text)
+        for index, block in enumerate(blocks):
+            if block.kind == "heading":
+                headings = [h for h in headings if h.level < block.level] + [block]
+                pending.append(block)
+                continue
+            next_is_table = index + 1 < len(blocks) and blocks[index + 1].kind == "table"
+            if block.kind == "text" and next_is_table and block.tokens <= MAX_CAPTION_TOKENS:
+                pending.append(block)
+                continue
+
+            unit = pending + [block]
+            pending = []
+            unit_tokens = sum(b.tokens for b in unit) + len(unit) - 1
+            if current and current_tokens + unit_tokens + 1 <= limit:
+                current.extend(b.text for b in unit)
+                current_tokens += unit_tokens + 1
+                continue
+
+            flush()
+            prefix = breadcrumb(unit)
+            prefix_tokens = sum(b.tokens + 1 for b in prefix)
+            if unit_tokens <= limit:
+                if prefix_tokens + unit_tokens > limit:
+                    prefix, prefix_tokens = [], 0
+                current = [b.text for b in prefix + unit]
+                current_tokens = prefix_tokens + unit_tokens
+                continue
+
+            # Oversize: split the block itself, repeating the headings / caption
+            lead = prefix + unit[:-1]
+            if sum(b.tokens + 1 for b in lead) > limit // 2:
+                lead = lead[-1:] if lead and lead[-1].tokens < limit // 2 else []
+            for piece in self._split_oversize(block, lead, limit):
+                chunks.append(piece)
+
+        if pending:
+            # Trailing headings with nothing after them
+            text_tail = "\n\n".join(b.text for b in pending)
+            if current and current_tokens + count_tokens(text_tail) + 1 <= limit:
+                current.append(text_tail)
+            else:
+                flush()
+                current = [text_tail]
+        flush()
+        return chunks
+
+    def _split_oversize(self, block: Block, lead: List[Block], limit: int) -> List[str]:
+        lead_text = [b.text for b in lead]
+        lead_tokens = sum(b.tokens + 1 for b in lead)
+        if block.kind == "table":
+            return self._split_table(block.text, lead_text, lead_tokens, limit)
+        pieces = self._split_prose(block.text, limit - lead_tokens)
+        return ["\n\n".join(lead_text + [piece]) for piece in pieces]
+
+    def _split_table(self, table: str, lead_text: List[str], lead_tokens: int, limit: int) -> List[str]:
+        header, rows = split_table_rows(table)
+        header_tokens = sum(count_tokens(row) + 1 for row in header)
+        budget = limit - lead_tokens - header_tokens
+        if budget < MIN_EFFECTIVE_CHUNK_SIZE:
+            # Very wide header: repeat only the heading row names
+            header, header_tokens = header[:1], count_tokens(header[0]) + 1 if header else 0
+            budget = limit - lead_tokens - header_tokens
+        groups: List[List[str]] = []
+        group: List[str] = []
+        group_tokens = 0
+        for row in rows:
+            row_tokens = count_tokens(row) + 1
+            if group and group_tokens + row_tokens > budget:
+                groups.append(group)
+                group, group_tokens = [], 0
+            if row_tokens > budget:
+                # A single row larger than a chunk: split its text
+                groups.extend([[piece] for piece in self._split_prose(row, budget)])
+                continue
+            group.append(row)
+            group_tokens += row_tokens
+        if group:
+            groups.append(group)
+        return ["\n\n".join(lead_text + ["\n".join(header + group)]) for group in groups]
+
+    def _split_prose(self, text: str, limit: int) -> List[str]:
+        """Packs sentences (or words, for run-on text) with chunk_overlap tokens of overlap."""
+        limit = max(limit, MIN_EFFECTIVE_CHUNK_SIZE)
+        units = SENTENCE_END.split(text)
+        if any(count_tokens(u) > limit for u in units):
+            units = [w for u in units for w in (u.split(" ") if count_tokens(u) > limit else [u])]
+        pieces: List[str] = []
+        current: List[str] = []
+        tokens = 0
+        for unit in units:
+            unit_tokens = count_tokens(unit) + 1
+            if current and tokens + unit_tokens > limit:
+                pieces.append(" ".join(current))
+                overlap: List[str] = []
+                overlap_tokens = 0
+                for previous in reversed(current):
+                    previous_tokens = count_tokens(previous) + 1
+                    if overlap_tokens + previous_tokens > min(self.chunk_overlap, limit - unit_tokens):
+                        break
+                    overlap.insert(0, previous)
+                    overlap_tokens += previous_tokens
+                current, tokens = overlap, overlap_tokens
+            current.append(unit)
+            tokens += unit_tokens
+        if current:
+            pieces.append(" ".join(current))
+        return pieces
+
+
+if LLAMAINDEX_INSTALLED:
+
+    class MarkdownTableNodeParser(MetadataAwareTextSplitter):
+        """LlamaIndex node parser using MarkdownTableSplitter; a drop-in for SentenceSplitter."""
+
+        chunk_size: int = Field(default=DEFAULT_CHUNK_SIZE, gt=0, description="Token budget per chunk.")
+        chunk_overlap: int = Field(
+            default=DEFAULT_CHUNK_OVERLAP, ge=0, description="Token overlap when splitting long paragraphs."
+        )
+
+        @classmethod
+        def class_name(cls) -> str:
+            return "MarkdownTableNodeParser"
+
+        def _splitter(self) -> MarkdownTableSplitter:
+            return MarkdownTableSplitter(self.chunk_size, self.chunk_overlap)
+
+        def split_text(self, text: str) -> List[str]:
+            return self._splitter().split_text(text)
+
+        def split_text_metadata_aware(self, text: str, metadata_str: str) -> List[str]:
+            # Metadata included in the embedded text counts against the chunk size
+            effective = self.chunk_size - count_tokens(metadata_str)
+            if effective < MIN_EFFECTIVE_CHUNK_SIZE:
+                logging.warning(
+                    f"Metadata uses {count_tokens(metadata_str)} of {self.chunk_size} chunk tokens; "
+                    f"chunking with {MIN_EFFECTIVE_CHUNK_SIZE} tokens"
+                )
+                effective = MIN_EFFECTIVE_CHUNK_SIZE
+            return self._splitter().split_text(text, chunk_size=effective)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Show how MarkdownTableSplitter chunks the Documents in a pickle.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("docs", help="Document pickle (e.g. parse.py output).")
+    parser.add_argument("--chunk_size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--chunk_overlap", type=int, default=DEFAULT_CHUNK_OVERLAP)
+    parser.add_argument("--show", type=int, default=3, help="Number of chunks to print.")
+    args = parser.parse_args()
+
+    with open(args.docs, "rb") as f:
+        docs = pickle.load(f)
+    splitter = MarkdownTableSplitter(args.chunk_size, args.chunk_overlap)
+    chunks = [chunk for doc in docs for chunk in splitter.split_text(doc.text)]
+    sizes = sorted(count_tokens(chunk) for chunk in chunks)
+    print(f"\n{len(docs)} documents -> {len(chunks)} chunks")
+    if sizes:
+        print(f"Tokens per chunk: mean {sum(sizes) / len(sizes):.0f}, max {sizes[-1]}")
+    for chunk in chunks[: args.show]:
+        print(f"\n--- {count_tokens(chunk)} tokens ---\n{chunk[:1000]}")
@@ -9,8 +9,10 @@ import os
 import uuid
 import asyncio
 import time
+import itertools
 from pathlib import Path
 from typing import List, Dict, Optional, Any, AsyncGenerator
+import numpy as np
 from dotenv import load_dotenv
 
 # Langfuse/LlamaIndex Integration
@@ -35,9 +37,21 @@ from llama_index.llms.openai import OpenAI
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.postprocessor.cohere_rerank import CohereRerank
 from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 from qdrant_client import QdrantClient
+from qdrant_client.http import models as qdrant_models
+
+from embedding_batcher import MicroBatchedEmbedding, get_query_embedding_batch
+from shared_constants import (
+    CONTEXT_FIELD,
+    CONTEXT_SEPARATOR,
+    CONTEXT_VERSION_FIELD,
+    FAILED_CONTEXT_PREFIXES,
+    OFFLINE_API_KEY,
+    OFFLINE_PROVIDER_ENV,
+)
 
 logger = logging.getLogger(__name__)
 load_dotenv()
@@ -72,12 +86,25 @@ QDRANT_COLLECTION_NAME = "matrix_docs"
 QDRANT_PATH_LOCAL = "./qdrant_db"
 QDRANT_PATH_PROD = "/app/qdrant_db"
 
+# Offline provider stand-ins (see offline_providers.py in the repo root).
+# When set, OpenAI and Cohere calls go to this base URL with dummy keys.
+OFFLINE_PROVIDER_URL = os.getenv(OFFLINE_PROVIDER_ENV, "").rstrip("/") or None
+
 # Retriever Settings
 VECTOR_SIMILARITY_TOP_K = 10
 KEYWORD_SIMILARITY_TOP_K = 5
 RERANK_TOP_N = 5
 HYBRID_RETRIEVER_MODE = "relative_score"
 
+# Query-embedding micro-batching (see embedding_batcher.py).
+# Concurrent queries arriving within the window share one embedding call; 0 disables it.
+EMBED_BATCH_WINDOW_MS = float(os.getenv("EMBED_BATCH_WINDOW_MS", "5"))
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "64"))
+
+# Node context fields written by metadata.py (see context_cache.py in the repo
+# root); the context is part of the indexed text, not of the stored metadata
+CONTEXT_FIELDS = (CONTEXT_FIELD, CONTEXT_VERSION_FIELD)
+
 # --- Helper Classes ---
 
 
@@ -167,68 +194,77 @@ class SQLiteFTSRetriever(BaseRetriever):
         This method is the INTERNAL implementation that will be called by retrieve().
         The BaseRetriever's retrieve() method adds instrumentation around this method.
         """
-        query_str = query_bundle.query_str # <-- Extract the string here
+        return self.retrieve_batch([query_bundle.query_str])[0]
 
+    def retrieve_batch(self, query_strs: List[str]) -> List[List[NodeWithScore]]:
+        """Runs several FTS queries over a single connection, results in input order."""
         # --- Restore DB connection logic ---
         if not os.path.exists(self.db_path):
             logging.error(f"Error: SQLite database not found at {self.db_path}")
-            return []
+            return [[] for _ in query_strs]
         conn = None # Initialize conn
         try:
             conn = sqlite3.connect(self.db_path)
             c = conn.cursor()
-            # ---------------------------------
-
-            # Perform query analysis
-            fts_query = f'"""*{query_str}*"""' # Use FTS5 phrase query syntax
-
-            # --- Fix syntax in query execution and logging ---
-            # Corrected logging format string
-            logging.debug(f"Executing FTS query: {query_str}")
-            
-            # FIXED QUERY: Join nodes_fts with nodes table to get node_id
-            c.execute(
-                """
-                SELECT nodes.node_id, nodes.content, nodes.metadata, nodes_fts.rank
-                FROM nodes_fts
-                JOIN nodes ON nodes_fts.rowid = nodes.rowid
-                WHERE nodes_fts MATCH ?
-                ORDER BY nodes_fts.rank
-                LIMIT ?
-                """,
-                (fts_query, self.top_k),
-            )
-            results = c.fetchall()
-
-            nodes = []
-            if results:
-                # No need for a second query - we already have all the data
-                for node_id, content, metadata_str, rank_score in results:
-                    try:
-                        # Parse the metadata JSON string
-                        metadata = json.loads(metadata_str)
-                        
-                        # Create the TextNode
-                        node = TextNode(
-                            id_=node_id,
-                            text=content,
-                            metadata=metadata,
-                        )
-                        
-                        # Use a score based on rank (lower rank -> higher score)
-                        score = 1.0 / (rank_score + 1) # Simple inverse rank score
-                        nodes.append(NodeWithScore(node=node, score=score))
-                    except json.JSONDecodeError:
-                        logging.error(f"Failed to decode metadata JSON for node_id: {node_id}")
-            return nodes
-
+            results = []
+            for query_str in query_strs:
+                try:
+                    results.append(self._query_fts(c, query_str))
+                except sqlite3.Error as e:
+                    logging.error(f"SQLite error during FTS query: {e}")
+                    results.append([])
+            return results
         except sqlite3.Error as e:
-            logging.error(f"SQLite error during FTS query: {e}")
-            return []
+            logging.error(f"SQLite error opening FTS database: {e}")
+            return [[] for _ in query_strs]
         finally:
             if conn:
                 conn.close()
-    
+
+    def _query_fts(self, c: sqlite3.Cursor, query_str: str) -> List[NodeWithScore]:
+        """Executes one FTS5 query on an open cursor and builds scored nodes."""
+        # Perform query analysis
+        fts_query = f'"""*{query_str}*"""' # Use FTS5 phrase query syntax
+
+        # --- Fix syntax in query execution and logging ---
+        # Corrected logging format string
+        logging.debug(f"Executing FTS query: {query_str}")
+
+        # FIXED QUERY: Join nodes_fts with nodes table to get node_id
+        c.execute(
+            """
+            SELECT nodes.node_id, nodes.content, nodes.metadata, nodes_fts.rank
+            FROM nodes_fts
+            JOIN nodes ON nodes_fts.rowid = nodes.rowid
+            WHERE nodes_fts MATCH ?
+            ORDER BY nodes_fts.rank
+            LIMIT ?
+            """,
+            (fts_query, self.top_k),
+        )
+        results = c.fetchall()
+
+        nodes = []
+        # No need for a second query - we already have all the data
+        for node_id, content, metadata_str, rank_score in results:
+            try:
+                # Parse the metadata JSON string
+                metadata = json.loads(metadata_str)
+
+                # Create the TextNode
+                node = TextNode(
+                    id_=node_id,
+                    text=content,
+                    metadata=metadata,
+                )
+
+                # Use a score based on rank (lower rank -> higher score)
+                score = 1.0 / (rank_score + 1) # Simple inverse rank score
+                nodes.append(NodeWithScore(node=node, score=score))
+            except json.JSONDecodeError:
+                logging.error(f"Failed to decode metadata JSON for node_id: {node_id}")
+        return nodes
+
     # NOTE: We DO NOT override retrieve() here.
     # BaseRetriever.retrieve() from the parent class will call our _retrieve() method.
     # The parent's retrieve() method has all the necessary instrumentation built in.
@@ -262,6 +298,10 @@ class HybridRetrieverWithReranking(BaseRetriever):
         vector_weight=0.7,
         keyword_weight=0.3,
         initial_top_k=20,
+        qdrant_client: Optional[QdrantClient] = None,
+        collection_name: str = QDRANT_COLLECTION_NAME,
+        embed_model=None,
+        vector_top_k: int = VECTOR_SIMILARITY_TOP_K,
     ):
         self.vector_retriever = vector_retriever
         self.keyword_retriever = keyword_retriever
@@ -269,6 +309,11 @@ class HybridRetrieverWithReranking(BaseRetriever):
         self.base_vector_weight = vector_weight
         self.base_keyword_weight = keyword_weight
         self.initial_top_k = initial_top_k
+        # Only used by retrieve_batch, which talks to Qdrant directly
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+        self.embed_model = embed_model
+        self.vector_top_k = vector_top_k
         super().__init__()
 
     def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
@@ -287,74 +332,172 @@ class HybridRetrieverWithReranking(BaseRetriever):
             keyword_nodes = self.keyword_retriever.retrieve(query_bundle)
             logger.info(f"Keyword retrieval returned {len(keyword_nodes)} nodes")
             
-            # Process results
-            node_scores = {}
-            max_score = 0.0
-            
-            # Process vector results
-            for result in vector_nodes:
-                node_id = result.node.node_id
-                score = result.score * self.base_vector_weight
-                if node_id not in node_scores:
-                    node_scores[node_id] = {"node": result.node, "score": 0.0}
-                node_scores[node_id]["score"] += score
-                max_score = max(max_score, node_scores[node_id]["score"])
-                
-            # Process keyword results (rank-based scoring)
-            keyword_max_rank_score = self.base_keyword_weight
-            for i, result in enumerate(keyword_nodes):
-                node_id = result.node.node_id
-                keyword_score = keyword_max_rank_score * (1.0 / (i + 1))
-                # Add boosting logic here if needed based on metadata
-                if node_id not in node_scores:
-                    node_scores[node_id] = {"node": result.node, "score": 0.0}
-                node_scores[node_id]["score"] += keyword_score
-                max_score = max(max_score, node_scores[node_id]["score"])
-                
-            # --- Normalize scores ---
-            if max_score > 0:
-                for node_id in node_scores:
-                    node_scores[node_id]["score"] /= max_score
-                    
-            logger.info(f"Completed score computation with {len(node_scores)} nodes and max score {max_score}")
-            
-            # --- Sort combined results ---
-            sorted_results = sorted(
-                node_scores.values(), key=lambda x: x["score"], reverse=True
-            )
-            
-            # --- Prepare for Reranking ---
-            initial_results_for_rerank = [
-                NodeWithScore(node=item["node"], score=item["score"])
-                for item in sorted_results[: self.initial_top_k]
-            ]
+            # --- Fuse, normalize and sort ---
+            initial_results_for_rerank = self._fuse(vector_nodes, keyword_nodes)
             
             # --- Rerank (if applicable) ---
-            final_top_n = self.reranker.top_n if self.reranker else 5
-            if self.reranker is not None and initial_results_for_rerank:
-                try:
-                    logger.info(f"Applying reranker: {self.reranker.__class__.__name__}")
-                    reranked_nodes = self.reranker.postprocess_nodes(
-                        initial_results_for_rerank, query_bundle
-                    )
-                    logger.info(f"Reranking complete, returning {min(len(reranked_nodes), final_top_n)} nodes")
-                    return reranked_nodes[:final_top_n]
-                except Exception as e:
-                    logger.error(
-                        f"Error during reranking: {e}. Returning initial sorted results."
-                    )
-                    return initial_results_for_rerank[:final_top_n]
-                    
-            # --- Return top N if no reranker or reranking failed ---
-            logger.info(f"No reranking needed, returning {min(len(initial_results_for_rerank), final_top_n)} nodes")
-            return initial_results_for_rerank[:final_top_n]
+            return self._rerank(initial_results_for_rerank, query_bundle)
             
         except Exception as e:
             logger.error(f"Error in hybrid retrieval: {e}", exc_info=True)
             raise
 
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        """Async variant used by astream_chat.
+
+        The base class falls back to the blocking _retrieve, which serializes
+        concurrent requests on the event loop. Both retrievers run in worker
+        threads instead: the vector store only has a sync QdrantClient (a local
+        Qdrant path can't be opened by a second, async client), and the
+        embedding batcher still combines query embeddings from concurrent threads.
+        """
+        logger.info(f"Starting async hybrid retrieval for query: {query_bundle.query_str[:50]}...")
+
+        try:
+            vector_nodes, keyword_nodes = await asyncio.gather(
+                asyncio.to_thread(self.vector_retriever.retrieve, query_bundle),
+                asyncio.to_thread(self.keyword_retriever.retrieve, query_bundle),
+            )
+            logger.info(
+                f"Vector retrieval returned {len(vector_nodes)} nodes, "
+                f"keyword retrieval returned {len(keyword_nodes)} nodes"
+            )
+            initial_results_for_rerank = self._fuse(vector_nodes, keyword_nodes)
+            # Cohere client is synchronous; keep it off the event loop
+            return await asyncio.to_thread(self._rerank, initial_results_for_rerank, query_bundle)
+
+        except Exception as e:
+            logger.error(f"Error in async hybrid retrieval: {e}", exc_info=True)
+            raise
+
+    def _fuse(
+        self, vector_nodes: List[NodeWithScore], keyword_nodes: List[NodeWithScore]
+    ) -> List[NodeWithScore]:
+        """Weighted fusion of vector scores and keyword rank scores, vectorized.
+
+        Vector results contribute score * vector_weight, keyword results contribute
+        keyword_weight / (rank + 1). Scores are normalized by the maximum and the
+        top initial_top_k nodes are returned, ties keeping first-seen order.
+        """
+        nodes_by_id: Dict[str, Any] = {}
+        for result in itertools.chain(vector_nodes, keyword_nodes):
+            nodes_by_id.setdefault(result.node.node_id, result.node)
+        if not nodes_by_id:
+            return []
+        position = {node_id: i for i, node_id in enumerate(nodes_by_id)}
+        scores = np.zeros(len(nodes_by_id), dtype=np.float64)
+
+        if vector_nodes:
+            v_idx = np.fromiter((position[r.node.node_id] for r in vector_nodes), dtype=np.int64)
+            v_scores = np.fromiter((r.score or 0.0 for r in vector_nodes), dtype=np.float64)
+            np.add.at(scores, v_idx, v_scores * self.base_vector_weight)
+        if keyword_nodes:
+            k_idx = np.fromiter((position[r.node.node_id] for r in keyword_nodes), dtype=np.int64)
+            k_scores = self.base_keyword_weight / np.arange(1, len(keyword_nodes) + 1)
+            np.add.at(scores, k_idx, k_scores)
+
+        max_score = max(0.0, float(scores.max()))
+        if max_score > 0:
+            scores /= max_score
+        logger.info(f"Completed score computation with {len(scores)} nodes and max score {max_score}")
+
+        order = np.argsort(-scores, kind="stable")[: self.initial_top_k]
+        node_list = list(nodes_by_id.values())
+        return [NodeWithScore(node=node_list[i], score=float(scores[i])) for i in order]
+
+    def _rerank(
+        self, initial_results_for_rerank: List[NodeWithScore], query_bundle: QueryBundle
+    ) -> List[NodeWithScore]:
+        """Applies the reranker if configured, falling back to the fused order."""
+        final_top_n = self.reranker.top_n if self.reranker else 5
+        if self.reranker is not None and initial_results_for_rerank:
+            try:
+                logger.info(f"Applying reranker: {self.reranker.__class__.__name__}")
+                reranked_nodes = self.reranker.postprocess_nodes(
+                    initial_results_for_rerank, query_bundle
+                )
+                logger.info(f"Reranking complete, returning {min(len(reranked_nodes), final_top_n)} nodes")
+                return reranked_nodes[:final_top_n]
+            except Exception as e:
+                logger.error(
+                    f"Error during reranking: {e}. Returning initial sorted results."
+                )
+                return initial_results_for_rerank[:final_top_n]
+                
+        # --- Return top N if no reranker or reranking failed ---
+        logger.info(f"No reranking needed, returning {min(len(initial_results_for_rerank), final_top_n)} nodes")
+        return initial_results_for_rerank[:final_top_n]
+
+    def retrieve_batch(
+        self, queries: List[Any], rerank: bool = False
+    ) -> List[List[NodeWithScore]]:
+        """Retrieves for many queries at once, returning result lists in input order.
+
+        All query embeddings are requested in one batched call, vector search runs as a
+        single Qdrant search_batch and the FTS queries share one SQLite connection.
+        Fusion is per query; reranking (one Cohere call per query) is optional.
+        Intended for offline evaluation and cache warmup, not the chat path.
+        """
+        bundles = [q if isinstance(q, QueryBundle) else QueryBundle(query_str=q) for q in queries]
+        if not bundles:
+            return []
+        query_strs = [b.query_str for b in bundles]
+        logger.info(f"Starting batch hybrid retrieval for {len(bundles)} queries")
+
+        vector_results = self._vector_search_batch(query_strs)
+        if hasattr(self.keyword_retriever, "retrieve_batch"):
+            keyword_results = self.keyword_retriever.retrieve_batch(query_strs)
+        else:
+            keyword_results = [self.keyword_retriever.retrieve(b) for b in bundles]
+
+        results = []
+        for bundle, vector_nodes, keyword_nodes in zip(bundles, vector_results, keyword_results):
+            fused = self._fuse(vector_nodes, keyword_nodes)
+            if rerank:
+                results.append(self._rerank(fused, bundle))
+            else:
+                final_top_n = self.reranker.top_n if self.reranker else 5
+                results.append(fused[:final_top_n])
+        logger.info(f"Batch hybrid retrieval complete for {len(bundles)} queries")
+        return results
+
+    def _vector_search_batch(self, query_strs: List[str]) -> List[List[NodeWithScore]]:
+        """One query-embedding request plus one Qdrant search_batch for all queries."""
+        if self.qdrant_client is None or self.embed_model is None:
+            logger.warning("No Qdrant client/embed model set; falling back to per-query vector retrieval.")
+            return [self.vector_retriever.retrieve(QueryBundle(query_str=q)) for q in query_strs]
+
+        embeddings = get_query_embedding_batch(self.embed_model, query_strs)
+        requests = [
+            qdrant_models.SearchRequest(vector=embedding, limit=self.vector_top_k, with_payload=True)
+            for embedding in embeddings
+        ]
+        batch_points = self.qdrant_client.search_batch(
+            collection_name=self.collection_name, requests=requests
+        )
+        results = []
+        for points in batch_points:
+            nodes = []
+            for point in points:
+                try:
+                    node = metadata_dict_to_node(point.payload)
+                except Exception as e:
+                    logger.error(f"Failed to rebuild node from Qdrant payload {point.id}: {e}")
+                    continue
+                nodes.append(NodeWithScore(node=node, score=point.score))
+            results.append(nodes)
+        return results
+
 
 # --- Add create_or_load_sqlite_db from working file ---
+def indexed_node_text(node) -> str:
+    """Node text plus its metadata context, as embedded by create_vector_db.py."""
+    context = (node.metadata or {}).get(CONTEXT_FIELD)
+    if not context or context.startswith(FAILED_CONTEXT_PREFIXES):
+        return node.text
+    return f"{node.text}{CONTEXT_SEPARATOR}{context}"
+
+
 def create_or_load_sqlite_db(nodes_path, db_path):
     if os.path.exists(db_path):
         logging.info(f"Using existing SQLite database at {db_path}")
@@ -409,10 +552,11 @@ def create_or_load_sqlite_db(nodes_path, db_path):
     skipped_count = 0
     for node in nodes:
         try:
-            metadata_json = json.dumps(node.metadata or {})
+            metadata = {k: v for k, v in (node.metadata or {}).items() if k not in CONTEXT_FIELDS}
+            metadata_json = json.dumps(metadata)
             c.execute(
                 "INSERT OR IGNORE INTO nodes (node_id, content, metadata) VALUES (?, ?, ?)",
-                (node.node_id, node.text, metadata_json),
+                (node.node_id, indexed_node_text(node), metadata_json),
             )
             if c.rowcount > 0:
                 inserted_count += 1
@@ -455,8 +599,23 @@ def _init_settings():
     """Loads API keys and initializes LLM, Embedding model, and Langfuse Callback Handler globally."""
     logger.info("Initializing settings...")
     try:
-        llm = OpenAI(model=LLM_MODEL, temperature=TEMPERATURE, max_tokens=MAX_TOKENS)
-        embed_model = OpenAIEmbedding(model=EMBED_MODEL, dimensions=EMBED_DIM)
+        openai_kwargs = {}
+        if OFFLINE_PROVIDER_URL:
+            logger.info(f"Using offline OpenAI stand-in at {OFFLINE_PROVIDER_URL}")
+            openai_kwargs = {
+                "api_base": f"{OFFLINE_PROVIDER_URL}/v1",
+                "api_key": os.getenv("OPENAI_API_KEY") or OFFLINE_API_KEY,
+            }
+        llm = OpenAI(
+            model=LLM_MODEL, temperature=TEMPERATURE, max_tokens=MAX_TOKENS, **openai_kwargs
+        )
+        embed_model = OpenAIEmbedding(
+            model=EMBED_MODEL, dimensions=EMBED_DIM, **openai_kwargs
+        )
+        if EMBED_BATCH_WINDOW_MS > 0:
+            embed_model = MicroBatchedEmbedding(
+                embed_model, window_ms=EMBED_BATCH_WINDOW_MS, max_batch_size=EMBED_BATCH_MAX_SIZE
+            )
         Settings.llm = llm
         Settings.embed_model = embed_model
         logger.info(f"Using LLM: {LLM_MODEL}, Embed Model: {EMBED_MODEL}")
@@ -648,7 +807,9 @@ def _create_sync_retriever(cohere_api_key: str) -> HybridRetrieverWithReranking:
         reranker = CohereRerank(
             api_key=cohere_api_key, 
             model=RERANK_MODEL, 
-            top_n=RERANK_TOP_N
+            top_n=RERANK_TOP_N,
+            # Offline stand-in when set; None uses the Cohere API (CO_API_URL is not consulted)
+            base_url=OFFLINE_PROVIDER_URL,
             # CohereRerank doesn't accept callback_manager
         )
     except Exception as e:
@@ -674,8 +835,13 @@ def _create_sync_retriever(cohere_api_key: str) -> HybridRetrieverWithReranking:
         reranker=reranker,
         # Using relative score mode, weights are not directly used but kept for potential future use
         vector_weight=0.7,
-        keyword_weight=0.3
+        keyword_weight=0.3,
         # HybridRetrieverWithReranking doesn't accept callback_manager
+        # Direct Qdrant access for retrieve_batch (evaluation and warmup)
+        qdrant_client=qdrant_client_instance,
+        collection_name=QDRANT_COLLECTION_NAME,
+        embed_model=Settings.embed_model,
+        vector_top_k=VECTOR_SIMILARITY_TOP_K,
     )
     
     # Directly attach the Langfuse client to the retriever for direct tracing
@@ -709,6 +875,9 @@ def init_chat_engine() -> Dict:
 
     # 2. Get Cohere API Key (needed for retriever)
     cohere_api_key = os.environ.get("COHERE_API_KEY")
+    if OFFLINE_PROVIDER_URL:
+        logger.info(f"Using offline Cohere stand-in at {OFFLINE_PROVIDER_URL}")
+        cohere_api_key = cohere_api_key or OFFLINE_API_KEY
     if not cohere_api_key:
         raise ValueError("COHERE_API_KEY environment variable is not set")
 
@@ -769,6 +938,7 @@ def init_chat_engine() -> Dict:
         "chat_engine": chat_engine,
         "retriever": retriever,
         "langfuse_instrumentor": langfuse_instrumentor, # Add instrumentor back
+        "embedding_batcher": getattr(Settings.embed_model, "batcher", None),
     }
 
 
@@ -0,0 +1,225 @@
+# --- START OF FILE embedding_batcher.py ---
+"""
+Micro-batching of query embeddings across concurrent chat requests.
+
+Each concurrent request normally makes its own OpenAI embedding call. The
+EmbeddingBatcher collects query-embedding requests that arrive within a
+short window (a few milliseconds) and sends them as one batched request,
+then resolves each caller's future. MicroBatchedEmbedding plugs it into
+LlamaIndex as a drop-in embed model, so retrievers need no changes.
+
+Works for both sync callers (any thread) and async callers (awaits a wrapped
+concurrent.futures.Future), because the dispatcher runs on its own thread.
+"""
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import PrivateAttr
+
+try:
+    from llama_index.embeddings.openai import OpenAIEmbedding
+    from llama_index.embeddings.openai.base import get_embeddings
+
+    OPENAI_EMBEDDING_INSTALLED = True
+except ImportError:
+    OPENAI_EMBEDDING_INSTALLED = False
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the batch-size histogram buckets
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+RECENT_SAMPLES = 1000
+
+
+def get_query_embedding_batch(embed_model: BaseEmbedding, queries: List[str]) -> List[List[float]]:
+    """
+    Query embeddings for several queries, identical to get_query_embedding().
+
+    BaseEmbedding only batches *text* embeddings, which can differ from query
+    embeddings (OpenAIEmbedding has separate query/text engines, other models
+    add a query instruction). OpenAIEmbedding queries are sent in one request
+    to its query engine; other models are embedded one query at a time.
+    """
+    if isinstance(embed_model, MicroBatchedEmbedding):
+        return [future.result() for future in [embed_model.batcher.submit(q) for q in queries]]
+    if OPENAI_EMBEDDING_INSTALLED and isinstance(embed_model, OpenAIEmbedding):
+        client = embed_model._get_client()
+
+        @embed_model._create_retry_decorator()
+        def _embed_queries():
+            return get_embeddings(
+                client, queries, engine=embed_model._query_engine, **embed_model.additional_kwargs
+            )
+
+        return _embed_queries()
+    return [embed_model.get_query_embedding(q) for q in queries]
+
+
+class EmbeddingBatcher:
+    """Collects texts for window_ms (or until max_batch_size) and embeds them in one call."""
+
+    def __init__(self, embed_model: BaseEmbedding, window_ms: float = 5.0, max_batch_size: int = 64):
+        self.embed_model = embed_model
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._queue: "queue.Queue[Optional[Tuple[str, Future, float]]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._failures = 0
+        self._histogram = {bucket: 0 for bucket in BATCH_SIZE_BUCKETS}
+        self._histogram["inf"] = 0
+        self._recent_waits = deque(maxlen=RECENT_SAMPLES)
+        self._recent_call_times = deque(maxlen=RECENT_SAMPLES)
+        self._max_wait = 0.0
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"EmbeddingBatcher started (window: {window_ms} ms, max batch: {max_batch_size})"
+        )
+
+    # --- Public API ---
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> List[float]:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=2)
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of batching metrics (batch sizes and queue wait times)."""
+        with self._stats_lock:
+            waits = sorted(self._recent_waits)
+            calls = sorted(self._recent_call_times)
+
+            def pct(values, p):
+                return values[min(len(values) - 1, int(len(values) * p / 100))] * 1000 if values else None
+
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "failures": self._failures,
+                "mean_batch_size": self._requests / self._batches if self._batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in self._histogram.items()},
+                "wait_ms_p50": pct(waits, 50),
+                "wait_ms_p95": pct(waits, 95),
+                "wait_ms_max": self._max_wait * 1000,
+                "embed_call_ms_p50": pct(calls, 50),
+                "embed_call_ms_p95": pct(calls, 95),
+                "window_ms": self.window * 1000,
+                "max_batch_size": self.max_batch_size,
+            }
+
+    # --- Dispatcher thread ---
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.perf_counter() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._dispatch(batch)
+                    return
+                batch.append(item)
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[Tuple[str, Future, float]]):
+        dispatched_at = time.perf_counter()
+        texts = [text for text, _, _ in batch]
+        try:
+            embeddings = get_query_embedding_batch(self.embed_model, texts)
+            error = None
+        except Exception as e:
+            embeddings, error = None, e
+            logger.error(f"Batched embedding call for {len(texts)} queries failed: {e}")
+        call_time = time.perf_counter() - dispatched_at
+
+        for i, (_, future, _) in enumerate(batch):
+            if future.set_running_or_notify_cancel():
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(embeddings[i])
+
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            if error is not None:
+                self._failures += 1
+            bucket = next((b for b in BATCH_SIZE_BUCKETS if len(batch) <= b), "inf")
+            self._histogram[bucket] += 1
+            for _, _, submitted_at in batch:
+                wait = dispatched_at - submitted_at
+                self._recent_waits.append(wait)
+                self._max_wait = max(self._max_wait, wait)
+            self._recent_call_times.append(call_time)
+
+
+class MicroBatchedEmbedding(BaseEmbedding):
+    """Embed model whose query embeddings go through an EmbeddingBatcher.
+
+    Document/text embeddings (ingestion) pass straight through to the wrapped
+    model, which already batches them.
+    """
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _batcher: EmbeddingBatcher = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, window_ms: float = 5.0, max_batch_size: int = 64, **kwargs: Any):
+        super().__init__(
+            model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs
+        )
+        self._inner = inner
+        self._batcher = EmbeddingBatcher(inner, window_ms=window_ms, max_batch_size=max_batch_size)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MicroBatchedEmbedding"
+
+    @property
+    def batcher(self) -> EmbeddingBatcher:
+        return self._batcher
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._batcher.embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await self._batcher.aembed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._inner.get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return await self._inner.aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._inner.get_text_embedding_batch(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self._inner.aget_text_embedding_batch(texts)
+
+# --- END OF FILE embedding_batcher.py ---
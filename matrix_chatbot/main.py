@@ -57,6 +57,7 @@ async def lifespan(app: FastHTML):
         chat_components = init_chat_engine()
         app.state.chat_engine = chat_components["chat_engine"]
         app.state.langfuse_instrumentor = chat_components.get("langfuse_instrumentor")
+        app.state.embedding_batcher = chat_components.get("embedding_batcher")
 
         # Store session ID for tracking
         app.state.session_id = f"session-{uuid4()}"
@@ -69,6 +70,7 @@ async def lifespan(app: FastHTML):
         )
         app.state.chat_engine = None  # Set to None on failure
         app.state.langfuse_instrumentor = None
+        app.state.embedding_batcher = None
 
     logging.info("Application startup: Loading suggested questions...")
     app.state.suggested_questions = []
@@ -104,6 +106,10 @@ async def lifespan(app: FastHTML):
         except Exception as e:
             logging.error(f"Error shutting down Langfuse instrumentor: {e}")
 
+    if getattr(app.state, "embedding_batcher", None):
+        logging.info(f"Embedding batcher stats at shutdown: {app.state.embedding_batcher.stats()}")
+        app.state.embedding_batcher.close()
+
     logging.info("Application shutdown.")
 
 
@@ -315,6 +321,14 @@ async def get_image(filename: str):
         return Response("Image not found", status_code=404)
 
 
+# Metrics endpoint (query-embedding batch sizes and queue wait times)
+@rt("/metrics")
+async def metrics(request: Request):
+    batcher = getattr(request.app.state, "embedding_batcher", None)
+    payload = {"embedding_batcher": batcher.stats() if batcher else None}
+    return Response(json.dumps(payload), media_type="application/json")
+
+
 @rt("/")
 async def get(request: Request):
     return Titled(
@@ -0,0 +1,24 @@
+# --- START OF FILE shared_constants.py ---
+"""
+Constants shared by the ingestion scripts in the repo root and the chatbot.
+
+Only this directory is deployed, so the values live here. chat_engine.py
+imports this module directly. The root modules (offline_providers.py and
+context_cache.py) import it as matrix_chatbot.shared_constants and re-export
+the values, so the indexing and serving sides can't drift apart.
+"""
+
+# Offline provider stand-ins (offline_providers.py): base URL variable and the
+# dummy key sent in place of real OpenAI / Cohere / LlamaCloud keys
+OFFLINE_PROVIDER_ENV = "OFFLINE_PROVIDER_URL"
+OFFLINE_API_KEY = "offline-provider-key"
+
+# Node context fields written by metadata.py (see context_cache.py). The context
+# is joined onto the text with CONTEXT_SEPARATOR only when a node is indexed.
+CONTEXT_SEPARATOR = "\n\nContext: "
+CONTEXT_FIELD = "context"
+CONTEXT_VERSION_FIELD = "context_version"
+# Contexts starting with these are error messages from failed generations
+FAILED_CONTEXT_PREFIXES = ("Error generating context", "Failed to generate context")
+
+# --- END OF FILE shared_constants.py ---
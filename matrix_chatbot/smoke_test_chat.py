@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Smoke test: one async (streaming) chat turn against a local Qdrant.
+
+Builds a throwaway Qdrant collection, node pickle and SQLite FTS DB from a
+few sample nodes in a temporary directory. It then initializes the chat
+engine exactly as main.py does and streams one astream_chat turn, which goes
+through HybridRetrieverWithReranking._aretrieve.
+OpenAI and Cohere calls go to offline_providers.py (repo root), so no keys
+or network are needed. Exits non-zero if the turn reports an error, streams
+no content or returns no source nodes, or if reranking did not run against
+the stand-in (the retriever falls back to the fused order when it fails).
+
+Requires:
+    The chat app's requirements (matrix_chatbot/requirements.txt).
+
+Usage:
+    python matrix_chatbot/smoke_test_chat.py
+    python matrix_chatbot/smoke_test_chat.py --query "What is the wavelength of the Matrix 532?" --keep
+"""
+
+import os
+import sys
+import shutil
+import uuid
+import pickle
+import asyncio
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(APP_DIR))
+sys.path.insert(1, str(APP_DIR.parent))  # offline_providers.py
+
+from offline_providers import ProviderConfig, fake_embedding, start_offline_providers
+
+SAMPLE_TEXTS = [
+    "The Matrix 532 is a diode-pumped solid-state laser emitting at 532 nm with up to 2 W output power.",
+    "The Matrix 355 delivers 355 nm UV output for micromachining, with pulse repetition rates up to 300 kHz.",
+    "All Matrix lasers are air cooled and controlled over RS-232 or Ethernet.",
+]
+
+
+def build_fixture(workdir: Path, embed_dim: int, collection: str):
+    """Writes matrix_nodes.pkl and a Qdrant collection of SAMPLE_TEXTS into workdir."""
+    from llama_index.core.schema import TextNode
+    from llama_index.vector_stores.qdrant import QdrantVectorStore
+    from qdrant_client import QdrantClient
+
+    nodes = []
+    for i, text in enumerate(SAMPLE_TEXTS):
+        node_id = str(uuid.uuid5(uuid.NAMESPACE_URL, f"smoke-node-{i}"))  # Qdrant point ids must be UUIDs
+        node = TextNode(text=text, id_=node_id, metadata={"file_name": "smoke_test.pdf"})
+        node.embedding = fake_embedding(text, dim=embed_dim)
+        nodes.append(node)
+    with open(workdir / "matrix_nodes.pkl", "wb") as f:
+        pickle.dump(nodes, f)
+
+    client = QdrantClient(path=str(workdir / "qdrant_db"))
+    QdrantVectorStore(client=client, collection_name=collection).add(nodes)
+    client.close()  # A local Qdrant path can only be opened by one client
+
+
+class CheckedReranker:
+    """Records reranker exceptions, which the retriever's _rerank swallows."""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.top_n = inner.top_n
+        self.failures = []
+
+    def postprocess_nodes(self, nodes, query_bundle):
+        try:
+            return self.inner.postprocess_nodes(nodes, query_bundle)
+        except Exception as e:
+            self.failures.append(str(e))
+            raise
+
+
+def rerank_requests(server) -> int:
+    return sum(server.request_counts[path] for path in ("/v1/rerank", "/v2/rerank"))
+
+
+async def run_turn(query: str, server) -> int:
+    import chat_engine
+
+    components = chat_engine.init_chat_engine()
+    content, sources, error = "", [], None
+    retriever = components["retriever"]
+    reranker = None
+    if retriever.reranker is not None:
+        reranker = retriever.reranker = CheckedReranker(retriever.reranker)
+    reranks_before = rerank_requests(server)
+    try:
+        response_stream = await components["chat_engine"].astream_chat(query)
+        async for chunk in response_stream.async_response_gen():
+            content += chunk
+        sources = response_stream.source_nodes
+    except Exception as e:
+        logging.error(f"Async chat turn failed: {e}", exc_info=True)
+        error = str(e)
+
+    print("\n--- Chat Smoke Test Summary ---")
+    print(f"Query: {query}")
+    print(f"Streamed characters: {len(content)}")
+    print(f"Source nodes: {len(sources)}")
+    reranks = rerank_requests(server) - reranks_before
+    print(f"Rerank requests to the stand-in: {reranks}")
+    if reranker is None:
+        print("Rerank errors: reranker not initialized")
+    else:
+        print(f"Rerank errors: {'; '.join(reranker.failures) or 'none'}")
+    print(f"Error: {error or 'none'}")
+    reranked = reranker is not None and not reranker.failures and reranks > 0
+    return 0 if content and sources and reranked and error is None else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Run one async chat turn against a throwaway local Qdrant and offline providers.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--query", default="Which Matrix laser emits at 532 nm?", help="Chat message to send.")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary directory for inspection.")
+    args = parser.parse_args()
+
+    server, base_url = start_offline_providers(ProviderConfig())
+    # chat_engine reads these at import time, and resolves its DB paths relative to the cwd
+    os.environ["OFFLINE_PROVIDER_URL"] = base_url
+    os.environ.pop("PLASH_PRODUCTION", None)
+    for key in ("LANGFUSE_SECRET_KEY", "LANGFUSE_PUBLIC_KEY"):
+        os.environ.pop(key, None)
+    workdir = Path(tempfile.mkdtemp(prefix="chat_smoke_"))
+    cwd = os.getcwd()
+    try:
+        from chat_engine import EMBED_DIM, QDRANT_COLLECTION_NAME
+
+        build_fixture(workdir, EMBED_DIM, QDRANT_COLLECTION_NAME)
+        os.chdir(workdir)
+        exit_code = asyncio.run(run_turn(args.query, server))
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(exit_code)
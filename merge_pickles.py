@@ -9,7 +9,9 @@ BaseNode objects (like TextNode). Merges objects of the same type into
 separate lists.
 
 Saves the merged lists to output files based on the provided base output
-filename, appending '_documents.pkl' or '_nodes.pkl' accordingly.
+filename, appending '_documents.pkl' or '_nodes.pkl' accordingly. A base
+filename ending in .nodes writes node stores instead ('_documents.nodes',
+'_nodes.nodes', see node_store.py).
 
 Requires:
 - Input pickle files containing lists of LlamaIndex Document or Node objects.
@@ -28,21 +30,55 @@ Basic Example:
 
    python merge_pickles.py --input_dir ./pickle_outputs --output_base_filename ./merged_data.pkl
 
+   Use --output_base_filename ./merged_data.nodes to write node stores instead.
+
+2. Merge dozens of large runs without holding them all in memory: load the
+   pickles in a process pool, drop objects already seen (same node_id or same
+   content), and stream the result into sharded, manifest-based outputs
+   (the parse scripts' .parts format, see parse_shards.py):
+
+   python merge_pickles.py -i ./pickle_outputs -o ./merged_data.pkl --stream --workers 8
+
+   This writes ./merged_data_documents.pkl.parts/ and/or ./merged_data_nodes.pkl.parts/.
+   Feed merged Documents to metadata.py with
+   --input ./merged_data_documents.pkl --input_parts, or add --consolidate to
+   also write the single pickles.
+
 Command Line Arguments:
 -----------------------
 --input_dir (-i) : Input directory containing .pkl files (searches recursively).
                    (Required)
 --output_base_filename (-o): Base path and filename for the merged output files.
                              Suffixes '_documents.pkl' and '_nodes.pkl' will be
-                             appended automatically based on the data found.
+                             appended automatically based on the data found
+                             ('_documents.nodes' / '_nodes.nodes' node stores
+                             if it ends in .nodes).
                              (Required)
+--stream         : Parallel, deduplicating merge into sharded outputs. Workers
+                   send back only (node_id, content hash) keys and write the
+                   kept objects to the shards themselves, so peak memory is
+                   about --workers x the largest input pickle.
+--workers        : Processes loading input pickles in --stream mode
+                   (default: CPU count).
+--shard_size     : Objects per output shard in --stream mode.
+--consolidate    : In --stream mode, also write the single merged pickles.
 """
 
+import io
 import os
+import json
+import time
 import pickle
+import hashlib
 import argparse
+import contextlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Any, Optional, Tuple, Type
+from typing import Dict, List, Any, Optional, Tuple, Type
+
+from node_store import STORE_SUFFIX, is_node_store, save_nodes
+from parse_shards import ShardedDocWriter, parts_dir_for, write_shard
 
 # Import Document and Node types for verification
 # Make it optional
@@ -163,22 +199,26 @@ def load_and_verify_pickle(file_path: Path) -> Optional[Tuple[List[Any], Type]]:
         return None
 
 
+def merged_output_path(output_base_path: Path, suffix: str) -> Path:
+    """<base>_<suffix>.pkl, or <base>_<suffix>.nodes when the base is a node store path."""
+    extension = STORE_SUFFIX if is_node_store(str(output_base_path)) else ".pkl"
+    return output_base_path.with_name(f"{output_base_path.stem}_{suffix}{extension}")
+
+
 def save_merged_list(data_list: List[Any], output_base_path: Path, suffix: str):
-    """Saves a list to a pickle file with a specific suffix."""
+    """Saves a list to a pickle file (or node store) with a specific suffix."""
     if not data_list:
         print(f"Skipping save for '{suffix}' (no data).")
         return
 
     # Construct the final output path
-    output_path = output_base_path.with_name(f"{output_base_path.stem}_{suffix}.pkl")
+    output_path = merged_output_path(output_base_path, suffix)
 
     print(
         f"\nAttempting to save {suffix} data ({len(data_list)} items) to: {output_path.resolve()}"
     )
     try:
-        output_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(output_path, "wb") as f:
-            pickle.dump(data_list, f)
+        save_nodes(data_list, str(output_path))
         print(f"Successfully saved {len(data_list)} {suffix} items to {output_path}")
     except Exception as e:
         print(f"ERROR: Failed to save output file '{output_path}': {e}")
@@ -270,6 +310,204 @@ def main(input_dir: str, output_base_filename: str):
         print("\nNo valid Document or Node data found to save.")
 
 
+DEFAULT_SHARD_SIZE = 5_000
+
+
+def content_hash(item: Any) -> str:
+    """sha256 of an object's text and metadata (identical objects from overlapping runs)."""
+    metadata = json.dumps(getattr(item, "metadata", None) or {}, sort_keys=True, default=str)
+    payload = f"{type(item).__name__}\0{getattr(item, 'text', '')}\0{metadata}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def merge_keys(file_path: Path) -> Tuple[str, bool, Optional[str], List[Tuple[str, str]]]:
+    """
+    Loads and verifies one pickle in a worker process. Returns the verification
+    message, whether it loaded, the kind ("documents", "nodes", or None for
+    empty lists), and the (node_id, content hash) key of each object. The
+    objects themselves stay in the worker.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        load_result = load_and_verify_pickle(file_path)
+    message = output.getvalue().strip()
+    if load_result is None:
+        return message, False, None, []
+    loaded_data, detected_type = load_result
+    if detected_type == DOCUMENT_TYPE:
+        kind = "documents"
+    elif detected_type == NODE_TYPE:
+        kind = "nodes"
+    else:
+        return message, True, None, []
+    return message, True, kind, [(item.node_id, content_hash(item)) for item in loaded_data]
+
+
+def write_kept(file_path: Path, parts_dir: Path, shards: List[Tuple[str, List[int]]]) -> List[str]:
+    """
+    Reloads one pickle in a worker process and writes the kept objects (by
+    index) to the given shards of parts_dir. Returns the shard file names.
+    """
+    with open(file_path, "rb") as f:
+        loaded_data = pickle.load(f)
+    return [
+        write_shard(parts_dir, shard_fname, [loaded_data[index] for index in indices])
+        for shard_fname, indices in shards
+    ]
+
+
+class MergedShardWriter:
+    """Assigns the kept objects of one kind to output shards of at most shard_size objects."""
+
+    def __init__(self, output_file: Path, shard_size: int):
+        self.output_file = output_file
+        self.shard_size = shard_size
+        self.writer = ShardedDocWriter(str(output_file), restart=True)
+        self.shards: List[Path] = []
+        self.items = 0
+
+    def plan(self, indices: List[int], hashes: List[str]) -> List[Tuple[Path, List[int], str]]:
+        """Splits one input file's kept objects into (shard name, indices, digest) chunks."""
+        planned = []
+        for start in range(0, len(indices), self.shard_size):
+            shard_fname = self.writer.parts_dir / f"merged-{len(self.shards):05d}"
+            digest = hashlib.sha256("".join(hashes[start : start + self.shard_size]).encode("utf-8")).hexdigest()
+            planned.append((shard_fname, indices[start : start + self.shard_size], digest))
+            self.shards.append(shard_fname)
+        return planned
+
+    def record(self, planned: List[Tuple[Path, List[int], str]], shard_names: List[str]):
+        """Adds shards written by write_kept to the manifest."""
+        for (shard_fname, indices, digest), shard_name in zip(planned, shard_names):
+            self.writer.record(shard_fname, shard_name, len(indices), digest)
+            self.items += len(indices)
+
+
+def stream_merge(
+    input_dir: str,
+    output_base_filename: str,
+    max_workers: Optional[int] = None,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    consolidate: bool = False,
+) -> Dict[str, Any]:
+    """
+    Merges the pickles under input_dir into sharded outputs, dropping objects
+    whose node_id or content hash was already seen. A process pool loads each
+    file and returns only its objects' keys; the keys are consumed in sorted
+    file order, so the first occurrence wins and the output is deterministic.
+    The kept objects of a file are then written to its output shards by a
+    second pool task that reloads the file, so no objects pass through the
+    parent. The parent holds the ids and hashes of kept objects; each worker
+    holds one input file at a time, so peak memory is about
+    workers x the largest input file.
+    """
+    pickle_files = find_pickle_files(input_dir)
+    if not pickle_files:
+        print("Exiting.")
+        return {}
+    if not LLAMAINDEX_INSTALLED:
+        print("ERROR: --stream needs llama-index-core to tell Documents from Nodes.")
+        return {}
+
+    max_workers = max_workers or os.cpu_count() or 1
+    output_base_path = Path(output_base_filename)
+    writers: Dict[str, MergedShardWriter] = {}
+    seen_ids: Dict[str, set] = {"documents": set(), "nodes": set()}
+    seen_hashes: Dict[str, set] = {"documents": set(), "nodes": set()}
+    stats = {
+        "files": len(pickle_files),
+        "loaded": 0,
+        "skipped": 0,
+        "input_bytes": 0,
+        "objects_in": 0,
+        "duplicate_ids": 0,
+        "duplicate_content": 0,
+    }
+
+    def consume(file_path, result):
+        """Dedupes one file's keys; returns its shard write task, if anything was kept."""
+        message, loaded, kind, keys = result
+        print(message)
+        stats["loaded" if loaded else "skipped"] += 1
+        if kind is None:
+            return None
+        stats["objects_in"] += len(keys)
+        if kind not in writers:
+            output_file = merged_output_path(output_base_path, kind)
+            writers[kind] = MergedShardWriter(output_file, shard_size)
+        kept_indices, kept_hashes = [], []
+        for index, (node_id, digest) in enumerate(keys):
+            if node_id in seen_ids[kind]:
+                stats["duplicate_ids"] += 1
+                continue
+            if digest in seen_hashes[kind]:
+                stats["duplicate_content"] += 1
+                continue
+            seen_ids[kind].add(node_id)
+            seen_hashes[kind].add(digest)
+            kept_indices.append(index)
+            kept_hashes.append(digest)
+        if not kept_indices:
+            return None
+        planned = writers[kind].plan(kept_indices, kept_hashes)
+        shards = [(shard_fname, indices) for shard_fname, indices, _ in planned]
+        return writers[kind], planned, pool.submit(write_kept, file_path, writers[kind].writer.parts_dir, shards)
+
+    print(f"\n--- Starting Streaming Merge ({max_workers} workers, {shard_size} objects per shard) ---")
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        # Bounded queues of key loads and shard writes; both are drained in input order
+        key_loads, shard_writes = deque(), deque()
+
+        def drain(limit):
+            while key_loads and len(key_loads) >= limit:
+                file_path, future = key_loads.popleft()
+                task = consume(file_path, future.result())
+                if task:
+                    shard_writes.append(task)
+            while shard_writes and len(shard_writes) >= limit:
+                writer, planned, future = shard_writes.popleft()
+                writer.record(planned, future.result())
+
+        for file_path in pickle_files:
+            stats["input_bytes"] += file_path.stat().st_size
+            key_loads.append((file_path, pool.submit(merge_keys, file_path)))
+            drain(max_workers)
+        drain(1)
+    elapsed = time.monotonic() - started
+
+    kept = {kind: writer.items for kind, writer in writers.items()}
+    stats.update(
+        {
+            "kept": kept,
+            "seconds": round(elapsed, 2),
+            "files_per_second": round(len(pickle_files) / elapsed, 2) if elapsed else None,
+            "objects_per_second": round(stats["objects_in"] / elapsed, 1) if elapsed else None,
+            "input_mb_per_second": round(stats["input_bytes"] / 1e6 / elapsed, 2) if elapsed else None,
+            "outputs": {kind: str(parts_dir_for(w.output_file)) for kind, w in writers.items()},
+        }
+    )
+
+    print("\n--- Streaming Merge Summary ---")
+    print(f"Files: {stats['files']} found, {stats['loaded']} loaded, {stats['skipped']} skipped")
+    print(f"Objects read: {stats['objects_in']}")
+    print(f"Duplicates dropped: {stats['duplicate_ids']} by node_id, {stats['duplicate_content']} by content hash")
+    for kind, writer in writers.items():
+        print(f"Kept {writer.items} {kind} in {len(writer.shards)} shard(s): {parts_dir_for(writer.output_file)}")
+    print(
+        f"Throughput: {stats['files_per_second']} files/s, {stats['objects_per_second']} objects/s, "
+        f"{stats['input_mb_per_second']} MB/s of input ({elapsed:.2f}s)"
+    )
+
+    for kind, writer in writers.items():
+        (writer.writer.parts_dir / "merge_stats.json").write_text(json.dumps(stats, indent=2))
+        if consolidate:
+            writer.writer.consolidate(writer.shards)
+    if not writers:
+        print("\nNo valid Document or Node data found to save.")
+    return stats
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Merge multiple pickle files containing lists of LlamaIndex Documents and/or Nodes into separate outputs.",
@@ -287,16 +525,45 @@ if __name__ == "__main__":
         "--output_base_filename",
         required=True,
         type=str,
-        help="Base path and filename for the merged output files. Suffixes '_documents.pkl' and '_nodes.pkl' will be added.",
+        help="Base path and filename for the merged output files. Suffixes '_documents.pkl' and '_nodes.pkl' will be added "
+        "('_documents.nodes' / '_nodes.nodes' node stores if it ends in .nodes).",
+    )
+
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Load inputs in a process pool, drop duplicate node_ids/contents, and write sharded outputs. "
+        "Each worker holds one input pickle at a time: peak memory is about --workers x the largest input.",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Processes for --stream (default: CPU count)."
+    )
+    parser.add_argument(
+        "--shard_size", type=int, default=DEFAULT_SHARD_SIZE, help="Objects per output shard in --stream mode."
+    )
+    parser.add_argument(
+        "--consolidate",
+        action="store_true",
+        help="With --stream, also write the single merged pickles or, for .nodes outputs, node stores "
+        "(both streamed shard by shard).",
     )
 
     args = parser.parse_args()
 
     # Basic check on output filename format
-    if not args.output_base_filename.endswith(".pkl"):
+    if not args.output_base_filename.endswith((".pkl", STORE_SUFFIX)):
         print(
-            "Warning: Output base filename does not end with .pkl. Suffixes will be added anyway."
+            "Warning: Output base filename does not end with .pkl or .nodes. Suffixes will be added anyway."
         )
         # Optionally, force .pkl or modify the suffix addition logic
 
-    main(args.input_dir, args.output_base_filename)
+    if args.stream:
+        stream_merge(
+            args.input_dir,
+            args.output_base_filename,
+            max_workers=args.workers,
+            shard_size=args.shard_size,
+            consolidate=args.consolidate,
+        )
+    else:
+        main(args.input_dir, args.output_base_filename)
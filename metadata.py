@@ -5,19 +5,26 @@ to generate enhanced TextNode objects suitable for indexing in a RAG system.
 
 This script performs the following main steps:
 1. Loads Document objects from an input pickle file.
-2. Splits the loaded Documents into smaller TextNode objects using SentenceSplitter.
+2. Splits the loaded Documents into smaller TextNode objects with a
+   table-preserving Markdown chunker (or SentenceSplitter), streaming small batches of Documents through a pool of worker processes.
    (Metadata from the parent Document, including extracted 'pairs', is
    preserved in the resulting Nodes).
 3. For each TextNode, generates contextual keywords/phrases using an OpenAI LLM
-   (e.g., gpt-4o-mini or gpt-4o) via the OpenAI API.
-4. Appends the generated context string to the end of each Node's text content.
+   (e.g., gpt-4o-mini or gpt-4o) via the async OpenAI API, many requests at a
+   time within the account's RPM/TPM limits (see rate_limiter.py).
+4. Stores the generated context in each Node's metadata ("context", with its
+   "context_version") and in a SQLite cache keyed by chunk text, model and
+   prompt version, so re-runs only pay for new or changed chunks. The context
+   is joined onto the text only at indexing time (see context_cache.py).
 5. Saves the final list of enhanced TextNode objects to an output pickle file.
 
 Requires:
 - An input pickle file containing a list of LlamaIndex Document objects.
-- The OPENAI_API_KEY environment variable to be set.
+- The OPENAI_API_KEY environment variable to be set (or OFFLINE_PROVIDER_URL
+  pointing at offline_providers.py for network-free runs); not needed with
+  --backend local.
 - Installation of necessary libraries:
-  `pip install openai llama-index llama-index-llms-openai llama-index-embeddings-openai tqdm pydantic`
+  `pip install openai llama-index llama-index-llms-openai llama-index-embeddings-openai tqdm pydantic tiktoken`
 
 Usage:
 ------
@@ -32,21 +39,65 @@ Basic Examples:
 2. Process a specific input file and save to a specific output file:
    python metadata.py --input processed_step1.pkl --output final_nodes_for_indexing.pkl
 
+3. Re-enrich the whole corpus through the Batch API (half price, no rate limits):
+   python metadata.py --backend batch --no_reuse
+
 Command Line Arguments:
 -----------------------
 --input  : Path to the input pickle file containing Document objects
            (default: ./parsed_docs.pkl).
 --output : Path to save the output pickle file containing enhanced TextNode objects
            (default: ./enhanced_laser_nodes.pkl).
+           Either path may be a columnar node store instead of a pickle: paths
+           ending in .nodes are read and written with node_store.py.
+--input_parts : Stream Documents one input file at a time from the parse
+           scripts' <input>.parts shards instead of loading the whole pickle.
+--chunker : "markdown" (default) keeps Markdown tables with their headings and
+           splits oversize tables by row groups with the header repeated
+           (see markdown_chunker.py); "sentence" is the plain SentenceSplitter.
+--chunk_workers : Processes that split Documents into nodes (default: CPU count).
+--debug_raw_nodes : Also save the raw chunker output to this pickle.
+--previous : Enhanced nodes from an earlier run whose contexts are imported into
+           the context cache, including contexts older versions of this script
+           appended to the text (default: the --output file, if it exists).
+--context_cache : SQLite context cache (default: ./data/nodes/context_cache.sqlite).
+           Nodes whose text is unchanged (e.g. untouched pages of a revised
+           datasheet) reuse their cached context.
+--no_cache : Don't read or write the context cache.
+--resume : Continue an interrupted run. While contexts are generated, the
+           enriched nodes are snapshotted atomically to <output>.checkpoint
+           (every --checkpoint_every new contexts, default 500, or
+           --checkpoint_seconds, default 300, and on failure). With --resume,
+           nodes whose text hash has a context there are skipped, even if
+           chunking changed the node order, and even with --no_cache or
+           --no_reuse. The checkpoint is deleted once the output is saved.
+--no_reuse : Regenerate context for every node.
+--backend : "openai" (default) sends one request per chunk; "batch" runs all
+           chunks through the OpenAI Batch API (see batch_context.py); "local"
+           extracts keyphrases and pairs model/part numbers without any API
+           calls (see local_context.py).
+--local_workers : Processes for --backend local (default: CPU count).
+--batch_dir : Batch API shards, results and resume manifest
+           (default: ./data/batches/context). Re-running resumes unfinished batches.
+--batch_results : Read Batch API result files from a directory instead of
+           calling the API (offline testing).
+--batch_no_wait : Submit the batches and exit; re-run later to collect them.
+--batch_poll_seconds / --batch_shard_size : Poll interval (default: 60) and
+           requests per input file (default: 10000).
+--concurrency : Maximum context requests in flight (default: 16).
+--rpm / --tpm : Requests / tokens per minute allowed for the context model
+           (default: 500 / 200000, 0 = unlimited). Calls are spread to stay
+           within both; 429s pause all calls for the Retry-After period.
 """
 
 import os
 import re
 import time
 import json
-import pickle
 import asyncio
 import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
 import openai
@@ -56,216 +107,601 @@ from llama_index.core import Settings
 from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.core.schema import TextNode
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.ingestion import IngestionPipeline
 from pydantic import BaseModel, Field
 from typing import List
 
-# Set up OpenAI API key
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("OPENAI_API_KEY environment variable is not set")
-openai.api_key = OPENAI_API_KEY
+from offline_providers import OFFLINE_API_KEY, offline_provider_url
+from parse_shards import iter_part_docs, parts_dir_for
+from node_store import is_node_store, iter_nodes, load_nodes, save_nodes
+from context_cache import (
+    CONTEXT_FIELD,
+    CONTEXT_VERSION_FIELD,
+    ContextCache,
+    NodeCheckpoint,
+    attach_context,
+    context_version,
+    is_failed_context,
+    node_context,
+    split_context,
+    text_hash,
+)
+from local_context import KEYWORD_VERSION, local_contexts
+from markdown_chunker import MarkdownTableNodeParser
+from batch_context import DEFAULT_POLL_SECONDS, DEFAULT_SHARD_SIZE, run_batch_contexts
+from rate_limiter import (
+    TokenBucketLimiter,
+    backoff_delay,
+    estimate_tokens,
+    is_retryable,
+    retry_after_seconds,
+)
+
+
+def configure_openai():
+    """
+    Sets the OpenAI API key (and base URL when OFFLINE_PROVIDER_URL points at
+    the local stand-ins) and returns an AsyncOpenAI client using them. Called
+    from main rather than at import time so the module can be imported without
+    credentials.
+    """
+    offline_url = offline_provider_url()
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if offline_url:
+        logging.info(f"Using offline OpenAI stand-in at {offline_url}")
+        openai.base_url = f"{offline_url}/v1/"
+        api_key = api_key or OFFLINE_API_KEY
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    openai.api_key = api_key
+    # Retries are handled in generate_context, in step with the rate limiter
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=f"{offline_url}/v1/" if offline_url else None,
+        max_retries=0,
+        timeout=60.0,
+    )
 
 
 def load_docs_from_pickle(file_path):
+    """Loads Documents from a pickle or a node store (*.nodes, see node_store.py)."""
     logging.info(f"Loading documents from {file_path}")
-    with open(file_path, "rb") as f:
-        loaded_docs = pickle.load(f)
-        logging.info(f"Loaded {len(loaded_docs)} documents from {file_path}")
-        for i, doc in enumerate(loaded_docs, start=1):
-            logging.info(f"Document {i}: Length = {len(doc.text)}")
+    loaded_docs = load_nodes(file_path)
+    logging.info(f"Loaded {len(loaded_docs)} documents from {file_path}")
+    for i, doc in enumerate(loaded_docs, start=1):
+        logging.info(f"Document {i}: Length = {len(doc.text)}")
     return loaded_docs
 
 
 def save_nodes_to_pickle(nodes, file_path):
-    Path(file_path).parent.mkdir(parents=True, exist_ok=True)
-    with open(file_path, "wb") as f:
-        pickle.dump(nodes, f)
+    """Saves nodes atomically, as a node store when file_path ends in .nodes."""
+    save_nodes(nodes, file_path)
     logging.info(f"Successfully saved {len(nodes)} nodes to {file_path}")
     return file_path
 
 
-async def generate_context(node_text, max_retries=3):
+CONTEXT_MODEL = "gpt-4o-mini"
+CONTEXT_MAX_TOKENS = 150
+CONTEXT_SYSTEM_PROMPT = "You are a helpful assistant that generates concise context for document chunks."
+# Bump when build_context_prompt or CONTEXT_SYSTEM_PROMPT change, so cached
+# contexts made with the old prompt are regenerated
+PROMPT_VERSION = 1
+CONTEXT_VERSION = context_version(CONTEXT_MODEL, PROMPT_VERSION)
+# Contexts appended to node text by earlier versions of this script (same prompt and model)
+LEGACY_CONTEXT_VERSION = context_version("gpt-4o-mini", 1)
+CONTEXT_CACHE_FILE = "./data/nodes/context_cache.sqlite"
+CACHE_COMMIT_EVERY = 50
+BATCH_DIR = "./data/batches/context"
+LOCAL_CONTEXT_VERSION = context_version("local-keywords", KEYWORD_VERSION)
+PROGRESS_LOG_EVERY = 0.1  # Log progress / ETA every 10% of the nodes
+
+
+def build_context_prompt(node_text):
+    return f"""
+    Generate keywords and brief phrases describing the main topics, entities, and actions in this text.
+    Replace any pronouns with their specific referents.
+    Format as comma-separated phrases.
+    
+    TEXT:
+    {node_text[:1000]}  # Limit text length to avoid token issues
+    """
+
+
+def context_request_body(node_text):
+    """Chat completion parameters for one node; shared by the online and batch backends."""
+    return {
+        "model": CONTEXT_MODEL,
+        "messages": [
+            {"role": "system", "content": CONTEXT_SYSTEM_PROMPT},
+            {"role": "user", "content": build_context_prompt(node_text)},
+        ],
+        "max_tokens": CONTEXT_MAX_TOKENS,
+        "temperature": 0.2,
+    }
+
+
+async def generate_context(client, node_text, limiter, max_retries=5):
     """
-    Generate context for a node using direct OpenAI API.
+    Generate context for a node with the async OpenAI client.
 
     Args:
+        client: openai.AsyncOpenAI client (see configure_openai)
         node_text: Text content of the node
+        limiter: TokenBucketLimiter shared by all concurrent calls
         max_retries: Number of retries in case of API errors
 
     Returns:
         Generated context string
     """
-    prompt = f"""
-    Generate keywords and brief phrases describing the main topics, entities, and actions in this text.
-    Replace any pronouns with their specific referents.
-    Format as comma-separated phrases.
-    
-    TEXT:
-    {node_text[:1000]}  # Limit text length to avoid token issues
-    """
+    body = context_request_body(node_text)
+    prompt_text = "".join(message["content"] for message in body["messages"])
+    estimate = estimate_tokens(prompt_text) + CONTEXT_MAX_TOKENS
 
     for attempt in range(max_retries):
+        reserved = await limiter.acquire(estimate)
         try:
-            response = openai.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are a helpful assistant that generates concise context for document chunks.",
-                    },
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=150,
-                temperature=0.2,
-            )
+            response = await client.chat.completions.create(**body)
+            usage = getattr(response, "usage", None)
+            limiter.settle(reserved, getattr(usage, "total_tokens", None))
 
             # Extract the content from the response
-            context = response.choices[0].message.content.strip()
-            return context
+            return response.choices[0].message.content.strip()
 
         except Exception as e:
+            limiter.settle(reserved, 0)  # Rejected calls are not billed against TPM
             logging.error(f"Error on attempt {attempt + 1}/{max_retries}: {str(e)}")
-            if attempt < max_retries - 1:
-                time.sleep(2)  # Wait before retrying
+            if not is_retryable(e) or attempt == max_retries - 1:
+                break
+            delay = retry_after_seconds(e) or backoff_delay(attempt)
+            if getattr(e, "status_code", None) == 429:
+                limiter.throttled(delay)
+            await asyncio.sleep(delay)
 
     return "Failed to generate context after multiple attempts"
 
 
-async def enhance_all_nodes(nodes, batch_size=5, sleep_time=1):
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def recover_appended_contexts(nodes):
+    """
+    Restores the original text of nodes that had contexts appended to it
+    (older enhanced pickles, or nodes enhanced more than once), so contexts
+    are never stacked. The last appended context is kept as a legacy-version
+    context field.
     """
-    Enhance all nodes by appending context to the content.
+    recovered = 0
+    for node in nodes:
+        text, appended = split_context(node.text)
+        if appended is None:
+            continue
+        node.text = text
+        recovered += 1
+        if not is_failed_context(appended) and CONTEXT_FIELD not in node.metadata:
+            attach_context(node, appended, LEGACY_CONTEXT_VERSION)
+    if recovered:
+        logging.info(f"Removed appended contexts from the text of {recovered} nodes")
+    return recovered
+
+
+async def generate_contexts_online(client, texts, cache, concurrency, rpm, tpm, on_result=None):
+    """
+    Generates contexts for {text_hash: text} with concurrent chat completion
+    requests, caching them as they complete. Returns {text_hash: context};
+    failed generations are returned as their error message and not cached.
+    on_result(text_hash, context) is called as each request completes.
+    """
+    logging.info(
+        f"Generating {len(texts)} contexts online (concurrency {concurrency}, "
+        f"{rpm or 'unlimited'} RPM, {tpm or 'unlimited'} TPM)"
+    )
+    limiter = TokenBucketLimiter(rpm=rpm, tpm=tpm)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def enhance(h, text):
+        async with semaphore:
+            try:
+                return h, await generate_context(client, text, limiter)
+            except Exception as e:
+                logging.error(f"Error processing node text {h[:12]}: {str(e)}")
+                return h, f"Error generating context: {str(e)}"
+
+    started = time.monotonic()
+    log_every = max(1, int(len(texts) * PROGRESS_LOG_EVERY))
+    tasks = [asyncio.create_task(enhance(h, text)) for h, text in texts.items()]
+    generated = {}
+    to_cache = []
+    with tqdm(total=len(texts)) as progress:
+        for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            h, context = await task
+            generated[h] = context
+            if on_result is not None:
+                on_result(h, context)
+            if not is_failed_context(context):
+                to_cache.append((h, context))
+            if cache is not None and len(to_cache) >= CACHE_COMMIT_EVERY:
+                cache.put_many(to_cache, CONTEXT_VERSION)
+                to_cache = []
+            progress.update(1)
+            if done % log_every == 0 and done < len(texts):
+                elapsed = time.monotonic() - started
+                rate = done / elapsed
+                logging.info(
+                    f"Context {done}/{len(texts)} ({done / len(texts):.0%}), "
+                    f"{rate:.1f} nodes/s, ETA {format_duration((len(texts) - done) / rate)}"
+                )
+    if cache is not None and to_cache:
+        cache.put_many(to_cache, CONTEXT_VERSION)
+
+    elapsed = time.monotonic() - started
+    stats = limiter.summary()
+    logging.info(
+        f"Generated {len(texts)} contexts in {format_duration(elapsed)} "
+        f"({len(texts) / max(elapsed, 1e-9):.1f} nodes/s, {stats['requests']} requests, "
+        f"{stats['tokens_used']} tokens, {stats['throttled']} throttled, "
+        f"{stats['wait_seconds']:.1f}s waiting on rate limits)"
+    )
+    return generated
+
+
+async def generate_contexts_batch(
+    client,
+    texts,
+    cache,
+    batch_dir=BATCH_DIR,
+    results_dir=None,
+    wait=True,
+    poll_seconds=DEFAULT_POLL_SECONDS,
+    shard_size=DEFAULT_SHARD_SIZE,
+):
+    """
+    Generates contexts for {text_hash: text} through the OpenAI Batch API
+    (see batch_context.py), with the text hash as custom_id, and caches them.
+    Returns {text_hash: context} for the requests that have finished.
+    """
+    requests = {h: context_request_body(text) for h, text in texts.items()}
+    generated = await run_batch_contexts(
+        client,
+        requests,
+        batch_dir,
+        CONTEXT_VERSION,
+        shard_size=shard_size,
+        poll_seconds=poll_seconds,
+        wait=wait,
+        results_dir=results_dir,
+    )
+    if cache is not None:
+        cache.put_many(list(generated.items()), CONTEXT_VERSION)
+    return generated
+
+
+def enhance_nodes_locally(nodes, max_workers=None):
+    """
+    Enhance all nodes with keyword contexts extracted locally (TF-IDF weighted
+    keyphrases plus model names / part numbers from 'pairs'; see
+    local_context.py). No API calls. The contexts depend on the whole corpus,
+    so they are always recomputed rather than cached.
+    """
+    logging.info(f"Enhancing {len(nodes)} nodes with local keywords ({LOCAL_CONTEXT_VERSION})...")
+    contexts = local_contexts(
+        [node.text for node in nodes],
+        [node.metadata.get("pairs") for node in nodes],
+        max_workers=max_workers,
+    )
+    successful = 0
+    for node, context in zip(nodes, contexts):
+        if context:
+            attach_context(node, context, LOCAL_CONTEXT_VERSION)
+            successful += 1
+    logging.info(f"Successfully enhanced {successful}/{len(nodes)} nodes")
+    return nodes
+
+
+async def enhance_all_nodes(
+    nodes,
+    client,
+    cache=None,
+    concurrency=16,
+    rpm=500,
+    tpm=200_000,
+    reuse=True,
+    backend="openai",
+    batch_options=None,
+    local_options=None,
+    checkpoint=None,
+    resume=False,
+):
+    """
+    Enhance all nodes with context, stored in node.metadata["context"] (see
+    context_cache.py); the text itself is left unchanged until indexing.
+
+    Contexts of the current version already on a node, or in the cache for the
+    node's text, are reused. The rest are generated once per distinct text,
+    either with concurrent requests (at most `concurrency` in flight, within
+    the rpm/tpm budgets) or through the Batch API, then cached and written back
+    in node order.
+
+    With a NodeCheckpoint, the nodes enriched so far are snapshotted while
+    contexts are generated, and once more if the run fails or is interrupted.
+    With resume, contexts from the last snapshot are reused by text hash.
 
     Args:
         nodes: List of nodes to process
-        batch_size: Number of nodes to process before sleeping
-        sleep_time: Time to sleep between batches to avoid rate limits
+        client: openai.AsyncOpenAI client
+        cache: ContextCache to read and write, or None
+        concurrency: Maximum number of requests in flight
+        rpm: Requests per minute allowed for the context model (0 = unlimited)
+        tpm: Tokens per minute allowed for the context model (0 = unlimited)
+        reuse: Use existing contexts from the nodes and the cache
+        backend: "openai" (interactive requests), "batch" (Batch API) or
+            "local" (API-free keywords, see enhance_nodes_locally)
+        batch_options: Keyword arguments for generate_contexts_batch
+        local_options: Keyword arguments for enhance_nodes_locally
+        checkpoint: NodeCheckpoint to write snapshots to, or None
+        resume: Reuse the contexts in the checkpoint
 
     Returns:
         The enhanced nodes list
     """
-    logging.info(f"Enhancing {len(nodes)} nodes with context...")
-
-    # Create a progress bar with standard tqdm
-    for i, node in enumerate(tqdm(nodes)):
-        try:
-            # Check if context already exists in metadata
-            if "context" in node.metadata:
-                # Use existing context from metadata
-                context = node.metadata["context"]
-                # Remove it from metadata
-                del node.metadata["context"]
-            else:
-                # Generate new context
-                context = await generate_context(node.text)
-
-            # Append context to the content with a separator
-            node.text = f"{node.text}\n\nContext: {context}"
-
-            # Sleep after each batch to avoid rate limits
-            if (i + 1) % batch_size == 0:
-                time.sleep(sleep_time)
+    recover_appended_contexts(nodes)
+    if backend == "local":
+        return enhance_nodes_locally(nodes, **(local_options or {}))
+    logging.info(f"Enhancing {len(nodes)} nodes with context ({CONTEXT_VERSION})...")
+
+    hashes = [text_hash(node.text) for node in nodes]
+    contexts = [node_context(node, CONTEXT_VERSION) if reuse else None for node in nodes]
+    on_nodes = sum(1 for context in contexts if context is not None)
+    cached = {}
+    if cache is not None and reuse:
+        cached = cache.get_many(
+            [h for h, context in zip(hashes, contexts) if context is None], CONTEXT_VERSION
+        )
+    checkpointed = checkpoint.load() if checkpoint is not None and resume else {}
+    from_cache = from_checkpoint = 0
+    pending = {}  # text hash -> indexes of the nodes with that text
+    for i, h in enumerate(hashes):
+        if contexts[i] is not None:
+            continue
+        if h in checkpointed:
+            contexts[i] = checkpointed[h]
+            from_checkpoint += 1
+        elif h in cached:
+            contexts[i] = cached[h]
+            from_cache += 1
+        else:
+            pending.setdefault(h, []).append(i)
+    logging.info(
+        f"Context: {on_nodes} already on nodes, {from_cache} from cache, "
+        f"{from_checkpoint} from checkpoint, {len(pending)} to generate ({backend})"
+    )
 
-        except Exception as e:
-            logging.error(f"Error processing node {i}: {str(e)}")
-            # Add a placeholder context
-            node.text = f"{node.text}\n\nContext: Error generating context: {str(e)}"
-            # Make sure we don't have context in metadata
-            if "context" in node.metadata:
-                del node.metadata["context"]
-            time.sleep(sleep_time)  # Sleep after an error
+    # Contexts known up front go onto the nodes now, so snapshots include them;
+    # failed nodes keep whatever they had
+    for node, context in zip(nodes, contexts):
+        if context is not None:
+            attach_context(node, context, CONTEXT_VERSION)
+
+    def enriched_nodes():
+        return [node for node in nodes if node_context(node, CONTEXT_VERSION) is not None]
+
+    def record(h, context, snapshot=True):
+        if is_failed_context(context):
+            return
+        for i in pending[h]:
+            attach_context(nodes[i], context, CONTEXT_VERSION)
+        if checkpoint is not None:
+            checkpoint.completed(len(pending[h]))
+            if snapshot and checkpoint.due():
+                checkpoint.save(enriched_nodes())
+
+    texts = {h: nodes[indexes[0]].text for h, indexes in pending.items()}
+    try:
+        if not texts:
+            generated = {}
+        elif backend == "batch":
+            generated = await generate_contexts_batch(client, texts, cache, **(batch_options or {}))
+            for h, context in generated.items():
+                record(h, context, snapshot=False)
+        else:
+            generated = await generate_contexts_online(
+                client, texts, cache, concurrency, rpm, tpm, on_result=record
+            )
+    finally:
+        if checkpoint is not None and checkpoint.unsaved:
+            checkpoint.save(enriched_nodes())
+    failed = sum(1 for h in pending if is_failed_context(generated.get(h)))
 
     # Count successful enhancements
-    successful = sum(
-        1
-        for node in nodes
-        if "\n\nContext: " in node.text and not "Error generating context" in node.text
+    successful = sum(1 for node in nodes if node_context(node, CONTEXT_VERSION) is not None)
+    logging.info(
+        f"Successfully enhanced {successful}/{len(nodes)} nodes "
+        f"({failed} failed or still pending)"
     )
-    logging.info(f"Successfully enhanced {successful}/{len(nodes)} nodes")
 
     return nodes
 
 
-async def create_origin_nodes(input_file_path):
+def import_previous_contexts(file_path, cache):
+    """
+    Adds the contexts of an earlier run's enhanced nodes pickle to the cache,
+    under the version they were generated with (contexts appended to the text
+    by older versions of this script count as LEGACY_CONTEXT_VERSION).
+    """
+    previous_nodes = load_nodes(file_path, with_embeddings=False)
+    by_version = {}
+    for node in previous_nodes:
+        text, appended = split_context(node.text)
+        metadata = getattr(node, "metadata", None) or {}
+        context = node_context(node) or appended
+        version = metadata.get(CONTEXT_VERSION_FIELD) or LEGACY_CONTEXT_VERSION
+        if not is_failed_context(context):
+            by_version.setdefault(version, []).append((text_hash(text), context))
+    imported = sum(cache.put_many(items, version) for version, items in by_version.items())
+    logging.info(f"Imported {imported} contexts from {file_path} into the context cache")
+    return imported
+
+
+CHUNK_SIZE = 2048
+CHUNK_OVERLAP = 128
+CHUNK_BATCH_DOCS = 8  # Documents per chunking task
+CHUNKERS = ("markdown", "sentence")
+_worker_splitter = None
+
+
+def make_node_parser(chunker="markdown", chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP):
     """
-    Create origin nodes from the input pickle file using the ingestion pipeline.
+    "markdown" keeps Markdown tables with their headings and splits oversize
+    tables by row groups (see markdown_chunker.py); "sentence" is the plain
+    SentenceSplitter.
+    """
+    if chunker == "markdown":
+        return MarkdownTableNodeParser(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
-    Args:
-        input_file_path: Path to the input pickle file
 
-    Returns:
-        List of processed nodes
+def _init_chunk_worker(chunker, chunk_size, chunk_overlap):
+    global _worker_splitter
+    _worker_splitter = make_node_parser(chunker, chunk_size, chunk_overlap)
+
+
+def chunk_documents(docs):
+    """Splits a batch of Documents into nodes (runs in a chunking worker)."""
+    return _worker_splitter.get_nodes_from_documents(docs)
+
+
+def iter_documents(input_file_path, from_parts=False):
+    """
+    Yields the input Documents one at a time. With from_parts, they are read
+    shard by shard from the parse scripts' <input>.parts directory, so only one
+    input file's Documents are in memory. Otherwise the pickle is loaded once
+    and each Document is released as soon as it has been handed on.
+    """
+    if from_parts:
+        logging.info(f"Streaming documents from {parts_dir_for(input_file_path)}")
+        yield from iter_part_docs(input_file_path)
+        return
+    if is_node_store(input_file_path):
+        logging.info(f"Streaming documents from node store {input_file_path}")
+        yield from iter_nodes(input_file_path, with_embeddings=False)
+        return
+    docs = load_docs_from_pickle(input_file_path)
+    docs.reverse()
+    while docs:
+        yield docs.pop()
+
+
+def iter_doc_batches(docs, batch_size=CHUNK_BATCH_DOCS):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def chunk_documents_parallel(
+    docs, max_workers=None, chunker="markdown", chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP
+):
+    """
+    Splits a stream of Documents into nodes across a process pool, keeping
+    node order. Only about two batches per worker are in flight at a time, so
+    the Documents waiting to be chunked never pile up in the parent.
     """
+    max_workers = max_workers or os.cpu_count() or 1
+    batches = iter_doc_batches(docs)
+    nodes = []
+    if max_workers == 1:
+        _init_chunk_worker(chunker, chunk_size, chunk_overlap)
+        for batch in batches:
+            nodes.extend(chunk_documents(batch))
+        return nodes
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_chunk_worker,
+        initargs=(chunker, chunk_size, chunk_overlap),
+    ) as pool:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(pool.submit(chunk_documents, batch))
+            if len(in_flight) >= 2 * max_workers:
+                nodes.extend(in_flight.popleft().result())
+        while in_flight:
+            nodes.extend(in_flight.popleft().result())
+    return nodes
 
-    logging.info(f"Loading documents from {input_file_path}")
-    loaded_docs = load_docs_from_pickle(input_file_path)
 
-    logging.info("Initializing MarkdownElementNodeParser...")
+async def create_origin_nodes(
+    input_file_path, max_workers=None, from_parts=False, debug_output=None, chunker="markdown"
+):
+    """
+    Create origin nodes from the input Documents, chunked in parallel worker
+    processes.
 
-    # Load documents
-    loaded_docs = load_docs_from_pickle(input_file_path)
+    Args:
+        input_file_path: Path to the input pickle file
+        max_workers: Chunking processes (default: CPU count, 1 = in process)
+        from_parts: Stream Documents from <input_file_path>.parts instead of the pickle
+        debug_output: Optional pickle path for the raw chunker output
+        chunker: "markdown" (table-preserving) or "sentence" (SentenceSplitter)
 
-    node_parser = SentenceSplitter(chunk_size=2048, chunk_overlap=128)
-    # Create ingestion pipeline (without program_extractor since pairs are now handled by LlamaParse)
-    pipeline = IngestionPipeline(transformations=[node_parser])
+    Returns:
+        List of processed nodes
 
-    # Run the pipeline with error handling
-    logging.info("Running ingestion pipeline to create origin nodes...")
+    Raises:
+        ValueError: If no nodes were created, so an empty output is never saved
+    """
+    logging.info(
+        f"Chunking documents with the {chunker} chunker (chunk_size={CHUNK_SIZE}, overlap={CHUNK_OVERLAP}, "
+        f"workers={max_workers or os.cpu_count()})..."
+    )
+    started = time.monotonic()
     try:
-        # Print document info for debugging
-        if loaded_docs:
-            logging.info(f"\nProcessing {len(loaded_docs)} documents")
-            for i, doc in enumerate(loaded_docs[:2]):  # Show first 2 docs
-                logging.info(f"\nDocument {i + 1}:")
-                logging.info("-" * 40)
-                logging.info(f"Text length: {len(doc.text)}")
-                logging.info("Sample content:")
-                logging.info(doc.text[:500] + "...")
-                logging.info("-" * 40)
-
-        logging.info("\nStarting pipeline run...")
-        origin_nodes = await pipeline.arun(documents=loaded_docs)
-        logging.info("Pipeline run completed")
-
-        # --- TEMPORARY DEBUGGING ---
-        # Save the direct output of the parser BEFORE enhancement
-        temp_output_path = "./raw_parser_output.pkl"
-        logging.info(
-            f"Saving raw parser output to {temp_output_path} for inspection..."
+        # Chunking is CPU-bound; run it off the event loop
+        origin_nodes = await asyncio.to_thread(
+            chunk_documents_parallel,
+            iter_documents(input_file_path, from_parts=from_parts),
+            max_workers,
+            chunker,
         )
-        save_nodes_to_pickle(origin_nodes, temp_output_path)
-        # --- END TEMPORARY DEBUGGING ---
-
-        if origin_nodes:
-            logging.info(f"Created {len(origin_nodes)} origin nodes")
-            # Print sample nodes
-            for i, node in enumerate(origin_nodes[:2]):  # Show first 2 nodes
-                logging.info(f"\nNode {i + 1}:")
-                logging.info("-" * 40)
-                logging.info(f"Text length: {len(node.text)}")
-                logging.info(f"Metadata: {node.metadata}")
-                logging.info("Sample content:")
-                logging.info(node.text[:500] + "...")
-                logging.info("-" * 40)
-            return origin_nodes
-        else:
-            logging.info(
-                "No valid nodes were created. Check the extraction rules and validation."
-            )
-            return []
     except Exception as e:
-        logging.error(f"Error during node creation: {str(e)}")
-        logging.info("Stack trace:")
-        import traceback
+        logging.error(f"Error during node creation from {input_file_path}: {str(e)}")
+        raise
 
-        traceback.print_exc()
-        logging.info("\nReturning empty node list to allow pipeline to continue")
-        return []
+    if not origin_nodes:
+        raise ValueError(f"No nodes were created from {input_file_path}. Check the input documents.")
+
+    logging.info(
+        f"Created {len(origin_nodes)} origin nodes in {format_duration(time.monotonic() - started)}"
+    )
+    if debug_output:
+        logging.info(f"Saving raw chunker output to {debug_output} for inspection...")
+        save_nodes_to_pickle(origin_nodes, debug_output)
+    for i, node in enumerate(origin_nodes[:2]):  # Show first 2 nodes
+        logging.debug(f"Node {i + 1}: length {len(node.text)}, metadata {node.metadata}")
+        logging.debug(node.text[:500] + "...")
+    return origin_nodes
 
 
 async def main(
     input_file="./parsed_lmc_docs.pkl",
     output_file="./enhanced_laser_nodes.pkl",
+    previous_nodes_file=None,
+    concurrency=16,
+    rpm=500,
+    tpm=200_000,
+    cache_file=CONTEXT_CACHE_FILE,
+    reuse=True,
+    backend="openai",
+    batch_options=None,
+    local_options=None,
+    chunk_options=None,
+    checkpoint_options=None,
+    resume=False,
 ):
     """
     Main function to process the metadata pipeline.
@@ -273,19 +709,68 @@ async def main(
     Args:
         input_file: Path to the input pickle file
         output_file: Path to the output pickle file
+        previous_nodes_file: Enhanced nodes from an earlier run whose contexts
+            are imported into the context cache
+        concurrency: Maximum context requests in flight
+        rpm: Requests per minute budget for the context model
+        tpm: Tokens per minute budget for the context model
+        cache_file: SQLite context cache (None disables it)
+        reuse: Reuse cached contexts; when False every context is regenerated
+        backend: "openai" for interactive requests, "batch" for the Batch API
+        batch_options: Keyword arguments for generate_contexts_batch
+        local_options: Keyword arguments for enhance_nodes_locally
+        chunk_options: Keyword arguments for create_origin_nodes
+        checkpoint_options: Keyword arguments for NodeCheckpoint (every_nodes,
+            every_seconds); snapshots go to <output_file>.checkpoint
+        resume: Skip nodes completed in the checkpoint of an interrupted run
     """
+    # The local backend needs no API key
+    client = None if backend == "local" else configure_openai()
+
     logging.info(f"Starting metadata processing pipeline...")
     logging.info(f"Input file: {input_file}")
     logging.info(f"Output file: {output_file}")
 
     # Step 1: Create origin nodes
-    origin_nodes = await create_origin_nodes(input_file)
+    origin_nodes = await create_origin_nodes(input_file, **(chunk_options or {}))
+
+    cache = ContextCache(cache_file) if cache_file else None
+    # The local backend is fast and recomputes everything, so it isn't checkpointed
+    checkpoint = None
+    if backend != "local":
+        checkpoint = NodeCheckpoint(
+            f"{output_file}.checkpoint", CONTEXT_VERSION, **(checkpoint_options or {})
+        )
+        if checkpoint.path.exists() and not resume:
+            logging.info(f"Ignoring checkpoint {checkpoint.path} (pass --resume to continue from it)")
+    if cache is not None and reuse and previous_nodes_file and Path(previous_nodes_file).exists():
+        import_previous_contexts(previous_nodes_file, cache)
 
     # Step 2: Enhance nodes with context (pairs metadata now handled by LlamaParse)
-    enhanced_nodes = await enhance_all_nodes(origin_nodes)
+    try:
+        enhanced_nodes = await enhance_all_nodes(
+            origin_nodes,
+            client,
+            cache=cache,
+            concurrency=concurrency,
+            rpm=rpm,
+            tpm=tpm,
+            reuse=reuse,
+            backend=backend,
+            batch_options=batch_options,
+            local_options=local_options,
+            checkpoint=checkpoint,
+            resume=resume,
+        )
+    finally:
+        if cache is not None:
+            logging.info(f"Context cache {cache_file}: {cache.stats()}")
+            cache.close()
 
     # Step 4: Save the enhanced nodes
     save_nodes_to_pickle(enhanced_nodes, output_file)
+    if checkpoint is not None:
+        checkpoint.remove()
 
     logging.info(f"Metadata processing pipeline completed successfully!")
     return enhanced_nodes
@@ -305,6 +790,125 @@ if __name__ == "__main__":
         default="./enhanced_laser_nodes.pkl",
         help="Path to the output pickle file",
     )
+    parser.add_argument(
+        "--input_parts",
+        action="store_true",
+        help="Stream Documents from the parse scripts' per-file shards (<input>.parts) "
+        "instead of loading the --input pickle",
+    )
+    parser.add_argument(
+        "--chunker",
+        choices=CHUNKERS,
+        default="markdown",
+        help="markdown keeps tables with their headings and splits oversize tables by row groups; "
+        "sentence is the plain SentenceSplitter",
+    )
+    parser.add_argument(
+        "--chunk_workers",
+        type=int,
+        default=None,
+        help="Processes for chunking documents into nodes (default: CPU count, 1 = in process)",
+    )
+    parser.add_argument(
+        "--debug_raw_nodes",
+        default=None,
+        help="Also save the raw chunker output (before enhancement) to this pickle",
+    )
+    parser.add_argument(
+        "--previous",
+        default=None,
+        help="Enhanced nodes from an earlier run to import contexts from (defaults to --output if it exists)",
+    )
+    parser.add_argument(
+        "--no_reuse",
+        action="store_true",
+        help="Regenerate context for every node, even unchanged or cached ones",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["openai", "batch", "local"],
+        default="openai",
+        help="Context generation backend: interactive OpenAI requests, the OpenAI Batch API, "
+        "or local TF-IDF keyphrases and pairs metadata (no API calls)",
+    )
+    parser.add_argument(
+        "--local_workers",
+        type=int,
+        default=None,
+        help="Processes for --backend local keyword extraction (default: CPU count)",
+    )
+    parser.add_argument(
+        "--batch_dir",
+        default=BATCH_DIR,
+        help="Working directory for Batch API shards, results and the resume manifest",
+    )
+    parser.add_argument(
+        "--batch_results",
+        default=None,
+        help="Read Batch API result files from this directory instead of calling the API (offline testing)",
+    )
+    parser.add_argument(
+        "--batch_no_wait",
+        action="store_true",
+        help="Submit batches and exit; re-run to collect the results",
+    )
+    parser.add_argument(
+        "--batch_poll_seconds",
+        type=float,
+        default=DEFAULT_POLL_SECONDS,
+        help="Seconds between Batch API status checks",
+    )
+    parser.add_argument(
+        "--batch_shard_size",
+        type=int,
+        default=DEFAULT_SHARD_SIZE,
+        help="Requests per Batch API input file",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run: skip nodes whose text has a context in <output>.checkpoint",
+    )
+    parser.add_argument(
+        "--checkpoint_every",
+        type=int,
+        default=500,
+        help="Checkpoint the enriched nodes after this many new contexts",
+    )
+    parser.add_argument(
+        "--checkpoint_seconds",
+        type=float,
+        default=300.0,
+        help="... or after this many seconds, whichever comes first",
+    )
+    parser.add_argument(
+        "--context_cache",
+        default=CONTEXT_CACHE_FILE,
+        help="SQLite cache of generated contexts, keyed by chunk text, model and prompt version",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Don't read or write the context cache",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=16,
+        help="Maximum number of context requests in flight",
+    )
+    parser.add_argument(
+        "--rpm",
+        type=int,
+        default=500,
+        help="Requests per minute allowed for the context model (0 = unlimited)",
+    )
+    parser.add_argument(
+        "--tpm",
+        type=int,
+        default=200_000,
+        help="Tokens per minute allowed for the context model (0 = unlimited)",
+    )
 
     args = parser.parse_args()
 
@@ -312,4 +916,36 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
 
     # Run the async main function
-    asyncio.run(main(input_file=args.input, output_file=args.output))
+    previous = None if args.no_reuse else (args.previous or args.output)
+    asyncio.run(
+        main(
+            input_file=args.input,
+            output_file=args.output,
+            previous_nodes_file=previous,
+            concurrency=args.concurrency,
+            rpm=args.rpm,
+            tpm=args.tpm,
+            cache_file=None if args.no_cache else args.context_cache,
+            reuse=not args.no_reuse,
+            backend=args.backend,
+            batch_options={
+                "batch_dir": args.batch_dir,
+                "results_dir": args.batch_results,
+                "wait": not args.batch_no_wait,
+                "poll_seconds": args.batch_poll_seconds,
+                "shard_size": args.batch_shard_size,
+            },
+            local_options={"max_workers": args.local_workers},
+            checkpoint_options={
+                "every_nodes": args.checkpoint_every,
+                "every_seconds": args.checkpoint_seconds,
+            },
+            resume=args.resume,
+            chunk_options={
+                "max_workers": args.chunk_workers,
+                "from_parts": args.input_parts,
+                "debug_output": args.debug_raw_nodes,
+                "chunker": args.chunker,
+            },
+        )
+    )
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Columnar store for Documents and nodes, replacing whole-file pickles between
+pipeline stages.
+
+A store is a directory (named *.nodes by convention):
+
+    <name>.nodes/
+        manifest.json       format version, row count, embedding dimension
+        nodes.parquet       id, text, metadata (JSON), node_json (the rest)
+        embeddings.arrow    id + embedding (fixed-size float32 list), Arrow IPC
+
+nodes.parquet is zstd-compressed and written in row groups. Readers project
+only the columns they need, e.g. id and text for deduplication, without
+building LlamaIndex objects. Embeddings go into an uncompressed Arrow IPC file,
+so embeddings() memory-maps them and returns numpy views without copying.
+Nothing in a store is pickled, so it is safe to load from any source.
+
+node_json is LlamaIndex's own docstore serialisation (doc_to_json) minus the
+text, metadata and embedding columns. Nodes therefore round-trip with their
+type, excluded metadata keys and relationships intact.
+
+Pickles remain supported everywhere through load_nodes() / save_nodes(),
+which pick the format from the path: *.nodes (or a store directory) is a
+store, anything else is a pickle. The CLI converts between the two.
+
+Requires:
+    pip install pyarrow numpy   (llama-index-core to convert to/from nodes)
+
+Usage:
+    python node_store.py import enhanced_laser_nodes.pkl data/nodes/matrix_nodes.nodes
+    python node_store.py export data/nodes/matrix_nodes.nodes matrix_chatbot/matrix_nodes.pkl
+    python node_store.py info data/nodes/matrix_nodes.nodes
+"""
+
+import os
+import json
+import time
+import shutil
+import pickle
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# Optional pyarrow / numpy import
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    PYARROW_INSTALLED = True
+except ImportError:
+    np = pa = pq = None
+    PYARROW_INSTALLED = False
+
+STORE_SUFFIX = ".nodes"
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+TABLE_FILE = "nodes.parquet"
+EMBEDDINGS_FILE = "embeddings.arrow"
+ROW_GROUP_SIZE = 2_000
+EMBEDDING_BATCH_ROWS = 8_192  # Rows per Arrow record batch (one zero-copy view each)
+COLUMNS = ("id", "text", "metadata", "node_json")
+
+
+def _require_pyarrow():
+    if not PYARROW_INSTALLED:
+        raise ImportError("The node store needs pyarrow and numpy: pip install pyarrow numpy")
+
+
+def is_node_store(path: str) -> bool:
+    path = Path(path)
+    return path.suffix == STORE_SUFFIX or (path / MANIFEST_FILE).exists()
+
+
+def node_record(node: Any) -> Tuple[str, str, str, str]:
+    """(id, text, metadata JSON, node_json) of a Document or node."""
+    from llama_index.core.storage.docstore.utils import doc_to_json
+
+    payload = doc_to_json(node)
+    data = payload["__data__"]
+    for key in ("text", "text_resource", "metadata", "embedding"):
+        data.pop(key, None)
+    return (
+        node.node_id,
+        node.text,
+        json.dumps(node.metadata or {}, default=str),
+        json.dumps(payload, default=str),
+    )
+
+
+def node_from_record(
+    node_id: str, text: str, metadata: str, node_json: str, embedding: Optional[List[float]] = None
+) -> Any:
+    from llama_index.core.storage.docstore.utils import json_to_doc
+
+    payload = json.loads(node_json)
+    payload["__data__"]["id_"] = node_id
+    node = json_to_doc(payload)
+    node.set_content(text)  # Document.text is a read-only property
+    node.metadata = json.loads(metadata)
+    node.embedding = embedding
+    return node
+
+
+class NodeStoreWriter:
+    """
+    Streams Documents or nodes into a new store. Everything is written to
+    <path>.tmp and swapped into place by close(), so readers never see a
+    half-written store.
+    """
+
+    def __init__(self, path: str):
+        _require_pyarrow()
+        self.path = Path(path)
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        if self.tmp_path.exists():
+            shutil.rmtree(self.tmp_path)
+        self.tmp_path.mkdir(parents=True)
+        self.schema = pa.schema([(name, pa.large_string()) for name in COLUMNS])
+        self._table_writer = pq.ParquetWriter(
+            str(self.tmp_path / TABLE_FILE), self.schema, compression="zstd"
+        )
+        self._embedding_writer = None
+        self._embedding_ids: List[str] = []
+        self._embedding_rows: List[Any] = []
+        self.dimension: Optional[int] = None
+        self.rows = 0
+        self.embedded = 0
+
+    def write(self, nodes: Iterable[Any]):
+        nodes = list(nodes)
+        self.write_records(
+            [node_record(node) for node in nodes],
+            [getattr(node, "embedding", None) for node in nodes],
+        )
+
+    def write_records(self, records: Sequence[Tuple[str, str, str, str]], embeddings=None):
+        """Writes (id, text, metadata JSON, node_json) rows, e.g. from another store."""
+        if records:
+            columns = list(zip(*records))
+            self._table_writer.write_table(
+                pa.table(dict(zip(COLUMNS, columns)), schema=self.schema),
+                row_group_size=ROW_GROUP_SIZE,
+            )
+            self.rows += len(records)
+        for record, embedding in zip(records, embeddings or ()):
+            self._add_embedding(record[0], embedding)
+
+    def _add_embedding(self, node_id: str, embedding: Any):
+        if embedding is None:
+            return
+        if self.dimension is None:
+            self.dimension = len(embedding)
+        if len(embedding) != self.dimension:
+            logging.warning(
+                f"Skipping embedding of {node_id}: dimension {len(embedding)} != {self.dimension}"
+            )
+            return
+        self._embedding_ids.append(node_id)
+        self._embedding_rows.append(embedding)
+        if len(self._embedding_ids) >= EMBEDDING_BATCH_ROWS:
+            self._flush_embeddings()
+
+    def _flush_embeddings(self):
+        if not self._embedding_ids:
+            return
+        vector_type = pa.list_(pa.float32(), self.dimension)
+        if self._embedding_writer is None:
+            schema = pa.schema([("id", pa.string()), ("embedding", vector_type)])
+            self._embedding_writer = pa.ipc.new_file(str(self.tmp_path / EMBEDDINGS_FILE), schema)
+        values = pa.array(np.asarray(self._embedding_rows, dtype=np.float32).ravel())
+        batch = pa.record_batch(
+            [pa.array(self._embedding_ids, pa.string()), pa.FixedSizeListArray.from_arrays(values, self.dimension)],
+            names=["id", "embedding"],
+        )
+        self._embedding_writer.write_batch(batch)
+        self.embedded += len(self._embedding_ids)
+        self._embedding_ids, self._embedding_rows = [], []
+
+    def close(self):
+        self._flush_embeddings()
+        self._table_writer.close()
+        if self._embedding_writer is not None:
+            self._embedding_writer.close()
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "rows": self.rows,
+            "embedded": self.embedded,
+            "dimension": self.dimension,
+            "created": time.time(),
+        }
+        (self.tmp_path / MANIFEST_FILE).write_text(json.dumps(manifest, indent=2))
+        old_path = self.path.with_name(self.path.name + ".old")
+        if old_path.exists():
+            shutil.rmtree(old_path) if old_path.is_dir() else old_path.unlink()
+        if self.path.exists():
+            os.replace(self.path, old_path)
+        os.replace(self.tmp_path, self.path)
+        if old_path.exists():
+            shutil.rmtree(old_path) if old_path.is_dir() else old_path.unlink()
+
+    def abort(self):
+        self._table_writer.close()
+        if self._embedding_writer is not None:
+            self._embedding_writer.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class NodeStore:
+    """Read access to a store: projected columns, zero-copy embeddings, LlamaIndex objects."""
+
+    def __init__(self, path: str):
+        _require_pyarrow()
+        self.path = Path(path)
+        manifest_path = self.path / MANIFEST_FILE
+        if not manifest_path.exists():
+            raise FileNotFoundError(f"Not a node store (no {MANIFEST_FILE}): {self.path}")
+        self.manifest = json.loads(manifest_path.read_text())
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(
+                f"{self.path} has format version {self.manifest.get('format_version')}, expected {FORMAT_VERSION}"
+            )
+        self._embedding_index: Optional[Dict[str, Tuple[int, int]]] = None
+
+    def __len__(self) -> int:
+        return self.manifest["rows"]
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self.manifest.get("dimension")
+
+    def table(self, columns: Optional[Sequence[str]] = None, filters=None) -> "pa.Table":
+        """The node table, reading only `columns` (and row groups matching `filters`)."""
+        return pq.read_table(
+            str(self.path / TABLE_FILE), columns=list(columns) if columns else None,
+            filters=filters, memory_map=True,
+        )
+
+    def iter_batches(self, columns: Optional[Sequence[str]] = None, batch_size: int = ROW_GROUP_SIZE):
+        """Yields the rows as dicts of column lists, batch_size rows at a time."""
+        parquet = pq.ParquetFile(str(self.path / TABLE_FILE), memory_map=True)
+        for batch in parquet.iter_batches(batch_size=batch_size, columns=list(columns) if columns else None):
+            yield batch.to_pydict()
+
+    def embedding_batches(self) -> Iterator[Tuple["pa.Array", "np.ndarray"]]:
+        """(ids, float32 matrix) per record batch; the matrices are views of the memory-mapped file."""
+        path = self.path / EMBEDDINGS_FILE
+        if not path.exists():
+            return
+        reader = pa.ipc.open_file(pa.memory_map(str(path), "r"))
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            vectors = batch.column(1)
+            matrix = vectors.values.to_numpy(zero_copy_only=True).reshape(len(vectors), self.dimension)
+            yield batch.column(0), matrix
+
+    def embeddings(self) -> Tuple[List[str], "np.ndarray"]:
+        """
+        All ids and embeddings. Zero-copy when the store has a single record
+        batch (up to EMBEDDING_BATCH_ROWS embeddings); concatenated otherwise.
+        """
+        ids: List[str] = []
+        matrices = []
+        for batch_ids, matrix in self.embedding_batches():
+            ids.extend(batch_ids.to_pylist())
+            matrices.append(matrix)
+        if not matrices:
+            return ids, np.empty((0, self.dimension or 0), dtype=np.float32)
+        return ids, matrices[0] if len(matrices) == 1 else np.concatenate(matrices)
+
+    def _embedding_lookup(self) -> Dict[str, Any]:
+        lookup = {}
+        for ids, matrix in self.embedding_batches():
+            for row, node_id in enumerate(ids.to_pylist()):
+                lookup[node_id] = matrix[row]
+        return lookup
+
+    def iter_nodes(self, batch_size: int = ROW_GROUP_SIZE, with_embeddings: bool = True) -> Iterator[Any]:
+        """Yields LlamaIndex objects one batch at a time (the pickle-compatible view)."""
+        embeddings = self._embedding_lookup() if with_embeddings else {}
+        for batch in self.iter_batches(COLUMNS, batch_size):
+            for node_id, text, metadata, node_json in zip(*(batch[c] for c in COLUMNS)):
+                vector = embeddings.get(node_id)
+                yield node_from_record(
+                    node_id, text, metadata, node_json, vector.tolist() if vector is not None else None
+                )
+
+    def load_nodes(self, with_embeddings: bool = True) -> List[Any]:
+        return list(self.iter_nodes(with_embeddings=with_embeddings))
+
+
+def write_nodes(path: str, nodes: Iterable[Any], batch_size: int = ROW_GROUP_SIZE) -> int:
+    """Writes an iterable of Documents or nodes to a new store. Returns the row count."""
+    with NodeStoreWriter(path) as writer:
+        batch = []
+        for node in nodes:
+            batch.append(node)
+            if len(batch) >= batch_size:
+                writer.write(batch)
+                batch = []
+        writer.write(batch)
+    return writer.rows
+
+
+def load_nodes(path: str, with_embeddings: bool = True) -> List[Any]:
+    """Loads a list of Documents or nodes from a store or (legacy) pickle file."""
+    if is_node_store(path):
+        return NodeStore(path).load_nodes(with_embeddings=with_embeddings)
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def iter_nodes(path: str, with_embeddings: bool = True) -> Iterator[Any]:
+    """Like load_nodes, but streams from a store instead of loading it all."""
+    if is_node_store(path):
+        yield from NodeStore(path).iter_nodes(with_embeddings=with_embeddings)
+    else:
+        yield from load_nodes(path)
+
+
+def save_nodes(nodes: List[Any], path: str) -> str:
+    """Saves Documents or nodes as a store (*.nodes) or as a pickle (any other path), atomically."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    if is_node_store(path):
+        write_nodes(path, nodes)
+    else:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(nodes, f)
+        os.replace(tmp_path, path)
+    return path
+
+
+def store_info(path: str) -> Dict[str, Any]:
+    store = NodeStore(path)
+    parquet = pq.ParquetFile(str(store.path / TABLE_FILE))
+    sizes = {p.name: p.stat().st_size for p in store.path.iterdir() if p.is_file()}
+    return {
+        **store.manifest,
+        "row_groups": parquet.num_row_groups,
+        "size_mb": {name: round(size / 1e6, 2) for name, size in sizes.items()},
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Convert between node pickles and columnar node stores.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Pickle -> store.")
+    import_parser.add_argument("pickle_file")
+    import_parser.add_argument("store")
+    export_parser = subparsers.add_parser("export", help="Store -> pickle.")
+    export_parser.add_argument("store")
+    export_parser.add_argument("pickle_file")
+    info_parser = subparsers.add_parser("info", help="Show a store's manifest and file sizes.")
+    info_parser.add_argument("store")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    if args.command == "import":
+        with open(args.pickle_file, "rb") as f:
+            nodes = pickle.load(f)
+        rows = write_nodes(args.store, nodes)
+        print(f"Imported {rows} objects from {args.pickle_file} into {args.store}")
+    elif args.command == "export":
+        nodes = NodeStore(args.store).load_nodes()
+        save_nodes(nodes, args.pickle_file)
+        print(f"Exported {len(nodes)} objects from {args.store} to {args.pickle_file}")
+    else:
+        print(json.dumps(store_info(args.store), indent=2))
+    if args.command != "info":
+        print(f"Took {time.monotonic() - started:.2f}s")
@@ -0,0 +1,708 @@
+#!/usr/bin/env python3
+"""
+Local, deterministic stand-ins for the OpenAI, Cohere and LlamaParse APIs.
+
+Runs a small HTTP server (standard library only) that speaks just enough of
+each provider's wire format for this project's clients:
+
+- OpenAI:     POST /v1/chat/completions (streaming SSE and non-streaming)
+              POST /v1/embeddings (hash-seeded vectors, 3072-dim by default)
+              POST /v1/files, GET /v1/files/<id>/content, POST /v1/batches,
+              GET /v1/batches[/<id>] (Batch API for chat completions; batches
+              complete after --batch_seconds, and --error_rate fails
+              individual request lines into the error file, never the
+              upload or batch-create calls)
+- Cohere:     POST /v1/rerank and /v2/rerank (lexical-overlap scores)
+- LlamaParse: POST /api/parsing/upload, GET /api/parsing/job/<id>,
+              GET /api/parsing/job/<id>/result/<markdown|text|json>
+              (also served under the /api/v1 prefix)
+
+Every response is derived from a hash of the request content, so repeated
+runs return identical text, vectors and scores. Latency, token rate and
+error injection are configurable, which makes load tests, ingestion
+throughput runs and regression benchmarks reproducible without network.
+
+Pointing the project at the stand-ins:
+    export OFFLINE_PROVIDER_URL=http://127.0.0.1:8089
+    (parse.py, parse_pdf_md.py, metadata.py, create_vector_db.py and
+    matrix_chatbot/chat_engine.py all honour this variable and fall back to
+    dummy API keys when it is set.)
+
+Usage:
+    python offline_providers.py --port 8089
+    python offline_providers.py --latency_ms 80 --tokens_per_second 40 --error_rate 0.02
+    python offline_providers.py --parse_job_seconds 2 --parse_max_concurrent_jobs 6
+    python offline_providers.py --help for more options
+"""
+
+import os
+import re
+import json
+import time
+import uuid
+import array
+import base64
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from email.parser import BytesParser
+from email.policy import default as default_email_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+# Shared with the deployed chatbot (matrix_chatbot/chat_engine.py)
+from matrix_chatbot.shared_constants import OFFLINE_API_KEY, OFFLINE_PROVIDER_ENV
+
+DEFAULT_EMBED_DIM = 3072
+PAGE_SEPARATOR = "\n---\n"
+
+WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9\-]{3,}")
+FALLBACK_VOCABULARY = [
+    "laser",
+    "power",
+    "sensor",
+    "wavelength",
+    "thermopile",
+    "calibration",
+    "meter",
+    "energy",
+    "measurement",
+    "interface",
+    "specification",
+    "accuracy",
+]
+
+
+def offline_provider_url() -> Optional[str]:
+    """Returns the stand-in base URL from the environment, without a trailing slash."""
+    url = os.environ.get(OFFLINE_PROVIDER_ENV, "").strip()
+    return url.rstrip("/") or None
+
+
+@dataclass
+class ProviderConfig:
+    """Behaviour knobs shared by every fake endpoint."""
+
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    tokens_per_second: float = 0.0  # 0 disables streaming throttling
+    response_tokens: int = 60
+    error_rate: float = 0.0
+    error_status: int = 500
+    parse_job_seconds: float = 0.0
+    parse_seconds_per_mb: float = 0.0  # Extra job time proportional to upload size
+    parse_max_concurrent_jobs: int = 0  # Uploads beyond this many pending jobs get 429; 0 = no quota
+    batch_seconds: float = 0.0  # Time a batch stays in_progress before its results are ready
+    embed_dim: int = DEFAULT_EMBED_DIM
+    seed: int = 0
+
+
+def stable_hash(*parts: str) -> str:
+    """sha256 hex digest over the given string parts."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8", errors="replace"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def fake_embedding(text: str, dim: int = DEFAULT_EMBED_DIM, seed: int = 0) -> List[float]:
+    """Deterministic unit-length vector seeded by a hash of the text."""
+    rng = random.Random(int(stable_hash(str(seed), text)[:16], 16))
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def fake_completion_tokens(prompt: str, n_tokens: int, seed: int = 0) -> List[str]:
+    """Deterministic response tokens drawn from the words of the prompt."""
+    vocabulary = WORD_RE.findall(prompt) or FALLBACK_VOCABULARY
+    rng = random.Random(int(stable_hash(str(seed), prompt)[:16], 16))
+    words = [rng.choice(vocabulary) for _ in range(max(n_tokens, 1))]
+    return [w if i == 0 else f" {w}" for i, w in enumerate(words)]
+
+
+def fake_chat_completion(request: Dict, config: ProviderConfig) -> Tuple[Dict, List[str]]:
+    """Non-streaming chat.completion payload for a request, and its response tokens."""
+    messages = request.get("messages") or []
+    prompt = "\n".join(
+        m.get("content", "") if isinstance(m.get("content"), str) else json.dumps(m.get("content"))
+        for m in messages
+    )
+    n_tokens = min(
+        int(request.get("max_tokens") or request.get("max_completion_tokens") or config.response_tokens),
+        config.response_tokens,
+    )
+    tokens = fake_completion_tokens(prompt, n_tokens, config.seed)
+    prompt_tokens = max(1, len(prompt) // 4)
+    payload = {
+        "id": f"chatcmpl-{stable_hash(prompt)[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "offline-model"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        },
+    }
+    return payload, tokens
+
+
+def fake_rerank_scores(query: str, documents: List[str], seed: int = 0) -> List[float]:
+    """Lexical-overlap relevance with a small hash-seeded tie breaker."""
+    query_terms = {w.lower() for w in WORD_RE.findall(query)}
+    scores = []
+    for doc in documents:
+        doc_terms = {w.lower() for w in WORD_RE.findall(doc)}
+        overlap = len(query_terms & doc_terms) / (len(query_terms) or 1)
+        jitter = int(stable_hash(str(seed), query, doc)[:8], 16) / 0xFFFFFFFF
+        scores.append(round(min(1.0, 0.9 * overlap + 0.1 * jitter), 6))
+    return scores
+
+
+def count_pdf_pages(pdf_bytes: bytes) -> int:
+    """Cheap page count by counting page objects; good enough for fake parsing."""
+    return max(1, len(re.findall(rb"/Type\s*/Page(?!s)", pdf_bytes)))
+
+
+def fake_parsed_pages(
+    file_bytes: bytes,
+    file_name: str,
+    with_pairs: bool,
+    target_pages: Optional[List[int]] = None,
+) -> List[Dict]:
+    """
+    Builds deterministic per-page Markdown for an uploaded file. When the job
+    carried a user prompt, the last page ends with a
+    "Metadata: {'pairs': [...]}" block like the real datasheet prompt produces.
+    """
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    n_pages = count_pdf_pages(file_bytes)
+    pages = list(range(n_pages)) if not target_pages else sorted(set(target_pages))
+    rng = random.Random(int(digest[:16], 16))
+    stem = os.path.splitext(os.path.basename(file_name))[0] or "document"
+    models = [f"PM{rng.randint(2, 500)}" for _ in range(3)]
+    results = []
+    for page_index in pages:
+        md = [
+            f"# {stem} page {page_index + 1}",
+            "",
+            f"Offline parse of {stem} ({digest[:12]}), page {page_index + 1} of {n_pages}.",
+            "",
+            "|Model|" + "|".join(models) + "|",
+            "|---|" + "|".join("---" for _ in models) + "|",
+            "|Wavelength Range (µm)|" + "|".join("0.19 to 12" for _ in models) + "|",
+            "|Part Number|"
+            + "|".join(str(1100000 + rng.randint(0, 99999)) for _ in models)
+            + "|",
+        ]
+        if with_pairs and page_index == pages[-1]:
+            pairs = ",\n".join(
+                f"        ('{m} USB', '{1100000 + rng.randint(0, 99999)}')" for m in models
+            )
+            md += ["", "Metadata: {", "    'pairs': [", pairs, "    ]", "}"]
+        text = "\n".join(md)
+        results.append({"page": page_index + 1, "md": text, "text": text})
+    return results
+
+
+class _ParseJobStore:
+    """Thread-safe in-memory registry of fake parse jobs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict] = {}
+
+    def _add(self, pages: List[Dict], ready_at: float) -> str:
+        # Caller holds self._lock
+        job_id = str(uuid.uuid4())
+        self._jobs[job_id] = {"pages": pages, "ready_at": ready_at}
+        return job_id
+
+    def create(self, pages: List[Dict], ready_at: float) -> str:
+        """Registers a job unconditionally and returns its id."""
+        with self._lock:
+            return self._add(pages, ready_at)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def try_create(self, pages: List[Dict], ready_at: float, max_pending: int) -> Optional[str]:
+        """Like create(), but returns None when max_pending (> 0) jobs are still running."""
+        now = time.time()
+        with self._lock:
+            if max_pending and sum(1 for job in self._jobs.values() if job["ready_at"] > now) >= max_pending:
+                return None
+            return self._add(pages, ready_at)
+
+
+class _BatchStore:
+    """Thread-safe in-memory files and Batch API jobs."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files: Dict[str, Dict] = {}
+        self.batches: Dict[str, Dict] = {}
+
+    def add_file(self, content: bytes, filename: str, purpose: str) -> Dict:
+        file_id = f"file-{uuid.uuid4().hex[:24]}"
+        record = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        with self._lock:
+            self.files[file_id] = {"meta": record, "content": content}
+        return record
+
+    def add_batch(self, request: Dict, ready_at: float) -> Dict:
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}",
+            "object": "batch",
+            "endpoint": request.get("endpoint", "/v1/chat/completions"),
+            "input_file_id": request["input_file_id"],
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": request.get("metadata"),
+        }
+        with self._lock:
+            if request["input_file_id"] not in self.files:
+                raise KeyError(f"No such file: {request['input_file_id']}")
+            self.batches[batch["id"]] = {"batch": batch, "ready_at": ready_at}
+        return batch
+
+
+class OfflineProviderHandler(BaseHTTPRequestHandler):
+    """Request handler; behaviour comes from the server's ProviderConfig."""
+
+    server_version = "OfflineProviders/1.0"
+
+    # --- helpers ---
+    @property
+    def config(self) -> ProviderConfig:
+        return self.server.provider_config
+
+    def log_message(self, format, *args):
+        logging.debug("offline_providers: " + format % args)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _multipart_fields(self, body: bytes, default_name: str = "upload") -> Tuple[Dict[str, str], bytes, str]:
+        """(form fields, file bytes, file name) of a multipart/form-data body."""
+        content_type = self.headers.get("Content-Type", "")
+        message = BytesParser(policy=default_email_policy).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+        )
+        file_bytes, file_name, fields = b"", default_name, {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                file_bytes = part.get_payload(decode=True) or b""
+                file_name = part.get_filename()
+            elif name:
+                fields[name] = (part.get_payload(decode=True) or b"").decode("utf-8", "replace")
+        return fields, file_bytes, file_name
+
+    def _send_json(self, payload: Dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate_latency(self):
+        delay = self.config.latency_ms
+        if self.config.jitter_ms:
+            delay += random.uniform(0, self.config.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def _maybe_inject_error(self) -> bool:
+        if self.config.error_rate > 0 and random.random() < self.config.error_rate:
+            status = self.config.error_status
+            message = "Rate limit exceeded" if status == 429 else "Injected failure"
+            self._send_json({"error": {"message": message, "type": "injected"}}, status)
+            return True
+        return False
+
+    def _route(self) -> Tuple[str, str]:
+        path = self.path.split("?", 1)[0]
+        # Accept both /api/parsing/... and /api/v1/parsing/...
+        path = path.replace("/api/v1/parsing/", "/api/parsing/")
+        with self.server.request_lock:
+            self.server.request_counts[path] += 1
+        return self.command, path
+
+    # --- dispatch ---
+    def do_GET(self):
+        _, path = self._route()
+        match = re.fullmatch(r"/api/parsing/job/([^/]+)(?:/result/(\w+))?", path)
+        if match:
+            return self._parse_job(match.group(1), match.group(2))
+        match = re.fullmatch(r"/v1/batches/([^/]+)", path)
+        if match:
+            return self._batch_status(match.group(1))
+        if path == "/v1/batches":
+            return self._batch_list()
+        match = re.fullmatch(r"/v1/files/([^/]+)/content", path)
+        if match:
+            return self._file_content(match.group(1))
+        if path == "/health":
+            return self._send_json({"status": "ok"})
+        self._send_json({"error": f"Unknown path {path}"}, 404)
+
+    def do_POST(self):
+        _, path = self._route()
+        body = self._read_body()
+        self._simulate_latency()
+        # Batch API errors are injected per request line, in _run_batch
+        if path not in ("/v1/files", "/v1/batches") and self._maybe_inject_error():
+            return
+        try:
+            if path == "/v1/chat/completions":
+                return self._chat_completions(json.loads(body or b"{}"))
+            if path == "/v1/embeddings":
+                return self._embeddings(json.loads(body or b"{}"))
+            if path in ("/v1/rerank", "/v2/rerank"):
+                return self._rerank(json.loads(body or b"{}"))
+            if path == "/api/parsing/upload":
+                return self._parse_upload(body)
+            if path == "/v1/files":
+                return self._file_upload(body)
+            if path == "/v1/batches":
+                return self._batch_create(json.loads(body or b"{}"))
+        except (ValueError, KeyError) as e:
+            return self._send_json({"error": f"Bad request: {e}"}, 400)
+        self._send_json({"error": f"Unknown path {path}"}, 404)
+
+    # --- OpenAI ---
+    def _chat_completions(self, request: Dict):
+        payload, tokens = fake_chat_completion(request, self.config)
+        if not request.get("stream"):
+            return self._send_json(payload)
+        model = payload["model"]
+        completion_id = payload["id"]
+        usage = payload["usage"]
+        created = payload["created"]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        token_delay = 1.0 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+
+        def send_chunk(delta: Dict, finish_reason: Optional[str] = None, extra: Optional[Dict] = None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if extra:
+                chunk.update(extra)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            send_chunk({"role": "assistant", "content": ""})
+            for token in tokens:
+                if token_delay:
+                    time.sleep(token_delay)
+                send_chunk({"content": token})
+            include_usage = (request.get("stream_options") or {}).get("include_usage")
+            send_chunk({}, "stop", {"usage": usage} if include_usage else None)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logging.debug("offline_providers: client closed the stream early")
+
+    def _embeddings(self, request: Dict):
+        inputs = request.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        # Token-array inputs are hashed by their repr so they stay deterministic
+        inputs = [i if isinstance(i, str) else json.dumps(i) for i in inputs]
+        dim = int(request.get("dimensions") or self.config.embed_dim)
+        as_base64 = request.get("encoding_format") == "base64"
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(text, dim, self.config.seed)
+            if as_base64:
+                encoded = base64.b64encode(array.array("f", vector).tobytes()).decode("ascii")
+                data.append({"object": "embedding", "index": index, "embedding": encoded})
+            else:
+                data.append({"object": "embedding", "index": index, "embedding": vector})
+        n_tokens = sum(max(1, len(t) // 4) for t in inputs)
+        self._send_json(
+            {
+                "object": "list",
+                "data": data,
+                "model": request.get("model", "offline-embedding"),
+                "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens},
+            }
+        )
+
+    # --- Cohere ---
+    def _rerank(self, request: Dict):
+        documents = [
+            d if isinstance(d, str) else d.get("text", json.dumps(d))
+            for d in request.get("documents", [])
+        ]
+        scores = fake_rerank_scores(request.get("query", ""), documents, self.config.seed)
+        ranked = sorted(range(len(documents)), key=lambda i: scores[i], reverse=True)
+        top_n = request.get("top_n") or len(documents)
+        self._send_json(
+            {
+                "id": str(uuid.uuid4()),
+                "results": [
+                    {"index": i, "relevance_score": scores[i]} for i in ranked[:top_n]
+                ],
+                "meta": {"billed_units": {"search_units": 1}},
+            }
+        )
+
+    # --- OpenAI Batch API ---
+    def _file_upload(self, body: bytes):
+        fields, content, filename = self._multipart_fields(body)
+        self._send_json(self.server.batch_store.add_file(content, filename, fields.get("purpose", "batch")))
+
+    def _file_content(self, file_id: str):
+        record = self.server.batch_store.files.get(file_id)
+        if record is None:
+            return self._send_json({"error": {"message": f"No such file: {file_id}"}}, 404)
+        content = record["content"]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _batch_create(self, request: Dict):
+        ready_at = time.time() + self.config.batch_seconds
+        self._send_json(self.server.batch_store.add_batch(request, ready_at))
+
+    def _batch_list(self):
+        store = self.server.batch_store
+        with store._lock:
+            batches = [entry["batch"] for entry in store.batches.values()]
+        batches.sort(key=lambda batch: batch["created_at"], reverse=True)  # Newest first, like the API
+        self._send_json({"object": "list", "data": batches[:100], "has_more": len(batches) > 100})
+
+    def _batch_status(self, batch_id: str):
+        store = self.server.batch_store
+        with store._lock:
+            entry = store.batches.get(batch_id)
+        if entry is None:
+            return self._send_json({"error": {"message": f"No such batch: {batch_id}"}}, 404)
+        batch = entry["batch"]
+        if batch["status"] == "in_progress" and time.time() >= entry["ready_at"]:
+            self._run_batch(batch)
+        self._send_json(batch)
+
+    def _run_batch(self, batch: Dict):
+        """Answers every request line of the batch's input file, failing some at --error_rate."""
+        store = self.server.batch_store
+        outputs, errors = [], []
+        for line in store.files[batch["input_file_id"]]["content"].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            result = {"id": f"batch_req_{uuid.uuid4().hex[:16]}", "custom_id": item.get("custom_id")}
+            if self.config.error_rate > 0 and random.random() < self.config.error_rate:
+                result["response"] = {"status_code": self.config.error_status, "body": {"error": {"message": "Injected failure"}}}
+                result["error"] = None
+                errors.append(result)
+                continue
+            payload, _ = fake_chat_completion(item.get("body") or {}, self.config)
+            result["response"] = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": payload}
+            result["error"] = None
+            outputs.append(result)
+
+        def to_file(lines: List[Dict], suffix: str) -> Optional[str]:
+            if not lines:
+                return None
+            content = "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8")
+            return store.add_file(content, f"{batch['id']}_{suffix}.jsonl", "batch_output")["id"]
+
+        batch["output_file_id"] = to_file(outputs, "output")
+        batch["error_file_id"] = to_file(errors, "error")
+        batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs), "failed": len(errors)}
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+
+    # --- LlamaParse ---
+    def _parse_upload(self, body: bytes):
+        fields, file_bytes, file_name = self._multipart_fields(body, default_name="upload.pdf")
+        target_pages = None
+        if fields.get("target_pages"):
+            target_pages = [int(p) for p in re.findall(r"\d+", fields["target_pages"])]
+        pages = fake_parsed_pages(
+            file_bytes, file_name, bool(fields.get("user_prompt")), target_pages
+        )
+        job_seconds = self.config.parse_job_seconds + self.config.parse_seconds_per_mb * len(file_bytes) / (1 << 20)
+        job_id = self.server.parse_jobs.try_create(
+            pages, time.time() + job_seconds, self.config.parse_max_concurrent_jobs
+        )
+        if job_id is None:
+            return self._send_json(
+                {"detail": "Too many concurrent parse jobs for this account"}, 429
+            )
+        self._send_json({"id": job_id, "status": "PENDING"})
+
+    def _parse_job(self, job_id: str, result_type: Optional[str]):
+        job = self.server.parse_jobs.get(job_id)
+        if job is None:
+            return self._send_json({"detail": "Job not found"}, 404)
+        ready = time.time() >= job["ready_at"]
+        if result_type is None:
+            return self._send_json({"id": job_id, "status": "SUCCESS" if ready else "PENDING"})
+        if not ready:
+            return self._send_json({"detail": "Job not ready"}, 404)
+        pages = job["pages"]
+        meta = {"job_pages": len(pages), "credits_used": len(pages)}
+        if result_type == "json":
+            return self._send_json({"pages": pages, "job_metadata": meta})
+        key = "markdown" if result_type == "markdown" else "text"
+        joined = PAGE_SEPARATOR.join(p["md"] if key == "markdown" else p["text"] for p in pages)
+        self._send_json({key: joined, "job_metadata": meta})
+
+
+def start_offline_providers(
+    config: Optional[ProviderConfig] = None, host: str = "127.0.0.1", port: int = 0
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Starts the stand-in server on a daemon thread and returns (server, base_url).
+    Use port=0 to pick a free port; call server.shutdown() when done.
+    server.request_counts counts the requests received per path (e.g. so a
+    test can check that "/v1/rerank" was actually called).
+    """
+    server = ThreadingHTTPServer((host, port), OfflineProviderHandler)
+    server.daemon_threads = True
+    server.provider_config = config or ProviderConfig()
+    server.parse_jobs = _ParseJobStore()
+    server.batch_store = _BatchStore()
+    server.request_counts = Counter()
+    server.request_lock = threading.Lock()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f"http://{host}:{server.server_address[1]}"
+    logging.info(f"Offline providers listening on {base_url}")
+    return server, base_url
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Serve deterministic offline stand-ins for OpenAI, Cohere and LlamaParse.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Bind address.")
+    parser.add_argument("--port", "-p", type=int, default=8089, help="Bind port.")
+    parser.add_argument(
+        "--latency_ms", type=float, default=0.0, help="Base latency added to every request."
+    )
+    parser.add_argument(
+        "--jitter_ms", type=float, default=0.0, help="Uniform random extra latency (0..jitter)."
+    )
+    parser.add_argument(
+        "--tokens_per_second",
+        type=float,
+        default=0.0,
+        help="Streaming token rate for chat completions (0 = unthrottled).",
+    )
+    parser.add_argument(
+        "--response_tokens", type=int, default=60, help="Tokens per chat completion."
+    )
+    parser.add_argument(
+        "--error_rate",
+        type=float,
+        default=0.0,
+        help="Fraction of POST requests that fail (for the Batch API: of request lines, not uploads or creates).",
+    )
+    parser.add_argument(
+        "--error_status",
+        type=int,
+        default=500,
+        help="HTTP status used for injected failures (e.g. 429 or 500).",
+    )
+    parser.add_argument(
+        "--parse_job_seconds",
+        type=float,
+        default=0.0,
+        help="Time a fake parse job stays PENDING before results are available.",
+    )
+    parser.add_argument(
+        "--parse_seconds_per_mb",
+        type=float,
+        default=0.0,
+        help="Extra parse job time per MB of uploaded PDF.",
+    )
+    parser.add_argument(
+        "--parse_max_concurrent_jobs",
+        type=int,
+        default=0,
+        help="Simulated account quota: uploads beyond this many running jobs get HTTP 429 (0 = unlimited).",
+    )
+    parser.add_argument(
+        "--batch_seconds",
+        type=float,
+        default=0.0,
+        help="Time a Batch API job stays in_progress before its results are ready.",
+    )
+    parser.add_argument(
+        "--embed_dim", type=int, default=DEFAULT_EMBED_DIM, help="Default embedding size."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed mixed into all hashes.")
+
+    args = parser.parse_args()
+    provider_config = ProviderConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        tokens_per_second=args.tokens_per_second,
+        response_tokens=args.response_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        parse_job_seconds=args.parse_job_seconds,
+        parse_seconds_per_mb=args.parse_seconds_per_mb,
+        parse_max_concurrent_jobs=args.parse_max_concurrent_jobs,
+        batch_seconds=args.batch_seconds,
+        embed_dim=args.embed_dim,
+        seed=args.seed,
+    )
+    httpd, url = start_offline_providers(provider_config, args.host, args.port)
+    print(f"Offline providers running at {url}")
+    print(f"  export {OFFLINE_PROVIDER_ENV}={url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print("\nShutting down offline providers.")
+        httpd.shutdown()
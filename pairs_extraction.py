@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Extraction of the model/part number pairs block that the datasheet parsing
+prompt asks LlamaParse to append to each section:
+
+    Metadata: {
+        'pairs': [
+            ('PM10 USB', '1174262'),
+            ('PM30 RS', '1174258')
+        ]
+    }
+
+The pairs are moved to metadata as [{'model_name': ..., 'part_number': ...}]
+and the block is removed from the text (unless it is the whole text).
+
+Compared with the old per-call `(\\[.*?\\])` DOTALL regex + ast.literal_eval +
+re.sub, the scanner here is precompiled and linear: it locates the block header,
+then matches the run of tuples with one anchored pattern (which also finds
+where the block ends) and splits it into fields. Only (str, str) tuples are accepted, so
+nothing but string literals is ever evaluated.
+
+extract_pairs() works on plain text so it can run in a ProcessPoolExecutor;
+apply_pairs_extraction() does that for a file's Documents when they are large
+enough to be worth shipping to another process. When parse_pdf_md.py
+--page_diff re-parses only the changed pages of a file, the re-parsed pages
+also get the pairs of the unchanged pages (merge_cached_pairs()), deduplicated
+on model_name/part_number, so the file keeps the pairs it had before.
+
+Used by parse.py and parse_pdf_md.py. Micro-benchmark:
+    python benchmarks/pairs_extraction_benchmark.py --pairs 10000
+"""
+
+import re
+import ast
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# Documents whose combined text is smaller than this are processed inline;
+# pickling them to a worker process would cost more than the extraction.
+POOL_MIN_CHARS = 200_000
+# Set by parse_pdf_md.py --page_diff on the re-parsed pages of a partly changed
+# file: the pairs of its unchanged (cached) pages, merged into their pairs
+# by apply_pairs_extraction()
+CACHED_PAIRS_KEY = "cached_page_pairs"
+
+BLOCK_HEADER = re.compile(
+    r"^[ \t]*Metadata:\s*\{\s*['\"]pairs['\"]\s*:\s*\[", re.MULTILINE | re.IGNORECASE
+)
+# Quoted string literal, "unrolled" so plain runs are consumed without per-char alternation
+_STRING = r"""'[^'\\\n]*(?:\\.[^'\\\n]*)*'|"[^"\\\n]*(?:\\.[^"\\\n]*)*\""""
+_TUPLE = rf"\s*\(\s*(?:{_STRING})\s*,\s*(?:{_STRING})\s*,?\s*\)\s*"
+# The run of comma-terminated tuples is matched in one pass, then split into fields
+TUPLE_RUN = re.compile(rf"(?:{_TUPLE},)*")
+LAST_TUPLE = re.compile(_TUPLE)
+PAIR_FIELDS = re.compile(rf"\(\s*({_STRING})\s*,\s*({_STRING})")
+LIST_END = re.compile(r"\s*\]\s*\}[ \t]*(?=\r?\n|$)")
+LEADING_BLANK_LINES = re.compile(r"(?:[ \t]*\r?\n)+")
+
+
+class PairsResult(NamedTuple):
+    # (model_name, part_number) tuples, None when no valid block was found.
+    # Tuples keep the payload small when results come back from a worker process.
+    pairs: Optional[List[Tuple[str, str]]]
+    text: Optional[str]  # Text with the block(s) removed, None if unchanged
+    message: str  # Why the block was kept, for logging; "" when extracted
+
+
+def _unquote(literal: str) -> str:
+    if "\\" not in literal:
+        return literal[1:-1]
+    # Escapes are rare in part numbers; evaluate just this one string literal
+    value = ast.literal_eval(literal)
+    if not isinstance(value, str):
+        raise ValueError(f"Not a string literal: {literal[:40]}")
+    return value
+
+
+def parse_pairs_list(text: str, pos: int) -> Tuple[List[Tuple[str, str]], int]:
+    """
+    Parses a list of (str, str) tuples starting just after its '['. Returns the
+    pairs and the offset just past the closing '}' of the block. Raises
+    ValueError on anything else.
+    """
+    run_end = TUPLE_RUN.match(text, pos).end()
+    last = LAST_TUPLE.match(text, run_end)
+    items_end = last.end() if last else run_end
+    end = LIST_END.match(text, items_end)
+    if not end:
+        snippet = text[items_end : items_end + 40].strip()
+        raise ValueError(f"expected a (str, str) tuple or end of list at offset {items_end}: '{snippet}'")
+    pairs = [
+        (model[1:-1], part[1:-1])
+        if "\\" not in model and "\\" not in part
+        else (_unquote(model), _unquote(part))
+        for model, part in PAIR_FIELDS.findall(text, pos, items_end)
+    ]
+    return pairs, end.end()
+
+
+def find_pairs_blocks(text: str) -> List[Tuple[int, int, Any]]:
+    """
+    All pairs blocks as (start, end, pairs-or-ValueError), in text order. A
+    block that doesn't parse is returned with its error and no end (-1).
+    """
+    blocks = []
+    pos = 0
+    while True:
+        header = BLOCK_HEADER.search(text, pos)
+        if not header:
+            return blocks
+        try:
+            pairs, end = parse_pairs_list(text, header.end())
+        except ValueError as e:
+            blocks.append((header.start(), -1, e))
+            pos = header.end()
+            continue
+        blocks.append((header.start(), end, pairs))
+        pos = end
+
+
+def _trim_blank_lines(piece: str) -> str:
+    """Drops the blank lines that separated a piece of text from the blocks around it."""
+    leading = LEADING_BLANK_LINES.match(piece)
+    return (piece[leading.end() :] if leading else piece).rstrip()
+
+
+def extract_pairs(text: str) -> PairsResult:
+    """Pure-text version of postprocess_extract_pairs; safe to run in a worker process."""
+    if not text or not text.strip():
+        return PairsResult(None, None, "")
+    blocks = find_pairs_blocks(text)
+    if not blocks:
+        return PairsResult(None, None, "")
+    start, end, first = blocks[0]
+    if isinstance(first, ValueError):
+        return PairsResult(None, None, f"Could not parse pairs string: {first}")
+
+    if text[start:end].strip() == text.strip():
+        return PairsResult(first, None, "Metadata block is entire content")
+
+    # Remove every well-formed block, leaving one blank line where each was
+    # (the blank lines around a block collapse, as with the legacy re.sub)
+    pieces = []
+    last = 0
+    for block_start, block_end, parsed in blocks:
+        if isinstance(parsed, ValueError):
+            continue
+        pieces.append(_trim_blank_lines(text[last:block_start]))
+        last = block_end
+    pieces.append(_trim_blank_lines(text[last:]))
+    new_text = "\n\n".join(piece for piece in pieces if piece).strip()
+    return PairsResult(first, new_text, "")
+
+
+def extract_pairs_batch(texts: List[str]) -> List[PairsResult]:
+    return [extract_pairs(text) for text in texts]
+
+
+def apply_pairs_result(doc: Any, result: PairsResult) -> Any:
+    """Applies an extract_pairs() result to a Document, logging like the old inline code."""
+    if not hasattr(doc, "metadata") or doc.metadata is None:
+        doc.metadata = {}
+    label = f"doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}"
+    if result.pairs is None:
+        if result.message:
+            logging.warning(f"{result.message} for {label}. Keeping block in text.")
+        return doc
+
+    doc.metadata["pairs"] = [
+        {"model_name": model, "part_number": part} for model, part in result.pairs
+    ]
+    logging.info(f"Extracted {len(result.pairs)} pairs to metadata (dict format) for {label}")
+    if result.message:
+        logging.warning(f"{result.message} for {label}. Leaving block in text.")
+    elif result.text is not None:
+        if hasattr(doc, "set_content"):
+            doc.set_content(result.text)
+        else:
+            logging.error("Document object missing 'set_content' method.")
+    return doc
+
+
+def merge_pairs(*pair_lists: Optional[List[Dict[str, str]]]) -> List[Dict[str, str]]:
+    """Concatenates pairs lists in order, dropping repeated (model_name, part_number) pairs."""
+    merged, seen = [], set()
+    for pairs in pair_lists:
+        for pair in pairs or []:
+            key = (pair.get("model_name"), pair.get("part_number"))
+            if key not in seen:
+                seen.add(key)
+                merged.append(pair)
+    return merged
+
+
+def pairs_from_texts(texts: List[str]) -> List[Dict[str, str]]:
+    """The merged pairs of several texts (e.g. the cached pages of one file)."""
+    return merge_pairs(
+        *(
+            [{"model_name": model, "part_number": part} for model, part in result.pairs]
+            for result in extract_pairs_batch(texts)
+            if result.pairs
+        )
+    )
+
+
+def merge_cached_pairs(doc: Any) -> Any:
+    """Merges the pairs left in CACHED_PAIRS_KEY by a changed-page re-parse into doc's pairs."""
+    metadata = getattr(doc, "metadata", None)
+    if not metadata or CACHED_PAIRS_KEY not in metadata:
+        return doc
+    cached_pairs = metadata.pop(CACHED_PAIRS_KEY)
+    pairs = merge_pairs(metadata.get("pairs"), cached_pairs)
+    if pairs:
+        metadata["pairs"] = pairs
+    return doc
+
+
+def postprocess_extract_pairs(doc: Any) -> Any:
+    """
+    Finds the "Metadata: {'pairs': [...]}" block, adds the pairs to metadata as
+    a list of {'model_name', 'part_number'} dicts, and removes the block from
+    the text unless it is the entire content. Returns the modified document.
+    """
+    return apply_pairs_result(doc, extract_pairs(getattr(doc, "text", "") or ""))
+
+
+async def apply_pairs_extraction(docs: List[Any], pool: Optional[Executor] = None) -> List[Any]:
+    """
+    Runs pairs extraction over one file's Documents, in a worker process when a
+    pool is given and the text is large, inline otherwise.
+    """
+    texts = [getattr(doc, "text", "") or "" for doc in docs]
+    if pool is not None and sum(len(text) for text in texts) >= POOL_MIN_CHARS:
+        results = await asyncio.get_running_loop().run_in_executor(
+            pool, extract_pairs_batch, texts
+        )
+    else:
+        results = extract_pairs_batch(texts)
+    return [merge_cached_pairs(apply_pairs_result(doc, result)) for doc, result in zip(docs, results)]
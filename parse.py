@@ -22,11 +22,10 @@ import time
 import argparse
 import asyncio
 import pickle
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 import logging
-import ast
-import re
 
 # Make sure llama-cloud is installed and import LlamaParse
 try:
@@ -38,6 +37,21 @@ except ImportError:
 
 from llama_index.core import Document
 
+from offline_providers import OFFLINE_API_KEY, offline_provider_url
+from parse_cache import (
+    ParseCache,
+    add_cache_arguments,
+    iter_parse_files_with_cache,
+    parser_config_hash,
+)
+from parse_shards import ShardedDocWriter
+from adaptive_concurrency import AdaptiveConcurrencyLimiter
+from pairs_extraction import apply_pairs_extraction
+
+# Processing config recorded with each shard (same labels as parse_pdf_md.py),
+# so a resumed run re-parses files written under different settings
+PARSE_MODE = "Custom Prompt/Pair Extraction"
+
 # Custom parsing prompt for technical documents (Same as baseline)
 DATASHEET_PARSE_PROMPT = """# CRITICAL PARSING INSTRUCTIONS - FOLLOW EXACTLY
 
@@ -119,16 +133,24 @@ def create_parser() -> LlamaParse:
     """Create and configure the LlamaParse instance using user_prompt."""
     # Get API key from environment variable
     # Prefer LLAMA_CLOUD_API_KEY if available
+    offline_url = offline_provider_url()
     api_key = os.environ.get("LLAMA_CLOUD_API_KEY")
     if not api_key:
         api_key = os.environ.get("OPENAI_API_KEY")  # Fallback
-        if not api_key:
+        if not api_key and offline_url:
+            api_key = OFFLINE_API_KEY
+        elif not api_key:
             raise ValueError(
                 "LLAMA_CLOUD_API_KEY or OPENAI_API_KEY environment variable must be set"
             )
         else:
             logging.info("Using OPENAI_API_KEY as fallback.")
 
+    extra_args = {}
+    if offline_url:
+        logging.info(f"Using offline LlamaParse stand-in at {offline_url}")
+        extra_args["base_url"] = offline_url
+
     logging.info("Initializing LlamaParse with user_prompt...")
     # Use settings that worked in the baseline `parse_backup2.py`
     return LlamaParse(
@@ -141,6 +163,7 @@ def create_parser() -> LlamaParse:
         do_not_cache=True,  # Keep for development
         verbose=True,  # Keep verbose logging
         user_prompt=DATASHEET_PARSE_PROMPT,
+        **extra_args,
     )
 
 
@@ -231,125 +254,6 @@ def create_parser() -> LlamaParse:
 #     return doc
 
 
-# --- Post-processing Function (Final Robust Version - Dictionary Format) ---
-def postprocess_extract_pairs(doc: Document) -> Document:
-    """
-    Finds "Metadata: {'pairs': ...}" block using line-anchored regex, parses it,
-    converts pairs to a list of dictionaries [{'model_name': ..., 'part_number': ...}],
-    adds this list to metadata, and conditionally removes the block using set_content
-    ONLY if the block doesn't constitute the entire text content.
-    Returns the modified document.
-    """
-    # Use ORIGINAL REGEX with ^ and $ anchors
-    metadata_pairs_regex = re.compile(
-        r"^\s*Metadata:\s*\{\s*['\"]pairs['\"]\s*:\s*(\[.*?\])\s*\}\s*$",  # Original ^...$
-        re.MULTILINE | re.DOTALL | re.IGNORECASE,
-    )
-
-    # Ensure metadata dict exists if we need to add to it later
-    if not hasattr(doc, "metadata") or doc.metadata is None:
-        doc.metadata = {}
-
-    # Check if text exists and is not empty/whitespace before proceeding
-    if hasattr(doc, "text") and doc.text and doc.text.strip():
-        original_text = doc.text
-        match = metadata_pairs_regex.search(original_text)
-
-        if match:
-            pairs_string = match.group(1)  # The list part '[...]'
-            matched_block = match.group(0)  # The entire matched block "Metadata: {...}"
-            logging.debug(
-                f"Found potential pairs string snippet: {pairs_string[:100]}..."
-            )
-
-            try:
-                # Parse the string representation of the list of tuples
-                raw_extracted_pairs = ast.literal_eval(pairs_string)
-
-                # Validate the raw format first (must be a list)
-                if isinstance(raw_extracted_pairs, list):
-                    # --- Convert to List of Dictionaries ---
-                    structured_pairs = []
-                    all_tuples_valid = (
-                        True  # Flag to track if all items had the correct tuple format
-                    )
-
-                    if not raw_extracted_pairs:  # Handle empty list case
-                        pass  # Empty list is fine
-                    else:
-                        # Iterate through the parsed tuples
-                        for p in raw_extracted_pairs:
-                            # Validate each item as (str, str) tuple
-                            if (
-                                isinstance(p, tuple)
-                                and len(p) == 2
-                                and isinstance(p[0], str)
-                                and isinstance(p[1], str)
-                            ):
-                                # Create dictionary for this pair
-                                structured_pairs.append(
-                                    {"model_name": p[0], "part_number": p[1]}
-                                )
-                            else:
-                                # Encountered an invalid item in the list
-                                all_tuples_valid = False
-                                logging.warning(
-                                    f"Invalid tuple format within pairs list for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}. Item: {p}. Keeping block in text."
-                                )
-                                break  # Stop processing this block if one tuple is bad
-                    # --- End Conversion ---
-
-                    # Proceed only if all original tuples were valid
-                    if all_tuples_valid:
-                        # Assign the list of dictionaries to metadata
-                        doc.metadata["pairs"] = structured_pairs
-                        logging.info(
-                            f"Extracted {len(structured_pairs)} pairs to metadata (dict format) for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}"
-                        )
-
-                        # --- Conditional Removal Logic (remains the same) ---
-                        # Compare stripped versions to see if block was the only non-whitespace content
-                        if matched_block.strip() == original_text.strip():
-                            logging.warning(
-                                f"Metadata block is entire content for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}. Leaving block in text."
-                            )
-                            # DO NOT MODIFY TEXT in this case
-                        else:
-                            # Metadata block is part of larger text content, remove it safely
-                            logging.debug(
-                                f"Removing metadata block from text for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}"
-                            )
-                            # Use re.sub on the original text, then strip the result
-                            new_text = metadata_pairs_regex.sub(
-                                "", original_text
-                            ).strip()
-                            # Ensure set_content exists before calling
-                            if hasattr(doc, "set_content"):
-                                doc.set_content(new_text)
-                            else:
-                                logging.error(
-                                    "Document object missing 'set_content' method. Cannot remove metadata block from text."
-                                )
-
-                    # else: all_tuples_valid was false, already logged warning, do nothing further to text
-
-                else:  # Original structure wasn't a list
-                    logging.warning(
-                        f"Extracted pairs structure not a list for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}. Keeping block in text."
-                    )
-
-            except (ValueError, SyntaxError) as e:  # Error during ast.literal_eval
-                logging.warning(
-                    f"Could not parse pairs string for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}: {e}. Snippet: '{pairs_string[:100]}...'. Keeping block in text."
-                )
-
-        # else: No metadata block found in text, do nothing
-
-    # else: Document has no text or only whitespace, do nothing
-
-    return doc  # Return the document, potentially modified or not
-
-
 # --- Parallel Processing Core (Re-enable post-processing call) ---
 async def process_documents_parallel(
     file_list: List[Path],
@@ -357,13 +261,23 @@ async def process_documents_parallel(
     max_workers: int = 4,  # Using updated defaults
     max_retries: int = 3,
     timeout_seconds: int = 180,
+    cache: Optional[ParseCache] = None,
+    refresh: bool = False,
+    writer: Optional[ShardedDocWriter] = None,
+    max_concurrency: Optional[int] = None,
 ) -> List[Document]:  # Return flat list
     """
     Process multiple documents in parallel using async.
-    Returns a flat list of all processed Document objects.
+    Returns a flat list of all processed Document objects, or an empty list
+    when a writer is given (each file is then persisted as it completes).
     """
     all_processed_docs = []
 
+    # AIMD limiter: starts at max_workers and adapts up to max_concurrency
+    limiter = AdaptiveConcurrencyLimiter(
+        initial=max_workers, max_limit=max_concurrency or max_workers
+    )
+
     async def process_single_doc(fname: Path):
         # Re-initialize parser instance for each job for safety
         try:
@@ -378,23 +292,31 @@ async def process_documents_parallel(
                 invalidate_cache=parser_template.invalidate_cache,
                 do_not_cache=parser_template.do_not_cache,
                 verbose=parser_template.verbose,
+                base_url=parser_template.base_url,
+                # Surface 429s/timeouts to the concurrency limiter instead of returning []
+                ignore_errors=False,
                 # Add other relevant params if needed (like auto_mode if reintroduced)
             )
         except Exception as init_e:
             logging.error(f"Failed to re-initialize parser for {fname.name}: {init_e}")
             return None
 
+        file_mb = fname.stat().st_size / (1 << 20)
         for attempt in range(max_retries):
             try:
                 logging.info(
                     f"Attempt {attempt + 1}/{max_retries} parsing {fname.name} (Timeout: {timeout_seconds}s)..."
                 )
-                start_time = time.time()
-                # Use asyncio.wait_for for timeout control
-                parsed_doc_list = await asyncio.wait_for(
-                    parser.aload_data(str(fname)), timeout=timeout_seconds
-                )
-                elapsed = time.time() - start_time
+                # Slot per attempt so backoff sleeps don't hold capacity; small files go first
+                async with limiter.slot(priority=file_mb, cost=file_mb) as slot:
+                    start_time = time.time()
+                    # Use asyncio.wait_for for timeout control
+                    parsed_doc_list = await asyncio.wait_for(
+                        parser.aload_data(str(fname)), timeout=timeout_seconds
+                    )
+                    elapsed = time.time() - start_time
+                    if not parsed_doc_list:
+                        slot.outcome = "error"
                 if (
                     parsed_doc_list
                     and isinstance(parsed_doc_list, list)
@@ -424,43 +346,58 @@ async def process_documents_parallel(
         logging.error(f"Failed to parse {fname.name} after {max_retries} attempts")
         return None
 
-    semaphore = asyncio.Semaphore(max_workers)
 
-    async def process_with_semaphore(fname):
-        async with semaphore:
-            return fname, await process_single_doc(fname)
+    # Identical files are parsed once; cached results skip LlamaParse entirely.
+    # Files are post-processed as they complete; with a writer they go straight to disk.
+    config_hash = parser_config_hash(parser_template)
+    docs_by_file: Dict[Path, List[Document]] = {}
+    # Pairs extraction on big catalogs is CPU-bound; workers start only when needed.
+    # The with block shuts the pool down even if parsing fails or is cancelled.
+    with ProcessPoolExecutor() as pairs_pool:
+        async for fname, doc_list_result, file_hash in iter_parse_files_with_cache(
+            file_list, process_single_doc, cache, config_hash, refresh=refresh
+        ):
+            if doc_list_result:
+                file_name = fname.name
+                total_docs_in_file = len(doc_list_result)
+                logging.info(
+                    f"Post-processing {total_docs_in_file} sections from {file_name}"
+                )
+                for i, doc in enumerate(doc_list_result, 1):
+                    # 1. Ensure metadata exists
+                    if not hasattr(doc, "metadata") or doc.metadata is None:
+                        doc.metadata = {}
+                    # 2. Add standard metadata
+                    doc.metadata["source"] = str(fname.resolve())
+                    doc.metadata["file_name"] = file_name
+                    doc.metadata["doc_num"] = i
+                    doc.metadata["total_docs_in_file"] = total_docs_in_file
+
+                # 3. Move pairs blocks to metadata (large files go to a worker process)
+                file_docs = await apply_pairs_extraction(doc_list_result, pairs_pool)
+                if writer:
+                    await asyncio.to_thread(writer.write, fname, file_docs, file_hash)
+                else:
+                    docs_by_file[fname] = file_docs
+                logging.info(f"✅ Finished post-processing {file_name}")
+            else:
+                logging.warning(
+                    f"❌ {fname.name}: Failed to parse or returned empty result."
+                )
+                if writer:
+                    await asyncio.to_thread(
+                        writer.record_failure, fname, "Failed to parse or returned empty result."
+                    )
 
-    tasks = [process_with_semaphore(fname) for fname in file_list]
-    results_list = await asyncio.gather(*tasks)
+    summary = limiter.summary()
+    logging.info(
+        f"Parse concurrency: final {summary['final_limit']}, peak {summary['peak_limit']}, "
+        f"outcomes {summary['counts']}, trajectory {limiter.format_trajectory()}"
+    )
 
-    # Process results: Combine all documents into a single list and apply post-processing
-    for fname, doc_list_result in results_list:
-        if doc_list_result:
-            file_name = fname.name
-            total_docs_in_file = len(doc_list_result)
-            logging.info(
-                f"Post-processing {total_docs_in_file} sections from {file_name}"
-            )
-            for i, doc in enumerate(doc_list_result, 1):
-                # 1. Ensure metadata exists
-                if not hasattr(doc, "metadata") or doc.metadata is None:
-                    doc.metadata = {}
-                # 2. Add standard metadata
-                doc.metadata["source"] = str(fname.resolve())
-                doc.metadata["file_name"] = file_name
-                doc.metadata["doc_num"] = i
-                doc.metadata["total_docs_in_file"] = total_docs_in_file
-
-                # 3. --- RE-ENABLE POST-PROCESSING CALL ---
-                processed_doc = postprocess_extract_pairs(doc)
-                # ----------------------------------------
-
-                all_processed_docs.append(processed_doc)
-            logging.info(f"✅ Finished post-processing {file_name}")
-        else:
-            logging.warning(
-                f"❌ {fname.name}: Failed to parse or returned empty result."
-            )
+    # Keep input order regardless of completion order
+    for fname in file_list:
+        all_processed_docs.extend(docs_by_file.get(fname, []))
     return all_processed_docs
 
 
@@ -485,6 +422,13 @@ async def main(
     max_workers: int,
     timeout: int,
     max_retries: int = 3,  # Make retries consistent or add arg
+    cache_dir: Optional[str] = None,
+    refresh: bool = False,
+    cache_max_gb: Optional[float] = None,
+    cache_max_age_days: Optional[float] = None,
+    restart: bool = False,
+    no_consolidate: bool = False,
+    max_concurrency: Optional[int] = None,
 ):
     """
     Main async function to orchestrate the parsing process.
@@ -521,47 +465,63 @@ async def main(
         logging.error(f"Failed to create LlamaParse instance: {e}", exc_info=True)
         return
 
+    cache = None
+    if cache_dir:
+        cache = ParseCache(cache_dir, max_gb=cache_max_gb, max_age_days=cache_max_age_days)
+        logging.info(f"Using parse cache at {cache_dir}{' (refresh: ignoring cached results)' if refresh else ''}")
+
+    # Results are written per file as they complete; completed files from an
+    # interrupted earlier run are skipped.
+    writer = ShardedDocWriter(output_file, restart=restart, config=PARSE_MODE)
+    pending_files = await asyncio.to_thread(writer.pending, file_list)
+
     # Process documents in parallel
     start_run_time = time.time()
     logging.info(
-        f"Starting parallel processing (Max Workers: {max_workers}, Timeout: {timeout}s)..."
-    )
-    processed_docs = await process_documents_parallel(
-        file_list,
-        parser_template,
-        max_workers=max_workers,
-        timeout_seconds=timeout,
-        max_retries=max_retries,
+        f"Starting parallel processing of {len(pending_files)} file(s) (Workers: {max_workers} adaptive up to {max_concurrency}, Timeout: {timeout}s)..."
     )
+    if pending_files:
+        await process_documents_parallel(
+            pending_files,
+            parser_template,
+            max_workers=max_workers,
+            timeout_seconds=timeout,
+            max_retries=max_retries,
+            cache=cache,
+            refresh=refresh,
+            writer=writer,
+            max_concurrency=max_concurrency,
+        )
     end_run_time = time.time()
 
     # Print summary
     total_files_attempted = len(file_list)
-    total_docs_generated = len(processed_docs)
-    successful_files_sources = set()
-    if processed_docs:
-        successful_files_sources = set(
-            doc.metadata.get("source")
-            for doc in processed_docs
-            if doc.metadata.get("source")
-        )
-    successful_files = len(successful_files_sources)
+    successful_files = len(writer.completed_sources(file_list))
     failed_files = total_files_attempted - successful_files
+    resumed_files = total_files_attempted - len(pending_files)
 
     print(f"\n--- Run Summary ---")
     print(f"Output File: {output_file}")
+    print(f"Per-file results: {writer.parts_dir}")
     print(f"Attempted to process {total_files_attempted} input file(s).")
+    if resumed_files:
+        print(f"Skipped {resumed_files} file(s) already completed by a previous run.")
     print(f"Successfully parsed {successful_files} file(s).")
     if failed_files > 0:
-        print(f"Failed to parse {failed_files} file(s) after retries.")
-    print(f"Generated {total_docs_generated} total document sections.")
+        print(f"Failed to parse {failed_files} file(s) after retries (re-run to retry them).")
+    if cache:
+        print(f"Parse cache: {cache.hits} hit(s), {cache.misses} miss(es), {cache.writes} new entr(ies).")
+        cache.evict()
     print(f"Total processing time: {end_run_time - start_run_time:.2f} seconds.")
 
-    # Save to pickle file
-    if processed_docs:
-        save_docs_to_pickle(processed_docs, output_file)
-    else:
+    # Consolidate shards into the single pickle used downstream
+    if successful_files == 0:
         print("\nNo documents were successfully processed or generated.")
+    elif no_consolidate:
+        print("\nSkipping consolidation (--no_consolidate); shards are in the parts directory.")
+    else:
+        total_docs_generated = writer.consolidate(file_list)
+        print(f"Generated {total_docs_generated} total document sections.")
 
 
 if __name__ == "__main__":
@@ -601,14 +561,20 @@ if __name__ == "__main__":
         "-o",
         type=str,
         default="parsed_docs.pkl",
-        help="Path to save the processed documents list.",
+        help="Path to save the processed documents list (a node store if it ends in .nodes).",
     )
     parser.add_argument(
         "--max_workers",
         "-w",
         type=int,
         default=4,
-        help="Maximum number of concurrent parsing workers.",
+        help="Initial number of concurrent parsing workers (adapted up to --max_concurrency).",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=16,
+        help="Upper bound for adaptive parse concurrency. Set equal to --max_workers for a fixed limit.",
     )
     parser.add_argument(
         "--timeout",
@@ -617,6 +583,17 @@ if __name__ == "__main__":
         default=180,
         help="Timeout in seconds for parsing each file.",
     )
+    add_cache_arguments(parser)
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Discard per-file results from a previous interrupted run instead of resuming.",
+    )
+    parser.add_argument(
+        "--no_consolidate",
+        action="store_true",
+        help="Leave results as per-file shards (<output_file>.parts/) without writing the combined pickle.",
+    )
     # Consider adding --max_retries if needed
 
     args = parser.parse_args()
@@ -630,6 +607,13 @@ if __name__ == "__main__":
                 output_file=args.output_file,
                 max_workers=args.max_workers,
                 timeout=args.timeout,
+                cache_dir=None if args.no_cache else args.cache_dir,
+                refresh=args.refresh,
+                cache_max_gb=args.cache_max_gb,
+                cache_max_age_days=args.cache_max_age_days,
+                restart=args.restart,
+                no_consolidate=args.no_consolidate,
+                max_concurrency=args.max_concurrency,
             )
         )
     except (FileNotFoundError, ValueError) as e:
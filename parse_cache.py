@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Content-addressed on-disk cache for LlamaParse results.
+
+Entries are keyed by the sha256 of the PDF bytes plus a hash of the parser
+configuration (result_type, auto_mode flags, user_prompt), so a datasheet that
+sits in several input directories is parsed once, and changing the prompt
+invalidates old results. Entries hold the raw LlamaParse Documents, before any
+metadata or pairs post-processing, so they can be reused for any path.
+
+Eviction is least-recently-used (hits refresh an entry's mtime), bounded by
+total size and optionally by age.
+
+Used by parse.py and parse_pdf_md.py. Can also be run directly to inspect or
+prune the cache:
+
+Usage:
+    python parse_cache.py --cache_dir .parse_cache --stats
+    python parse_cache.py --cache_dir .parse_cache --max_gb 2 --max_age_days 90
+    python parse_cache.py --cache_dir .parse_cache --clear
+"""
+
+import os
+import copy
+import json
+import time
+import pickle
+import asyncio
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Bump when the stored payload format changes; old entries then simply miss.
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = ".parse_cache"
+DEFAULT_MAX_GB = 5.0
+
+# LlamaParse settings that change the parse output
+PARSER_CONFIG_FIELDS = (
+    "result_type",
+    "auto_mode",
+    "auto_mode_trigger_on_image_in_page",
+    "auto_mode_trigger_on_table_in_page",
+    "user_prompt",
+)
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_sha256(path: Path) -> str:
+    """sha256 of a file's bytes, read in 1 MiB chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parser_config_hash(parser: Any, **extra: Any) -> str:
+    """Hash of the parser settings that affect output (plus any extra key/values)."""
+    config = {field: getattr(parser, field, None) for field in PARSER_CONFIG_FIELDS}
+    config.update(extra)
+    config["cache_format_version"] = CACHE_FORMAT_VERSION
+    payload = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+async def compute_cache_keys(file_list: List[Path], config_hash: str) -> Dict[Path, str]:
+    """Hashes all files off the event loop and returns {path: cache_key}."""
+    file_hashes = await asyncio.gather(
+        *(asyncio.to_thread(file_sha256, fname) for fname in file_list)
+    )
+    return {
+        fname: f"{file_hash}-{config_hash[:16]}"
+        for fname, file_hash in zip(file_list, file_hashes)
+    }
+
+
+class ParseCache:
+    """Pickled parse results stored under <cache_dir>/<key[:2]>/<key>.pkl."""
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_gb: Optional[float] = DEFAULT_MAX_GB,
+        max_age_days: Optional[float] = None,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_gb * (1 << 30)) if max_gb else None
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.pkl"
+
+    def get(self, key: str) -> Optional[List[Any]]:
+        path = self._entry_path(key)
+        if not path.exists():
+            self.misses += 1
+            return None
+        try:
+            with open(path, "rb") as f:
+                docs = pickle.load(f)
+            os.utime(path)  # Mark as recently used for LRU eviction
+            self.hits += 1
+            return docs
+        except Exception as e:
+            logging.warning(f"Discarding unreadable parse cache entry {path.name}: {e}")
+            path.unlink(missing_ok=True)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, docs: List[Any]):
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".tmp{os.getpid()}")
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(docs, f)
+            os.replace(tmp_path, path)  # Atomic, so readers never see partial entries
+            self.writes += 1
+        except Exception as e:
+            logging.warning(f"Could not write parse cache entry {path.name}: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    def _entries(self) -> List[tuple]:
+        entries = []
+        for path in self.cache_dir.glob("*/*.pkl"):
+            try:
+                entries.append((path, path.stat()))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def evict(self) -> int:
+        """Drops expired entries, then least recently used ones until under max size."""
+        entries = sorted(self._entries(), key=lambda e: e[1].st_mtime)
+        now = time.time()
+        removed = 0
+        kept = []
+        for path, st in entries:
+            if self.max_age_seconds and now - st.st_mtime > self.max_age_seconds:
+                path.unlink(missing_ok=True)
+                removed += 1
+            else:
+                kept.append((path, st))
+
+        if self.max_bytes:
+            total = sum(st.st_size for _, st in kept)
+            for path, st in kept:
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= st.st_size
+                removed += 1
+
+        if removed:
+            logging.info(f"Evicted {removed} parse cache entries from {self.cache_dir}")
+        return removed
+
+    def clear(self) -> int:
+        entries = self._entries()
+        for path, _ in entries:
+            path.unlink(missing_ok=True)
+        return len(entries)
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._entries()
+        return {
+            "entries": len(entries),
+            "size_mb": sum(st.st_size for _, st in entries) / (1 << 20),
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+        }
+
+
+async def iter_parse_files_with_cache(
+    file_list: List[Path],
+    parse_one: Callable[[Path], Awaitable[Optional[List[Any]]]],
+    cache: Optional[ParseCache],
+    config_hash: str,
+    refresh: bool = False,
+) -> AsyncIterator[Tuple[Path, Optional[List[Any]], str]]:
+    """
+    Runs parse_one once per distinct file content, serving cache hits from disk.
+
+    Yields (path, docs-or-None, file_sha256) as soon as each file is done, in
+    completion order, so callers can persist results without holding them all.
+    Files with identical bytes (e.g. the same datasheet in two input directories)
+    share one parse; duplicates get deep copies so per-path metadata stays separate.
+    """
+    cache_keys = await compute_cache_keys(file_list, config_hash)
+    paths_by_key: Dict[str, List[Path]] = {}
+    for fname in file_list:
+        paths_by_key.setdefault(cache_keys[fname], []).append(fname)
+
+    duplicates = len(file_list) - len(paths_by_key)
+    if duplicates:
+        logging.info(f"{duplicates} file(s) have the same content as another input and will be parsed once.")
+
+    async def resolve(key: str, fname: Path):
+        if cache and not refresh:
+            cached = await asyncio.to_thread(cache.get, key)
+            if cached is not None:
+                logging.info(f"Parse cache hit for {fname.name} ({len(cached)} sections).")
+                return key, cached
+        docs = await parse_one(fname)
+        if cache and docs:
+            await asyncio.to_thread(cache.put, key, docs)
+        return key, docs
+
+    tasks = [asyncio.create_task(resolve(key, paths[0])) for key, paths in paths_by_key.items()]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            key, docs = await next_done
+            file_hash = key.split("-", 1)[0]
+            for i, fname in enumerate(paths_by_key[key]):
+                yield fname, (copy.deepcopy(docs) if docs and i > 0 else docs), file_hash
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    """Adds the shared parse-cache flags to a script's argument parser."""
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help="Directory for the content-addressed LlamaParse result cache.",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Disable the parse cache entirely.",
+    )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore cached results and re-parse every file (cache is rewritten).",
+    )
+    parser.add_argument(
+        "--cache_max_gb",
+        type=float,
+        default=DEFAULT_MAX_GB,
+        help="Evict least recently used cache entries beyond this total size.",
+    )
+    parser.add_argument(
+        "--cache_max_age_days",
+        type=float,
+        default=None,
+        help="Evict cache entries not used for this many days.",
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+    parser = argparse.ArgumentParser(
+        description="Inspect, prune or clear the LlamaParse result cache.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--cache_dir", type=str, default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--max_gb", type=float, default=DEFAULT_MAX_GB)
+    parser.add_argument("--max_age_days", type=float, default=None)
+    parser.add_argument("--stats", action="store_true", help="Only print cache stats.")
+    parser.add_argument("--clear", action="store_true", help="Remove all entries.")
+    args = parser.parse_args()
+
+    cache = ParseCache(args.cache_dir, max_gb=args.max_gb, max_age_days=args.max_age_days)
+    if args.clear:
+        print(f"Removed {cache.clear()} entries from {args.cache_dir}")
+    elif not args.stats:
+        cache.evict()
+    stats = cache.stats()
+    print(f"Parse cache {args.cache_dir}: {stats['entries']} entries, {stats['size_mb']:.1f} MB")
@@ -668,6 +668,7 @@ as a list of LlamaIndex Document objects in a pickle file.
 Requires:
 - LLAMA_CLOUD_API_KEY or OPENAI_API_KEY in environment variables (for PDF parsing).
 - `pip install llama-cloud llama-index-core python-dotenv` (dotenv is optional)
+- `pip install pypdf` (optional, for --shard_pages, --local_text and --page_diff)
 
 Usage:
     # Process PDF datasheets and MD files (default, custom prompt + pair extraction)
@@ -679,6 +680,15 @@ Usage:
     # Process a single file (auto-detects PDF/MD)
     python parse_pdf_md.py --input_file <file.pdf_or_md> [--disable-pair-extraction]
 
+    # Split PDFs longer than 20 pages into page-range shards parsed concurrently
+    python parse_pdf_md.py --input_dir <dir> --shard_pages 20
+
+    # Extract plain-text pages locally, LlamaParse only tables/figures/part numbers
+    python parse_pdf_md.py --input_dir <dir> --local_text
+
+    # Revised datasheets: re-parse only the pages that changed since earlier runs
+    python parse_pdf_md.py --input_dir <dir> --page_diff
+
     python parse_pdf_md.py --help for more options
 """
 
@@ -687,11 +697,13 @@ import time
 import argparse
 import asyncio
 import pickle
+import codecs
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, NamedTuple, Optional, Tuple
 import logging
-import ast
-import re
 
 # Optional LlamaParse import
 try:
@@ -703,6 +715,15 @@ except ImportError:
     LLAMA_PARSE_INSTALLED = False
     logging.warning("llama_cloud_services not found. PDF parsing will be disabled.")
 
+# Optional pypdf import (page-range sharding of large PDFs)
+try:
+    from pypdf import PdfReader, PdfWriter
+
+    PYPDF_INSTALLED = True
+except ImportError:
+    PdfReader = PdfWriter = None
+    PYPDF_INSTALLED = False
+
 # Required LlamaIndex import
 try:
     from llama_index.core import Document
@@ -712,6 +733,29 @@ except ImportError:
     )
 
 
+from offline_providers import OFFLINE_API_KEY, offline_provider_url
+from parse_cache import (
+    ParseCache,
+    add_cache_arguments,
+    iter_parse_files_with_cache,
+    parser_config_hash,
+)
+from parse_shards import ShardedDocWriter
+from adaptive_concurrency import AdaptiveConcurrencyLimiter
+from pairs_extraction import CACHED_PAIRS_KEY, apply_pairs_extraction, pairs_from_texts
+from local_pdf_text import (
+    analyze_pdf,
+    pdf_page_fingerprints,
+    routing_summary,
+    write_page_subset,
+)
+
+
+MD_ENCODING_SAMPLE_SIZE = 64 * 1024  # Bytes inspected to pick a Markdown file's encoding
+MD_READ_CHUNK_SIZE = 1 << 20
+MD_PROGRESS_EVERY = 500
+
+
 # Custom parsing prompt (only used if --disable-pair-extraction is NOT set)
 # --- FULL PROMPT INCLUDED HERE ---
 DATASHEET_PARSE_PROMPT = """# CRITICAL PARSING INSTRUCTIONS - FOLLOW EXACTLY
@@ -800,10 +844,13 @@ def create_parser(disable_pair_extraction: bool) -> Optional[LlamaParse]:
         logging.warning("LlamaParse library not installed. PDF parsing disabled.")
         return None
 
+    offline_url = offline_provider_url()
     api_key = os.environ.get("LLAMA_CLOUD_API_KEY")
     if not api_key:
         api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
+        if not api_key and offline_url:
+            api_key = OFFLINE_API_KEY
+        elif not api_key:
             logging.warning(
                 "API key (LLAMA_CLOUD_API_KEY or OPENAI_API_KEY) not found. PDF parsing disabled."
             )
@@ -822,6 +869,9 @@ def create_parser(disable_pair_extraction: bool) -> Optional[LlamaParse]:
         "do_not_cache": True,
         "verbose": True,
     }
+    if offline_url:
+        logging.info(f"Using offline LlamaParse stand-in at {offline_url}")
+        init_args["base_url"] = offline_url
 
     # --- Conditionally add user_prompt ---
     if not disable_pair_extraction:
@@ -844,99 +894,87 @@ def create_parser(disable_pair_extraction: bool) -> Optional[LlamaParse]:
         return None
 
 
-# --- Post-processing Function (remains the same, but called conditionally) ---
-def postprocess_extract_pairs(doc: Document) -> Document:
+# --- Parallel Processing Core (Conditional prompt in worker, conditional post-processing) ---
+class PdfShard(NamedTuple):
+    path: Path
+    first_page: int  # 1-based, inclusive
+    last_page: int
+
+
+def split_pdf_into_shards(fname: Path, pages_per_shard: int, shard_dir: Path) -> List[PdfShard]:
     """
-    Finds "Metadata: {'pairs': ...}" block using line-anchored regex, parses it,
-    converts pairs to a list of dictionaries [{'model_name': ..., 'part_number': ...}],
-    adds this list to metadata, and conditionally removes the block using set_content
-    ONLY if the block doesn't constitute the entire text content.
-    Returns the modified document.
+    Splits a PDF into consecutive page-range files of up to pages_per_shard pages.
+    Returns an empty list when the PDF fits in a single shard.
     """
-    metadata_pairs_regex = re.compile(
-        r"^\s*Metadata:\s*\{\s*['\"]pairs['\"]\s*:\s*(\[.*?\])\s*\}\s*$",
-        re.MULTILINE | re.DOTALL | re.IGNORECASE,
-    )
-    if not hasattr(doc, "metadata") or doc.metadata is None:
-        doc.metadata = {}
-    if hasattr(doc, "text") and doc.text and doc.text.strip():
-        original_text = doc.text
-        match = metadata_pairs_regex.search(original_text)
-        if match:
-            pairs_string = match.group(1)
-            matched_block = match.group(0)
-            logging.debug(
-                f"Found potential pairs string snippet: {pairs_string[:100]}..."
-            )
-            try:
-                raw_extracted_pairs = ast.literal_eval(pairs_string)
-                if isinstance(raw_extracted_pairs, list):
-                    structured_pairs = []
-                    all_tuples_valid = True
-                    if not raw_extracted_pairs:
-                        pass
-                    else:
-                        for p in raw_extracted_pairs:
-                            if (
-                                isinstance(p, tuple)
-                                and len(p) == 2
-                                and isinstance(p[0], str)
-                                and isinstance(p[1], str)
-                            ):
-                                structured_pairs.append(
-                                    {"model_name": p[0], "part_number": p[1]}
-                                )
-                            else:
-                                all_tuples_valid = False
-                                logging.warning(
-                                    f"Invalid tuple format within pairs list for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}. Item: {p}. Keeping block in text."
-                                )
-                                break
-                    if all_tuples_valid:
-                        doc.metadata["pairs"] = structured_pairs
-                        logging.info(
-                            f"Extracted {len(structured_pairs)} pairs to metadata (dict format) for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}"
-                        )
-                        if matched_block.strip() == original_text.strip():
-                            logging.warning(
-                                f"Metadata block is entire content for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}. Leaving block in text."
-                            )
-                        else:
-                            logging.debug(
-                                f"Removing metadata block from text for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}"
-                            )
-                            new_text = metadata_pairs_regex.sub(
-                                "", original_text
-                            ).strip()
-                            if hasattr(doc, "set_content"):
-                                doc.set_content(new_text)
-                            else:
-                                logging.error(
-                                    "Document object missing 'set_content' method."
-                                )
-                else:
-                    logging.warning(
-                        f"Extracted pairs structure not a list for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}. Keeping block in text."
-                    )
-            except (ValueError, SyntaxError) as e:
-                logging.warning(
-                    f"Could not parse pairs string for doc {doc.metadata.get('file_name', '?')} sec {doc.metadata.get('doc_num', '?')}: {e}. Snippet: '{pairs_string[:100]}...'. Keeping block in text."
-                )
-    return doc
+    reader = PdfReader(str(fname))
+    total_pages = len(reader.pages)
+    if total_pages <= pages_per_shard:
+        return []
+    shards = []
+    for start in range(0, total_pages, pages_per_shard):
+        end = min(start + pages_per_shard, total_pages)
+        writer = PdfWriter()
+        for page_index in range(start, end):
+            writer.add_page(reader.pages[page_index])
+        shard_path = shard_dir / f"{fname.stem}.p{start + 1:04d}-{end:04d}.pdf"
+        with open(shard_path, "wb") as f:
+            writer.write(f)
+        shards.append(PdfShard(shard_path, start + 1, end))
+    return shards
+
+
+def merge_routed_pages(
+    analysis: Dict[str, Any], llamaparse_docs: List[Document], file_name: str
+) -> List[Document]:
+    """
+    Interleaves locally extracted text pages with the LlamaParse results for the
+    remaining pages, in original page order.
+    """
+    complex_pages = [page for page in analysis["pages"] if page["kind"] != "text"]
+    one_per_page = len(llamaparse_docs) == len(complex_pages)
+    if complex_pages and not one_per_page:
+        # Can't map sections to pages; keep them together at the first routed page
+        logging.warning(
+            f"LlamaParse returned {len(llamaparse_docs)} sections for {len(complex_pages)} pages of {file_name}."
+        )
+    merged = []
+    remaining = iter(llamaparse_docs)
+    for page in analysis["pages"]:
+        if page["kind"] == "text":
+            merged.append(Document(text=page["markdown"]))
+        elif one_per_page:
+            merged.append(next(remaining))
+        elif page is complex_pages[0]:
+            merged.extend(llamaparse_docs)
+    return merged
 
 
-# --- Parallel Processing Core (Conditional prompt in worker, conditional post-processing) ---
 async def process_pdf_documents_parallel(
     pdf_file_list: List[Path],
     parser_template: LlamaParse,  # Template created by create_parser
     max_workers: int = 4,
     max_retries: int = 3,
     timeout_seconds: int = 180,
+    cache: Optional[ParseCache] = None,
+    refresh: bool = False,
+    writer: Optional[ShardedDocWriter] = None,
+    max_concurrency: Optional[int] = None,
+    shard_pages: int = 0,
+    local_text: bool = False,
+    local_workers: Optional[int] = None,
+    page_cache: Optional[ParseCache] = None,
 ) -> List[Document]:
     """
     Process PDF documents in parallel using LlamaParse.
+    PDFs longer than shard_pages (if > 0) are split locally into page-range
+    shards that are parsed concurrently and stitched back in page order.
+    With local_text, plain-text pages are extracted locally (in a process pool)
+    and only pages with tables, figures or part numbers are sent to LlamaParse.
+    With a page_cache, pages seen in an earlier run (by content fingerprint) are
+    reused and only new or changed pages are parsed.
     Applies post-processing ONLY if the parser template was created with the custom prompt.
-    Returns a flat list of processed Document objects.
+    Returns a flat list of processed Document objects, or an empty list when a
+    writer is given (each file is then persisted as it completes).
     """
     all_processed_pdf_docs = []
     # Retrieve the setting from the template using the internal attribute name
@@ -944,42 +982,44 @@ async def process_pdf_documents_parallel(
         parser_template, "_internal_disable_pair_extraction", True
     )  # Default to disabled if attribute missing
 
-    async def process_single_pdf(fname: Path):
-        # Define arguments for re-initialization
-        worker_init_args = {
-            "api_key": parser_template.api_key,
-            "result_type": parser_template.result_type,
-            "auto_mode": parser_template.auto_mode,
-            "auto_mode_trigger_on_image_in_page": getattr(
-                parser_template, "auto_mode_trigger_on_image_in_page", False
-            ),  # Use getattr for safety
-            "auto_mode_trigger_on_table_in_page": getattr(
-                parser_template, "auto_mode_trigger_on_table_in_page", False
-            ),
-            "invalidate_cache": parser_template.invalidate_cache,
-            "do_not_cache": parser_template.do_not_cache,
-            "verbose": parser_template.verbose,
-        }
-        # Conditionally add user_prompt based on template setting
-        if not disable_pair_extraction:
-            # Check if user_prompt actually exists on template before accessing
-            if hasattr(parser_template, "user_prompt") and parser_template.user_prompt:
-                worker_init_args["user_prompt"] = parser_template.user_prompt
-            else:
-                # This case should ideally not happen if disable_pair_extraction is False, but good to handle
-                logging.warning(
-                    f"Pair extraction enabled but user_prompt missing on template for {fname.name}. Proceeding without custom prompt."
-                )
-
-        try:
-            parser = LlamaParse(**worker_init_args)
-        except Exception as init_e:
-            logging.error(
-                f"Failed to re-initialize worker parser for PDF {fname.name}: {init_e}"
+    # AIMD limiter: starts at max_workers and adapts up to max_concurrency
+    limiter = AdaptiveConcurrencyLimiter(
+        initial=max_workers, max_limit=max_concurrency or max_workers
+    )
+    page_counts = {"local": 0, "llamaparse": 0, "reused": 0, "changed": 0}
+
+    # Define arguments for worker re-initialization
+    worker_init_args = {
+        "api_key": parser_template.api_key,
+        "result_type": parser_template.result_type,
+        "auto_mode": parser_template.auto_mode,
+        "auto_mode_trigger_on_image_in_page": getattr(
+            parser_template, "auto_mode_trigger_on_image_in_page", False
+        ),  # Use getattr for safety
+        "auto_mode_trigger_on_table_in_page": getattr(
+            parser_template, "auto_mode_trigger_on_table_in_page", False
+        ),
+        "invalidate_cache": parser_template.invalidate_cache,
+        "do_not_cache": parser_template.do_not_cache,
+        "verbose": parser_template.verbose,
+        "base_url": parser_template.base_url,
+        # Surface 429s/timeouts to the concurrency limiter instead of returning []
+        "ignore_errors": False,
+    }
+    # Conditionally add user_prompt based on template setting
+    if not disable_pair_extraction:
+        # Check if user_prompt actually exists on template before accessing
+        if hasattr(parser_template, "user_prompt") and parser_template.user_prompt:
+            worker_init_args["user_prompt"] = parser_template.user_prompt
+        else:
+            # This case should ideally not happen if disable_pair_extraction is False, but good to handle
+            logging.warning(
+                "Pair extraction enabled but user_prompt missing on template. Proceeding without custom prompt."
             )
-            return None
 
-        # Parsing Loop
+    async def parse_with_retries(parser: LlamaParse, path: Path):
+        """Runs one LlamaParse job (a whole PDF or one page-range shard) with retries."""
+        file_mb = path.stat().st_size / (1 << 20)
         for attempt in range(max_retries):
             try:
                 log_prefix = (
@@ -988,128 +1028,324 @@ async def process_pdf_documents_parallel(
                     else "(Default Prompt)"
                 )
                 logging.info(
-                    f"Attempt {attempt + 1}/{max_retries} parsing PDF {log_prefix} {fname.name} (Timeout: {timeout_seconds}s)..."
-                )
-                start_time = time.time()
-                parsed_doc_list = await asyncio.wait_for(
-                    parser.aload_data(str(fname)), timeout=timeout_seconds
+                    f"Attempt {attempt + 1}/{max_retries} parsing PDF {log_prefix} {path.name} (Timeout: {timeout_seconds}s)..."
                 )
-                elapsed = time.time() - start_time
+                # Slot per attempt so backoff sleeps don't hold capacity; small files go first
+                async with limiter.slot(priority=file_mb, cost=file_mb) as slot:
+                    start_time = time.time()
+                    parsed_doc_list = await asyncio.wait_for(
+                        parser.aload_data(str(path)), timeout=timeout_seconds
+                    )
+                    elapsed = time.time() - start_time
+                    if not parsed_doc_list:
+                        slot.outcome = "error"
                 if (
                     parsed_doc_list
                     and isinstance(parsed_doc_list, list)
                     and len(parsed_doc_list) > 0
                 ):
                     logging.info(
-                        f"Successfully parsed PDF {fname.name} into {len(parsed_doc_list)} sections in {elapsed:.2f} seconds."
+                        f"Successfully parsed PDF {path.name} into {len(parsed_doc_list)} sections in {elapsed:.2f} seconds."
                     )
                     return parsed_doc_list
                 else:
                     logging.warning(
-                        f"No content returned for PDF {fname.name} on attempt {attempt + 1}"
+                        f"No content returned for PDF {path.name} on attempt {attempt + 1}"
                     )
             except asyncio.TimeoutError:
                 logging.error(
-                    f"Timeout error ({timeout_seconds}s) on attempt {attempt + 1} for PDF {fname.name}"
+                    f"Timeout error ({timeout_seconds}s) on attempt {attempt + 1} for PDF {path.name}"
                 )
             except Exception as e:
                 logging.error(
-                    f"Error on attempt {attempt + 1} for PDF {fname.name}: {str(e)}",
+                    f"Error on attempt {attempt + 1} for PDF {path.name}: {str(e)}",
                     exc_info=True,
                 )
             if attempt < max_retries - 1:
                 backoff_time = 2**attempt
-                logging.info(f"Retrying {fname.name} in {backoff_time} seconds...")
+                logging.info(f"Retrying {path.name} in {backoff_time} seconds...")
                 await asyncio.sleep(backoff_time)
-        logging.error(f"Failed to parse PDF {fname.name} after {max_retries} attempts")
+        logging.error(f"Failed to parse PDF {path.name} after {max_retries} attempts")
         return None
 
-    # Semaphore and Task Gathering
-    semaphore = asyncio.Semaphore(max_workers)
+    async def parse_pdf_file(parser: LlamaParse, path: Path):
+        """Parses a whole PDF, or its page-range shards when it is longer than shard_pages."""
+        if not shard_pages:
+            return await parse_with_retries(parser, path)
 
-    async def process_with_semaphore(fname):
-        async with semaphore:
-            return fname, await process_single_pdf(fname)
+        # Large PDFs: parse page-range shards concurrently, stitch back in page order
+        with tempfile.TemporaryDirectory(prefix="pdf_shards_") as shard_dir:
+            try:
+                shards = await asyncio.to_thread(
+                    split_pdf_into_shards, path, shard_pages, Path(shard_dir)
+                )
+            except Exception as e:
+                logging.warning(f"Could not split {path.name} into shards ({e}); parsing it whole.")
+                shards = []
+            if len(shards) <= 1:
+                return await parse_with_retries(parser, path)
 
-    tasks = [process_with_semaphore(fname) for fname in pdf_file_list]
-    results_list = await asyncio.gather(*tasks)
+            logging.info(
+                f"Parsing {path.name} as {len(shards)} page-range shards of up to {shard_pages} pages."
+            )
+            shard_results = await asyncio.gather(
+                *(parse_with_retries(parser, shard.path) for shard in shards)
+            )
+        failed = [shard for shard, docs in zip(shards, shard_results) if not docs]
+        if failed:
+            ranges = ", ".join(f"pages {s.first_page}-{s.last_page}" for s in failed)
+            logging.error(f"Failed to parse {path.name}: shard(s) {ranges} did not return content.")
+            return None
+        return [doc for docs in shard_results for doc in docs]
 
-    # Process results: Add metadata and CONDITIONALLY apply post-processing
-    for fname, doc_list_result in results_list:
-        if doc_list_result:
-            file_name = fname.name
-            total_docs_in_file = len(doc_list_result)
-            post_processing_status = (
-                "Applying" if not disable_pair_extraction else "Skipping"
+    async def parse_routed(parser: LlamaParse, path: Path):
+        """Parses a PDF, extracting plain-text pages locally when local_text is on."""
+        if not local_text:
+            return await parse_pdf_file(parser, path)
+
+        # Plain-text pages are extracted locally; only the rest go to LlamaParse
+        with tempfile.TemporaryDirectory(prefix="pdf_local_") as tmp_dir:
+            subset_path = Path(tmp_dir) / f"{path.stem}.llamaparse.pdf"
+            try:
+                analysis = await asyncio.get_running_loop().run_in_executor(
+                    cpu_pool, analyze_pdf, str(path), str(subset_path), not disable_pair_extraction
+                )
+            except Exception as e:
+                logging.warning(
+                    f"Local extraction failed for {path.name} ({e}); sending the whole file to LlamaParse."
+                )
+                return await parse_pdf_file(parser, path)
+
+            local_pages = sum(1 for page in analysis["pages"] if page["kind"] == "text")
+            page_counts["local"] += local_pages
+            page_counts["llamaparse"] += analysis["total_pages"] - local_pages
+            logging.info(f"PDF {path.name}: {routing_summary(analysis)}")
+            if not local_pages:
+                return await parse_pdf_file(parser, path)
+            llamaparse_docs = []
+            if analysis["subset_path"]:
+                llamaparse_docs = await parse_pdf_file(parser, subset_path)
+                if not llamaparse_docs:
+                    return None
+        return merge_routed_pages(analysis, llamaparse_docs, path.name)
+
+    async def parse_changed_pages(parser: LlamaParse, fname: Path):
+        """
+        Reuses earlier results for pages whose fingerprint was seen before and
+        parses only the new or changed pages (a revised datasheet usually
+        touches one or two). Results are stored per page for future revisions.
+        """
+        try:
+            fingerprints = await asyncio.get_running_loop().run_in_executor(
+                cpu_pool, pdf_page_fingerprints, str(fname)
             )
+        except Exception as e:
+            logging.warning(f"Could not fingerprint pages of {fname.name} ({e}); parsing it whole.")
+            return await parse_routed(parser, fname)
+        page_keys = [f"{fp}-{config_hash[:16]}" for fp in fingerprints]
+        cached_pages = await asyncio.gather(
+            *(asyncio.to_thread(page_cache.get, key) for key in page_keys)
+        )
+        changed = [num for num, cached in enumerate(cached_pages, 1) if cached is None]
+
+        if not changed:
+            docs = []
+        elif len(changed) == len(page_keys):
+            docs = await parse_routed(parser, fname)
+        else:
             logging.info(
-                f"{post_processing_status} pairs post-processing for {total_docs_in_file} sections from PDF {file_name}"
+                f"PDF {fname.name}: {len(page_keys) - len(changed)} of {len(page_keys)} pages unchanged, re-parsing pages {changed}."
+            )
+            with tempfile.TemporaryDirectory(prefix="pdf_changed_") as tmp_dir:
+                subset_path = Path(tmp_dir) / f"{fname.stem}.changed.pdf"
+                await asyncio.to_thread(write_page_subset, str(fname), changed, str(subset_path))
+                docs = await parse_routed(parser, subset_path)
+        if changed and not docs:
+            return None
+
+        if len(docs) != len(changed):
+            # Sections don't map onto pages: nothing can be stored per page
+            logging.warning(
+                f"Got {len(docs)} sections for {len(changed)} pages of {fname.name}; page-level reuse skipped."
+            )
+            if len(changed) < len(page_keys):
+                return await parse_routed(parser, fname)
+            return docs
+
+        # Store before the caller adds per-file metadata to the Documents
+        for page_num, doc in zip(changed, docs):
+            await asyncio.to_thread(page_cache.put, page_keys[page_num - 1], [doc])
+        if docs and not disable_pair_extraction and len(changed) < len(page_keys):
+            # The re-parsed pages only saw themselves: carry over the unchanged pages' pairs
+            cached_pairs = await asyncio.get_running_loop().run_in_executor(
+                cpu_pool, pairs_from_texts, [cached[0].text for cached in cached_pages if cached]
+            )
+            for doc in docs:
+                doc.metadata[CACHED_PAIRS_KEY] = cached_pairs
+        page_counts["reused"] += len(page_keys) - len(changed)
+        page_counts["changed"] += len(changed)
+        changed_docs = iter(docs)
+        return [cached[0] if cached else next(changed_docs) for cached in cached_pages]
+
+    async def process_single_pdf(fname: Path):
+        try:
+            parser = LlamaParse(**worker_init_args)
+        except Exception as init_e:
+            logging.error(
+                f"Failed to re-initialize worker parser for PDF {fname.name}: {init_e}"
             )
+            return None
+
+        if page_cache:
+            return await parse_changed_pages(parser, fname)
+        return await parse_routed(parser, fname)
+
+    # Stitched shard output can differ slightly from a whole-file parse
+    extra_config = {"shard_pages": shard_pages} if shard_pages else {}
+    if local_text:
+        extra_config["local_text"] = True
+    config_hash = parser_config_hash(parser_template, **extra_config)
+    # Identical files are parsed once; cached results skip LlamaParse entirely.
+    # Files are post-processed as they complete; with a writer they go straight to disk.
+    docs_by_file: Dict[Path, List[Document]] = {}
+    # Page classification, text extraction, fingerprinting and pairs extraction
+    # are CPU-bound: run them in processes (workers start only when first used).
+    # The nested helpers above use cpu_pool only while this loop runs; the with
+    # block shuts it down even if parsing fails or is cancelled.
+    with ProcessPoolExecutor(max_workers=local_workers) as cpu_pool:
+        async for fname, doc_list_result, file_hash in iter_parse_files_with_cache(
+            pdf_file_list, process_single_pdf, cache, config_hash, refresh=refresh
+        ):
+            if doc_list_result:
+                file_name = fname.name
+                total_docs_in_file = len(doc_list_result)
+                post_processing_status = (
+                    "Applying" if not disable_pair_extraction else "Skipping"
+                )
+                logging.info(
+                    f"{post_processing_status} pairs post-processing for {total_docs_in_file} sections from PDF {file_name}"
+                )
 
-            for i, doc in enumerate(doc_list_result, 1):
-                if not hasattr(doc, "metadata") or doc.metadata is None:
-                    doc.metadata = {}
-                doc.metadata["source"] = str(fname.resolve())
-                doc.metadata["file_name"] = file_name
-                doc.metadata["doc_num"] = i
-                doc.metadata["total_docs_in_file"] = total_docs_in_file
+                for i, doc in enumerate(doc_list_result, 1):
+                    if not hasattr(doc, "metadata") or doc.metadata is None:
+                        doc.metadata = {}
+                    doc.metadata["source"] = str(fname.resolve())
+                    doc.metadata["file_name"] = file_name
+                    doc.metadata["doc_num"] = i
+                    doc.metadata["total_docs_in_file"] = total_docs_in_file
 
                 if not disable_pair_extraction:
-                    processed_doc = postprocess_extract_pairs(doc)
+                    file_docs = await apply_pairs_extraction(doc_list_result, cpu_pool)
                 else:
-                    processed_doc = doc
+                    file_docs = doc_list_result
                     # Add empty 'pairs' if consistency is desired when skipping post-processing
-                    # if 'pairs' not in processed_doc.metadata:
-                    #     processed_doc.metadata['pairs'] = []
+                    # for doc in file_docs: doc.metadata.setdefault('pairs', [])
+                if writer:
+                    await asyncio.to_thread(writer.write, fname, file_docs, file_hash)
+                else:
+                    docs_by_file[fname] = file_docs
+            else:
+                logging.warning(
+                    f"❌ PDF {fname.name}: Failed to parse or returned empty result."
+                )
+                if writer:
+                    await asyncio.to_thread(
+                        writer.record_failure, fname, "Failed to parse or returned empty result."
+                    )
 
-                all_processed_pdf_docs.append(processed_doc)
-        else:
-            logging.warning(
-                f"❌ PDF {fname.name}: Failed to parse or returned empty result."
-            )
+    if local_text:
+        logging.info(
+            f"Pages extracted locally: {page_counts['local']}, sent to LlamaParse: {page_counts['llamaparse']}"
+        )
+    if page_cache:
+        logging.info(
+            f"Pages reused from earlier runs: {page_counts['reused']}, parsed: {page_counts['changed']}"
+        )
+    summary = limiter.summary()
+    logging.info(
+        f"Parse concurrency: final {summary['final_limit']}, peak {summary['peak_limit']}, "
+        f"outcomes {summary['counts']}, trajectory {limiter.format_trajectory()}"
+    )
 
+    # Keep input order regardless of completion order
+    for fname in pdf_file_list:
+        all_processed_pdf_docs.extend(docs_by_file.get(fname, []))
     return all_processed_pdf_docs
 
 
-# --- process_markdown_file remains the same ---
-def process_markdown_file(file_path: Path) -> List[Document]:
-    """Reads a Markdown file and returns it as a single Document object."""
-    logging.info(f"Processing Markdown file: {file_path.name}")
-    try:
-        encodings_to_try = ["utf-8", "latin-1", "cp1252"]
-        content = None
-        for enc in encodings_to_try:
+# --- Markdown ingestion ---
+def detect_encoding(sample: bytes) -> str:
+    """
+    Picks an encoding from the first bytes of a file: BOM if present, else
+    utf-8 if the sample decodes, else cp1252 (common for Windows-authored
+    docs), else latin-1 (decodes anything).
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    for encoding in ("utf-8", "cp1252"):
+        try:
+            # final=False: a multi-byte character cut at the sample end is fine
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "latin-1"
+
+
+def read_text_streaming(file_path: Path) -> Tuple[str, str, str]:
+    """
+    Reads a text file in one pass of MD_READ_CHUNK_SIZE chunks, decoding and
+    hashing as it goes. Returns (text, encoding, sha256). If bytes beyond the
+    sample turn out not to fit the detected encoding, the file is re-read once
+    as latin-1.
+    """
+    with open(file_path, "rb") as f:
+        first = f.read(MD_READ_CHUNK_SIZE)
+        encoding = detect_encoding(first[:MD_ENCODING_SAMPLE_SIZE])
+        for attempt_encoding in (encoding, "latin-1"):
+            digest = hashlib.sha256()
+            decoder = codecs.getincrementaldecoder(attempt_encoding)()
+            pieces = []
+            chunk = first
             try:
-                with open(file_path, "r", encoding=enc) as f:
-                    content = f.read()
-                logging.debug(f"Successfully read {file_path.name} with encoding {enc}")
-                break
+                while chunk:
+                    digest.update(chunk)
+                    pieces.append(decoder.decode(chunk))
+                    chunk = f.read(MD_READ_CHUNK_SIZE)
+                pieces.append(decoder.decode(b"", final=True))
+                return "".join(pieces), attempt_encoding, digest.hexdigest()
             except UnicodeDecodeError:
-                logging.debug(f"Failed to read {file_path.name} with encoding {enc}")
-                continue
-            except Exception as e_read:
-                logging.error(f"Error reading {file_path.name}: {e_read}")
-                return []
-
-        if content is None:
-            logging.error(f"Could not decode Markdown file {file_path.name}")
-            return []
-        if not content.strip():
-            logging.warning(
-                f"Markdown file {file_path.name} is empty or contains only whitespace."
-            )
+                logging.debug(f"{file_path.name} is not valid {attempt_encoding}; re-reading as latin-1")
+                f.seek(len(first))
+    raise RuntimeError(f"Could not decode {file_path.name}")  # latin-1 accepts any bytes
+
+
+def markdown_documents(file_path: Path, content: str) -> List[Document]:
+    """Wraps a Markdown file's content as a single Document with standard metadata."""
+    if not content.strip():
+        logging.warning(
+            f"Markdown file {file_path.name} is empty or contains only whitespace."
+        )
+    doc = Document(text=content)
+    doc.metadata = {
+        "source": str(file_path.resolve()),
+        "file_name": file_path.name,
+        "doc_num": 1,
+        "total_docs_in_file": 1,
+        # Consider adding 'pairs': [] here for absolute consistency if needed downstream
+        # 'pairs': []
+    }
+    return [doc]
 
-        doc = Document(text=content if content else "")
-        doc.metadata = {
-            "source": str(file_path.resolve()),
-            "file_name": file_path.name,
-            "doc_num": 1,
-            "total_docs_in_file": 1,
-            # Consider adding 'pairs': [] here for absolute consistency if needed downstream
-            # 'pairs': []
-        }
-        logging.info(f"✅ Successfully processed Markdown file {file_path.name}")
-        return [doc]
+
+def process_markdown_file(file_path: Path) -> List[Document]:
+    """Reads a Markdown file and returns it as a single Document object."""
+    try:
+        content, encoding, _ = read_text_streaming(file_path)
+        logging.debug(f"Read {file_path.name} as {encoding}")
+        return markdown_documents(file_path, content)
     except Exception as e:
         logging.error(
             f"❌ Error processing Markdown file {file_path.name}: {e}", exc_info=True
@@ -1117,6 +1353,40 @@ def process_markdown_file(file_path: Path) -> List[Document]:
         return []
 
 
+async def ingest_markdown_files(
+    md_files: List[Path], writer: ShardedDocWriter, max_workers: int = 8
+) -> int:
+    """
+    Reads Markdown files in a thread pool and writes each one to the writer as
+    soon as it is read, so it runs alongside in-flight PDF jobs and never holds
+    more than max_workers files in memory. Returns the number ingested.
+    """
+
+    def ingest_one(md_file: Path) -> bool:
+        try:
+            content, _, sha256 = read_text_streaming(md_file)
+        except Exception as e:
+            logging.error(f"❌ Could not read Markdown file {md_file.name}: {e}")
+            writer.record_failure(md_file, "Could not read Markdown file.")
+            return False
+        writer.write(md_file, markdown_documents(md_file, content), sha256)
+        return True
+
+    loop = asyncio.get_running_loop()
+    start_time = time.time()
+    ingested = 0
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="md") as pool:
+        futures = [loop.run_in_executor(pool, ingest_one, md_file) for md_file in md_files]
+        for done, future in enumerate(asyncio.as_completed(futures), 1):
+            ingested += await future
+            if done % MD_PROGRESS_EVERY == 0:
+                logging.info(f"Markdown: {done}/{len(md_files)} files read")
+    logging.info(
+        f"✅ Ingested {ingested}/{len(md_files)} Markdown files in {time.time() - start_time:.2f} seconds."
+    )
+    return ingested
+
+
 # --- Saving Function remains the same ---
 def save_docs_to_pickle(docs: List[Document], file_path: str):
     """Save parsed documents to a pickle file."""
@@ -1139,11 +1409,22 @@ async def main(
     timeout: int,
     disable_pair_extraction: bool,  # Accept the flag here
     max_retries: int = 3,
+    cache_dir: Optional[str] = None,
+    refresh: bool = False,
+    cache_max_gb: Optional[float] = None,
+    cache_max_age_days: Optional[float] = None,
+    restart: bool = False,
+    no_consolidate: bool = False,
+    max_concurrency: Optional[int] = None,
+    shard_pages: int = 0,
+    local_text: bool = False,
+    local_workers: Optional[int] = None,
+    page_diff: bool = False,
+    md_workers: int = 8,
 ):
     """
     Main async function to orchestrate the parsing of PDF and Markdown files.
     """
-    all_docs = []
     pdf_files_to_process = []
     md_files_to_process = []
 
@@ -1178,76 +1459,120 @@ async def main(
     else:
         raise ValueError("Missing input source: Specify --input_dir or --input_file.")
 
-    # Process Markdown Files
-    if md_files_to_process:
-        logging.info(f"\n--- Processing {len(md_files_to_process)} Markdown files ---")
-        for md_file in md_files_to_process:
-            processed_md_docs = process_markdown_file(md_file)
-            all_docs.extend(processed_md_docs)
+    # Results are written per file as they complete; completed files from an
+    # interrupted earlier run are skipped.
+    pdf_mode = (
+        "Default Parsing" if disable_pair_extraction else "Custom Prompt/Pair Extraction"
+    )
+    if local_text and not PYPDF_INSTALLED:
+        logging.warning("pypdf not installed; --local_text ignored (pip install pypdf).")
+        local_text = False
+    if local_text:
+        pdf_mode += " + Local Text"
+    writer = ShardedDocWriter(output_file, restart=restart, config=pdf_mode)
+    all_files = md_files_to_process + pdf_files_to_process
+    pending_md_files = await asyncio.to_thread(writer.pending, md_files_to_process)
+    pending_pdf_files = await asyncio.to_thread(writer.pending, pdf_files_to_process)
+
+    # Process Markdown Files in the background, alongside the PDF jobs
+    md_task = None
+    if pending_md_files:
+        logging.info(f"\n--- Processing {len(pending_md_files)} Markdown files ---")
+        md_task = asyncio.create_task(
+            ingest_markdown_files(pending_md_files, writer, max_workers=md_workers)
+        )
 
     # Process PDF Files
-    processed_pdf_docs = []
-    if pdf_files_to_process:
-        logging.info(f"\n--- Processing {len(pdf_files_to_process)} PDF files ---")
+    cache = None
+    page_cache = None
+    if pending_pdf_files:
+        logging.info(f"\n--- Processing {len(pending_pdf_files)} PDF files ---")
         # Pass the flag to create_parser
         parser_template = create_parser(disable_pair_extraction=disable_pair_extraction)
+        if parser_template and cache_dir:
+            cache = ParseCache(cache_dir, max_gb=cache_max_gb, max_age_days=cache_max_age_days)
+            logging.info(f"Using parse cache at {cache_dir}{' (refresh: ignoring cached results)' if refresh else ''}")
+        if shard_pages and not PYPDF_INSTALLED:
+            logging.warning("pypdf not installed; --shard_pages ignored (pip install pypdf).")
+            shard_pages = 0
+        if page_diff and not (PYPDF_INSTALLED and cache):
+            logging.warning("--page_diff needs pypdf and the parse cache; ignored.")
+        elif page_diff and refresh:
+            logging.warning("--page_diff ignored with --refresh: every page is re-parsed.")
+        elif page_diff:
+            # Per-page results live next to the per-file ones, keyed by page fingerprint
+            page_cache = ParseCache(
+                str(Path(cache_dir) / "pages"), max_gb=cache_max_gb, max_age_days=cache_max_age_days
+            )
         if parser_template:
             start_pdf_time = time.time()
             logging.info(
-                f"Starting PDF parallel processing (Max Workers: {max_workers}, Timeout: {timeout}s)..."
+                f"Starting PDF parallel processing (Workers: {max_workers} adaptive up to {max_concurrency}, Timeout: {timeout}s)..."
             )
-            processed_pdf_docs = await process_pdf_documents_parallel(
-                pdf_files_to_process,
+            await process_pdf_documents_parallel(
+                pending_pdf_files,
                 parser_template,  # Pass the template
                 max_workers=max_workers,
                 timeout_seconds=timeout,
                 max_retries=max_retries,
+                cache=cache,
+                refresh=refresh,
+                writer=writer,
+                max_concurrency=max_concurrency,
+                shard_pages=shard_pages,
+                local_text=local_text,
+                local_workers=local_workers,
+                page_cache=page_cache,
             )
             end_pdf_time = time.time()
             logging.info(
                 f"Finished PDF processing in {end_pdf_time - start_pdf_time:.2f} seconds."
             )
-            all_docs.extend(processed_pdf_docs)  # Add PDF results
         else:
             logging.warning(
                 "PDF processing skipped because LlamaParse parser could not be initialized."
             )
 
+    if md_task:
+        await md_task
+
     # Final Summary and Saving
-    successful_md_files = sum(
-        1
-        for doc in all_docs
-        if doc.metadata.get("file_name", "").lower().endswith((".md", ".markdown"))
-    )
-    successful_pdf_files = sum(
-        1
-        for doc in all_docs
-        if doc.metadata.get("file_name", "").lower().endswith(".pdf")
-    )
+    successful_md_files = len(writer.completed_sources(md_files_to_process))
+    successful_pdf_files = len(writer.completed_sources(pdf_files_to_process))
     failed_pdf_files = len(pdf_files_to_process) - successful_pdf_files
+    resumed_files = (len(md_files_to_process) - len(pending_md_files)) + (
+        len(pdf_files_to_process) - len(pending_pdf_files)
+    )
 
     print(f"\n--- Run Summary ---")
     print(f"Output File: {output_file}")
+    print(f"Per-file results: {writer.parts_dir}")
+    if resumed_files:
+        print(f"Skipped {resumed_files} file(s) already completed by a previous run.")
     print(f"Processed {successful_md_files}/{len(md_files_to_process)} Markdown files.")
     print(f"Attempted {len(pdf_files_to_process)} PDF files.")
     if LLAMA_PARSE_INSTALLED and pdf_files_to_process:
-        pdf_mode = (
-            "Default Parsing"
-            if disable_pair_extraction
-            else "Custom Prompt/Pair Extraction"
-        )
         print(f"PDF Processing Mode: {pdf_mode}")
         print(f"Successfully parsed and processed {successful_pdf_files} PDF file(s).")
         if failed_pdf_files > 0:
-            print(f"Failed to parse {failed_pdf_files} PDF file(s) after retries.")
+            print(f"Failed to parse {failed_pdf_files} PDF file(s) after retries (re-run to retry them).")
     elif pdf_files_to_process:
         print("PDF processing was skipped (LlamaParse not initialized).")
-    print(f"Generated {len(all_docs)} total document sections.")
-
-    if all_docs:
-        save_docs_to_pickle(all_docs, output_file)
-    else:
+    if cache:
+        print(f"Parse cache: {cache.hits} hit(s), {cache.misses} miss(es), {cache.writes} new entr(ies).")
+        cache.evict()
+    if page_cache:
+        print(f"Page cache: {page_cache.hits} page(s) reused, {page_cache.writes} page(s) parsed and stored.")
+        page_cache.evict()
+
+    # Consolidate shards into the single pickle used downstream
+    if successful_md_files + successful_pdf_files == 0:
         print("\nNo documents were successfully processed or generated.")
+    elif no_consolidate:
+        print("\nSkipping consolidation (--no_consolidate); shards are in the parts directory.")
+    else:
+        total_sections = writer.consolidate(all_files)
+        print(f"Generated {total_sections} total document sections.")
 
 
 # --- __main__ block (Adds the new flag) ---
@@ -1288,21 +1613,55 @@ if __name__ == "__main__":
         "-o",
         type=str,
         default="parsed_docs.pkl",
-        help="Path to save the processed Document objects list.",
+        help="Path to save the processed Document objects list (a node store if it ends in .nodes).",
     )
     parser.add_argument(
         "--max_workers",
         "-w",
         type=int,
         default=4,
-        help="Maximum concurrent PDF parsing workers.",
+        help="Initial number of concurrent PDF parsing workers (adapted up to --max_concurrency).",
+    )
+    parser.add_argument(
+        "--max_concurrency",
+        type=int,
+        default=16,
+        help="Upper bound for adaptive parse concurrency. Set equal to --max_workers for a fixed limit.",
+    )
+    parser.add_argument(
+        "--shard_pages",
+        type=int,
+        default=0,
+        help="Split PDFs longer than this many pages into page-range shards parsed concurrently (0 disables; needs pypdf).",
+    )
+    parser.add_argument(
+        "--local_text",
+        action="store_true",
+        help="Extract plain-text PDF pages locally with pypdf; send only pages with tables, figures or part numbers to LlamaParse.",
+    )
+    parser.add_argument(
+        "--local_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="Processes for local page work (--local_text, --page_diff) and pairs extraction on large files.",
+    )
+    parser.add_argument(
+        "--page_diff",
+        action="store_true",
+        help="Fingerprint PDF pages and re-parse only pages not seen in earlier runs (revised datasheets); needs pypdf and the parse cache, ignored with --refresh.",
+    )
+    parser.add_argument(
+        "--md_workers",
+        type=int,
+        default=8,
+        help="Threads reading Markdown files (runs alongside PDF parsing).",
     )
     parser.add_argument(
         "--timeout",
         "-t",
         type=int,
         default=180,
-        help="Timeout in seconds for parsing each PDF file.",
+        help="Timeout in seconds for parsing each PDF file (or page-range shard).",
     )
     # --- Add the new flag ---
     parser.add_argument(
@@ -1311,6 +1670,17 @@ if __name__ == "__main__":
         default=False,  # Default is to perform extraction
         help="Disable custom datasheet prompt and pair extraction post-processing for PDFs (use default LlamaParse behavior).",
     )
+    add_cache_arguments(parser)
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Discard per-file results from a previous interrupted run instead of resuming.",
+    )
+    parser.add_argument(
+        "--no_consolidate",
+        action="store_true",
+        help="Leave results as per-file shards (<output_file>.parts/) without writing the combined pickle.",
+    )
     # ---
     # Optional: Add --max_retries argument
     # parser.add_argument("--max_retries", type=int, default=3, help="Max retries for PDF parsing.")
@@ -1325,6 +1695,18 @@ if __name__ == "__main__":
                 output_file=args.output_file,
                 max_workers=args.max_workers,
                 timeout=args.timeout,
+                cache_dir=None if args.no_cache else args.cache_dir,
+                refresh=args.refresh,
+                cache_max_gb=args.cache_max_gb,
+                cache_max_age_days=args.cache_max_age_days,
+                restart=args.restart,
+                no_consolidate=args.no_consolidate,
+                max_concurrency=args.max_concurrency,
+                shard_pages=args.shard_pages,
+                local_text=args.local_text,
+                local_workers=args.local_workers,
+                page_diff=args.page_diff,
+                md_workers=args.md_workers,
                 disable_pair_extraction=args.disable_pair_extraction,  # Pass the flag value to main
                 # max_retries=args.max_retries # Pass if added as arg
             )
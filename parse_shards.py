@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Incremental, crash-resumable output for the parse scripts.
+
+Instead of holding every parsed Document until the end of the run, each input
+file's processed Documents are written to their own pickle shard as soon as
+the file completes, and a line is appended to an append-only JSONL manifest:
+
+    <output_file>.parts/
+        manifest.jsonl        one JSON object per completed (or failed) file
+        <source-id>.pkl       list of Documents for one input file
+
+On restart, files whose manifest entry is "ok" and whose sha256 still matches
+are skipped. The final consolidation reads the shards in input order and
+writes the usual single pickle that metadata.py expects, or a node store
+(see node_store.py) when the output path ends in .nodes.
+
+Used by parse.py and parse_pdf_md.py.
+"""
+
+import os
+import json
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from node_store import NodeStoreWriter, is_node_store
+from parse_cache import file_sha256
+
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def source_id(fname: Path) -> str:
+    """Stable shard name for an input path."""
+    resolved = str(Path(fname).resolve())
+    return f"{hashlib.sha256(resolved.encode('utf-8')).hexdigest()[:16]}-{Path(fname).stem[:40]}"
+
+
+# A pickled list written item by item: PROTO 3, EMPTY_LIST, then one pickled
+# item plus APPEND per element, then STOP. pickle.load() returns the plain list.
+# Protocol 3 memoizes with explicit BINPUT indices, so each item's
+# self-contained memo entries may safely reuse indices of earlier items.
+LIST_PICKLE_PROTOCOL = 3
+LIST_PICKLE_HEADER = pickle.PROTO + bytes([LIST_PICKLE_PROTOCOL]) + pickle.EMPTY_LIST
+
+
+def write_list_item(f, item: Any):
+    """Appends one element to a list pickle started with LIST_PICKLE_HEADER."""
+    data = pickle.dumps(item, protocol=LIST_PICKLE_PROTOCOL)
+    f.write(data[2:-1])  # strip this item's PROTO header and STOP
+    f.write(pickle.APPEND)
+
+
+def write_shard(parts_dir: Path, fname: Path, docs: List[Any]) -> str:
+    """Atomically pickles one input file's Documents into parts_dir; returns the shard name."""
+    shard_name = f"{source_id(fname)}.pkl"
+    shard_path = Path(parts_dir) / shard_name
+    tmp_path = shard_path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(docs, f)
+    os.replace(tmp_path, shard_path)
+    return shard_name
+
+
+class ShardedDocWriter:
+    """Writes one pickle shard per input file and records it in the manifest."""
+
+    def __init__(self, output_file: str, restart: bool = False, config: Optional[str] = None):
+        self.output_file = Path(output_file)
+        # Entries written under a different processing config are not reused
+        self.config = config
+        self.parts_dir = parts_dir_for(output_file)
+        self.manifest_path = self.parts_dir / MANIFEST_NAME
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        if restart and self.manifest_path.exists():
+            logging.info(f"Discarding previous partial run in {self.parts_dir}")
+            for shard in self.parts_dir.glob("*.pkl"):
+                shard.unlink()
+            self.manifest_path.unlink()
+        self.entries: Dict[str, Dict[str, Any]] = self._load_manifest()
+        self.written = 0
+        # write()/record_failure() are called from worker threads (e.g. Markdown ingestion)
+        self._lock = threading.Lock()
+
+    def _load_manifest(self) -> Dict[str, Dict[str, Any]]:
+        """Latest manifest entry per source. A torn last line (crash mid-write) is ignored."""
+        entries = {}
+        if not self.manifest_path.exists():
+            return entries
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            for line_num, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f"Ignoring unreadable manifest line {line_num} in {self.manifest_path}")
+                    continue
+                entries[entry["source"]] = entry
+        return entries
+
+    def _append_manifest(self, entry: Dict[str, Any]):
+        with self._lock:
+            with open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.entries[entry["source"]] = entry
+
+    def is_complete(self, fname: Path, sha256: Optional[str] = None) -> bool:
+        entry = self.entries.get(str(Path(fname).resolve()))
+        if not entry or entry.get("status") != "ok":
+            return False
+        if entry.get("config") != self.config:
+            return False
+        if not (self.parts_dir / entry["shard"]).exists():
+            return False
+        return sha256 is None or entry.get("sha256") == sha256
+
+    def pending(self, file_list: List[Path], max_workers: int = 8) -> List[Path]:
+        """Files that still need processing (new, changed, failed, or missing a shard)."""
+        # Only files with an "ok" entry need hashing; hash those concurrently
+        known = [fname for fname in file_list if self.is_complete(fname)]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            hashes = dict(zip(known, pool.map(file_sha256, known)))
+        pending = [
+            fname
+            for fname in file_list
+            if fname not in hashes or not self.is_complete(fname, hashes[fname])
+        ]
+        skipped = len(file_list) - len(pending)
+        if skipped:
+            logging.info(
+                f"Resuming from {self.manifest_path}: skipping {skipped} completed file(s), {len(pending)} to go."
+            )
+        return pending
+
+    def write(self, fname: Path, docs: List[Any], sha256: Optional[str] = None):
+        """Persists one file's Documents (atomic shard write, then manifest append)."""
+        shard_name = write_shard(self.parts_dir, fname, docs)
+        self.record(fname, shard_name, len(docs), sha256 or file_sha256(fname))
+
+    def record(self, fname: Path, shard_name: str, sections: int, sha256: str):
+        """Registers a shard already written by write_shard (e.g. from a worker process)."""
+        self._append_manifest(
+            {
+                "source": str(Path(fname).resolve()),
+                "file_name": Path(fname).name,
+                "sha256": sha256,
+                "shard": shard_name,
+                "sections": sections,
+                "config": self.config,
+                "status": "ok",
+                "completed_at": time.time(),
+            }
+        )
+        with self._lock:
+            self.written += 1
+
+    def record_failure(self, fname: Path, reason: str = ""):
+        """Failed files are logged in the manifest but retried on the next run."""
+        self._append_manifest(
+            {
+                "source": str(Path(fname).resolve()),
+                "file_name": Path(fname).name,
+                "status": "failed",
+                "reason": reason,
+                "completed_at": time.time(),
+            }
+        )
+
+    def iter_docs(self, file_list: List[Path]):
+        """Yields each completed file's Documents, in input order."""
+        for fname in file_list:
+            if not self.is_complete(fname):
+                continue
+            entry = self.entries[str(Path(fname).resolve())]
+            with open(self.parts_dir / entry["shard"], "rb") as f:
+                yield fname, pickle.load(f)
+
+    def consolidate(self, file_list: List[Path]) -> int:
+        """
+        Concatenates the shards for file_list into output_file, one shard in
+        memory at a time. Returns section count.
+        """
+        if is_node_store(str(self.output_file)):
+            return self._consolidate_store(file_list)
+        total = 0
+        tmp_path = self.output_file.with_suffix(self.output_file.suffix + ".tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(LIST_PICKLE_HEADER)
+                for _, docs in self.iter_docs(file_list):
+                    for doc in docs:
+                        write_list_item(f, doc)
+                    total += len(docs)
+                f.write(pickle.STOP)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        if not total:
+            tmp_path.unlink()
+            return 0
+        os.replace(tmp_path, self.output_file)
+        print(f"\nSaved {total} processed document sections to {self.output_file}")
+        return total
+
+    def _consolidate_store(self, file_list: List[Path]) -> int:
+        """Streams the shards into a node store, one shard in memory at a time."""
+        total = 0
+        store = NodeStoreWriter(str(self.output_file))
+        try:
+            for _, docs in self.iter_docs(file_list):
+                store.write(docs)
+                total += len(docs)
+        except BaseException:
+            store.abort()
+            raise
+        if not total:
+            store.abort()
+            return 0
+        store.close()
+        print(f"\nSaved {total} processed document sections to node store {self.output_file}")
+        return total
+
+    def completed_sources(self, file_list: List[Path]) -> List[str]:
+        return [str(Path(fname).resolve()) for fname in file_list if self.is_complete(fname)]
+
+
+def parts_dir_for(output_file: str) -> Path:
+    output_file = Path(output_file)
+    return output_file.with_name(output_file.name + ".parts")
+
+
+def iter_part_docs(output_file: str):
+    """
+    Yields the Documents of every completed shard of output_file, one shard
+    (input file) at a time, in manifest order. Lets metadata.py stream a parse
+    run without loading the consolidated pickle.
+    """
+    writer = ShardedDocWriter(output_file)
+    for entry in writer.entries.values():
+        if entry.get("status") != "ok":
+            continue
+        shard_path = writer.parts_dir / entry["shard"]
+        if not shard_path.exists():
+            logging.warning(f"Skipping {entry.get('file_name')}: shard {shard_path} is missing")
+            continue
+        with open(shard_path, "rb") as f:
+            yield from pickle.load(f)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Client-side request and token rate limiting for OpenAI calls.
+
+OpenAI enforces two budgets per model: requests per minute (RPM) and tokens
+per minute (TPM). Bounded concurrency alone keeps either one only by luck:
+short chunks hit the RPM limit, long chunks hit the TPM limit. TokenBucketLimiter keeps a
+bucket for each, refilled continuously. A call reserves one request plus its
+estimated tokens before it is sent. Once the response reports its usage, the
+estimate is corrected with settle().
+
+A 429 response pauses the whole limiter (not just the failing call) for the
+server's Retry-After, or for a jittered backoff when no Retry-After is given.
+Every caller then backs off together instead of hammering the API in lockstep.
+
+Usage:
+    limiter = TokenBucketLimiter(rpm=500, tpm=200_000)
+    estimate = await limiter.acquire(tokens=estimate_tokens(prompt) + max_tokens)
+    response = await client.chat.completions.create(...)
+    limiter.settle(estimate, response.usage.total_tokens)
+"""
+
+import time
+import random
+import asyncio
+from typing import Any, Dict, Optional
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English text)."""
+    return max(1, len(text) // 4)
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Exponential backoff with full jitter: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(cap, base * (2**attempt)))
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """The Retry-After (or retry-after-ms) header of an API error response, if any."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Timeouts, connection errors, throttling and 5xx are retried; other 4xx are not."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        # openai.APIConnectionError / APITimeoutError carry no status code
+        return type(exc).__name__ in ("APIConnectionError", "APITimeoutError")
+    return status in RETRYABLE_STATUS_CODES
+
+
+class TokenBucketLimiter:
+    def __init__(self, rpm: int = 0, tpm: int = 0, burst_seconds: float = 10.0):
+        """
+        rpm / tpm: per-minute limits, 0 = unlimited. burst_seconds: how much of
+        the per-minute budget may be spent at once after an idle period.
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self._request_rate = rpm / 60.0
+        self._token_rate = tpm / 60.0
+        self._request_capacity = max(1.0, self._request_rate * burst_seconds)
+        self._token_capacity = max(1.0, self._token_rate * burst_seconds)
+        self._requests = self._request_capacity
+        self._tokens = self._token_capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+        self.stats: Dict[str, Any] = {
+            "requests": 0,
+            "tokens_reserved": 0,
+            "tokens_used": 0,
+            "throttled": 0,
+            "wait_seconds": 0.0,
+        }
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self._request_capacity, self._requests + elapsed * self._request_rate)
+        self._tokens = min(self._token_capacity, self._tokens + elapsed * self._token_rate)
+
+    def _wait_time(self, now: float, tokens: int) -> float:
+        wait = max(0.0, self._paused_until - now)
+        if self.rpm and self._requests < 1:
+            wait = max(wait, (1 - self._requests) / self._request_rate)
+        # A request larger than the bucket waits for a full bucket, then runs
+        needed = min(tokens, self._token_capacity)
+        if self.tpm and self._tokens < needed:
+            wait = max(wait, (needed - self._tokens) / self._token_rate)
+        return wait
+
+    async def acquire(self, tokens: int = 0) -> int:
+        """
+        Waits until one request and `tokens` tokens are available, then reserves
+        them. Callers are served in arrival order. Returns the reservation, to be
+        passed to settle() with the actual usage.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_time(now, tokens)
+                if wait <= 0:
+                    break
+                self.stats["wait_seconds"] += wait
+                await asyncio.sleep(wait)
+            if self.rpm:
+                self._requests -= 1
+            if self.tpm:
+                self._tokens -= tokens  # May go negative for oversized requests: repaid by refill
+            self.stats["requests"] += 1
+            self.stats["tokens_reserved"] += tokens
+        return tokens
+
+    def settle(self, reserved: int, used: Optional[int]):
+        """Corrects a reservation with the tokens the API reported using."""
+        if used is None:
+            used = reserved
+        self.stats["tokens_used"] += used
+        if self.tpm:
+            self._tokens = min(self._token_capacity, self._tokens + reserved - used)
+
+    def throttled(self, seconds: float):
+        """Pauses all callers after a 429, for the Retry-After or backoff period."""
+        self.stats["throttled"] += 1
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def summary(self) -> Dict[str, Any]:
+        return {**self.stats, "rpm": self.rpm, "tpm": self.tpm}
@@ -1,22 +1,60 @@
-import pickle
+"""
+Lists the model/part number pairs found in node metadata and checks them,
+using the shared SQLite inspection index (see node_index.py) instead of
+unpickling the nodes.
 
-def load_nodes(file_path):
-    with open(file_path, 'rb') as f:
-        return pickle.load(f)
+Usage:
+    python utilities/check_pairs.py
+    python utilities/check_pairs.py -f data/nodes/matrix_nodes.pkl --part 1174257 --validate
+"""
+import argparse
 
-def check_pairs(nodes):
+from node_index import open_index
+
+
+def check_pairs(index, limit=None, offset=0, part_number=None):
     print("Found pairs:")
     print("-" * 50)
-    
-    for node in nodes:
-        if "pairs" in node.metadata:
-            print(f"\nNode text sample: {node.text[:200]}...")
-            print("\nPairs found:")
-            for pair in node.metadata["pairs"]:
-                print(f"  Part number: {pair['part_number']}")
-                print(f"  Product name: {pair['product_name']}")
-                print("-" * 30)
+
+    results = index.nodes_with_pairs(limit=limit, offset=offset, part_number=part_number)
+    for node, pairs in results:
+        print(f"\nNode text sample: {node.text[:200]}...")
+        print("\nPairs found:")
+        for pair in pairs:
+            print(f"  Part number: {pair.get('part_number', '')}")
+            print(f"  Product name: {pair.get('product_name') or pair.get('model_name', '')}")
+            print("-" * 30)
+
+
+def validate_pairs(index):
+    issues = index.pair_issues()
+    print("\n--- Pair Validation ---")
+    print(f"Totals: {index.pair_stats()}")
+    print(f"Pairs missing a part number or model name: {len(issues['missing_fields'])}")
+    for issue in issues["missing_fields"]:
+        print(f"  - node {issue['node_id']}: {issue['pair']}")
+    print(f"Part numbers with several model names: {len(issues['part_number_with_several_models'])}")
+    for issue in issues["part_number_with_several_models"]:
+        print(f"  - {issue['part_number']}: {issue['models']}")
+    print(f"Part numbers not found in their node's text: {len(issues['part_number_not_in_text'])}")
+    for issue in issues["part_number_not_in_text"]:
+        print(f"  - node {issue['node_id']}: {issue['part_number']}")
+
 
 if __name__ == "__main__":
-    nodes = load_nodes("./enhanced_laser_nodes.pkl")
-    check_pairs(nodes)
+    parser = argparse.ArgumentParser(
+        description="List and validate the pairs metadata of nodes.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("-f", "--file", default="./enhanced_laser_nodes.pkl", help="Node pickle or node store.")
+    parser.add_argument("-n", "--limit", type=int, default=None, help="Nodes to list (all if not specified).")
+    parser.add_argument("--offset", type=int, default=0, help="Skip this many nodes with pairs first.")
+    parser.add_argument("--part", default=None, help="Only list nodes with this part number.")
+    parser.add_argument("--validate", action="store_true", help="Also report missing, conflicting and unmatched pairs.")
+    parser.add_argument("--rebuild-index", action="store_true", help="Rebuild the inspection index.")
+    args = parser.parse_args()
+
+    index = open_index(args.file, rebuild=args.rebuild_index)
+    check_pairs(index, args.limit, args.offset, args.part)
+    if args.validate:
+        validate_pairs(index)
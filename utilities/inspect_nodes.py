@@ -1,85 +1,45 @@
 #!/usr/bin/env python3
 """
-Loads and inspects a pickle file expected to contain a list of
+Inspects a pickle file (or node store) expected to contain a list of
 LlamaIndex Node objects (e.g., TextNode).
 Prints metadata and text content for each node.
+
+Reads through the shared SQLite inspection index (see node_index.py), built
+once per version of the file, so only the requested nodes are loaded.
 """
 
-import pickle
 import argparse
-from pathlib import Path
-
-# Optional: Import LlamaIndex types for more specific checking
-try:
-    from llama_index.core.schema import TextNode, BaseNode
 
-    LLAMAINDEX_INSTALLED = True
-except ImportError:
-    print(
-        "Warning: llama-index-core not installed. Cannot perform detailed Node inspection."
-    )
-    TextNode = None
-    BaseNode = None
-    LLAMAINDEX_INSTALLED = False
+from node_index import open_index
 
 
-def display_nodes(file_path: str, limit: int = None, show_full_text: bool = False):
-    """Loads nodes from a pickle file and displays their details."""
-    path = Path(file_path)
-    if not path.is_file():
-        print(f"Error: File not found at {path}")
-        return
-
-    print(f"Loading nodes from: {path}...")
+def display_nodes(
+    file_path: str, limit: int = None, show_full_text: bool = False, offset: int = 0, rebuild: bool = False
+):
+    """Displays the details of nodes offset..offset+limit of a pickle file or node store."""
+    index = open_index(file_path, rebuild=rebuild)
+    print(f"Loading nodes from: {file_path}...")
     try:
-        with open(path, "rb") as f:
-            nodes = pickle.load(f)
-    except pickle.UnpicklingError:
-        print(
-            f"Error: Failed to unpickle file. It might be corrupted or not a pickle file."
-        )
-        return
+        total_count = index.count()
     except Exception as e:
         print(f"Error loading file: {e}")
         return
 
-    if not isinstance(nodes, list):
-        print(
-            f"Error: Expected a list in the pickle file, but found type {type(nodes).__name__}."
-        )
-        return
-
-    if not nodes:
-        print("Pickle file loaded successfully, but the list is empty.")
+    if not total_count:
+        print("File loaded successfully, but the list is empty.")
         return
 
-    print(f"Successfully loaded {len(nodes)} potential node objects.")
+    print(f"Index holds {total_count} potential node objects.")
 
-    # Determine how many nodes to display
-    nodes_to_display = nodes[:limit] if limit is not None and limit > 0 else nodes
+    # Determine which nodes to display
+    nodes_to_display = index.query(limit=limit if limit is not None and limit > 0 else None, offset=offset)
     displayed_count = len(nodes_to_display)
-    total_count = len(nodes)
 
     print(f"\n--- Displaying {displayed_count} out of {total_count} Nodes ---")
 
     for i, node in enumerate(nodes_to_display):
-        print(f"\n--- Node {i + 1}/{displayed_count} | ", end="")
-
-        node_id = getattr(node, "node_id", "N/A")
-        node_type = type(node).__name__
-
-        # Try to determine type more specifically if possible
-        if LLAMAINDEX_INSTALLED:
-            if isinstance(node, TextNode):
-                node_type = "TextNode"
-            elif isinstance(node, BaseNode):
-                node_type = f"BaseNode (Subclass: {type(node).__name__})"
-            else:
-                node_type = f"Unknown LlamaIndex Object ({type(node).__name__})"
-        else:
-            node_type = f"Object (Type: {type(node).__name__})"
-
-        print(f"Type: {node_type} | ID: {node_id} ---")
+        print(f"\n--- Node {offset + i + 1}/{total_count} | ", end="")
+        print(f"Type: {node.node_type} | ID: {node.node_id} ---")
 
         # Display Metadata
         if hasattr(node, "metadata") and isinstance(node.metadata, dict):
@@ -125,7 +85,7 @@ def display_nodes(file_path: str, limit: int = None, show_full_text: bool = Fals
         print("-" * 60)
 
     if limit is not None and limit < total_count:
-        print(f"\nNote: Display limited to the first {limit} nodes.")
+        print(f"\nNote: Display limited to {limit} nodes starting at node {offset + 1} (see --offset).")
 
 
 if __name__ == "__main__":
@@ -137,7 +97,7 @@ if __name__ == "__main__":
         "-f",
         "--file",
         required=True,
-        help="Path to the input .pkl file containing the list of nodes.",
+        help="Path to the input .pkl file (or node store) containing the list of nodes.",
     )
     parser.add_argument(
         "-l",
@@ -146,6 +106,17 @@ if __name__ == "__main__":
         default=None,  # Show all by default
         help="Limit the number of nodes displayed (shows first N nodes).",
     )
+    parser.add_argument(
+        "--offset",
+        type=int,
+        default=0,
+        help="Skip this many nodes first (page through with --limit).",
+    )
+    parser.add_argument(
+        "--rebuild-index",
+        action="store_true",
+        help="Rebuild the inspection index even if it matches the file.",
+    )
     parser.add_argument(
         "--full-text",
         action="store_true",
@@ -153,4 +124,4 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
-    display_nodes(args.file, args.limit, args.full_text)
+    display_nodes(args.file, args.limit, args.full_text, args.offset, args.rebuild_index)
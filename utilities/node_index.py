@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+Indexed SQLite view of a Document/node artifact for the inspection utilities
+(view_nodes.py, inspect_nodes.py, view_docs.py, check_pairs.py).
+
+The first inspection of an artifact (a pickle, or a node store directory, see
+node_store.py) unpickles it once and writes <artifact>.inspect.sqlite next to
+it. The index has these tables:
+
+    nodes          position, node_id, type, file_name, text, metadata JSON, relationships JSON
+    nodes_fts      FTS5 over the text (porter stemming, like chat_engine.py)
+    metadata_kv    one row per top-level metadata key, value as a string, indexed on (key, value)
+    pairs          one row per 'pairs' entry, indexed on part number and model name
+
+The index records the artifact's size and mtime and is rebuilt when they
+change. Later inspections only run indexed queries against it: metadata
+filters, text search, pair checks and paging. They never load the whole
+artifact, so they return in milliseconds on any corpus size.
+
+Filters compare values as strings, like the old filter_nodes(): a missing key
+matches "" and list/dict values compare by their str().
+
+Usage:
+    from node_index import NodeIndex
+    index = NodeIndex("enhanced_laser_nodes.pkl")
+    total = index.count(filters={"file_name": "PM10.pdf"}, search="wavelength")
+    for node in index.query(filters={"file_name": "PM10.pdf"}, search="wavelength", limit=20, offset=40):
+        print(node.node_id, node.metadata, node.text[:80])
+
+    python utilities/node_index.py enhanced_laser_nodes.pkl --rebuild
+"""
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from node_store import load_nodes  # noqa: E402
+
+INDEX_SUFFIX = ".inspect.sqlite"
+INDEX_SCHEMA_VERSION = 1  # Bump when the tables below change
+INSERT_BATCH = 1_000
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE nodes (
+    position INTEGER PRIMARY KEY,
+    node_id TEXT,
+    node_type TEXT,
+    file_name TEXT,
+    text TEXT,
+    text_length INTEGER,
+    metadata TEXT,
+    relationships TEXT
+);
+CREATE INDEX nodes_node_id ON nodes (node_id);
+CREATE INDEX nodes_file_name ON nodes (file_name, position);
+CREATE VIRTUAL TABLE nodes_fts USING fts5(
+    text, content='nodes', content_rowid='position', tokenize='porter unicode61'
+);
+CREATE TABLE metadata_kv (position INTEGER, key TEXT, value TEXT);
+CREATE INDEX metadata_kv_lookup ON metadata_kv (key, value, position);
+CREATE TABLE pairs (
+    position INTEGER,
+    model_name TEXT,
+    part_number TEXT,
+    pair TEXT
+);
+CREATE INDEX pairs_part_number ON pairs (part_number, position);
+CREATE INDEX pairs_model_name ON pairs (model_name, position);
+"""
+
+
+@dataclass
+class RelatedNode:
+    node_id: str
+
+
+@dataclass
+class IndexedNode:
+    """A row of the index, with the attributes the inspection scripts display."""
+
+    position: int
+    node_id: str
+    node_type: str
+    text: str
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    relationships: Dict[str, Any] = field(default_factory=dict)
+
+
+def index_path_for(artifact: str) -> Path:
+    artifact = Path(artifact)
+    return artifact.with_name(artifact.name + INDEX_SUFFIX)
+
+
+def artifact_version(artifact: str) -> str:
+    """Changes whenever the artifact is rewritten (size and mtime of its files)."""
+    path = Path(artifact)
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    parts = [f"{p.name}:{p.stat().st_size}:{p.stat().st_mtime_ns}" for p in files]
+    return f"{INDEX_SCHEMA_VERSION}|" + "|".join(parts)
+
+
+def _relationships_json(node: Any) -> str:
+    relationships = {}
+    for key, related in (getattr(node, "relationships", None) or {}).items():
+        name = getattr(key, "name", str(key))
+        if isinstance(related, list):
+            relationships[name] = [getattr(r, "node_id", "?") for r in related]
+        else:
+            relationships[name] = getattr(related, "node_id", "?")
+    return json.dumps(relationships)
+
+
+def _node_rows(position: int, node: Any) -> Tuple[tuple, List[tuple], List[tuple]]:
+    metadata = getattr(node, "metadata", None)
+    metadata = metadata if isinstance(metadata, dict) else {}
+    text = getattr(node, "text", None) or ""
+    node_row = (
+        position,
+        str(getattr(node, "node_id", "") or ""),
+        type(node).__name__,
+        str(metadata.get("file_name", "")),
+        text,
+        len(text),
+        json.dumps(metadata, default=str),
+        _relationships_json(node),
+    )
+    kv_rows = [(position, str(key), str(value)) for key, value in metadata.items()]
+    pair_rows = []
+    pairs = metadata.get("pairs")
+    for pair in pairs if isinstance(pairs, list) else []:
+        if isinstance(pair, dict):
+            model = pair.get("model_name") or pair.get("product_name") or ""
+            pair_rows.append(
+                (position, str(model).strip(), str(pair.get("part_number", "")).strip(), json.dumps(pair, default=str))
+            )
+    return node_row, kv_rows, pair_rows
+
+
+def _fts_query(search: str) -> str:
+    """Plain words are ANDed as quoted terms; input with FTS syntax (quotes, operators, *) is used as is."""
+    if any(c in search for c in '"*():^') or any(op in search.split() for op in ("AND", "OR", "NOT", "NEAR")):
+        return search
+    return " ".join(f'"{word}"' for word in search.split())
+
+
+class NodeIndex:
+    """Lazily built and opened SQLite index of one artifact (see module docstring)."""
+
+    def __init__(self, artifact: str, index_path: Optional[str] = None, rebuild: bool = False):
+        self.artifact = Path(artifact)
+        self.path = Path(index_path) if index_path else index_path_for(artifact)
+        self.rebuild = rebuild
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if not self.artifact.exists():
+                raise FileNotFoundError(f"Artifact not found: {self.artifact}")
+            version = artifact_version(str(self.artifact))
+            if self.rebuild or self._stored_version() != version:
+                self.build(version)
+            self._conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            self._conn.row_factory = sqlite3.Row
+        return self._conn
+
+    def _stored_version(self) -> Optional[str]:
+        if not self.path.exists():
+            return None
+        try:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'artifact_version'").fetchone()
+            finally:
+                conn.close()
+            return row[0] if row else None
+        except sqlite3.Error:
+            return None
+
+    def build(self, version: Optional[str] = None):
+        """Loads the artifact once and writes a fresh index (atomically replacing the old one)."""
+        version = version or artifact_version(str(self.artifact))
+        print(f"Building inspection index {self.path} (one-time for this version of {self.artifact})...")
+        started = time.monotonic()
+        nodes = load_nodes(str(self.artifact), with_embeddings=False)
+        if not isinstance(nodes, list):
+            raise ValueError(f"Expected a list of Documents/nodes in {self.artifact}, found {type(nodes).__name__}")
+
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        conn = sqlite3.connect(str(tmp_path))
+        try:
+            conn.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;" + SCHEMA)
+            for start in range(0, len(nodes), INSERT_BATCH):
+                node_rows, kv_rows, pair_rows = [], [], []
+                for position, node in enumerate(nodes[start : start + INSERT_BATCH], start=start):
+                    node_row, kvs, pairs = _node_rows(position, node)
+                    node_rows.append(node_row)
+                    kv_rows.extend(kvs)
+                    pair_rows.extend(pairs)
+                conn.executemany("INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", node_rows)
+                conn.executemany("INSERT INTO metadata_kv VALUES (?, ?, ?)", kv_rows)
+                conn.executemany("INSERT INTO pairs VALUES (?, ?, ?, ?)", pair_rows)
+            conn.execute("INSERT INTO nodes_fts (nodes_fts) VALUES ('rebuild')")
+            conn.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                [("artifact_version", version), ("artifact", str(self.artifact.resolve())), ("built", str(time.time()))],
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        os.replace(tmp_path, self.path)
+        print(f"Indexed {len(nodes)} objects in {time.monotonic() - started:.1f}s.")
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _where(self, filters: Optional[Dict[str, str]], search: Optional[str]) -> Tuple[str, List[Any]]:
+        """
+        WHERE clause for metadata filters and text search. One constraint
+        drives the query (file_name, else the first metadata filter, as an
+        IN over its index); the others are checked per row with correlated
+        index lookups, which SQLite's planner doesn't pick on its own.
+        """
+        clauses, params = [], []
+        filters = dict(filters or {})
+        driven = False
+        if "file_name" in filters:
+            clauses.append("n.file_name = ?")
+            params.append(filters.pop("file_name"))
+            driven = True
+        for key, value in filters.items():
+            if value == "":
+                clauses.append(
+                    "n.position NOT IN (SELECT kv.position FROM metadata_kv kv WHERE kv.key = ? AND kv.value != '')"
+                )
+                params.append(key)
+            elif not driven:
+                clauses.append(
+                    "n.position IN (SELECT kv.position FROM metadata_kv kv WHERE kv.key = ? AND kv.value = ?)"
+                )
+                params.extend([key, value])
+                driven = True
+            else:
+                clauses.append(
+                    "EXISTS (SELECT 1 FROM metadata_kv kv WHERE kv.key = ? AND kv.value = ? AND kv.position = n.position)"
+                )
+                params.extend([key, value])
+        if search:
+            clauses.append("n.position IN (SELECT rowid FROM nodes_fts WHERE nodes_fts MATCH ?)")
+            params.append(_fts_query(search))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def count(self, filters: Optional[Dict[str, str]] = None, search: Optional[str] = None) -> int:
+        where, params = self._where(filters, search)
+        return self.conn.execute(f"SELECT COUNT(*) FROM nodes n{where}", params).fetchone()[0]
+
+    def query(
+        self,
+        filters: Optional[Dict[str, str]] = None,
+        search: Optional[str] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+    ) -> List[IndexedNode]:
+        """Matching nodes in artifact order, one page (limit/offset) at a time."""
+        where, params = self._where(filters, search)
+        sql = f"SELECT * FROM nodes n{where} ORDER BY n.position LIMIT ? OFFSET ?"
+        rows = self.conn.execute(sql, params + [limit if limit is not None else -1, offset]).fetchall()
+        return [self._to_node(row) for row in rows]
+
+    def file_names(self, limit: Optional[int] = None, offset: int = 0) -> List[Tuple[str, int]]:
+        """(file_name, object count) in order of first appearance."""
+        sql = (
+            "SELECT file_name, COUNT(*) FROM nodes GROUP BY file_name "
+            "ORDER BY MIN(position) LIMIT ? OFFSET ?"
+        )
+        return [tuple(row) for row in self.conn.execute(sql, (limit if limit is not None else -1, offset))]
+
+    def nodes_with_pairs(
+        self, limit: Optional[int] = None, offset: int = 0, part_number: Optional[str] = None
+    ) -> Iterator[Tuple[IndexedNode, List[Dict[str, Any]]]]:
+        """Nodes with 'pairs' metadata (optionally only those listing part_number) and their pairs."""
+        where, params = ("WHERE part_number = ? ", [part_number]) if part_number else ("", [])
+        positions = self.conn.execute(
+            f"SELECT DISTINCT position FROM pairs {where}ORDER BY position LIMIT ? OFFSET ?",
+            params + [limit if limit is not None else -1, offset],
+        ).fetchall()
+        for (position,) in positions:
+            row = self.conn.execute("SELECT * FROM nodes WHERE position = ?", (position,)).fetchone()
+            pairs = [
+                json.loads(pair)
+                for (pair,) in self.conn.execute("SELECT pair FROM pairs WHERE position = ?", (position,))
+            ]
+            yield self._to_node(row), pairs
+
+    def pair_issues(self, limit: int = 50) -> Dict[str, List[Dict[str, Any]]]:
+        """Pair validation as grouped queries over the pairs table."""
+        missing = self.conn.execute(
+            "SELECT p.position, n.node_id, p.pair FROM pairs p JOIN nodes n USING (position) "
+            "WHERE p.part_number = '' OR p.model_name = '' ORDER BY p.position LIMIT ?",
+            (limit,),
+        ).fetchall()
+        conflicting = self.conn.execute(
+            "SELECT part_number, GROUP_CONCAT(DISTINCT model_name), COUNT(DISTINCT model_name) AS models "
+            "FROM pairs WHERE part_number != '' GROUP BY part_number HAVING models > 1 "
+            "ORDER BY part_number LIMIT ?",
+            (limit,),
+        ).fetchall()
+        not_in_text = self.conn.execute(
+            "SELECT p.position, n.node_id, p.part_number FROM pairs p JOIN nodes n USING (position) "
+            "WHERE p.part_number != '' AND instr(n.text, p.part_number) = 0 ORDER BY p.position LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return {
+            "missing_fields": [
+                {"position": r[0], "node_id": r[1], "pair": json.loads(r[2])} for r in missing
+            ],
+            "part_number_with_several_models": [
+                {"part_number": r[0], "models": r[1].split(",")} for r in conflicting
+            ],
+            "part_number_not_in_text": [
+                {"position": r[0], "node_id": r[1], "part_number": r[2]} for r in not_in_text
+            ],
+        }
+
+    def pair_stats(self) -> Dict[str, int]:
+        row = self.conn.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT position), COUNT(DISTINCT part_number) FROM pairs"
+        ).fetchone()
+        return {"pairs": row[0], "nodes_with_pairs": row[1], "distinct_part_numbers": row[2]}
+
+    @staticmethod
+    def _to_node(row: sqlite3.Row) -> IndexedNode:
+        relationships = {
+            name: [RelatedNode(i) for i in related] if isinstance(related, list) else RelatedNode(related)
+            for name, related in json.loads(row["relationships"] or "{}").items()
+        }
+        return IndexedNode(
+            position=row["position"],
+            node_id=row["node_id"],
+            node_type=row["node_type"],
+            text=row["text"],
+            metadata=json.loads(row["metadata"] or "{}"),
+            relationships=relationships,
+        )
+
+
+def open_index(artifact: str, rebuild: bool = False) -> NodeIndex:
+    """NodeIndex for artifact; exits with a message when it doesn't exist (for the CLI scripts)."""
+    if not Path(artifact).exists():
+        print(f"Error: File not found at '{artifact}'", file=sys.stderr)
+        sys.exit(1)
+    return NodeIndex(artifact, rebuild=rebuild)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build (or check) the inspection index of a node/Document artifact.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("artifact", help="Pickle or node store to index.")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild even if the index is current.")
+    args = parser.parse_args()
+
+    index = open_index(args.artifact, rebuild=args.rebuild)
+    started = time.monotonic()
+    total = index.count()
+    print(f"{index.path}: {total} objects, {len(index.file_names())} files, {index.pair_stats()}")
+    print(f"Ready in {time.monotonic() - started:.2f}s")
@@ -1,75 +1,52 @@
-import pickle
+#!/usr/bin/env python3
+"""
+Inspects the Document sections of a pickle file (or node store), grouped by
+source file. Files and sections are paged through the shared SQLite
+inspection index (see node_index.py), built once per version of the file.
+"""
 import argparse
 import sys
 from pathlib import Path
-from collections import defaultdict
-from typing import List, Dict
 
-# Attempt to import Document, handle if llama_index is not installed
-try:
-    from llama_index.core import Document
-
-    BaseNodeType = Document  # Use Document as the base type we expect
-except ImportError:
-    print(
-        "Warning: llama_index.core not found. Assuming loaded objects have 'text' and 'metadata' attributes."
-    )
-
-    # Define a dummy class or use 'object' if llama_index is not critical for inspection itself
-    class BasicNode:
-        def __init__(self, text=None, metadata=None):
-            self.text = text
-            self.metadata = metadata
-
-    BaseNodeType = BasicNode
+from node_index import NodeIndex, open_index
 
 
 def display_documents(
-    parsed_docs: List[BaseNodeType],
+    index: NodeIndex,
     num_files_limit: int | None,
     num_sections_limit: int | None,
     show_full_view: bool,
+    search: str | None = None,
 ):
     """Groups documents by file and displays them according to limits."""
 
-    if not parsed_docs or not isinstance(parsed_docs, list):
-        print(
-            f"Input is not a valid list of documents (Type: {type(parsed_docs).__name__}). Cannot display."
-        )
-        return
-
-    docs_by_file: Dict[str, List[BaseNodeType]] = defaultdict(list)
-    for doc in parsed_docs:
-        if not hasattr(doc, "metadata") or not isinstance(doc.metadata, dict):
-            print(f"Warning: Skipping document without valid 'metadata' dictionary.")
-            continue
-        file_name = doc.metadata.get("file_name", "Unknown_File")
-        docs_by_file[file_name].append(doc)
-
-    total_files = len(docs_by_file)
-    file_names_to_process = list(docs_by_file.keys())
+    files = index.file_names()
+    total_files = len(files)
+    file_names_to_process = files
 
     if num_files_limit is not None and num_files_limit < total_files:
         print(
             f"Limiting display to first {num_files_limit} out of {total_files} source files.\n"
         )
-        file_names_to_process = file_names_to_process[:num_files_limit]
+        file_names_to_process = files[:num_files_limit]
     else:
         print(f"Displaying details for all {total_files} source files found.\n")
         num_files_limit = total_files  # For accurate progress display
 
     global_doc_index = 0
-    for file_idx, file_name in enumerate(file_names_to_process, start=1):
-        sections_in_file = docs_by_file[file_name]
-        total_sections_in_file = len(sections_in_file)
-
-        sections_to_display = sections_in_file
+    for file_idx, (file_key, total_sections_in_file) in enumerate(file_names_to_process, start=1):
+        file_name = file_key or "Unknown_File"
+        file_filter = {"file_name": file_key}
+        if search:
+            total_sections_in_file = index.count(file_filter, search)
+            if not total_sections_in_file:
+                continue
+        sections_to_display = index.query(file_filter, search, limit=num_sections_limit)
         limit_msg = ""
         if (
             num_sections_limit is not None
             and num_sections_limit < total_sections_in_file
         ):
-            sections_to_display = sections_in_file[:num_sections_limit]
             limit_msg = f" (showing first {num_sections_limit})"
 
         print(
@@ -132,7 +109,7 @@ def main():
         "--file",
         type=Path,  # Use pathlib for better path handling
         default=Path("test_parsed_doc.pkl"),
-        help="Path to the input pickle file containing a list of Document objects.",
+        help="Path to the input pickle file (or node store) containing a list of Document objects.",
     )
     parser.add_argument(
         "-nf",
@@ -148,6 +125,17 @@ def main():
         default=None,  # Default to showing all sections per file
         help="Maximum number of sections (Document objects) to display per source file. Shows all if not specified.",
     )
+    parser.add_argument(
+        "--search",
+        type=str,
+        default=None,
+        help="Only show sections whose text matches this full-text search (FTS5).",
+    )
+    parser.add_argument(
+        "--rebuild-index",
+        action="store_true",
+        help="Rebuild the inspection index even if it matches the file.",
+    )
     parser.add_argument(
         "--full-view",
         action="store_true",  # Creates a boolean flag, True if present
@@ -157,46 +145,23 @@ def main():
 
     args = parser.parse_args()
 
-    # --- File Loading ---
+    # --- Indexed loading (the index is built on first use of each file version) ---
     pickle_file: Path = args.file
-    if not pickle_file.is_file():
-        print(f"Error: Pickle file not found at '{pickle_file}'")
-        sys.exit(1)  # Exit with an error code
-
     print(f"Loading documents from: {pickle_file}...")
+    index = open_index(str(pickle_file), rebuild=args.rebuild_index)
     try:
-        with open(pickle_file, "rb") as f:
-            # Load the data
-            loaded_data = pickle.load(f)
+        total = index.count()
     except Exception as e:
         print(f"Error loading pickle file: {e}")
         sys.exit(1)
 
-    # --- Data Validation and Display ---
-    # Check if the loaded data is a list (basic check)
-    if isinstance(loaded_data, list):
-        # Check if the list is not empty and items seem like documents (have metadata)
-        if loaded_data and hasattr(loaded_data[0], "metadata"):
-            print(f"Successfully loaded {len(loaded_data)} document objects.")
-            display_documents(
-                loaded_data, args.num_files, args.num_sections, args.full_view
-            )
-        elif not loaded_data:
-            print("Pickle file loaded successfully, but the list is empty.")
-        else:
-            print(
-                "Warning: Loaded a list, but items might not be Document objects (missing metadata attribute on first item)."
-            )
-            # Optionally, you could still try to display if items have 'text'
-            # display_documents(loaded_data, args.num_files, args.num_sections, args.full_view)
-    else:
-        print(
-            f"Error: Expected a list of documents in the pickle file, but found type '{type(loaded_data).__name__}'."
-        )
-        print(
-            "Please ensure the pickle file was created correctly by the updated parse.py script."
-        )
-        sys.exit(1)
+    if not total:
+        print("Pickle file loaded successfully, but the list is empty.")
+        return
+    print(f"Index holds {total} document objects.")
+    display_documents(
+        index, args.num_files, args.num_sections, args.full_view, args.search
+    )
 
 
 if __name__ == "__main__":
@@ -1,36 +1,24 @@
 #!/usr/bin/env python3
-import pickle
+"""
+Inspects the nodes of a pickle or node store through its SQLite inspection
+index (see node_index.py): metadata filters, full-text search and paging run
+as indexed queries, so only the page being shown is read.
+
+Usage:
+    python utilities/view_nodes.py -f enhanced_laser_nodes.pkl --filter file_name=PM10.pdf -n 20 --page 2
+    python utilities/view_nodes.py -f enhanced_laser_nodes.pkl --search "damage threshold" -n 5
+"""
 import argparse
 import sys
 import json
+import time
 from pathlib import Path
-from collections import defaultdict
 from typing import List, Dict, Any, Optional
 
-# Attempt to import LlamaIndex types, handle if not installed
-try:
-    from llama_index.core.schema import BaseNode, TextNode, NodeRelationship
-
-    NODE_CLASSES = (BaseNode,)  # Check against BaseNode
-except ImportError:
-    print(
-        "Warning: llama_index.core not found. Assuming loaded objects have 'text', 'metadata', and 'node_id' attributes."
-    )
-
-    # Define a dummy class if llama_index is not critical for inspection itself
-    class BasicNode:
-        def __init__(self, text=None, metadata=None, node_id=None, relationships=None):
-            self.text = text
-            self.metadata = metadata or {}
-            self.node_id = node_id
-            self.relationships = relationships or {}
-
-    NODE_CLASSES = (BasicNode,)
-    NodeRelationship = None  # No enum available
-
+from node_index import open_index
 
 def display_nodes(
-    nodes_to_display: List[Any],  # Expecting list of BaseNode or similar
+    nodes_to_display: List[Any],  # IndexedNode rows (or BaseNode-like objects)
     show_full_view: bool,
     node_limit_applied: int,
 ):
@@ -41,7 +29,7 @@ def display_nodes(
     )
 
     for i, node in enumerate(nodes_to_display, start=1):
-        node_type = type(node).__name__
+        node_type = getattr(node, "node_type", type(node).__name__)
         node_id = getattr(node, "node_id", "N/A")
 
         print(
@@ -78,12 +66,8 @@ def display_nodes(
         relationships = getattr(node, "relationships", {})
         if relationships and isinstance(relationships, dict):
             for rel_key, related_node_info in relationships.items():
-                # Use enum name if possible, otherwise raw key
-                rel_name = (
-                    rel_key.name
-                    if NodeRelationship and isinstance(rel_key, NodeRelationship)
-                    else str(rel_key)
-                )
+                # The index stores relationship enum names (SOURCE, NEXT, ...)
+                rel_name = str(rel_key)
                 # Handle single or list of related nodes
                 if isinstance(related_node_info, list):
                     ids = [getattr(n, "node_id", "?") for n in related_node_info]
@@ -116,32 +100,6 @@ def display_nodes(
         print("-" * 60)
 
 
-def filter_nodes(nodes: List[Any], filter_dict: Optional[Dict[str, str]]) -> List[Any]:
-    """Filters nodes based on metadata key-value pairs."""
-    if not filter_dict:
-        return nodes
-
-    filtered_list = []
-    print(f"\nApplying metadata filters: {filter_dict}")
-    filter_items = filter_dict.items()
-
-    for node in nodes:
-        metadata = getattr(node, "metadata", {})
-        if isinstance(metadata, dict):
-            match = True
-            for key, expected_value in filter_items:
-                actual_value = str(metadata.get(key, ""))  # Compare as strings
-                if actual_value != expected_value:
-                    match = False
-                    break  # No need to check other keys for this node
-            if match:
-                filtered_list.append(node)
-        # else: Node doesn't have dict metadata, cannot match filter
-
-    print(f"Found {len(filtered_list)} nodes matching filters.")
-    return filtered_list
-
-
 def parse_filter_string(filter_str: Optional[str]) -> Optional[Dict[str, str]]:
     """Parses 'key1=value1,key2=value2' into a dictionary."""
     if not filter_str:
@@ -168,7 +126,7 @@ def parse_filter_string(filter_str: Optional[str]) -> Optional[Dict[str, str]]:
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Inspect LlamaIndex Node objects stored in a pickle file.",
+        description="Inspect LlamaIndex Node objects stored in a pickle file or node store.",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
 
@@ -177,14 +135,14 @@ def main():
         "--file",
         type=Path,
         default=Path("enhanced_laser_nodes.pkl"),
-        help="Path to the input pickle file containing a list of Node objects.",
+        help="Path to the input pickle file (or node store) containing a list of Node objects.",
     )
     parser.add_argument(
         "-n",
         "--num-nodes",
         type=int,
         default=None,
-        help="Maximum number of nodes to display. Shows all if not specified.",
+        help="Maximum number of nodes to display (the page size for --page). Shows all if not specified.",
     )
     parser.add_argument(
         "--filter",
@@ -192,6 +150,23 @@ def main():
         default=None,
         help="Filter nodes by metadata. Format: 'key1=value1,key2=value2,...' (e.g., 'file_name=doc.pdf,element_type=table'). Values are compared as strings.",
     )
+    parser.add_argument(
+        "--search",
+        type=str,
+        default=None,
+        help="Full-text search of the node text (FTS5; plain words must all occur).",
+    )
+    parser.add_argument(
+        "--page",
+        type=int,
+        default=1,
+        help="Page of --num-nodes results to display.",
+    )
+    parser.add_argument(
+        "--rebuild-index",
+        action="store_true",
+        help="Rebuild the inspection index even if it matches the file.",
+    )
     parser.add_argument(
         "--full-view",
         action="store_true",
@@ -201,58 +176,39 @@ def main():
 
     args = parser.parse_args()
 
-    # --- File Loading ---
-    pickle_file: Path = args.file
-    if not pickle_file.is_file():
-        print(f"Error: Pickle file not found at '{pickle_file}'", file=sys.stderr)
-        sys.exit(1)
-
-    print(f"Loading nodes from: {pickle_file}...")
-    try:
-        with open(pickle_file, "rb") as f:
-            loaded_data = pickle.load(f)
-    except Exception as e:
-        print(f"Error loading pickle file: {e}", file=sys.stderr)
-        sys.exit(1)
+    # --- Indexed query (the index is built on first use of each file version) ---
+    index = open_index(str(args.file), rebuild=args.rebuild_index)
+    filter_dict = parse_filter_string(args.filter)
+    if filter_dict:
+        print(f"\nApplying metadata filters: {filter_dict}")
+    if args.search:
+        print(f"Full-text search: {args.search!r}")
+
+    index.conn  # Opens (or first builds) the index before timing the query
+    started = time.monotonic()
+    total_nodes_after_filter = index.count(filter_dict, args.search)
+    if not total_nodes_after_filter:
+        print("No nodes remaining after applying filters.")
+        sys.exit(0)
+    print(f"Found {total_nodes_after_filter} matching nodes.")
 
-    # --- Data Validation ---
-    if not isinstance(loaded_data, list):
+    # --- Paging ---
+    pages = -(-total_nodes_after_filter // args.num_nodes) if args.num_nodes else 1
+    if not 1 <= args.page <= pages:
         print(
-            f"Error: Expected a list of Node objects in the pickle file, but found type '{type(loaded_data).__name__}'.",
+            f"Error: --page {args.page} is out of range; the last page is {pages} "
+            f"({total_nodes_after_filter} nodes, {args.num_nodes or 'all'} per page).",
             file=sys.stderr,
         )
         sys.exit(1)
-
-    if not loaded_data:
-        print("Pickle file loaded successfully, but the list of nodes is empty.")
-        sys.exit(0)
-
-    # Basic check if items look like nodes
-    if not all(isinstance(item, NODE_CLASSES) for item in loaded_data):
-        print(
-            f"Warning: Loaded a list, but not all items appear to be Nodes (based on type check against {NODE_CLASSES}). Proceeding cautiously."
-        )
-
-    print(f"Successfully loaded {len(loaded_data)} potential node objects.")
-
-    # --- Filtering ---
-    filter_dict = parse_filter_string(args.filter)
-    nodes_after_filter = filter_nodes(loaded_data, filter_dict)
-
-    if not nodes_after_filter:
-        print("No nodes remaining after applying filters.")
-        sys.exit(0)
-
-    total_nodes_after_filter = len(nodes_after_filter)
-
-    # --- Limiting ---
-    nodes_to_display = nodes_after_filter
-    limit_applied = total_nodes_after_filter  # Store total before potentially limiting
-    if args.num_nodes is not None and args.num_nodes < total_nodes_after_filter:
-        nodes_to_display = nodes_after_filter[: args.num_nodes]
+    offset = (args.page - 1) * args.num_nodes if args.num_nodes else 0
+    nodes_to_display = index.query(filter_dict, args.search, limit=args.num_nodes, offset=offset)
+    limit_applied = total_nodes_after_filter
+    if pages > 1:
         print(
-            f"\nLimiting display to first {args.num_nodes} out of {total_nodes_after_filter} nodes."
+            f"\nShowing page {args.page}/{pages} ({args.num_nodes} per page) of {total_nodes_after_filter} nodes."
         )
+    print(f"Query took {(time.monotonic() - started) * 1000:.0f} ms.")
 
     # --- Display ---
     display_nodes(nodes_to_display, args.full_view, limit_applied)